@@ -10,16 +10,55 @@
 #                                     more descriptive email messages
 #                                     list generation instead of for loops
 #                                     chunk loading
+#                         2026-10-17 worker pool mode for concurrent file ingestion (Common ingest.workers)
+#                                    COPY INTO load mode straight from S3 (Common load.mode: copy)
+#                                    vectorized chunk parser (Common parse.engine)
+#                                    pipelined download / parse / upload (Common pipeline.queue_size)
+#                                    staged load with one COPY INTO per file (Common load.mode: staged)
+#                                    pooled Snowflake sessions reused across files
+#                                    typed schema inference (Common schema.inference: typed)
+#                                    schema evolution of existing tables (Common schema.evolution)
+#                                    concurrent ranged download and parallel parse of large files
+#                                    bulk S3 moves with multipart copy, batched deletes and no fixed sleep
+#                                    resumable loads from per-chunk checkpoints (Common checkpoint.path)
+#                                    duplicate files skipped by ETag, size and table (Common dedup.enabled, off by
+#                                    default)
+#                                    memory budgeted chunk sizes (Common memory.max_rss_mb)
+#                                    streaming decompression of .gz, .bz2 and .zst input files
+#                                    offline benchmark of s3_to_sf with S3 and Snowflake stand-ins (benchmark.py)
+#                                    per chunk, file and run metrics (Common metrics.json_path, metrics.textfile_path)
+#                                    malformed rows loaded to a quarantine table (Common quarantine.enabled)
+#                                    notifications sent in the background over one SMTP connection, per team
+#                                    digests (Email email.queue, email.digest)
+#                                    daemon mode, watermark or S3 event discovery (Main.py --daemon, Common daemon.*)
+#                                    chunks parsed in processes through shared memory (Common parse.pool: process)
+#                                    Parquet input loaded by row group with ranged GETs and its own schema
+#                                    validate-only preflight scan without Snowflake (Main.py --validate,
+#                                    Common validate.only)
+#                                    small files of a table loaded together by one COPY INTO (Common coalesce.*)
 # python_version		  : 3.9
 # _______________________________________________________________________________________________________________________
 import yaml
 import time
-import csv
+import datetime
+from collections import Counter
 import pandas
 import os
+import queue
+import shutil
+import signal
+import sys
+import threading
+import uuid
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import S3Connection
 import PandasProcessing
+import Checkpoint
+import EventQueue
+import Metrics
 import SnowflakeConnection
 import Communication
 
@@ -76,253 +115,3258 @@ def fix_table_col_names(row):
     return clean_row
 
 
-def s3_to_sf(config_yaml_path):
+def get_receiver_email(sfDatabase, email_config):
     """
     Description
     -----------
-    A function that writes file from an S3 input folder to a Snowflake table
+    A function that picks the notification recipients for a Snowflake database
+
+    Args
+    ----
+    sfDatabase : string
+        Snowflake database parsed from the file key
+    email_config : dict
+        the Email section of the yaml configuration
+
+    Returns
+    -------
+    receiver_email : list
+        list of email addresses to notify
+    """
+    if sfDatabase.lower() == "team_a":
+        receiver_email = [email_config['email. A'], email_config['email.B']]
+    elif sfDatabase.lower() == "team_b":
+        receiver_email = [email_config['email.B']]
+    elif sfDatabase.lower() == "team_c":
+        receiver_email = [email_config['email. C'], email_config['email.C']]
+    else:
+        receiver_email = [email_config['email.B']]
+    return receiver_email
+
+
+def get_checkpoint_path(Config):
+    """
+    Description
+    -----------
+    A function that gets the path of the load state store shared by checkpoints and the loaded file index
+
+    Args
+    ----
+    Config : dict
+        the loaded yaml configuration
+
+    Returns
+    -------
+    checkpoint_path : string
+        path of the SQLite file, empty when Common checkpoint.path is set empty to turn load state off
+    """
+    return Config['Common'].get('checkpoint.path',
+                                os.path.join(Config['Common']['linux.temp_path'], 'file2table_checkpoints.db'))
+
+
+def get_run_config(Config):
+    """
+    Description
+    -----------
+    A function that reads the settings every run and every file load needs, once per run or file instead of in
+    each loader
+
+    Args
+    ----
+    Config : dict
+        the loaded yaml configuration
+
+    Returns
+    -------
+    run_config : dict
+        - s3Bucket, s3Key, s3Secret, s3Folder and s3InternationalInput from the AWS section
+        - SfSchema, SfPassphrase, SfKeyfile, sfUser, sfAccount, sfWarehouse, sfRole, sfStage, sfStorageIntegration,
+          sfInlineCredentials and sfOnError from the Snowflake section
+        - email_config, sender_email and err_sender_email from the Email section
+        - load_mode, parse_engine, parse_workers, parse_pool, queue_size, chunk_size, large_file_bytes,
+          large_file_workers, max_rss_mb, schema_inference, sample_rows, schema_evolution, quarantine_enabled,
+          quarantine_table, error_sample_rows, max_bad_ratio, read_workers, dedup_enabled and checkpoint_path
+          from the Common section
+    """
+    s3_config = Config['AWS']
+    snowflake_config = Config['Snowflake']
+    email_config = Config['Email']
+    common_config = Config['Common']
+    return {'s3Bucket': s3_config['s3.bucket'], 's3Key': s3_config['s3.key'], 's3Secret': s3_config['s3.secret'],
+            's3Folder': s3_config['s3.folder'], 's3InternationalInput': s3_config['s3.internationalInputFolder'],
+            'SfSchema': snowflake_config['sf.schema'], 'SfPassphrase': snowflake_config['sf.passphrase'],
+            'SfKeyfile': snowflake_config['p8.key.file'], 'sfUser': snowflake_config.get('sf.user'),
+            'sfAccount': snowflake_config.get('sf.account'), 'sfWarehouse': snowflake_config.get('sf.warehouse'),
+            'sfRole': snowflake_config.get('sf.Role'),
+            'sfStage': snowflake_config.get('sf.stage', 'FILE2TABLE_S3_STAGE'),
+            'sfStorageIntegration': snowflake_config.get('sf.storage_integration'),
+            'sfInlineCredentials': snowflake_config.get('sf.stage_inline_credentials', False),
+            'sfOnError': snowflake_config.get('sf.copy_on_error', 'CONTINUE'),
+            'email_config': email_config,
+            'sender_email': email_config['email.sender'], 'err_sender_email': email_config['email.error_sender'],
+            'load_mode': common_config.get('load.mode', 'pandas'),
+            'parse_engine': common_config.get('parse.engine', 'numpy'),
+            'parse_workers': int(common_config.get('parse.workers', 1)),
+            'parse_pool': common_config.get('parse.pool', 'thread'),
+            'queue_size': int(common_config.get('pipeline.queue_size', 1)),
+            'chunk_size': get_chunk_size(Config),
+            'large_file_bytes': int(common_config.get('largefile.threshold_mb', 1024)) * (1024 ** 2),
+            'large_file_workers': int(common_config.get('largefile.workers', 8)),
+            'max_rss_mb': common_config.get('memory.max_rss_mb'),
+            'schema_inference': common_config.get('schema.inference', 'varchar'),
+            'sample_rows': int(common_config.get('schema.sample_rows', 100000)),
+            'schema_evolution': common_config.get('schema.evolution', True),
+            'quarantine_enabled': common_config.get('quarantine.enabled', False),
+            'quarantine_table': common_config.get('quarantine.table', 'FILE2TABLE_QUARANTINE'),
+            'error_sample_rows': int(common_config.get('quarantine.sample_rows', 20)),
+            'max_bad_ratio': float(common_config.get('validate.max_bad_ratio', 0)),
+            'read_workers': int(common_config.get('coalesce.read_workers', 8)),
+            'dedup_enabled': common_config.get('dedup.enabled', False),
+            'checkpoint_path': get_checkpoint_path(Config)}
+
+
+def get_clean_column_names(table_header_row, delimiter):
+    """
+    Description
+    -----------
+    A function that cleans the header row of a file into Snowflake column names
+
+    Args
+    ----
+    table_header_row : string
+        first line of the file
+    delimiter : string
+        character used to separate the fields
+
+    Returns
+    -------
+    clean_column_names : list
+        column names with special characters replaced and N prefixed to names starting with a digit
+    column_name_changes_string : string
+        one "<original> renamed to <clean>" line per column that changed
+    """
+    table_header_row = table_header_row.strip()
+    original_column_names = table_header_row.split(delimiter)
+    clean_table_header_row = fix_table_col_names(table_header_row)
+    clean_column_names = clean_table_header_row.split(delimiter)
+    clean_column_names = [f"N{column_name}" if column_name[0].isdigit() else f"{column_name}" for
+                          column_name in
+                          clean_column_names]
+    column_name_changes = [f"{original_column_name} renamed to {column_name}\n" for
+                           (original_column_name, column_name) in
+                           list(zip(original_column_names, clean_column_names)) if
+                           (original_column_name != column_name)]
+    column_name_changes_string = "".join(column_name_changes)
+    return clean_column_names, column_name_changes_string
+
+
+def get_file_delimiter(data_file):
+    """
+    Description
+    -----------
+    A function that picks the delimiter of a delimited input file from its name
+
+    Args
+    ----
+    data_file : string
+        S3 key of the file without its compression suffix, output from S3Connection.s3ObjectCompression
+
+    Returns
+    -------
+    delimiter : string
+        character used to separate the fields, None when the file is not a .txt or .csv file
+    """
+    if data_file.endswith('.txt'):
+        return "|"
+    elif data_file.endswith('.csv'):
+        return "|"
+    return None
+
+
+def get_chunk_size(Config):
+    """
+    Description
+    -----------
+    A function that reads the number of bytes to read per chunk, Common read.chunk_mb (default 128)
+
+    Args
+    ----
+    Config : dict
+        the loaded yaml configuration
+
+    Returns
+    -------
+    chunk_size : int
+        number of bytes to read per chunk
+    """
+    return int(float(Config['Common'].get('read.chunk_mb', 128)) * (1024 ** 2))
+
+
+def get_success_message(sfFile, sfDatabase, SfSchema, sfTable_name, file_load, duration):
+    """
+    Description
+    -----------
+    A function that writes the body of the email sent when a file is loaded
+
+    Args
+    ----
+    sfFile : string
+        file name
+    sfDatabase : string
+        Snowflake database the file was loaded into
+    SfSchema : string
+        Snowflake schema the file was loaded into
+    sfTable_name : string
+        Snowflake table the file was loaded into
+    file_load : dict
+        load results of the file
+        - success, total_rows_loaded, number_o_chunks, column_name_changes_string, error_attatchment, file_size
+        - quarantine_table, bad_rows and error_sample when malformed rows were quarantined
+        - resumed_line_number and resumed_bad_rows when the load resumed from a checkpoint
+    duration : float
+        seconds taken to load the file
+
+    Returns
+    -------
+    message : string
+        email body
+    """
+    success = file_load['success']
+    total_rows_loaded = file_load['total_rows_loaded']
+    number_o_chunks = file_load['number_o_chunks']
+    column_name_changes_string = file_load['column_name_changes_string']
+    error_attatchment = file_load['error_attatchment']
+    file_size = file_load['file_size']
+    if column_name_changes_string:
+        if len(error_attatchment) == 0:
+            message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}.\n\n' \
+                      f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
+                      f'The following column names were converted:\n{column_name_changes_string}\n\n' \
+                      f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
+        else:
+            message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}.\n\n' \
+                      f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
+                      f'The following column names were converted:\n{column_name_changes_string}\n\n' \
+                      f'error log attached\n\n' \
+                      f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
+    else:
+        if len(error_attatchment) == 0:
+            message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}.\n\n' \
+                      f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
+                      f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
+        else:
+            message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}. \n \n' \
+                      f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
+                      f'error log attached\n\n' \
+                      f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
+    if file_load.get('quarantine_table') and file_load.get('bad_rows'):
+        error_sample = "\n".join(file_load.get('error_sample', []))
+        message += f'\n\n{file_load["bad_rows"]} malformed rows were written to {file_load["quarantine_table"]}, ' \
+                   f'the first {len(file_load.get("error_sample", []))}:\n{error_sample}'
+    if file_load.get('resumed_bad_rows') and not file_load.get('quarantine_table'):
+        message += f'\n\nThe load resumed at line {file_load["resumed_line_number"]} from a checkpoint of an earlier run. ' \
+                   f'{file_load["resumed_bad_rows"]} malformed rows before that line are counted but are not in the error log, ' \
+                   f'which only covers the lines loaded by this run.'
+    return message
+
+
+def get_validation_message(sfFile, sfDatabase, SfSchema, sfTable_name, file_load, duration):
+    """
+    Description
+    -----------
+    A function that writes the body of the email sent when a file is validated without loading it
+
+    Args
+    ----
+    sfFile : string
+        file name
+    sfDatabase : string
+        Snowflake database the file would be loaded into
+    SfSchema : string
+        Snowflake schema the file would be loaded into
+    sfTable_name : string
+        Snowflake table the file would be loaded into
+    file_load : dict
+        validation results of the file, output from validate_file
+    duration : float
+        seconds taken to scan the file
+
+    Returns
+    -------
+    message : string
+        email body
+    """
+    table_name = f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}"
+    if file_load['success']:
+        message = f'Please be advised that {sfFile} passed validation for the table {table_name}, it has not been loaded.\n\n'
+    else:
+        message = f'Please be advised that {sfFile} failed validation for the table {table_name}, it has not been loaded.\n\n'
+    if file_load['problems']:
+        problems = "\n".join(f"- {problem}" for problem in file_load['problems'])
+        message += f'The following problems have to be fixed before the file is loaded:\n{problems}\n\n'
+    message += f'{file_load["rows"]} rows were read, {file_load["bad_rows"]} with the wrong number of columns and ' \
+               f'{file_load["encoding_errors"]} that are not UTF-8\n\n'
+    if file_load['error_sample']:
+        error_sample = "\n".join(file_load['error_sample'])
+        message += f'The first {len(file_load["error_sample"])} rows with errors:\n{error_sample}\n\n'
+    if file_load['column_name_changes_string']:
+        message += f'The following column names would be converted:\n{file_load["column_name_changes_string"]}\n\n'
+    if file_load['snowflakeSchemaDefinition']:
+        message += f'Proposed snowflake schema:\n{file_load["snowflakeSchemaDefinition"]}\n\n'
+    if file_load['error_attatchment']:
+        message += 'error log attached\n\n'
+    message += f'file size: {file_load["file_size"] / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
+    return message
+
+
+def get_coalesced_message(sfDatabase, SfSchema, sfTable_name, file_loads, duration):
+    """
+    Description
+    -----------
+    A function that writes the body of the email sent when small files are loaded together
+
+    Args
+    ----
+    sfDatabase : string
+        Snowflake database the files were loaded into
+    SfSchema : string
+        Snowflake schema the files were loaded into
+    sfTable_name : string
+        Snowflake table the files were loaded into
+    file_loads : list
+        (file name, load results) of each file, output from coalesced_files_to_sf
+    duration : float
+        seconds taken to load the files
+
+    Returns
+    -------
+    message : string
+        email body
+    """
+    table_name = f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}"
+    file_results = "\n".join(
+        f"{sfFile}: Success is {file_load['success']} with {file_load['total_rows_loaded']} rows loaded"
+        + (f", {file_load['bad_rows']} malformed rows" if file_load['bad_rows'] else "")
+        for sfFile, file_load in file_loads)
+    message = f'Please be advised that {len(file_loads)} files have been imported into snowflake as the table {table_name} in one load.\n\n' \
+              f'{file_results}\n\n'
+    column_name_changes = "".join(f"{sfFile}: {column_name_change}\n" for sfFile, file_load in file_loads
+                                  for column_name_change in file_load['column_name_changes_string'].splitlines())
+    if column_name_changes:
+        message += f'The following column names were converted:\n{column_name_changes}\n'
+    if any(file_load['error_attatchment'] for _, file_load in file_loads):
+        message += 'error logs attached\n\n'
+    bad_files = [(sfFile, file_load) for sfFile, file_load in file_loads
+                 if file_load.get('quarantine_table') and file_load['bad_rows']]
+    for sfFile, file_load in bad_files:
+        error_sample = "\n".join(file_load['error_sample'])
+        message += f'{file_load["bad_rows"]} malformed rows of {sfFile} were written to ' \
+                   f'{file_load["quarantine_table"]}, the first {len(file_load["error_sample"])}:\n{error_sample}\n\n'
+    file_size = sum(file_load['file_size'] for _, file_load in file_loads)
+    message += f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
+    return message
+
+
+def get_quarantine_dataframe(errored_data, file, sf_table, column_count, delimiter, error_messages=None):
+    """
+    Description
+    -----------
+    A function that makes the quarantine table rows of the malformed rows of a file
+
+    Args
+    ----
+    errored_data : list
+        [line number, original row] for each malformed row
+    file : string
+        S3 key of the file
+    sf_table : string
+        table the file is loaded to
+    column_count : int
+        number of columns of the table
+    delimiter : string
+        character used to separate the fields
+    error_messages : list
+        error of each row, COPY INTO validation errors in copy mode
+        - the column count error by default
+
+    Returns
+    -------
+    quarantine_df : object
+        dataframe with the SnowflakeConnection.QUARANTINE_COLUMNS
+    """
+    actual_columns = [line.count(delimiter) + 1 for _, line in errored_data]
+    if error_messages is None:
+        error_messages = [f"expected {column_count} columns but read {actual}" for actual in actual_columns]
+    quarantine_df = pandas.DataFrame({'FILE_NAME': file, 'SF_TABLE': sf_table,
+                                      'LINE_NUMBER': [int(line_number) for line_number, _ in errored_data],
+                                      'EXPECTED_COLUMNS': column_count, 'ACTUAL_COLUMNS': actual_columns,
+                                      'RAW_LINE': [line for _, line in errored_data], 'ERROR': error_messages},
+                                     columns=SnowflakeConnection.QUARANTINE_COLUMNS)
+    return quarantine_df
+
+
+def get_mismatched_data(df, mismatched_rows, delimiter, start_line_number, errored_data):
+    """
+    Description
+    -----------
+    A function that finds the line numbers and rows of the chunk rows that do not match the column types
+
+    Args
+    ----
+    df : object
+        dataframe of the good rows of the chunk before convertPandas2Schema
+    mismatched_rows : list
+        [row position, error message] for each row, output from PandasProcessing.convertPandas2Schema
+    delimiter : string
+        character used to separate the fields
+    start_line_number : int
+        line number of the first line of the chunk
+    errored_data : list
+        [line number, original row] for each malformed row of the chunk, they are not in df
+
+    Returns
+    -------
+    mismatched_data : list
+        [line number, original row] for each row
+    error_messages : list
+        error of each row
+    """
+    errored_line_numbers = sorted(line_number for line_number, _ in errored_data)
+    mismatched_data = []
+    for position, _ in mismatched_rows:
+        # lines of the chunk are good rows or malformed rows, skip the malformed ones up to the row
+        line_number = start_line_number + position
+        for errored_line_number in errored_line_numbers:
+            if errored_line_number > line_number:
+                break
+            line_number += 1
+        mismatched_data.append([line_number, delimiter.join(str(value) for value in df.iloc[position].tolist())])
+    return mismatched_data, [error_message for _, error_message in mismatched_rows]
+
+
+def get_rss_bytes():
+    """
+    Description
+    -----------
+    A function that reads the resident set size of the process
+
+    Returns
+    -------
+    rss_bytes : int
+        resident memory of the process in bytes, 0 where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def new_memory_budget(max_rss_mb, raw_chunks, dataframe_chunks, max_chunk_size, prefetch_ranges=0,
+                      max_range_size=16 * 1024 ** 2, min_chunk_size=1024 ** 2, initial_expansion=32):
+    """
+    Description
+    -----------
+    A function that sizes the chunks of a file so the process stays within a memory budget
+        - the memory left under the budget when the file starts is shared by every chunk that can be alive at once,
+          as raw bytes and as parsed dataframes
+        - a dataframe of strings takes several times the bytes of its lines, the narrower the rows the more,
+          until a chunk has been parsed the first chunks are sized for very narrow rows
+
+    Args
+    ----
+    max_rss_mb : int
+        memory budget of the process in MiB
+    raw_chunks : int
+        number of raw chunks, or their parse scratch space, that can be alive at once
+    dataframe_chunks : int
+        number of parsed chunks that can be alive at once
+    max_chunk_size : int
+        largest chunk in bytes
+    prefetch_ranges : int
+        number of ranged GETs in flight for large files, they get at most a quarter of the budget
+    max_range_size : int
+        largest ranged GET in bytes
+    min_chunk_size : int
+        smallest chunk in bytes, used when the budget is already spent
+    initial_expansion : float
+        dataframe bytes per line byte assumed until a chunk has been parsed
+
+    Returns
+    -------
+    memory_budget : dict
+        chunk_size and range_size to read with, updated by observe_chunk_memory(memory_budget, chunk_bytes, df)
+    """
+    max_rss_bytes = int(max_rss_mb) * (1024 ** 2)
+    available_bytes = max_rss_bytes - get_rss_bytes()
+    range_size = max_range_size
+    if prefetch_ranges > 0:
+        range_size = min(max_range_size, max(min_chunk_size, available_bytes // (4 * prefetch_ranges)))
+        available_bytes -= prefetch_ranges * range_size
+    memory_budget = {'max_rss_bytes': max_rss_bytes,
+                     'available_bytes': available_bytes,
+                     'raw_chunks': raw_chunks,
+                     'dataframe_chunks': dataframe_chunks,
+                     'min_chunk_size': min_chunk_size,
+                     'max_chunk_size': max_chunk_size,
+                     'range_size': range_size,
+                     'expansion': initial_expansion,
+                     'observed_chunks': 0}
+    set_budget_chunk_size(memory_budget)
+    return memory_budget
+
+
+def set_budget_chunk_size(memory_budget):
+    """
+    Description
+    -----------
+    A function that works out the chunk size of a memory budget from its current row width expansion
+
+    Args
+    ----
+    memory_budget : dict
+        output from new_memory_budget(max_rss_mb, raw_chunks, dataframe_chunks, max_chunk_size)
+
+    Returns
+    -------
+    chunk_size : int
+        number of bytes to read per chunk
+    """
+    chunk_bytes_alive = memory_budget['raw_chunks'] + memory_budget['expansion'] * memory_budget['dataframe_chunks']
+    chunk_size = int(memory_budget['available_bytes'] / chunk_bytes_alive)
+    memory_budget['chunk_size'] = min(memory_budget['max_chunk_size'], max(memory_budget['min_chunk_size'], chunk_size))
+    return memory_budget['chunk_size']
+
+
+def observe_chunk_memory(memory_budget, chunk_bytes, df, sample_rows=1000):
+    """
+    Description
+    -----------
+    A function that resizes the next chunks of a memory budget from the size of a parsed chunk
+        - the dataframe size is estimated from its first rows, measuring every string would cost a pass over the chunk
+        - the widest expansion seen in the file is kept, rows of a file do not all look alike
+        - when the process is over the budget anyway the chunks are held to half their size for the rest of the file
+
+    Args
+    ----
+    memory_budget : dict
+        output from new_memory_budget(max_rss_mb, raw_chunks, dataframe_chunks, max_chunk_size)
+    chunk_bytes : int
+        number of bytes of the lines parsed into df
+    df : object
+        dataframe parsed from the chunk
+
+    Returns
+    -------
+    chunk_size : int
+        number of bytes to read per chunk
+    """
+    if chunk_bytes > 0 and len(df) > 0:
+        sample = df.iloc[:sample_rows]
+        dataframe_bytes = sample.memory_usage(index=False, deep=True).sum() / len(sample) * len(df)
+        expansion = dataframe_bytes / chunk_bytes
+        if memory_budget['observed_chunks'] > 0:
+            expansion = max(expansion, memory_budget['expansion'])
+        memory_budget['expansion'] = expansion
+        memory_budget['observed_chunks'] += 1
+    if get_rss_bytes() > memory_budget['max_rss_bytes']:
+        memory_budget['max_chunk_size'] = max(memory_budget['min_chunk_size'], memory_budget['chunk_size'] // 2)
+    return set_budget_chunk_size(memory_budget)
+
+
+def pipeline_stage(generator, max_queued):
+    """
+    Description
+    -----------
+    A function that runs a generator in its own thread and hands its items over through a bounded queue
+        - lets download, parse and upload of different chunks overlap
+        - an error in the stage is raised again in the consumer
+        - when the consumer stops (finishes or fails) the stage is told to stop and the thread is joined
+
+    Args
+    ----
+    generator : object
+        generator to run in the stage thread
+    max_queued : int
+        number of items the stage can get ahead of the consumer
+        - 0 runs the generator in the consumer thread instead
+
+    Yields
+    ------
+    item : object
+        items of the generator in order
+    """
+    if max_queued <= 0:
+        yield from generator
+        return
+    stage_queue = queue.Queue(maxsize=max_queued)
+    stop_stage = threading.Event()
+    stage_done = object()
+
+    def put_item(item):
+        # wait for space in the queue unless the consumer has stopped reading
+        while not stop_stage.is_set():
+            try:
+                stage_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run_stage():
+        try:
+            for item in generator:
+                if not put_item((None, item)):
+                    return
+                # the queue holds the item now, do not keep it alive while the next one is made
+                item = None
+            put_item((None, stage_done))
+        except Exception as err_message:
+            put_item((err_message, None))
+        finally:
+            generator.close()
+
+    stage_thread = threading.Thread(target=run_stage, daemon=True)
+    stage_thread.start()
+    try:
+        while True:
+            err_message, item = stage_queue.get()
+            if err_message is not None:
+                raise err_message
+            if item is stage_done:
+                return
+            yield item
+            item = None
+    finally:
+        stop_stage.set()
+        stage_thread.join()
+
+
+def time_line_chunks(line_chunks, download_times):
+    """
+    Description
+    -----------
+    A generator that times how long each chunk of lines takes to arrive from its reader
+        - the time includes the S3 reads and any decompression of the chunk
+        - times are appended in chunk order, parse_line_chunks takes them off in the same order
+
+    Args
+    ----
+    line_chunks : object
+        generator of chunks of complete lines
+    download_times : object
+        deque the seconds of each chunk are appended to
+
+    Yields
+    ------
+    chunk : bytes
+        chunks of line_chunks in order
+    """
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(line_chunks)
+            except StopIteration:
+                return
+            download_times.append(time.perf_counter() - start)
+            yield chunk
+            chunk = None
+    finally:
+        line_chunks.close()
+
+
+def parse_line_chunks(line_chunks, delimiter, parse_engine, text_file_errors, file_load, parse_workers=1,
+                      header_row=None, start_byte=0, start_line_number=2, download_times=None, parse_pool='thread'):
+    """
+    Description
+    -----------
+    A generator that parses chunks of lines into dataframes of good rows and writes the bad rows to the error log
+        - the first line of the first chunk is the header, unless header_row is given for a resumed load
+        - with parse_workers above 1 chunks are parsed in parallel threads, or in parse processes that get the
+          chunks through shared memory, results are taken in order and renumbered so line numbers in the error
+          log match the sequential parse
+
+    Args
+    ----
+    line_chunks : iterable
+        chunks of complete lines
+        - output from PandasProcessing.readLineChunks(s3ObjectBody, chunkSize) or
+          S3Connection.s3GetObjectLineChunks
+    delimiter : string
+        character used to separate the fields
+    parse_engine : string
+        PandasProcessing.parseChunk engine
+    text_file_errors : object
+        open error log file
+    file_load : dict
+        load state of the file
+        - column_names, column_name_changes_string and has_errors are filled in
+    parse_workers : int
+        number of chunks parsed at the same time
+    header_row : string
+        header of the file when line_chunks starts after it
+    start_byte : int
+        offset in the file of the first chunk
+    start_line_number : int
+        line number of the first line after the header in the first chunk
+    download_times : object
+        deque of the download seconds of each chunk, from time_line_chunks(line_chunks, download_times)
+    parse_pool : string
+        "thread" or "process", where chunks are parsed when parse_workers is above 1
+
+    Yields
+    ------
+    df : object
+        dataframe of the good rows of a chunk
+    chunk_end_byte : int
+        offset in the file right after the chunk
+    next_line_number : int
+        line number of the first line after the chunk
+    errored_data : list
+        [line number, original row] for each malformed row of the chunk
+    chunk_metrics : dict
+        bytes, rows, bad_rows, download_seconds, split_seconds and build_seconds of the chunk
+    """
+    newline = '\n'.encode()
+    header_chunk = True
+    chunk_end_byte = start_byte
+    process_pool = None
+    if parse_workers > 1 and parse_pool == 'process':
+        # the pure python split and the dataframe build hold the GIL, processes parse on the other cores
+        process_pool = PandasProcessing.getParseProcessPool(workers=parse_workers)
+        parse_pool = None
+    else:
+        parse_pool = ThreadPoolExecutor(max_workers=parse_workers) if parse_workers > 1 else None
+    # chunks being parsed, in file order
+    pending_chunks = deque()
+
+    def finish_chunk(parsed_chunk, chunk_end_byte, chunk_metrics):
+        # chunks are parsed from line 0, number them after the lines of the chunks before
+        nonlocal start_line_number
+        if process_pool is not None:
+            parsed_chunk = PandasProcessing.getParseChunkResult(future=parsed_chunk, columnNames=clean_column_names,
+                                                                timings=chunk_metrics)
+        elif parse_pool is not None:
+            parsed_chunk = parsed_chunk.result()
+        df, errored_data, chunk_line_count = parsed_chunk
+        errored_data = [[start_line_number + line_number, line] for line_number, line in errored_data]
+        start_line_number += chunk_line_count
+        chunk_metrics['rows'] = len(df)
+        chunk_metrics['bad_rows'] = len(errored_data)
+        file_load['bad_rows'] = file_load.get('bad_rows', 0) + len(errored_data)
+
+        ## get bad data
+        errored_data_message = PandasProcessing.getChunkErrorMessage(erroredData=errored_data,
+                                                                     columnCount=column_count,
+                                                                     delimiter=delimiter)
+        text_file_errors.write(f"{errored_data_message}\n")
+        if len(errored_data) > 0:
+            file_load['has_errors'] = True
+        return df, chunk_end_byte, start_line_number, errored_data, chunk_metrics
+
+    try:
+        for s3_body_chunk in line_chunks:
+            chunk_end_byte += len(s3_body_chunk)
+            chunk_metrics = {'bytes': len(s3_body_chunk),
+                             'download_seconds': download_times.popleft() if download_times else 0.0}
+            if header_row is None:
+                header_end = s3_body_chunk.find(newline)
+                if header_end == -1:
+                    header_end = len(s3_body_chunk)
+                header_row = s3_body_chunk[0:header_end].decode('utf-8')
+                s3_body_chunk = s3_body_chunk[header_end + 1:]
+            if header_chunk == True:
+                header_chunk = False
+                clean_column_names, column_name_changes_string = get_clean_column_names(
+                    table_header_row=header_row, delimiter=delimiter)
+                column_count = len(clean_column_names)
+                file_load['column_names'] = clean_column_names
+                file_load['column_name_changes_string'] = column_name_changes_string
+
+            # good rows as a dataframe, line number and original row of the bad rows
+            if parse_pool is None and process_pool is None:
+                parsed_chunk = PandasProcessing.parseChunk(chunkBytes=s3_body_chunk, delimiter=delimiter,
+                                                           columnNames=clean_column_names, startLineNumber=0,
+                                                           engine=parse_engine, timings=chunk_metrics)
+                # release the raw bytes before the dataframe waits for the upload
+                s3_body_chunk = None
+                yield finish_chunk(parsed_chunk, chunk_end_byte, chunk_metrics)
+                parsed_chunk = None
+                continue
+            if process_pool is not None:
+                parse_future = PandasProcessing.submitParseChunk(processPool=process_pool, chunkBytes=s3_body_chunk,
+                                                                 delimiter=delimiter, columnNames=clean_column_names,
+                                                                 engine=parse_engine)
+            else:
+                parse_future = parse_pool.submit(PandasProcessing.parseChunk, chunkBytes=s3_body_chunk,
+                                                 delimiter=delimiter, columnNames=clean_column_names,
+                                                 startLineNumber=0, engine=parse_engine, timings=chunk_metrics)
+            s3_body_chunk = None
+            pending_chunks.append((parse_future, chunk_end_byte, chunk_metrics))
+            if len(pending_chunks) >= parse_workers:
+                parsed_chunk, parsed_chunk_end, parsed_chunk_metrics = pending_chunks.popleft()
+                yield finish_chunk(parsed_chunk, parsed_chunk_end, parsed_chunk_metrics)
+        while pending_chunks:
+            parsed_chunk, parsed_chunk_end, parsed_chunk_metrics = pending_chunks.popleft()
+            yield finish_chunk(parsed_chunk, parsed_chunk_end, parsed_chunk_metrics)
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown(wait=True, cancel_futures=True)
+        # the process pool is shared by the files of the run, only the parses of this file are dropped
+        for parse_future, _, _ in pending_chunks:
+            parse_future.cancel()
+
+
+def read_file_head(client, s3Bucket, file, compression=None, head_size=1024 ** 2):
+    """
+    Description
+    -----------
+    A function that reads the first bytes of a file, decompressed for compressed files
+
+    Args
+    ----
+    client : object
+        A S3 client instance
+    s3Bucket : string
+        A S3 bucket
+    file : string
+        S3 key of the file
+    compression : string
+        compression of the file, output from S3Connection.s3ObjectCompression(s3Key)
+    head_size : int
+        number of bytes to read
+
+    Returns
+    -------
+    head_bytes : bytes
+        first bytes of the file, the header line and the start of the rows
+    """
+    if compression is None:
+        return S3Connection.s3GetObjectRange(s3Client=client, s3Bucket=s3Bucket, s3Key=file, startByte=0,
+                                             endByte=head_size - 1)
+    s3_object_body = S3Connection.s3GetObject(s3Client=client, s3Bucket=s3Bucket, s3Key=file)['Body']
+    try:
+        return S3Connection.s3DecompressBody(s3ObjectBody=s3_object_body, compression=compression).read(head_size)
+    finally:
+        s3_object_body.close()
+
+
+def sample_file_rows(client, s3Bucket, file, file_size, delimiter, column_names, parse_engine, sample_count=4,
+                     sample_bytes=1024 ** 2):
+    """
+    Description
+    -----------
+    A function that samples rows from across a file with ranged GETs, for schema inference
+        - ranges are spread evenly over the file after the first chunk
+        - the partial lines at both ends of a range are dropped
+
+    Args
+    ----
+    client : object
+        A S3 client instance
+    s3Bucket : string
+        S3 bucket in use
+    file : string
+        S3 key of the file
+    file_size : int
+        size of the file in bytes
+    delimiter : string
+        character used to separate the fields
+    column_names : list
+        clean column names of the file
+    parse_engine : string
+        PandasProcessing.parseChunk engine
+    sample_count : int
+        number of ranges to read
+    sample_bytes : int
+        size of each range
+
+    Returns
+    -------
+    samples : list
+        dataframes of the good rows of each range
+    """
+    newline = '\n'.encode()
+    samples = []
+    for sample in range(1, sample_count + 1):
+        start_byte = file_size * sample // (sample_count + 1)
+        sample_chunk = S3Connection.s3GetObjectRange(s3Client=client, s3Bucket=s3Bucket, s3Key=file,
+                                                     startByte=start_byte, endByte=start_byte + sample_bytes - 1)
+        first_newline = sample_chunk.find(newline)
+        last_newline = sample_chunk.rfind(newline)
+        if first_newline == -1 or last_newline <= first_newline:
+            continue
+        df, _, _ = PandasProcessing.parseChunk(chunkBytes=sample_chunk[first_newline + 1:last_newline + 1],
+                                               delimiter=delimiter, columnNames=column_names, startLineNumber=0,
+                                               engine=parse_engine)
+        samples.append(df)
+    return samples
+
+
+def stage_pandas_chunk(sf_conn, load_stage, df, quarantine_df, stage_path, quarantine_stage_path, file_name,
+                       temp_folder):
+    """
+    Description
+    -----------
+    A function that PUTs a chunk and its malformed rows to the load stage, the staged write path of pandas_file_to_sf
+        - nothing is committed here, each stage path is loaded by one COPY INTO once every chunk of the file is staged
+
+    Args
+    ----
+    sf_conn : object
+        Snowflake connection instance
+    load_stage : string
+        stage the chunks are PUT to, output from SnowflakeConnection.createSnowflakeLoadStage
+    df : object
+        dataframe of the good rows of the chunk
+    quarantine_df : object
+        quarantine rows of the chunk, output from get_quarantine_dataframe, None when there are none to quarantine
+    stage_path : string
+        path in the stage of the good rows of the file
+    quarantine_stage_path : string
+        path in the stage of the malformed rows of the file
+    file_name : string
+        name of the parquet file of the chunk
+    temp_folder : string
+        folder the parquet files are written to before the PUT
+
+    Returns
+    -------
+    staged_chunks : int
+        1 when the good rows were staged, 0 for a chunk without any
+    quarantine_chunks : int
+        1 when malformed rows were staged, 0 otherwise
+    """
+    staged_chunks = 0
+    quarantine_chunks = 0
+    if quarantine_df is not None and len(quarantine_df) > 0:
+        quarantine_chunks = 1
+        SnowflakeConnection.putPandas2Stage(sfConn=sf_conn, pdDF=quarantine_df, sfStage=load_stage,
+                                            stagePath=quarantine_stage_path, fileName=file_name,
+                                            tempFolder=temp_folder)
+    if len(df) > 0:
+        staged_chunks = 1
+        SnowflakeConnection.putPandas2Stage(sfConn=sf_conn, pdDF=df, sfStage=load_stage, stagePath=stage_path,
+                                            fileName=file_name, tempFolder=temp_folder)
+    return staged_chunks, quarantine_chunks
+
+
+def write_pandas_chunk(sf_conn, df, quarantine_df, sf_table_name, quarantine_table, file_checkpoint, chunk_end_byte,
+                       next_line_number, chunk_bad_rows):
+    """
+    Description
+    -----------
+    A function that writes a chunk and its malformed rows with write_pandas, the write path of pandas_file_to_sf
+        - every write is checkpointed, the malformed rows are checkpointed with the start of the chunk and the line
+          they are quarantined up to, so a resume reads the chunk again without quarantining its rows twice
+        - the malformed rows of a resumed chunk that were quarantined before the resume are left out
+
+    Args
+    ----
+    sf_conn : object
+        Snowflake connection instance
+    df : object
+        dataframe of the good rows of the chunk
+    quarantine_df : object
+        quarantine rows of the chunk, output from get_quarantine_dataframe, None when there are none to quarantine
+    sf_table_name : string
+        table the good rows are written to
+    quarantine_table : string
+        table the malformed rows are written to
+    file_checkpoint : dict
+        committed state of the file as keyword arguments of Checkpoint.saveCheckpoint, updated as the chunk is
+        written
+        - nothing is saved when its checkpointPath is empty
+    chunk_end_byte : int
+        offset in the file right after the chunk
+    next_line_number : int
+        line number of the first line after the chunk
+    chunk_bad_rows : int
+        malformed rows of the chunk
+
+    Returns
+    -------
+    success : bool
+        output from SnowflakeConnection.writePandas2Snowflake
+    nrows : int
+        rows of the chunk written to the table
+    """
+    if quarantine_df is not None:
+        quarantine_df = quarantine_df[quarantine_df['LINE_NUMBER'] >= file_checkpoint['quarantinedLineNumber']]
+    if quarantine_df is not None and len(quarantine_df) > 0:
+        SnowflakeConnection.writePandas2Snowflake(sfConn=sf_conn, pdDF=quarantine_df, sfTable=quarantine_table)
+        file_checkpoint['quarantinedLineNumber'] = next_line_number
+        if file_checkpoint['checkpointPath']:
+            Checkpoint.saveCheckpoint(**file_checkpoint)
+    success, nchunks, nrows = SnowflakeConnection.writePandas2Snowflake(sfConn=sf_conn, pdDF=df,
+                                                                        sfTable=sf_table_name)
+    file_checkpoint.update({'byteOffset': chunk_end_byte, 'startLineNumber': next_line_number,
+                            'rowsLoaded': file_checkpoint['rowsLoaded'] + nrows,
+                            'chunksLoaded': file_checkpoint['chunksLoaded'] + 1,
+                            'badRows': file_checkpoint['badRows'] + chunk_bad_rows,
+                            'quarantinedLineNumber': next_line_number})
+    if file_checkpoint['checkpointPath']:
+        Checkpoint.saveCheckpoint(**file_checkpoint)
+    return success, nrows
+
+
+def pandas_file_to_sf(file, run_config, client, sfPrivateKey, temp_folder, file_load):
+    """
+    Description
+    -----------
+    A function that streams a file through pandas in chunks and writes each chunk to Snowflake with write_pandas
+        - rows with the wrong number of columns are written to the error log
+        - download, parse and upload run as a pipeline so chunk N+1 downloads and parses while chunk N uploads
+        - Common pipeline.queue_size sets how many chunks a stage can get ahead, 0 runs the stages in sequence
+        - files of Common largefile.threshold_mb or more are downloaded with largefile.workers concurrent
+          ranged GETs, Common parse.workers chunks are parsed at the same time, in threads or with
+          Common parse.pool set to "process" in parse processes shared by the files of the run
+        - with Common load.mode set to "staged" chunks are PUT to one stage and committed by a single COPY INTO
+        - with Common schema.inference set to "typed" the table gets typed columns inferred from rows sampled
+          across the file, and every chunk is converted to those types before upload
+        - an existing table gets the new columns of the file added unless Common schema.evolution is false
+        - with Common memory.max_rss_mb set, chunks are sized from the memory left under the budget and the
+          observed row width instead of the fixed Common read.chunk_mb (default 128)
+        - outside staged mode a checkpoint is saved after every committed chunk, a rerun of the same file
+          (same ETag) resumes with a ranged GET after the last committed chunk instead of reloading it
+        - .gz, .bz2 and .zst files are decompressed as they stream through the chunk reader, they are always
+          read in order and a resumed compressed file is decompressed up to its checkpoint again
+        - download, split, build, convert and upload time, bytes and rows of every chunk go to Metrics.recordChunk
+        - with Common quarantine.enabled the malformed rows of every chunk are loaded the same way as the good
+          rows to the quarantine.table of the database, and the email carries their count and a sample
+          instead of the error log
+        - chunks are written by stage_pandas_chunk in staged mode and by write_pandas_chunk otherwise
+
+    Args
+    ----
+    file : string
+        S3 key of the file to be loaded
+    run_config : dict
+        output from get_run_config(Config)
+    client : object
+        A S3 client instance
+    sfPrivateKey : object
+        The decrypted snowflake private key
+    temp_folder : string
+        folder the error log for this file is written to
+    file_load : dict
+        load state of the file, filled in as the load progresses so the error email can report it
+
+    Returns
+    -------
+    file_load : dict
+        load state of the file
+    """
+    s3Bucket = run_config['s3Bucket']
+    SfSchema = run_config['SfSchema']
+    sfRole = run_config['sfRole']
+    parse_engine = run_config['parse_engine']
+    queue_size = run_config['queue_size']
+    schema_inference = run_config['schema_inference']
+    parse_workers = run_config['parse_workers']
+    large_file_workers = run_config['large_file_workers']
+    max_rss_mb = run_config['max_rss_mb']
+    staged_load = run_config['load_mode'] == 'staged'
+    quarantine_enabled = run_config['quarantine_enabled']
+    quarantine_table = run_config['quarantine_table']
+    error_sample_rows = run_config['error_sample_rows']
+    checkpoint_path = run_config['checkpoint_path']
+
+    sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
+    sfTable_name = fix_table_col_names(sfTable)
+    checkpoint_table = f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}"
+    delimiter = file_load['delimiter']
+    compression = file_load['compression']
+
+    s3_head = client.head_object(Bucket=s3Bucket, Key=file)
+    file_load['file_size'] = s3_head['ContentLength']
+    file_etag = s3_head['ETag'].strip('"')
+
+    # a staged load commits the whole file in one COPY, there is nothing to resume
+    checkpoint = None
+    if checkpoint_path and not staged_load:
+        checkpoint = Checkpoint.getCheckpoint(checkpointPath=checkpoint_path, etag=file_etag,
+                                           sfTable=checkpoint_table)
+
+    # number of bytes to read per chunk
+    chunk_size = run_config['chunk_size']
+
+    header_chunk = True
+    number_o_chunks = 0
+    total_rows_loaded = 0
+    success = False
+    header_row = None
+    start_byte = 0
+    start_line_number = 2
+    if checkpoint is not None:
+        # chunks committed by an earlier run are already in the table
+        print(f"{file} resuming at byte {checkpoint['byte_offset']} of {file_load['file_size']}")
+        header_bytes = read_file_head(client=client, s3Bucket=s3Bucket, file=file, compression=compression)
+        header_row = header_bytes.split('\n'.encode())[0].decode('utf-8')
+        start_byte = checkpoint['byte_offset']
+        start_line_number = checkpoint['start_line_number']
+        number_o_chunks = checkpoint['chunks_loaded']
+        total_rows_loaded = checkpoint['rows_loaded']
+        # the error log of the earlier run is gone, only its count of malformed rows is kept
+        file_load['bad_rows'] = checkpoint['bad_rows']
+        file_load['resumed_line_number'] = start_line_number
+        file_load['resumed_bad_rows'] = checkpoint['bad_rows']
+        success = True
+    # byte offsets of compressed files are offsets in the decompressed stream, they can only be read in order
+    ranged_read = (file_load['file_size'] >= run_config['large_file_bytes'] or start_byte > 0) and compression is None
+    read_size = chunk_size
+    range_size = 16 * (1024 ** 2)
+    memory_budget = None
+    if max_rss_mb:
+        # raw chunks: queued for parse, being read and waiting on the queue, being parsed with ~2x scratch space
+        # dataframes: queued for upload, waiting on the queue, parsed ahead by the parse workers, being uploaded
+        # and its converted or parquet copy
+        memory_budget = new_memory_budget(max_rss_mb=max_rss_mb, raw_chunks=max(queue_size, 1) + 1 + 3 * parse_workers,
+                                          dataframe_chunks=max(queue_size, 1) + parse_workers + 2,
+                                          max_chunk_size=chunk_size,
+                                          prefetch_ranges=large_file_workers if ranged_read else 0)
+        read_size = lambda: memory_budget['chunk_size']
+        range_size = memory_budget['range_size']
+        print(f"{file} memory budget {max_rss_mb} MiB, first chunk {memory_budget['chunk_size'] / (1024 ** 2):.1f} MiB")
+    last_chunk_end_byte = start_byte
+    staged_chunks = 0
+    quarantine_chunks = 0
+    column_types = []
+    stage_path = f"{sfDatabase}/{sfTable_name}/{uuid.uuid4().hex}"
+    quarantine_stage_path = f"{stage_path}_quarantine"
+    file_load['error_sample'] = []
+    # what is committed of the file, the parse stage counts malformed rows of chunks that are not committed yet
+    file_checkpoint = {'checkpointPath': checkpoint_path, 'etag': file_etag, 'sfTable': checkpoint_table,
+                       's3Key': file, 'byteOffset': start_byte, 'startLineNumber': start_line_number,
+                       'rowsLoaded': total_rows_loaded, 'chunksLoaded': number_o_chunks,
+                       'badRows': checkpoint['bad_rows'] if checkpoint is not None else 0,
+                       'quarantinedLineNumber': checkpoint['quarantined_line_number'] if checkpoint is not None else 0}
+
+    snowflakeConnection = None
+    load_failed = True
+    try:
+        with open(f"{temp_folder}/{sfTable}_errors.txt", "w") as text_file_errors:
+            # download -> parse -> upload, an error in any stage stops the others
+            if ranged_read:
+                # large or resumed file, concurrent ranged GETs instead of one sequential stream
+                file_chunks = S3Connection.s3GetObjectLineChunks(s3Client=client, s3Bucket=s3Bucket, s3Key=file,
+                                                                 fileSize=file_load['file_size'],
+                                                                 chunkSize=read_size, rangeSize=range_size,
+                                                                 maxWorkers=large_file_workers,
+                                                                 startByte=start_byte)
+            else:
+                ## try to open the S3 file
+                s3_object = S3Connection.s3GetObject(s3Client=client, s3Bucket=s3Bucket, s3Key=file)
+                # compressed files are decompressed as the chunks are read, a resumed one skips what was
+                # committed
+                s3_object_body = S3Connection.s3DecompressBody(s3ObjectBody=s3_object['Body'],
+                                                               compression=compression, startByte=start_byte)
+                file_chunks = PandasProcessing.readLineChunks(s3ObjectBody=s3_object_body, chunkSize=read_size)
+            download_times = deque()
+            line_chunks = pipeline_stage(time_line_chunks(line_chunks=file_chunks, download_times=download_times),
+                                         max_queued=queue_size)
+            parsed_chunks = pipeline_stage(parse_line_chunks(line_chunks=line_chunks, delimiter=delimiter,
+                                                             parse_engine=parse_engine,
+                                                             text_file_errors=text_file_errors, file_load=file_load,
+                                                             parse_workers=parse_workers, header_row=header_row,
+                                                             start_byte=start_byte,
+                                                             start_line_number=start_line_number,
+                                                             download_times=download_times,
+                                                             parse_pool=run_config['parse_pool']),
+                                           max_queued=queue_size)
+            chunk_start_line_number = start_line_number
+            try:
+                for df, chunk_end_byte, next_line_number, errored_data, chunk_metrics in parsed_chunks:
+                    number_o_chunks += 1
+                    if memory_budget is not None:
+                        observe_chunk_memory(memory_budget=memory_budget,
+                                             chunk_bytes=chunk_end_byte - last_chunk_end_byte, df=df)
+                    last_chunk_end_byte = chunk_end_byte
+                    # create the snowflake table
+                    if header_chunk == True:
+                        header_chunk = False
+                        if schema_inference == 'typed':
+                            # first chunk plus ranges from the rest of the file
+                            samples = [df.head(run_config['sample_rows'])]
+                            if file_load['file_size'] > chunk_size and compression is None:
+                                samples += sample_file_rows(client=client, s3Bucket=s3Bucket, file=file,
+                                                            file_size=file_load['file_size'],
+                                                            delimiter=delimiter,
+                                                            column_names=file_load['column_names'],
+                                                            parse_engine=parse_engine)
+                            column_types, snowflakeSchemaDefinition = PandasProcessing.inferSnowflakeSchema(
+                                pandas.concat(samples, axis=0))
+                            samples = None
+                        else:
+                            s3FileDF, _ = PandasProcessing.pandasInferSchema(df)
+                            snowflakeSchemaDefinition = PandasProcessing.getSchemaPandas2Snowflake(s3FileDF)
+                            s3FileDF = None
+                        file_load['snowflakeSchemaDefinition'] = snowflakeSchemaDefinition
+                        snowflakeConnection = SnowflakeConnection.getPooledSnowflakeConnection(
+                            sfAccount=run_config['sfAccount'], sfUser=run_config['sfUser'],
+                            sfPrivateKey=sfPrivateKey, sfWarehouse=run_config['sfWarehouse'], sfRole=sfRole,
+                            sfDatabase=sfDatabase, sfSchema=SfSchema)
+                        file_load['create_sql'] = SnowflakeConnection.createSnowflakeTable(
+                            sfConn=snowflakeConnection, sfRole=sfRole, sfDatabase=sfDatabase, sfSchema=SfSchema,
+                            sfTable=sfTable_name, tableSchemaDef=snowflakeSchemaDefinition, insert=True,
+                            setContext=False)
+                        if run_config['schema_evolution']:
+                            # add new columns and widen existing ones so the file appends to the table
+                            alter_sql, table_column_types = SnowflakeConnection.reconcileSnowflakeTable(
+                                sfConn=snowflakeConnection, sfDatabase=sfDatabase, sfSchema=SfSchema,
+                                sfTable=sfTable_name, tableSchemaDef=snowflakeSchemaDefinition)
+                            file_load['create_sql'] = ";\n".join([file_load['create_sql']] + alter_sql)
+                            if column_types:
+                                column_types = table_column_types
+                        if staged_load:
+                            load_stage = SnowflakeConnection.createSnowflakeLoadStage(sfConn=snowflakeConnection,
+                                                                                      sfStage="FILE2TABLE_LOAD_STAGE")
+                        if quarantine_enabled:
+                            SnowflakeConnection.createQuarantineTable(sfConn=snowflakeConnection,
+                                                                      sfDatabase=sfDatabase, sfSchema=SfSchema,
+                                                                      sfTable=quarantine_table)
+                            file_load['quarantine_table'] = f"{sfDatabase}.{SfSchema}.{quarantine_table}"
+
+                    convert_start = time.perf_counter()
+                    error_messages = None
+                    if column_types:
+                        # values that do not match the sampled types are reported with the malformed rows
+                        typed_df, mismatched_rows = PandasProcessing.convertPandas2Schema(pandasDataframe=df,
+                                                                                         columnTypes=column_types)
+                        if mismatched_rows:
+                            mismatched_data, mismatch_messages = get_mismatched_data(
+                                df=df, mismatched_rows=mismatched_rows, delimiter=delimiter,
+                                start_line_number=chunk_start_line_number, errored_data=errored_data)
+                            text_file_errors.write("\n".join(
+                                f"line {line_number}: {error_message} [{line}]" for (line_number, line), error_message
+                                in zip(mismatched_data, mismatch_messages)) + "\n")
+                            error_messages = [f"expected {len(file_load['column_names'])} columns but read "
+                                              f"{line.count(delimiter) + 1}" for _, line in errored_data]
+                            error_messages += mismatch_messages
+                            errored_data = errored_data + mismatched_data
+                            file_load['bad_rows'] += len(mismatched_data)
+                            file_load['has_errors'] = True
+                            chunk_metrics['rows'] -= len(mismatched_data)
+                            chunk_metrics['bad_rows'] += len(mismatched_data)
+                        df = typed_df
+                    chunk_metrics['convert_seconds'] = time.perf_counter() - convert_start
+                    chunk_start_line_number = next_line_number
+
+                    if len(file_load['error_sample']) < error_sample_rows and errored_data:
+                        sample_data = errored_data[:error_sample_rows - len(file_load['error_sample'])]
+                        if error_messages is None:
+                            file_load['error_sample'] += PandasProcessing.getChunkErrorMessage(
+                                erroredData=sample_data, columnCount=len(file_load['column_names']),
+                                delimiter=delimiter).split("\n")
+                        else:
+                            file_load['error_sample'] += [f"line {line_number}: {error_message} [{line}]"
+                                                          for (line_number, line), error_message
+                                                          in zip(sample_data, error_messages)]
+                    quarantine_df = None
+                    if quarantine_enabled and errored_data:
+                        quarantine_df = get_quarantine_dataframe(errored_data=errored_data, file=file,
+                                                                 sf_table=checkpoint_table,
+                                                                 column_count=len(file_load['column_names']),
+                                                                 delimiter=delimiter, error_messages=error_messages)
+                    errored_data = None
+
+                    upload_start = time.perf_counter()
+                    if staged_load:
+                        # chunks are only staged here, the file is committed by one COPY at the end
+                        chunk_staged, chunk_quarantined = stage_pandas_chunk(
+                            sf_conn=snowflakeConnection, load_stage=load_stage, df=df, quarantine_df=quarantine_df,
+                            stage_path=stage_path, quarantine_stage_path=quarantine_stage_path,
+                            file_name=f"{sfTable}_{number_o_chunks}.parquet", temp_folder=temp_folder)
+                        staged_chunks += chunk_staged
+                        quarantine_chunks += chunk_quarantined
+                    else:
+                        success, nrows = write_pandas_chunk(
+                            sf_conn=snowflakeConnection, df=df, quarantine_df=quarantine_df,
+                            sf_table_name=sfTable_name, quarantine_table=quarantine_table,
+                            file_checkpoint=file_checkpoint, chunk_end_byte=chunk_end_byte,
+                            next_line_number=next_line_number, chunk_bad_rows=chunk_metrics['bad_rows'])
+                        total_rows_loaded += nrows
+                    quarantine_df = None
+                    chunk_metrics['upload_seconds'] = time.perf_counter() - upload_start
+                    Metrics.recordChunk(s3Key=file, sfTable=checkpoint_table, chunkNumber=number_o_chunks,
+                                        chunkMetrics=chunk_metrics)
+                    # release the chunk before waiting for the next one
+                    df = None
+            finally:
+                parsed_chunks.close()
+
+        if staged_load and staged_chunks > 0:
+            success, number_o_chunks, total_rows_loaded = SnowflakeConnection.copyStage2Snowflake(
+                sfConn=snowflakeConnection, sfStage=load_stage, stagePath=stage_path, sfTable=sfTable_name,
+                columnNames=file_load['column_names'])
+        elif staged_load:
+            # nothing but a header, there is nothing to copy
+            success, number_o_chunks = True, 0
+        if quarantine_chunks > 0:
+            SnowflakeConnection.copyStage2Snowflake(sfConn=snowflakeConnection, sfStage=load_stage,
+                                                    stagePath=quarantine_stage_path, sfTable=quarantine_table,
+                                                    columnNames=SnowflakeConnection.QUARANTINE_COLUMNS)
+        load_failed = False
+        if checkpoint_path and not staged_load:
+            Checkpoint.deleteCheckpoint(checkpointPath=checkpoint_path, etag=file_etag, sfTable=checkpoint_table)
+    finally:
+        if snowflakeConnection is not None:
+            SnowflakeConnection.releaseSnowflakeConnection(sfConn=snowflakeConnection, healthy=not load_failed)
+
+    error_attatchment = []
+    if file_load.get('has_errors') and not quarantine_enabled:
+        error_attatchment = [f"{temp_folder}/{sfTable}_errors.txt"]
+    file_load['success'] = success
+    file_load['number_o_chunks'] = number_o_chunks
+    file_load['total_rows_loaded'] = total_rows_loaded
+    file_load['error_attatchment'] = error_attatchment
+    return file_load
+
+
+def parquet_file_to_sf(file, run_config, client, sfPrivateKey, temp_folder, file_load):
+    """
+    Description
+    -----------
+    A function that loads a Parquet file one row group at a time, the rows are never written out as text
+        - the footer and each row group are read with ranged GETs, only the columns loaded are downloaded
+        - the table schema comes from the types in the Parquet metadata, decimals of more than 38 digits are
+          loaded as text to VARCHAR columns
+        - each row group is PUT to a stage as Parquet and committed by its own COPY INTO, a checkpoint after
+          each one lets a failed load resume at the next row group
+        - with Common load.mode set to "staged" or "copy" the row groups are committed by a single COPY INTO
+        - an existing table gets the new columns of the file added unless Common schema.evolution is false,
+          then the columns the table does not have are not read
+
+    Args
+    ----
+    file : string
+        S3 key of the file to be loaded
+    run_config : dict
+        output from get_run_config(Config)
+    client : object
+        A S3 client instance
+    sfPrivateKey : object
+        The decrypted snowflake private key
+    temp_folder : string
+        folder the row groups are written to before the PUT
+    file_load : dict
+        load state of the file, filled in as the load progresses so the error email can report it
+
+    Returns
+    -------
+    file_load : dict
+        load state of the file
+    """
+    s3Bucket = run_config['s3Bucket']
+    SfSchema = run_config['SfSchema']
+    sfUser = run_config['sfUser']
+    sfAccount = run_config['sfAccount']
+    sfWarehouse = run_config['sfWarehouse']
+    sfRole = run_config['sfRole']
+    schema_evolution = run_config['schema_evolution']
+    single_copy = run_config['load_mode'] in ('staged', 'copy')
+    checkpoint_path = run_config['checkpoint_path']
+
+    sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
+    sfTable_name = fix_table_col_names(sfTable)
+    checkpoint_table = f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}"
+
+    s3_head = client.head_object(Bucket=s3Bucket, Key=file)
+    file_load['file_size'] = s3_head['ContentLength']
+    file_etag = s3_head['ETag'].strip('"')
+
+    # only the footer is read here
+    parquet_file = PandasProcessing.openParquetFile(S3Connection.S3RangedFile(
+        s3Client=client, s3Bucket=s3Bucket, s3Key=file, fileSize=file_load['file_size']))
+    arrow_schema = parquet_file.schema_arrow
+    # a character that is not in column names, the names are cleaned like a header row
+    clean_column_names, file_load['column_name_changes_string'] = get_clean_column_names(
+        table_header_row="\0".join(arrow_schema.names), delimiter="\0")
+    column_types, snowflakeSchemaDefinition = PandasProcessing.getSnowflakeSchemaArrow(
+        arrowSchema=arrow_schema, columnNames=clean_column_names)
+    file_load['snowflakeSchemaDefinition'] = snowflakeSchemaDefinition
+
+    checkpoint = None
+    if checkpoint_path and not single_copy:
+        checkpoint = Checkpoint.getCheckpoint(checkpointPath=checkpoint_path, etag=file_etag,
+                                           sfTable=checkpoint_table)
+    start_row_group = 0
+    number_o_chunks = 0
+    total_rows_loaded = 0
+    success = True
+    if checkpoint is not None:
+        print(f"{file} resuming at row group {checkpoint['row_group']} of {parquet_file.num_row_groups}")
+        start_row_group = checkpoint['row_group']
+        number_o_chunks = checkpoint['chunks_loaded']
+        total_rows_loaded = checkpoint['rows_loaded']
+    stage_path = f"{sfDatabase}/{sfTable_name}/{uuid.uuid4().hex}"
+    staged_chunks = 0
+
+    snowflakeConnection = None
+    load_failed = True
+    try:
+        snowflakeConnection = SnowflakeConnection.getPooledSnowflakeConnection(
+            sfAccount=sfAccount, sfUser=sfUser, sfPrivateKey=sfPrivateKey, sfWarehouse=sfWarehouse,
+            sfRole=sfRole, sfDatabase=sfDatabase, sfSchema=SfSchema)
+        file_load['create_sql'] = SnowflakeConnection.createSnowflakeTable(
+            sfConn=snowflakeConnection, sfRole=sfRole, sfDatabase=sfDatabase, sfSchema=SfSchema,
+            sfTable=sfTable_name, tableSchemaDef=snowflakeSchemaDefinition, insert=True, setContext=False)
+        load_columns = list(range(len(clean_column_names)))
+        if schema_evolution:
+            alter_sql, _ = SnowflakeConnection.reconcileSnowflakeTable(
+                sfConn=snowflakeConnection, sfDatabase=sfDatabase, sfSchema=SfSchema, sfTable=sfTable_name,
+                tableSchemaDef=snowflakeSchemaDefinition)
+            file_load['create_sql'] = ";\n".join([file_load['create_sql']] + alter_sql)
+        else:
+            table_columns = SnowflakeConnection.getSnowflakeTableColumns(
+                sfConn=snowflakeConnection, sfDatabase=sfDatabase, sfSchema=SfSchema, sfTable=sfTable_name)
+            load_columns = [column for column in load_columns if clean_column_names[column].upper() in table_columns]
+            if not load_columns:
+                raise ValueError(f"none of the columns of {sfFile} are in {checkpoint_table}")
+        file_load['column_names'] = [clean_column_names[column] for column in load_columns]
+        load_stage = SnowflakeConnection.createSnowflakeLoadStage(sfConn=snowflakeConnection,
+                                                                  sfStage="FILE2TABLE_LOAD_STAGE")
+
+        for row_group in range(start_row_group, parquet_file.num_row_groups):
+            download_start = time.perf_counter()
+            # column pruning, the column chunks that are not loaded are never downloaded
+            arrow_table = parquet_file.read_row_group(row_group, columns=[arrow_schema.names[column]
+                                                                          for column in load_columns])
+            arrow_table = PandasProcessing.convertArrow2Schema(
+                arrowTable=arrow_table.rename_columns(file_load['column_names']),
+                columnTypes=[column_types[column] for column in load_columns])
+            upload_start = time.perf_counter()
+            chunk_metrics = {'bytes': parquet_file.metadata.row_group(row_group).total_byte_size,
+                             'rows': arrow_table.num_rows, 'bad_rows': 0,
+                             'download_seconds': upload_start - download_start}
+            if arrow_table.num_rows > 0:
+                number_o_chunks += 1
+                chunk_path = stage_path if single_copy else f"{stage_path}/{row_group}"
+                SnowflakeConnection.putArrow2Stage(sfConn=snowflakeConnection, arrowTable=arrow_table,
+                                                   sfStage=load_stage, stagePath=chunk_path,
+                                                   fileName=f"{sfTable}_{row_group}.parquet", tempFolder=temp_folder)
+                staged_chunks += 1
+                if not single_copy:
+                    chunk_success, _, nrows = SnowflakeConnection.copyStage2Snowflake(
+                        sfConn=snowflakeConnection, sfStage=load_stage, stagePath=chunk_path, sfTable=sfTable_name,
+                        columnNames=file_load['column_names'])
+                    success = success and chunk_success
+                    total_rows_loaded += nrows
+            if checkpoint_path and not single_copy:
+                Checkpoint.saveCheckpoint(checkpointPath=checkpoint_path, etag=file_etag, sfTable=checkpoint_table,
+                                          s3Key=file, byteOffset=0, startLineNumber=0, rowsLoaded=total_rows_loaded,
+                                          chunksLoaded=number_o_chunks, rowGroup=row_group + 1)
+            chunk_metrics['upload_seconds'] = time.perf_counter() - upload_start
+            Metrics.recordChunk(s3Key=file, sfTable=checkpoint_table, chunkNumber=row_group + 1,
+                                chunkMetrics=chunk_metrics)
+            # release the row group before reading the next one
+            arrow_table = None
+
+        if single_copy and staged_chunks > 0:
+            success, number_o_chunks, total_rows_loaded = SnowflakeConnection.copyStage2Snowflake(
+                sfConn=snowflakeConnection, sfStage=load_stage, stagePath=stage_path, sfTable=sfTable_name,
+                columnNames=file_load['column_names'])
+        load_failed = False
+        if checkpoint_path and not single_copy:
+            Checkpoint.deleteCheckpoint(checkpointPath=checkpoint_path, etag=file_etag, sfTable=checkpoint_table)
+    finally:
+        if snowflakeConnection is not None:
+            SnowflakeConnection.releaseSnowflakeConnection(sfConn=snowflakeConnection, healthy=not load_failed)
+
+    file_load['success'] = success
+    file_load['number_o_chunks'] = number_o_chunks
+    file_load['total_rows_loaded'] = total_rows_loaded
+    file_load['error_attatchment'] = []
+    return file_load
+
+
+def read_coalesced_file(input_file, run_config, client, temp_folder):
+    """
+    Description
+    -----------
+    A function that downloads and parses a small file of a coalesced load, nothing is written to Snowflake
+
+    Args
+    ----
+    input_file : dict
+        Key, Size and ETag of the file
+    run_config : dict
+        output from get_run_config(Config)
+    client : object
+        A S3 client instance
+    temp_folder : string
+        folder the error log of the file is written to
+
+    Returns
+    -------
+    file_load : dict
+        load state of the file, with the dataframe of its good rows as df and its malformed rows as errored_data
+    """
+    s3Bucket = run_config['s3Bucket']
+    parse_engine = run_config['parse_engine']
+    error_sample_rows = run_config['error_sample_rows']
+
+    file = input_file['Key']
+    _, _, sfFile = splitFileName(fileKey=file)
+    file_load = {'delimiter': "", 'file_size': input_file['Size'], 'snowflakeSchemaDefinition': "", 'create_sql': "",
+                 'column_name_changes_string': "", 'error_attatchment': [], 'success': False,
+                 'number_o_chunks': 0, 'total_rows_loaded': 0, 'bad_rows': 0, 'error_sample': [],
+                 'error_log': f"{temp_folder}/{sfFile}_errors.txt"}
+    data_file, file_load['compression'] = S3Connection.s3ObjectCompression(s3Key=file)
+    # the delimiter and chunk size s3_file_to_sf and pandas_file_to_sf read the file with
+    delimiter = file_load['delimiter'] = get_file_delimiter(data_file=data_file)
+    if delimiter is None:
+        raise ValueError(f"{sfFile} is not a delimited file")
+
+    errored_rows = []
+    s3_object_body = S3Connection.s3GetObject(s3Client=client, s3Bucket=s3Bucket, s3Key=file)['Body']
+    try:
+        # the lines are split as pandas_file_to_sf splits them, malformed rows are kept with their line numbers
+        df = next(PandasProcessing.readCsvBatches(
+            s3ObjectBody=S3Connection.s3DecompressBody(s3ObjectBody=s3_object_body,
+                                                       compression=file_load['compression']),
+            delimiter=delimiter, chunksize=None, blockSize=run_config['chunk_size'], splitEngine=parse_engine,
+            erroredRows=errored_rows), None)
+    finally:
+        s3_object_body.close()
+    if df is None:
+        raise ValueError(f"{sfFile} is empty")
+    file_load['column_names'], file_load['column_name_changes_string'] = get_clean_column_names(
+        table_header_row=delimiter.join(df.columns), delimiter=delimiter)
+    df.columns = file_load['column_names']
+    file_load['df'] = df
+    file_load['rows'] = len(df)
+    file_load['errored_data'] = errored_rows
+    file_load['bad_rows'] = len(errored_rows)
+    file_load['has_errors'] = bool(errored_rows)
+    with open(file_load['error_log'], "w") as text_file_errors:
+        text_file_errors.write(PandasProcessing.getChunkErrorMessage(
+            erroredData=errored_rows, columnCount=len(file_load['column_names']), delimiter=delimiter) + "\n")
+    if errored_rows:
+        file_load['error_sample'] = PandasProcessing.getChunkErrorMessage(
+            erroredData=errored_rows[:error_sample_rows], columnCount=len(file_load['column_names']),
+            delimiter=delimiter).split("\n")
+    return file_load
+
+
+def load_coalesced_files(file_loads, run_config, sfPrivateKey, temp_folder):
+    """
+    Description
+    -----------
+    A function that loads the parsed small files of one table with a single staged COPY INTO
+        - files with the same header are written to one parquet file, so there is one PUT per distinct header
+          and one COPY for the table, on one pooled connection
+        - columns are matched by name, a column missing from a file is loaded as NULL for its rows
+        - the table is created, evolved and typed once per distinct header as pandas_file_to_sf does for a file,
+          every header is converted to the column types before the first PUT so a row that does not match
+          raises a ValueError with nothing staged
+        - with ON_ERROR = ABORT_STATEMENT the files are loaded completely or not at all
+        - with Common quarantine.enabled the malformed rows of each file are loaded by one more COPY INTO, a file
+          succeeds when its good rows and its malformed rows were both loaded
+
+    Args
+    ----
+    file_loads : list
+        (input file, load state) of each file, output from read_coalesced_file
+    run_config : dict
+        output from get_run_config(Config)
+    sfPrivateKey : object
+        The decrypted snowflake private key
+    temp_folder : string
+        folder the parquet files are written to before the PUT
+
+    Returns
+    -------
+    file_loads : list
+        (input file, load state) of each file, with success and total_rows_loaded filled in
+    """
+    SfSchema = run_config['SfSchema']
+    sfUser = run_config['sfUser']
+    sfAccount = run_config['sfAccount']
+    sfWarehouse = run_config['sfWarehouse']
+    sfRole = run_config['sfRole']
+    schema_inference = run_config['schema_inference']
+    sample_rows = run_config['sample_rows']
+    schema_evolution = run_config['schema_evolution']
+    quarantine_enabled = run_config['quarantine_enabled']
+    quarantine_table = run_config['quarantine_table']
+
+    sfDatabase, sfTable, _ = splitFileName(fileKey=file_loads[0][0]['Key'])
+    sfTable_name = fix_table_col_names(sfTable)
+    table_name = f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}"
+    stage_path = f"{sfDatabase}/{sfTable_name}/{uuid.uuid4().hex}"
+    quarantine_stage_path = f"{stage_path}_quarantine"
+
+    # files with the same header share a parquet file, unquoted column names are not case sensitive
+    header_groups = {}
+    for input_file, file_load in file_loads:
+        header = tuple(column_name.upper() for column_name in file_load['column_names'])
+        header_groups.setdefault(header, []).append((input_file, file_load))
+    column_names = list(dict.fromkeys(column_name for header in header_groups for column_name in header))
+
+    snowflakeConnection = SnowflakeConnection.getPooledSnowflakeConnection(
+        sfAccount=sfAccount, sfUser=sfUser, sfPrivateKey=sfPrivateKey, sfWarehouse=sfWarehouse, sfRole=sfRole,
+        sfDatabase=sfDatabase, sfSchema=SfSchema)
+    load_failed = True
+    try:
+        create_sql = None
+        load_stage = SnowflakeConnection.createSnowflakeLoadStage(sfConn=snowflakeConnection,
+                                                                  sfStage="FILE2TABLE_LOAD_STAGE")
+        if quarantine_enabled:
+            quarantine_table = SnowflakeConnection.createQuarantineTable(sfConn=snowflakeConnection,
+                                                                         sfDatabase=sfDatabase, sfSchema=SfSchema,
+                                                                         sfTable=quarantine_table)
+        # every group is typed and converted before the first PUT, so a mismatch leaves nothing staged
+        group_loads = []
+        for header, group in header_groups.items():
+            df = pandas.concat([file_load['df'].set_axis(list(header), axis=1) for _, file_load in group], axis=0,
+                               ignore_index=True)
+            if schema_inference == 'typed':
+                # sampled from each file
+                column_types, snowflakeSchemaDefinition = PandasProcessing.inferSnowflakeSchema(pandas.concat(
+                    [file_load['df'].head(sample_rows).set_axis(list(header), axis=1) for _, file_load in group],
+                    axis=0))
+            else:
+                column_types = []
+                s3FileDF, _ = PandasProcessing.pandasInferSchema(df.head(0))
+                snowflakeSchemaDefinition = PandasProcessing.getSchemaPandas2Snowflake(s3FileDF)
+            if create_sql is None:
+                create_sql = SnowflakeConnection.createSnowflakeTable(
+                    sfConn=snowflakeConnection, sfRole=sfRole, sfDatabase=sfDatabase, sfSchema=SfSchema,
+                    sfTable=sfTable_name, tableSchemaDef=snowflakeSchemaDefinition, insert=True, setContext=False)
+            group_create_sql = create_sql
+            if schema_evolution:
+                alter_sql, table_column_types = SnowflakeConnection.reconcileSnowflakeTable(
+                    sfConn=snowflakeConnection, sfDatabase=sfDatabase, sfSchema=SfSchema, sfTable=sfTable_name,
+                    tableSchemaDef=snowflakeSchemaDefinition)
+                group_create_sql = ";\n".join([create_sql] + alter_sql)
+                if column_types:
+                    column_types = table_column_types
+            if column_types:
+                df, mismatched_rows = PandasProcessing.convertPandas2Schema(pandasDataframe=df,
+                                                                            columnTypes=column_types)
+                if mismatched_rows:
+                    # a data error, the connection is fine and the files are loaded one at a time to report
+                    # the rows of each
+                    load_failed = False
+                    raise ValueError(f"{len(mismatched_rows)} rows do not match the column types, "
+                                     f"first {mismatched_rows[0][1]}")
+            for input_file, file_load in group:
+                file_load['snowflakeSchemaDefinition'] = snowflakeSchemaDefinition
+                file_load['create_sql'] = group_create_sql
+                file_load.pop('df')
+            group_loads.append((header, group, df))
+
+        staged_files = {}
+        quarantine_files = {}
+        for group_number, (header, group, df) in enumerate(group_loads):
+            staged_file = f"{sfTable_name}_{group_number}.parquet"
+            if len(df) > 0:
+                SnowflakeConnection.putPandas2Stage(sfConn=snowflakeConnection, pdDF=df, sfStage=load_stage,
+                                                    stagePath=stage_path, fileName=staged_file,
+                                                    tempFolder=temp_folder)
+                staged_files[staged_file] = group
+            group_loads[group_number] = df = None
+            for input_file, file_load in group:
+                if quarantine_enabled and file_load['errored_data']:
+                    quarantine_file = f"{sfTable_name}_{len(quarantine_files) + 1}.parquet"
+                    quarantine_df = get_quarantine_dataframe(errored_data=file_load['errored_data'],
+                                                             file=input_file['Key'], sf_table=table_name,
+                                                             column_count=len(header),
+                                                             delimiter=file_load['delimiter'])
+                    SnowflakeConnection.putPandas2Stage(sfConn=snowflakeConnection, pdDF=quarantine_df,
+                                                        sfStage=load_stage, stagePath=quarantine_stage_path,
+                                                        fileName=quarantine_file, tempFolder=temp_folder)
+                    quarantine_df = None
+                    quarantine_files[quarantine_file] = file_load
+                    file_load['quarantine_table'] = f"{sfDatabase}.{SfSchema}.{quarantine_table}"
+                file_load['errored_data'] = None
+
+        file_results = {}
+        if staged_files:
+            SnowflakeConnection.copyStage2Snowflake(sfConn=snowflakeConnection, sfStage=load_stage,
+                                                    stagePath=stage_path, sfTable=sfTable_name,
+                                                    columnNames=column_names, fileResults=file_results)
+        quarantine_results = {}
+        if quarantine_files:
+            SnowflakeConnection.copyStage2Snowflake(sfConn=snowflakeConnection, sfStage=load_stage,
+                                                    stagePath=quarantine_stage_path, sfTable=quarantine_table,
+                                                    columnNames=SnowflakeConnection.QUARANTINE_COLUMNS,
+                                                    fileResults=quarantine_results)
+        load_failed = False
+    finally:
+        SnowflakeConnection.releaseSnowflakeConnection(sfConn=snowflakeConnection, healthy=not load_failed)
+
+    for input_file, file_load in file_loads:
+        # a file with no good rows has nothing in the table, it succeeded when it had nothing to load
+        file_load['number_o_chunks'] = 1
+        file_load['success'] = True
+        file_load['total_rows_loaded'] = 0
+    for staged_file, group in staged_files.items():
+        status, _ = file_results.get(staged_file, (None, 0))
+        for input_file, file_load in group:
+            # the rows of a staged file are loaded together, each file loaded its good rows
+            file_load['success'] = status == 'LOADED'
+            file_load['total_rows_loaded'] = file_load['rows'] if file_load['success'] else 0
+    for quarantine_file, file_load in quarantine_files.items():
+        # the malformed rows of a file are loaded by the quarantine COPY
+        status, _ = quarantine_results.get(quarantine_file, (None, 0))
+        file_load['success'] = file_load['success'] and status == 'LOADED'
+    return file_loads
+
+
+def coalesced_files_to_sf(input_files, Config, client, sfPrivateKey, temp_folder):
+    """
+    Description
+    -----------
+    A function that loads small files of the same table together, output from plan_input_batches
+        - the files are downloaded and parsed concurrently, Common coalesce.read_workers at a time
+        - the table gets one connection, one CREATE TABLE and one COPY INTO for all the files
+        - each file is moved to success_files or failed_files and added to the loaded file index on its own,
+          one email reports the rows loaded and malformed rows of each file with their error logs attached
+        - a file that can not be read, or all the files when the load fails, are loaded again one at a time
+          with s3_file_to_sf so each gets its own error
+
+    Args
+    ----
+    input_files : list
+        Key, Size and ETag of each file
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance
+    sfPrivateKey : object
+        The decrypted snowflake private key
+    temp_folder : string
+        base temp folder, the files get their own folder inside it
+
+    Returns
+    -------
+    None
+    """
+    run_config = get_run_config(Config)
+    s3Bucket = run_config['s3Bucket']
+    SfSchema = run_config['SfSchema']
+    email_config = run_config['email_config']
+    read_workers = run_config['read_workers']
+    quarantine_enabled = run_config['quarantine_enabled']
+    checkpoint_path = run_config['checkpoint_path']
+    dedup_enabled = bool(checkpoint_path) and run_config['dedup_enabled']
+
+    start = time.time()
+    sfDatabase, sfTable, _ = splitFileName(fileKey=input_files[0]['Key'])
+    sfTable_name = fix_table_col_names(sfTable)
+    table_name = f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}"
+    print(f"{len(input_files)} files coalesced into {table_name}")
+
+    group_temp_folder = tempfile.mkdtemp(dir=temp_folder)
+    try:
+        read_files = {}
+        with ThreadPoolExecutor(max_workers=max(min(read_workers, len(input_files)), 1)) as executor:
+            futures = {executor.submit(read_coalesced_file, input_file=input_file, run_config=run_config, client=client,
+                                       temp_folder=group_temp_folder): input_file['Key']
+                       for input_file in input_files}
+            for future in as_completed(futures):
+                try:
+                    read_files[futures[future]] = future.result()
+                except Exception as err_message:
+                    print(f"{futures[future]} not read for the coalesced load: {err_message}")
+        file_loads = [(input_file, read_files[input_file['Key']]) for input_file in input_files
+                      if input_file['Key'] in read_files]
+        single_files = [input_file for input_file in input_files if input_file['Key'] not in read_files]
+        read_files = None
+
+        if file_loads:
+            try:
+                load_coalesced_files(file_loads=file_loads, run_config=run_config, sfPrivateKey=sfPrivateKey,
+                                     temp_folder=group_temp_folder)
+            except Exception as err_message:
+                print(f"coalesced load of {table_name} failed, loading its files one at a time: {err_message}")
+                single_files = [input_file for input_file, _ in file_loads] + single_files
+                file_loads = []
+
+        if file_loads:
+            duration = time.time() - start
+            moves = []
+            for input_file, file_load in file_loads:
+                _, _, sfFile = splitFileName(fileKey=input_file['Key'])
+                destination_folder = 'success_files' if file_load['success'] else 'failed_files'
+                moves.append((input_file['Key'], f"file2table/{sfDatabase}/{destination_folder}/{sfFile}"))
+                if file_load.get('has_errors') and not quarantine_enabled:
+                    file_load['error_attatchment'] = [file_load['error_log']]
+            move_results = S3Connection.s3MoveObjects(s3Client=client, s3Bucket=s3Bucket, s3Moves=moves)
+            for input_file, file_load in file_loads:
+                file = input_file['Key']
+                # the name the file's own load would use, so skip_duplicate_file finds it
+                file_database, file_table, _ = splitFileName(fileKey=file)
+                file_table_name = f"{file_database}.{str(SfSchema).lower()}.{fix_table_col_names(file_table)}"
+                if not move_results[file]['moved']:
+                    # the file stays in the input folder, with dedup the loaded file index skips it on the next run
+                    print(f"{file} not moved to {move_results[file]['destination']}: {move_results[file]['error']}")
+                if dedup_enabled and file_load['success']:
+                    try:
+                        Checkpoint.recordLoadedFile(checkpointPath=checkpoint_path, etag=input_file['ETag'],
+                                                    fileSize=input_file['Size'], sfTable=file_table_name,
+                                                    s3Key=file, rowsLoaded=file_load['total_rows_loaded'])
+                    except Exception as err_message:
+                        print(f"{file} not added to the loaded file index: {err_message}")
+                Metrics.recordFile(s3Key=file, sfTable=file_table_name,
+                                   status='success' if file_load['success'] else 'failed',
+                                   seconds=duration, fileBytes=file_load['file_size'],
+                                   rowsLoaded=file_load['total_rows_loaded'], badRows=file_load['bad_rows'],
+                                   chunks=file_load['number_o_chunks'], loadMode='coalesced')
+
+            subject = f"{len(file_loads)} files uploaded to Snowflake from {sfDatabase}"
+            message = get_coalesced_message(sfDatabase=sfDatabase, SfSchema=SfSchema, sfTable_name=sfTable_name,
+                                            file_loads=[(splitFileName(fileKey=input_file['Key'])[2], file_load)
+                                                        for input_file, file_load in file_loads],
+                                            duration=duration)
+            notify_start = time.perf_counter()
+            Communication.queue_mail(sender_email=email_config['email.sender'],
+                                     receiver_email=get_receiver_email(sfDatabase=sfDatabase,
+                                                                       email_config=email_config),
+                                     subject=subject, body=message,
+                                     attachments=[attachment for _, file_load in file_loads
+                                                  for attachment in file_load['error_attatchment']],
+                                     digest_key=sfDatabase)
+            Metrics.recordStage(stage='notify', seconds=time.perf_counter() - notify_start)
+
+        for input_file in single_files:
+            s3_file_to_sf(file=input_file['Key'], Config=Config, client=client, sfPrivateKey=sfPrivateKey,
+                          temp_folder=group_temp_folder, file_etag=input_file['ETag'])
+    finally:
+        shutil.rmtree(group_temp_folder, ignore_errors=True)
+
+
+def copy_file_to_sf(file, run_config, client, sfPrivateKey, temp_folder, file_load):
+    """
+    Description
+    -----------
+    A function that loads a file straight from S3 with COPY INTO so parsing happens on the warehouse
+        - only the header row is downloaded, to name the table columns
+        - the file is scanned once, rows with errors are skipped by ON_ERROR and read back from the COPY job
+          with VALIDATE so the per-line error log is kept
+        - the stage reads the bucket through Snowflake sf.storage_integration, inline AWS keys are only used
+          with Snowflake sf.stage_inline_credentials set
+        - with Common schema.inference set to "typed" column types are inferred from ranges sampled across the file
+        - the file is loaded by column name, new columns are added to an existing table
+        - with Common quarantine.enabled the rejected rows are written to the quarantine.table of the database
+          instead of being attached to the email
+
+    Args
+    ----
+    file : string
+        S3 key of the file to be loaded
+    run_config : dict
+        output from get_run_config(Config)
+    client : object
+        A S3 client instance
+    sfPrivateKey : object
+        The decrypted snowflake private key
+    temp_folder : string
+        folder the error log for this file is written to
+    file_load : dict
+        load state of the file, filled in as the load progresses so the error email can report it
+
+    Returns
+    -------
+    file_load : dict
+        load state of the file
+    """
+    s3Bucket = run_config['s3Bucket']
+    SfSchema = run_config['SfSchema']
+    sfUser = run_config['sfUser']
+    sfAccount = run_config['sfAccount']
+    sfWarehouse = run_config['sfWarehouse']
+    sfRole = run_config['sfRole']
+    sfStage = run_config['sfStage']
+    sfStorageIntegration = run_config['sfStorageIntegration']
+    sfInlineCredentials = run_config['sfInlineCredentials']
+    sfOnError = run_config['sfOnError']
+    parse_engine = run_config['parse_engine']
+    schema_inference = run_config['schema_inference']
+    schema_evolution = run_config['schema_evolution']
+    quarantine_enabled = run_config['quarantine_enabled']
+    quarantine_table = run_config['quarantine_table']
+    error_sample_rows = run_config['error_sample_rows']
+
+    sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
+    sfTable_name = fix_table_col_names(sfTable)
+    delimiter = file_load['delimiter']
+
+    file_load['file_size'] = client.head_object(Bucket=s3Bucket, Key=file)['ContentLength']
+
+    # only the header row is needed locally, Snowflake decompresses compressed files itself
+    header_bytes = read_file_head(client=client, s3Bucket=s3Bucket, file=file, compression=file_load['compression'])
+    table_header_row = header_bytes.split('\n'.encode())[0].decode('utf-8')
+    clean_column_names, column_name_changes_string = get_clean_column_names(table_header_row=table_header_row,
+                                                                            delimiter=delimiter)
+    column_count = len(clean_column_names)
+    file_load['column_name_changes_string'] = column_name_changes_string
+
+    if schema_inference == 'typed':
+        # rows after the header in the first range plus ranges from the rest of the file
+        header_end = header_bytes.find('\n'.encode())
+        last_newline = header_bytes.rfind('\n'.encode())
+        samples = [PandasProcessing.parseChunk(chunkBytes=header_bytes[header_end + 1:last_newline + 1],
+                                               delimiter=delimiter, columnNames=clean_column_names,
+                                               startLineNumber=2, engine=parse_engine)[0]]
+        if file_load['file_size'] > len(header_bytes) and file_load['compression'] is None:
+            samples += sample_file_rows(client=client, s3Bucket=s3Bucket, file=file,
+                                        file_size=file_load['file_size'], delimiter=delimiter,
+                                        column_names=clean_column_names, parse_engine=parse_engine)
+        _, snowflakeSchemaDefinition = PandasProcessing.inferSnowflakeSchema(pandas.concat(samples, axis=0))
+    else:
+        snowflakeSchemaDefinition = PandasProcessing.getSchemaPandas2Snowflake(
+            pandas.DataFrame(columns=clean_column_names))
+    file_load['snowflakeSchemaDefinition'] = snowflakeSchemaDefinition
+    snowflakeConnection = SnowflakeConnection.getPooledSnowflakeConnection(sfAccount=sfAccount, sfUser=sfUser,
+                                                                           sfPrivateKey=sfPrivateKey,
+                                                                           sfWarehouse=sfWarehouse, sfRole=sfRole,
+                                                                           sfDatabase=sfDatabase, sfSchema=SfSchema)
+    load_failed = True
+    try:
+        file_load['create_sql'] = SnowflakeConnection.createSnowflakeTable(
+            sfConn=snowflakeConnection, sfRole=sfRole, sfDatabase=sfDatabase, sfSchema=SfSchema,
+            sfTable=sfTable_name, tableSchemaDef=snowflakeSchemaDefinition, insert=True, setContext=False)
+        if schema_evolution:
+            alter_sql, _ = SnowflakeConnection.reconcileSnowflakeTable(sfConn=snowflakeConnection,
+                                                                       sfDatabase=sfDatabase, sfSchema=SfSchema,
+                                                                       sfTable=sfTable_name,
+                                                                       tableSchemaDef=snowflakeSchemaDefinition)
+            file_load['create_sql'] = ";\n".join([file_load['create_sql']] + alter_sql)
+        stage = SnowflakeConnection.createSnowflakeStage(sfConn=snowflakeConnection, sfDatabase=sfDatabase,
+                                                         sfSchema=SfSchema, sfStage=sfStage, s3Bucket=s3Bucket,
+                                                         s3Key=run_config['s3Key'], s3Secret=run_config['s3Secret'],
+                                                         sfStorageIntegration=sfStorageIntegration,
+                                                         inlineCredentials=sfInlineCredentials)
+
+        ## load the file, the rejected rows are read back from the COPY job
+        copy_errors = []
+        success, nchunks, nrows = SnowflakeConnection.copyIntoSnowflake(sfConn=snowflakeConnection,
+                                                                        sfTable=sfTable_name, sfStage=stage,
+                                                                        fileKey=file, delimiter=delimiter,
+                                                                        onError=sfOnError,
+                                                                        columnNames=clean_column_names,
+                                                                        copyErrors=copy_errors)
+
+        ## get bad data
+        error_attatchment = []
+        with open(f"{temp_folder}/{sfTable}_errors.txt", "w") as text_file_errors:
+            errored_data_string_list = [
+                f"line {line_number}: expected {column_count} columns but read {line.count(delimiter) + 1} [{line}]"
+                if line.count(delimiter) + 1 != column_count else f"line {line_number}: {error} [{line}]"
+                for line_number, error, line in copy_errors]
+            text_file_errors.write("\n".join(errored_data_string_list) + "\n")
+        file_load['bad_rows'] = len(copy_errors)
+        file_load['error_sample'] = errored_data_string_list[:error_sample_rows]
+        if quarantine_enabled:
+            quarantine_table = SnowflakeConnection.createQuarantineTable(sfConn=snowflakeConnection,
+                                                                         sfDatabase=sfDatabase, sfSchema=SfSchema,
+                                                                         sfTable=quarantine_table)
+            file_load['quarantine_table'] = f"{sfDatabase}.{SfSchema}.{quarantine_table}"
+            if len(copy_errors) > 0:
+                quarantine_df = get_quarantine_dataframe(
+                    errored_data=[[line_number, line] for line_number, _, line in copy_errors], file=file,
+                    sf_table=f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}", column_count=column_count,
+                    delimiter=delimiter, error_messages=[error for _, error, _ in copy_errors])
+                SnowflakeConnection.writePandas2Snowflake(sfConn=snowflakeConnection, pdDF=quarantine_df,
+                                                          sfTable=quarantine_table)
+                quarantine_df = None
+        elif len(copy_errors) > 0:
+            error_attatchment = [f"{temp_folder}/{sfTable}_errors.txt"]
+        load_failed = False
+    finally:
+        SnowflakeConnection.releaseSnowflakeConnection(sfConn=snowflakeConnection, healthy=not load_failed)
+
+    file_load['success'] = success
+    file_load['number_o_chunks'] = nchunks
+    file_load['total_rows_loaded'] = nrows
+    file_load['error_attatchment'] = error_attatchment
+    return file_load
+
+
+def get_header_problems(table_header_row, delimiter):
+    """
+    Description
+    -----------
+    A function that finds header names a load would fail on, for a validation scan
+
+    Args
+    ----
+    table_header_row : string
+        first line of the file
+    delimiter : string
+        character used to separate the fields
+
+    Returns
+    -------
+    problems : list
+        one message per column with no name and per cleaned name shared by several columns
+    """
+    original_column_names = table_header_row.strip().split(delimiter)
+    problems = [f"column {column_number} has no name" for column_number, column_name in
+                enumerate(original_column_names, 1) if not fix_table_col_names(column_name)]
+    if problems:
+        return problems
+    clean_column_names, _ = get_clean_column_names(table_header_row=table_header_row, delimiter=delimiter)
+    # unquoted Snowflake identifiers are not case sensitive
+    name_counts = Counter(column_name.upper() for column_name in clean_column_names)
+    for clean_name, name_count in name_counts.items():
+        if name_count > 1:
+            duplicates = ", ".join(original_column_name for original_column_name, column_name in
+                                   zip(original_column_names, clean_column_names) if column_name.upper() == clean_name)
+            problems.append(f"columns {duplicates} are all named {clean_name} once cleaned")
+    return problems
+
+
+def validate_file(file, run_config, client, temp_folder, file_load):
+    """
+    Description
+    -----------
+    A function that scans a file for the problems a load would run into, without connecting to Snowflake
+        - the file is streamed like a load, large uncompressed files with concurrent ranged GETs, and each chunk
+          is only checked for delimiters and UTF-8, no dataframes are built
+        - reports rows with the wrong number of columns, rows that are not UTF-8, a byte order mark, header
+          renames, header names that are empty or duplicated once cleaned and the schema a load would create
+        - Parquet files are checked from their footer, their rows are not read
+        - the file passes when nothing blocks a load and the share of malformed rows is at most
+          Common validate.max_bad_ratio (default 0)
+
+    Args
+    ----
+    file : string
+        S3 key of the file to be validated
+    run_config : dict
+        output from get_run_config(Config)
+    client : object
+        A S3 client instance
+    temp_folder : string
+        folder the error log for this file is written to
+    file_load : dict
+        validation state of the file, filled in as the scan progresses
+
+    Returns
+    -------
+    file_load : dict
+        validation state of the file
+        - success, problems, rows, bad_rows, encoding_errors, error_sample, column_name_changes_string,
+          snowflakeSchemaDefinition and error_attatchment
+    """
+    s3Bucket = run_config['s3Bucket']
+    parse_engine = run_config['parse_engine']
+    queue_size = run_config['queue_size']
+    schema_inference = run_config['schema_inference']
+    large_file_bytes = run_config['large_file_bytes']
+    large_file_workers = run_config['large_file_workers']
+    error_sample_rows = run_config['error_sample_rows']
+    max_bad_ratio = run_config['max_bad_ratio']
+
+    sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
+    delimiter = file_load['delimiter']
+    compression = file_load['compression']
+    file_load.update({'problems': [], 'rows': 0, 'encoding_errors': 0, 'error_sample': []})
+
+    file_load['file_size'] = client.head_object(Bucket=s3Bucket, Key=file)['ContentLength']
+
+    if file_load.get('file_format') == 'parquet':
+        parquet_file = PandasProcessing.openParquetFile(S3Connection.S3RangedFile(
+            s3Client=client, s3Bucket=s3Bucket, s3Key=file, fileSize=file_load['file_size']))
+        arrow_schema = parquet_file.schema_arrow
+        file_load['problems'] = get_header_problems(table_header_row="\0".join(arrow_schema.names), delimiter="\0")
+        if not file_load['problems']:
+            clean_column_names, file_load['column_name_changes_string'] = get_clean_column_names(
+                table_header_row="\0".join(arrow_schema.names), delimiter="\0")
+            _, file_load['snowflakeSchemaDefinition'] = PandasProcessing.getSnowflakeSchemaArrow(
+                arrowSchema=arrow_schema, columnNames=clean_column_names)
+        file_load['rows'] = parquet_file.metadata.num_rows
+        file_load['success'] = not file_load['problems']
+        return file_load
+
+    # number of bytes checked per chunk, nothing but the chunk is held in memory
+    chunk_size = (1024 ** 2) * 16
+    sample_size = 1024 ** 2
+    newline = '\n'.encode()
+    header_row = None
+    column_count = 0
+    start_line_number = 2
+    scan_start = time.perf_counter()
+    scanned_bytes = 0
+    error_log_path = f"{temp_folder}/{sfTable}_errors.txt"
+    s3_object_body = None
+    with open(error_log_path, "w") as text_file_errors:
+        if file_load['file_size'] >= large_file_bytes and compression is None:
+            file_chunks = S3Connection.s3GetObjectLineChunks(s3Client=client, s3Bucket=s3Bucket, s3Key=file,
+                                                             fileSize=file_load['file_size'], chunkSize=chunk_size,
+                                                             maxWorkers=large_file_workers)
+        else:
+            s3_object = S3Connection.s3GetObject(s3Client=client, s3Bucket=s3Bucket, s3Key=file)
+            s3_object_body = S3Connection.s3DecompressBody(s3ObjectBody=s3_object['Body'], compression=compression)
+            file_chunks = PandasProcessing.readLineChunks(s3ObjectBody=s3_object_body, chunkSize=chunk_size)
+        line_chunks = pipeline_stage(file_chunks, max_queued=queue_size)
+        try:
+            for s3_body_chunk in line_chunks:
+                scanned_bytes += len(s3_body_chunk)
+                if header_row is None:
+                    if s3_body_chunk.startswith((b'\xff\xfe', b'\xfe\xff')):
+                        file_load['problems'].append("the file is UTF-16, save it as UTF-8")
+                        break
+                    if s3_body_chunk.startswith(b'\xef\xbb\xbf'):
+                        # the mark would become part of the first column name
+                        file_load['problems'].append("the file starts with a UTF-8 byte order mark (UTF-8-BOM), "
+                                                     "save it as UTF-8 without one")
+                        s3_body_chunk = s3_body_chunk[3:]
+                    header_end = s3_body_chunk.find(newline)
+                    if header_end == -1:
+                        header_end = len(s3_body_chunk)
+                    try:
+                        header_row = s3_body_chunk[0:header_end].decode('utf-8')
+                    except UnicodeDecodeError as err_message:
+                        file_load['problems'].append(f"the header row is not UTF-8: {err_message}")
+                        break
+                    s3_body_chunk = s3_body_chunk[header_end + 1:]
+                    header_problems = get_header_problems(table_header_row=header_row, delimiter=delimiter)
+                    file_load['problems'] += header_problems
+                    if not header_problems:
+                        clean_column_names, file_load['column_name_changes_string'] = get_clean_column_names(
+                            table_header_row=header_row, delimiter=delimiter)
+                        file_load['column_names'] = clean_column_names
+                        file_load['snowflakeSchemaDefinition'] = PandasProcessing.getSchemaPandas2Snowflake(
+                            pandas.DataFrame(columns=clean_column_names))
+                        sample_end = s3_body_chunk.rfind(newline, 0, sample_size) + 1
+                        if schema_inference == 'typed' and sample_end > 0:
+                            try:
+                                samples = [PandasProcessing.parseChunk(
+                                    chunkBytes=s3_body_chunk[:sample_end], delimiter=delimiter,
+                                    columnNames=clean_column_names, startLineNumber=2, engine=parse_engine)[0]]
+                                if file_load['file_size'] > chunk_size and compression is None:
+                                    samples += sample_file_rows(client=client, s3Bucket=s3Bucket, file=file,
+                                                                file_size=file_load['file_size'],
+                                                                delimiter=delimiter, column_names=clean_column_names,
+                                                                parse_engine=parse_engine)
+                                _, file_load['snowflakeSchemaDefinition'] = PandasProcessing.inferSnowflakeSchema(
+                                    pandas.concat(samples, axis=0))
+                            except UnicodeDecodeError:
+                                # reported with its line number by the scan, the VARCHAR schema is proposed
+                                pass
+                            samples = None
+                    column_count = len(header_row.strip().split(delimiter))
+
+                errored_data, encoding_errors, next_line_number = PandasProcessing.validateChunk(
+                    chunkBytes=s3_body_chunk, delimiter=delimiter, columnCount=column_count,
+                    startLineNumber=start_line_number)
+                s3_body_chunk = None
+                file_load['rows'] += next_line_number - start_line_number
+                start_line_number = next_line_number
+                file_load['bad_rows'] += len(errored_data)
+                file_load['encoding_errors'] += len(encoding_errors)
+                errored_data_string_list = sorted(
+                    [(line_number, f"line {line_number}: {error}") for line_number, error in encoding_errors] +
+                    [(line_number, f"line {line_number}: expected {column_count} columns but read "
+                                   f"{line.count(delimiter) + 1} [{line}]") for line_number, line in errored_data])
+                errored_data_string_list = [error for _, error in errored_data_string_list]
+                if errored_data_string_list:
+                    text_file_errors.write("\n".join(errored_data_string_list) + "\n")
+                file_load['error_sample'] += errored_data_string_list[:error_sample_rows -
+                                                                      len(file_load['error_sample'])]
+        finally:
+            line_chunks.close()
+            if s3_object_body is not None:
+                s3_object_body.close()
+    Metrics.recordStage(stage='validate', seconds=time.perf_counter() - scan_start, nbytes=scanned_bytes,
+                        rows=file_load['rows'])
+
+    if header_row is None and not file_load['problems']:
+        file_load['problems'].append("the file is empty")
+    if file_load['encoding_errors']:
+        file_load['problems'].append(f"{file_load['encoding_errors']} rows are not UTF-8")
+    if file_load['bad_rows'] > max_bad_ratio * file_load['rows']:
+        file_load['problems'].append(f"{file_load['bad_rows']} of {file_load['rows']} rows have the wrong number "
+                                     f"of columns, more than the {max_bad_ratio:.2%} allowed")
+    if file_load['bad_rows'] or file_load['encoding_errors']:
+        file_load['error_attatchment'] = [error_log_path]
+    file_load['success'] = not file_load['problems']
+    return file_load
+
+
+def move_s3_file(client, s3Bucket, sourceKey, destinationKey):
+    """
+    Description
+    -----------
+    moves a loaded file to its success or failed folder, raises when the file was not moved
+
+    Args
+    ----
+    client: object
+        A S3 client
+    s3Bucket: string
+        A S3 bucket
+    sourceKey: string
+        key of the loaded file
+    destinationKey: string
+        key in the success or failed folder
+
+    Returns
+    -------
+    None
+    """
+    moveResult = S3Connection.s3MoveObjects(s3Client=client, s3Bucket=s3Bucket,
+                                            s3Moves=[(sourceKey, destinationKey)])[sourceKey]
+    if not moveResult['moved']:
+        raise Exception(f"{sourceKey} not moved to {destinationKey}: {moveResult['error']}")
+    print('S3 Object moved')
+
+
+def skip_duplicate_file(input_file, Config, client, checkpoint_path):
+    """
+    Description
+    -----------
+    A function that skips a discovered file whose contents were already loaded to its table
+        - the file is moved to success_files and a "duplicate, skipped" notification is sent,
+          also when the file can not be moved
+        - nothing is downloaded and no warehouse time is used
+
+    Args
+    ----
+    input_file : dict
+        Key, Size and ETag of the file from S3Connection.s3DiscoverInputFiles
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance
+    checkpoint_path : string
+        path of the load state store
+
+    Returns
+    -------
+    skipped : bool
+        True when the file is a duplicate
+    """
+    s3Bucket = Config['AWS']['s3.bucket']
+    SfSchema = Config['Snowflake']['sf.schema']
+    email_config = Config['Email']
+    file = input_file['Key']
+    sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
+    sfTable_name = fix_table_col_names(sfTable)
+    table_name = f"{sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}"
+
+    loaded_file = Checkpoint.getLoadedFile(checkpointPath=checkpoint_path, etag=input_file['ETag'],
+                                           fileSize=input_file['Size'], sfTable=table_name)
+    if loaded_file is None:
+        return False
+
+    print(f"{file} duplicate of {loaded_file['s3_key']}, skipped")
+    Metrics.recordFile(s3Key=file, sfTable=table_name, status='skipped', seconds=0.0, fileBytes=input_file['Size'])
+    moved = 'has been moved to success_files'
+    try:
+        destinationKey = f"file2table/{sfDatabase}/success_files/{sfFile}"
+        move_s3_file(client=client, s3Bucket=s3Bucket, sourceKey=file, destinationKey=destinationKey)
+    except Exception as err_message:
+        # the file stays in the input folder and is skipped again on the next run
+        print(f"{file} duplicate not moved: {err_message}")
+        moved = f'could not be moved to success_files, it is still in the input folder: {err_message}'
+    try:
+        loaded_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(loaded_file['loaded_at']))
+        subject = f"File skipped as a duplicate from {sfDatabase}"
+        message = f'Please be advised that {sfFile} has the same contents as {loaded_file["s3_key"]}, which was imported into snowflake as the table {table_name} on {loaded_at}.\n\n' \
+                  f'duplicate, skipped\n\n' \
+                  f'{loaded_file["rows_loaded"]} rows were loaded from the original file, this file was not loaded again and {moved}.\n\n' \
+                  f'To load the same contents again, turn off Common dedup.enabled for the run.'
+        Communication.queue_mail(sender_email=email_config['email.sender'],
+                                 receiver_email=get_receiver_email(sfDatabase=sfDatabase, email_config=email_config),
+                                 subject=subject, body=message, attachments=[], digest_key=sfDatabase)
+    except Exception as err_message:
+        print(f"{file} duplicate notification not sent: {err_message}")
+    return True
+
+
+def s3_file_to_sf(file, Config, client, sfPrivateKey, temp_folder, file_etag=None):
+    """
+    Description
+    -----------
+    A function that writes a single file from an S3 input folder to a Snowflake table
+        - moves the file to success_files or failed_files
+        - sends the success or error notification for the file
+        - Common load.mode picks the loader, "pandas" (default), "staged" for one COPY INTO per file
+          or "copy" for COPY INTO straight from S3
+        - with Common dedup.enabled a loaded file is added to the loaded file index so later copies of it are skipped
+        - .txt and .csv files are loaded, also compressed as .gz, .bz2 or .zst, and .parquet files
+          with parquet_file_to_sf whatever the load mode
+
+    Args
+    ----
+    file : string
+        S3 key of the file to be loaded
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance
+    sfPrivateKey : object
+        The decrypted snowflake private key
+        - Output from SnowflakeConnection.getPrivateKey(keyFile, snowflakePassword)
+    temp_folder : string
+        folder the error log for this file is written to
+    file_etag : string
+        S3 ETag of the file from discovery, files without one are not added to the loaded file index
+
+    Returns
+    -------
+    None
+    """
+    run_config = get_run_config(Config)
+
+    start = time.time()
+    print(f"{file} ingestion started")
+
+    sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
+    sfTable_name = fix_table_col_names(sfTable)
+    receiver_email = get_receiver_email(sfDatabase=sfDatabase, email_config=run_config['email_config'])
+    # defaults so the error email can always be built
+    file_load = {'delimiter': "", 'file_size': 0, 'snowflakeSchemaDefinition': "", 'create_sql': "",
+                 'column_name_changes_string': "", 'error_attatchment': [], 'success': False,
+                 'number_o_chunks': 0, 'total_rows_loaded': 0, 'compression': None, 'bad_rows': 0}
+
+    try:
+        ## assign delimeter
+        # name.csv.gz, name.txt.bz2 and name.csv.zst are read as name.csv and name.txt
+        data_file, file_load['compression'] = S3Connection.s3ObjectCompression(s3Key=file)
+        delimiter = get_file_delimiter(data_file=data_file)
+        if delimiter:
+            file_load['delimiter'] = delimiter
+        elif data_file.endswith('.parquet') and file_load['compression'] is None:
+            # Parquet pages are compressed inside the file, the file itself is read by offset
+            file_load['file_format'] = 'parquet'
+        else:
+            return
+
+        if file_load.get('file_format') == 'parquet':
+            parquet_file_to_sf(file=file, run_config=run_config, client=client, sfPrivateKey=sfPrivateKey,
+                               temp_folder=temp_folder, file_load=file_load)
+        elif run_config['load_mode'] == 'copy':
+            copy_file_to_sf(file=file, run_config=run_config, client=client, sfPrivateKey=sfPrivateKey,
+                            temp_folder=temp_folder, file_load=file_load)
+        else:
+            pandas_file_to_sf(file=file, run_config=run_config, client=client, sfPrivateKey=sfPrivateKey,
+                              temp_folder=temp_folder, file_load=file_load)
+    except Exception as err_message:
+        err_subject = f"{sfTable_name} Load Table Error"
+        end = time.time()
+        duration = end - start
+        err_body = f"file: {sfFile} \ntable: \n{sfTable_name} \n\nsnowflake schema: \n{file_load['snowflakeSchemaDefinition']}\n\n" \
+                   f"Create Table SQL:\n{file_load['create_sql']} \n\nerror: \n{err_message}  \n\n" \
+                   f"Please make sure the file format is UTF-8\n\t- UTF-8-BOM is not supported \n\n" \
+                   f"Delimiter Used: {file_load['delimiter']}\n\nfile size: {file_load['file_size'] / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds"
+        destinationKey = f"file2table/{sfDatabase}/failed_files/{sfFile}"
+        try:
+            move_s3_file(client=client, s3Bucket=run_config['s3Bucket'], sourceKey=file, destinationKey=destinationKey)
+        except Exception as move_err_message:
+            # the error is still reported, the file is left in the input folder
+            print(f"{file} not moved to failed_files: {move_err_message}")
+            err_body += f"\n\nthe file was not moved to failed_files and is still in the input folder: \n{move_err_message}"
+        Communication.queue_mail(sender_email=run_config['err_sender_email'], receiver_email=receiver_email,
+                                 subject=err_subject, body=err_body, attachments=[], digest_key=sfDatabase)
+        Metrics.recordFile(s3Key=file, sfTable=f"{sfDatabase}.{str(run_config['SfSchema']).lower()}.{sfTable_name}",
+                           status='failed', seconds=duration, fileBytes=file_load['file_size'],
+                           rowsLoaded=file_load['total_rows_loaded'], badRows=file_load['bad_rows'],
+                           chunks=file_load['number_o_chunks'], loadMode=run_config['load_mode'])
+    else:
+        # the table is loaded, a file that can not be moved is reported but not sent down the failed path
+        move_err_message = None
+        destinationKey = f"file2table/{sfDatabase}/success_files/{sfFile}"
+        try:
+            move_s3_file(client=client, s3Bucket=run_config['s3Bucket'], sourceKey=file, destinationKey=destinationKey)
+        except Exception as err_message:
+            print(f"{file} loaded but not moved to success_files: {err_message}")
+            move_err_message = err_message
+        checkpoint_path = run_config['checkpoint_path']
+        if file_etag and checkpoint_path and run_config['dedup_enabled'] and file_load['success']:
+            try:
+                Checkpoint.recordLoadedFile(checkpointPath=checkpoint_path, etag=file_etag,
+                                            fileSize=file_load['file_size'],
+                                            sfTable=f"{sfDatabase}.{str(run_config['SfSchema']).lower()}."
+                                                    f"{sfTable_name}",
+                                            s3Key=file, rowsLoaded=file_load['total_rows_loaded'])
+            except Exception as err_message:
+                # the file is loaded already, only later copies of it will not be skipped
+                print(f"{file} not added to the loaded file index: {err_message}")
+
+        end = time.time()
+        duration = end - start
+
+        subject = f"File uploaded to Snowflake from {sfDatabase}"
+        message = get_success_message(sfFile=sfFile, sfDatabase=sfDatabase, SfSchema=run_config['SfSchema'],
+                                      sfTable_name=sfTable_name, file_load=file_load, duration=duration)
+        notify_sender_email = run_config['sender_email']
+        if move_err_message is not None:
+            subject = f"{sfTable_name} loaded but not moved"
+            message = f"{message}\n\nThe file was loaded but not moved to success_files and is still in the input folder: \n{move_err_message}"
+            notify_sender_email = run_config['err_sender_email']
+        notify_start = time.perf_counter()
+        try:
+            Communication.queue_mail(sender_email=notify_sender_email, receiver_email=receiver_email,
+                                     subject=subject, body=message, attachments=file_load['error_attatchment'],
+                                     digest_key=sfDatabase)
+        except Exception as err_message:
+            print(f"{file} notification not sent: {err_message}")
+        Metrics.recordStage(stage='notify', seconds=time.perf_counter() - notify_start)
+        Metrics.recordFile(s3Key=file, sfTable=f"{sfDatabase}.{str(run_config['SfSchema']).lower()}.{sfTable_name}",
+                           status='success' if file_load['success'] else 'failed', seconds=time.time() - start,
+                           fileBytes=file_load['file_size'], rowsLoaded=file_load['total_rows_loaded'],
+                           badRows=file_load['bad_rows'], chunks=file_load['number_o_chunks'],
+                           loadMode=run_config['load_mode'])
+    if os.path.isfile(f"{temp_folder}/{sfTable}_errors.txt"):
+        os.remove(f"{temp_folder}/{sfTable}_errors.txt")
+
+
+def s3_file_to_sf_worker(file, Config, client, sfPrivateKey, temp_folder, file_etag=None):
+    """
+    Description
+    -----------
+    A function that runs s3_file_to_sf inside a worker of the ingestion pool
+        - gives the file its own temp folder so error logs of files sharing a table name do not collide
 
     Args
     ----
-    config_yaml_path : string
-        path to yaml file specifying configurations to be used
+    file : string
+        S3 key of the file to be loaded
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance, boto3 clients are thread safe and shared by the workers
+    sfPrivateKey : object
+        The decrypted snowflake private key
+    temp_folder : string
+        base temp folder, the worker creates its own folder inside it
+    file_etag : string
+        S3 ETag of the file from discovery
 
     Returns
     -------
     None
     """
-    # get configurations
-    mismaches_in_a_row_limit = 50
+    file_temp_folder = tempfile.mkdtemp(dir=temp_folder)
+    try:
+        s3_file_to_sf(file=file, Config=Config, client=client, sfPrivateKey=sfPrivateKey,
+                      temp_folder=file_temp_folder, file_etag=file_etag)
+    finally:
+        shutil.rmtree(file_temp_folder, ignore_errors=True)
 
-    with open(config_yaml_path) as file:
-        Config = yaml.load(file, Loader=yaml.FullLoader)
 
-    common_config = Config['Common']
-    s3_config = Config['AWS']
-    snowflake_config = Config['Snowflake']
-    email_config = Config['Email']
+def validate_s3_file(file, Config, client, temp_folder):
+    """
+    Description
+    -----------
+    A function that validates a single file from an S3 input folder without loading it
+        - the file stays in its input folder
+        - sends the validation report for the file, with the error log attached
 
-    # Get Credentials
-    temp_folder = common_config["linux.temp_path"]
+    Args
+    ----
+    file : string
+        S3 key of the file to be validated
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance
+    temp_folder : string
+        folder the error log for this file is written to
+
+    Returns
+    -------
+    valid : bool
+        True when the file passed validation, None when it is not a file type that is loaded
+    """
+    run_config = get_run_config(Config)
 
-    # S3
-    s3Bucket = s3_config['s3.bucket']
-    s3Key = s3_config['s3.key']
-    s3Secret = s3_config['s3.secret']
-    s3Folder = s3_config['s3.folder']
-    s3InternationalInput = s3_config['s3.internationalInputFolder']
+    start = time.time()
+    print(f"{file} validation started")
 
-    # Snowflake
-    SfSchema = snowflake_config['sf.schema']
-    SfPassphrase = snowflake_config['sf.passphrase']
-    SfKeyfile = snowflake_config['p8.key.file']
-    sfUser = snowflake_config['sf.user']
-    sfAccount = snowflake_config['sf.account']
-    sfWarehouse = snowflake_config['sf.warehouse']
-    sfPrivateKey = SnowflakeConnection.getPrivateKey(keyFile=SfKeyfile, snowflakePassword=SfPassphrase)
-    sfRole = snowflake_config['sf.Role']
-
-    # Email
-    sender_email = email_config['email.sender']
-    err_sender_email = email_config['email.error_sender']
+    sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
+    sfTable_name = fix_table_col_names(sfTable)
+    table_name = f"{sfDatabase}.{str(run_config['SfSchema']).lower()}.{sfTable_name}"
+    receiver_email = get_receiver_email(sfDatabase=sfDatabase, email_config=run_config['email_config'])
+    file_load = {'delimiter': "", 'file_size': 0, 'snowflakeSchemaDefinition': "", 'column_name_changes_string': "",
+                 'error_attatchment': [], 'success': False, 'compression': None, 'bad_rows': 0}
 
-    # Create S3 Instances
-    client = S3Connection.createS3Client(s3Key=s3Key, s3Secret=s3Secret)
-    session = S3Connection.createS3Session(s3AccessKey=s3Key, s3Secret=s3Secret)
-    resource = S3Connection.createS3Resource(s3Session=session)
+    try:
+        # the file types s3_file_to_sf loads
+        data_file, file_load['compression'] = S3Connection.s3ObjectCompression(s3Key=file)
+        delimiter = get_file_delimiter(data_file=data_file)
+        if delimiter:
+            file_load['delimiter'] = delimiter
+        elif data_file.endswith('.parquet') and file_load['compression'] is None:
+            file_load['file_format'] = 'parquet'
+        else:
+            return None
+        validate_file(file=file, run_config=run_config, client=client, temp_folder=temp_folder, file_load=file_load)
+        duration = time.time() - start
+        print(f"{file} {'passed' if file_load['success'] else 'failed'} validation, {file_load['rows']} rows, "
+              f"{file_load['bad_rows']} malformed, {file_load['encoding_errors']} not UTF-8 in {duration:.1f} seconds")
+        for problem in file_load['problems']:
+            print(f"    {problem}")
+
+        subject = f"File {'validated' if file_load['success'] else 'failed validation'} from {sfDatabase}"
+        message = get_validation_message(sfFile=sfFile, sfDatabase=sfDatabase, SfSchema=run_config['SfSchema'],
+                                         sfTable_name=sfTable_name, file_load=file_load, duration=duration)
+        Communication.queue_mail(sender_email=run_config['sender_email'], receiver_email=receiver_email,
+                                 subject=subject, body=message, attachments=file_load['error_attatchment'],
+                                 digest_key=sfDatabase)
+        Metrics.recordFile(s3Key=file, sfTable=table_name, status='valid' if file_load['success'] else 'invalid',
+                           seconds=duration, fileBytes=file_load['file_size'], badRows=file_load['bad_rows'],
+                           loadMode='validate')
+    except Exception as err_message:
+        duration = time.time() - start
+        print(f"{file} not validated: {err_message}")
+        err_body = f"file: {sfFile} \ntable: \n{table_name} \n\nerror: \n{err_message}  \n\n" \
+                   f"The file has not been loaded.\n\n" \
+                   f"file size: {file_load['file_size'] / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds"
+        Communication.queue_mail(sender_email=run_config['err_sender_email'], receiver_email=receiver_email,
+                                 subject=f"{sfTable_name} Validation Error", body=err_body, attachments=[],
+                                 digest_key=sfDatabase)
+        Metrics.recordFile(s3Key=file, sfTable=table_name, status='invalid', seconds=duration,
+                           fileBytes=file_load['file_size'], loadMode='validate')
+        file_load['success'] = False
+    finally:
+        if os.path.isfile(f"{temp_folder}/{sfTable}_errors.txt"):
+            os.remove(f"{temp_folder}/{sfTable}_errors.txt")
+    return file_load['success']
+
+
+def validate_s3_file_worker(file, Config, client, temp_folder):
+    """
+    Description
+    -----------
+    A function that runs validate_s3_file inside a worker of the ingestion pool, in its own temp folder
+
+    Args
+    ----
+    file : string
+        S3 key of the file to be validated
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance
+    temp_folder : string
+        base temp folder, the worker creates its own folder inside it
+
+    Returns
+    -------
+    valid : bool
+        output from validate_s3_file
+    """
+    file_temp_folder = tempfile.mkdtemp(dir=temp_folder)
+    try:
+        return validate_s3_file(file=file, Config=Config, client=client, temp_folder=file_temp_folder)
+    finally:
+        shutil.rmtree(file_temp_folder, ignore_errors=True)
+
+
+def move_international_files(client, s3Bucket, s3InternationalInput):
+    """
+    Description
+    -----------
+    A function that moves files into file2table/team_international/input/ for the international team
+        - the moves are verified at their destination before the input folders are listed
+
+    Args
+    ----
+    client : object
+        A S3 client instance
+    s3Bucket : string
+        S3 bucket used
+    s3InternationalInput : string
+        folder the international team drops files in
 
-    # moves files into file2table/team_international/input/ for international team
+    Returns
+    -------
+    None
+    """
     internationalInputFiles = S3Connection.s3GetInputFiles(s3Client=client, inputFolderlist=[s3InternationalInput],
                                                            s3Bucket=s3Bucket)
     if internationalInputFiles:
+        internationalMoves = []
         for internationalFileKey in internationalInputFiles:
             _, _, fileName = splitFileName(fileKey=internationalFileKey)
             Destination = f"file2table/team_international/input/{fileName}"
-            S3Connection.s3Move(s3Resource=resource, s3DestinationBucket=s3Bucket, s3DestinationKey=Destination,
-                                s3SourceBucket=s3Bucket, s3SourceKey=internationalFileKey)
-        time.sleep(3)
+            internationalMoves.append((internationalFileKey, Destination))
+        moveResults = S3Connection.s3MoveObjects(s3Client=client, s3Bucket=s3Bucket, s3Moves=internationalMoves)
+        for internationalFileKey, moveResult in moveResults.items():
+            if not moveResult['moved']:
+                print(f"{internationalFileKey} not moved: {moveResult['error']}")
+
+
+def start_run_reporting(Config):
+    """
+    Description
+    -----------
+    A function that starts the metrics run and the background mail queue of a run
+
+    Args
+    ----
+    Config : dict
+        the loaded yaml configuration
+
+    Returns
+    -------
+    None
+    """
+    common_config = Config['Common']
+    email_config = Config['Email']
+    Metrics.startMetricsRun(jsonPath=common_config.get("metrics.json_path"),
+                            textfilePath=common_config.get("metrics.textfile_path"))
+    if email_config.get("email.queue", True):
+        # loads do not wait on the mail relay, the queue is emptied before the run ends
+        Communication.start_mail_queue(smtp_host=email_config.get("email.smtp_host", Communication.SMTP_HOST),
+                                       digest=email_config.get("email.digest", False),
+                                       digest_max_mails=email_config.get("email.digest_max_mails", 100))
+
+
+def finish_run_reporting():
+    """
+    Description
+    -----------
+    A function that sends the queued notifications and writes the metrics of a run
+
+    Returns
+    -------
+    None
+    """
+    Communication.stop_mail_queue()
+    run_metrics = Metrics.finishMetricsRun()
+    if run_metrics is not None:
+        print(f"{run_metrics['rows']} rows from {run_metrics['files']['success']} files in "
+              f"{run_metrics['seconds']:.1f} seconds, {run_metrics['rows_per_second']:.0f} rows per second")
+
+
+def plan_input_batches(input_files, Config):
+    """
+    Description
+    -----------
+    A generator that groups small input files that load to the same table, for coalesced_files_to_sf
+        - only with Common coalesce.enabled, .txt and .csv files, compressed or not, of at most
+          Common coalesce.max_file_mb (default 16) are grouped by their database and table
+        - a group is let go once it has Common coalesce.max_files files (default 100) or
+          Common coalesce.max_group_mb (default 64), the other groups once discovery ends
+        - every other file is let go straight away on its own
+
+    Args
+    ----
+    input_files : iterable
+        Key, Size and ETag of each input file
+    Config : dict
+        the loaded yaml configuration
+
+    Yields
+    ------
+    batch : list
+        Key, Size and ETag of the files loaded together, one file when it is not coalesced
+    """
+    common_config = Config['Common']
+    if not common_config.get('coalesce.enabled', False):
+        for inputFile in input_files:
+            yield [inputFile]
+        return
+    max_file_bytes = float(common_config.get('coalesce.max_file_mb', 16)) * (1024 ** 2)
+    max_group_bytes = float(common_config.get('coalesce.max_group_mb', 64)) * (1024 ** 2)
+    max_files = int(common_config.get('coalesce.max_files', 100))
+    groups = {}
+    for inputFile in input_files:
+        data_file, _ = S3Connection.s3ObjectCompression(s3Key=inputFile['Key'])
+        if inputFile['Size'] > max_file_bytes or not data_file.endswith(('.txt', '.csv')):
+            yield [inputFile]
+            continue
+        sfDatabase, sfTable, _ = splitFileName(fileKey=inputFile['Key'])
+        # unquoted table names are not case sensitive
+        group_key = (sfDatabase, fix_table_col_names(sfTable).upper())
+        group = groups.setdefault(group_key, {'files': [], 'bytes': 0})
+        group['files'].append(inputFile)
+        group['bytes'] += inputFile['Size']
+        if len(group['files']) >= max_files or group['bytes'] >= max_group_bytes:
+            yield groups.pop(group_key)['files']
+    for group in groups.values():
+        yield group['files']
+
+
+def load_input_files(input_files, Config, client, sfPrivateKey):
+    """
+    Description
+    -----------
+    A function that loads input files to Snowflake
+        - files are loaded one at a time unless Common ingest.workers is greater than 1
+        - with Common dedup.enabled, files with the same ETag and size as a file already loaded to the same
+          table are skipped, it is off by default so a file dropped again on purpose is loaded again
+        - with Common coalesce.enabled small files of the same table are loaded together, see plan_input_batches
+
+    Args
+    ----
+    input_files : iterable
+        Key, Size and ETag of each input file
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance
+    sfPrivateKey : object
+        The decrypted snowflake private key
+
+    Returns
+    -------
+    files_found : int
+        number of input files
+    """
+    common_config = Config['Common']
+    temp_folder = common_config["linux.temp_path"]
+    workers = int(common_config.get("ingest.workers", 1))
+    checkpoint_path = get_checkpoint_path(Config)
+    dedup_enabled = bool(checkpoint_path) and common_config.get("dedup.enabled", False)
+    batches = plan_input_batches(input_files=input_files, Config=Config)
+    files_found = 0
+
+    if workers <= 1:
+        for batch in batches:
+            files_found += len(batch)
+            if dedup_enabled:
+                batch = [inputFile for inputFile in batch if not skip_duplicate_file(
+                    input_file=inputFile, Config=Config, client=client, checkpoint_path=checkpoint_path)]
+            if len(batch) > 1:
+                coalesced_files_to_sf(input_files=batch, Config=Config, client=client, sfPrivateKey=sfPrivateKey,
+                                      temp_folder=temp_folder)
+            elif batch:
+                s3_file_to_sf(file=batch[0]['Key'], Config=Config, client=client, sfPrivateKey=sfPrivateKey,
+                              temp_folder=temp_folder, file_etag=batch[0]['ETag'])
+    else:
+        # copies of a file that is loading are held back until the pool is done, then checked again
+        loading_contents = set()
+        held_files = []
+        # worker pool, each file is loaded, moved and notified independently
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for batch in batches:
+                files_found += len(batch)
+                load_batch = []
+                for inputFile in batch:
+                    if dedup_enabled:
+                        if skip_duplicate_file(input_file=inputFile, Config=Config, client=client,
+                                               checkpoint_path=checkpoint_path):
+                            continue
+                        sfDatabase, sfTable, _ = splitFileName(fileKey=inputFile['Key'])
+                        file_contents = (inputFile['ETag'], inputFile['Size'], sfDatabase,
+                                         fix_table_col_names(sfTable))
+                        if file_contents in loading_contents:
+                            held_files.append(inputFile)
+                            continue
+                        loading_contents.add(file_contents)
+                    load_batch.append(inputFile)
+                if len(load_batch) > 1:
+                    future = executor.submit(coalesced_files_to_sf, input_files=load_batch, Config=Config,
+                                             client=client, sfPrivateKey=sfPrivateKey, temp_folder=temp_folder)
+                    futures[future] = f"{load_batch[0]['Key']} and {len(load_batch) - 1} coalesced files"
+                elif load_batch:
+                    future = executor.submit(s3_file_to_sf_worker, file=load_batch[0]['Key'], Config=Config,
+                                             client=client, sfPrivateKey=sfPrivateKey, temp_folder=temp_folder,
+                                             file_etag=load_batch[0]['ETag'])
+                    futures[future] = load_batch[0]['Key']
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err_message:
+                    print(f"{futures[future]} worker failed: {err_message}")
+        for inputFile in held_files:
+            if skip_duplicate_file(input_file=inputFile, Config=Config, client=client,
+                                   checkpoint_path=checkpoint_path):
+                continue
+            s3_file_to_sf(file=inputFile['Key'], Config=Config, client=client, sfPrivateKey=sfPrivateKey,
+                          temp_folder=temp_folder, file_etag=inputFile['ETag'])
+    return files_found
+
+
+def validate_input_files(input_files, Config, client):
+    """
+    Description
+    -----------
+    A function that validates input files without loading them, Common ingest.workers files at a time
+
+    Args
+    ----
+    input_files : iterable
+        Key, Size and ETag of each input file
+    Config : dict
+        the loaded yaml configuration
+    client : object
+        A S3 client instance
+
+    Returns
+    -------
+    files_found : int
+        number of input files
+    files_failed : int
+        number of files that failed validation
+    """
+    temp_folder = Config['Common']["linux.temp_path"]
+    workers = int(Config['Common'].get("ingest.workers", 1))
+    files_found = 0
+    files_failed = 0
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {}
+        for inputFile in input_files:
+            files_found += 1
+            future = executor.submit(validate_s3_file_worker, file=inputFile['Key'], Config=Config, client=client,
+                                     temp_folder=temp_folder)
+            futures[future] = inputFile['Key']
+        for future in as_completed(futures):
+            try:
+                if future.result() is False:
+                    files_failed += 1
+            except Exception as err_message:
+                print(f"{futures[future]} worker failed: {err_message}")
+                files_failed += 1
+    return files_found, files_failed
+
+
+def s3_to_sf(config_yaml_path, validate_only=None):
+    """
+    Description
+    -----------
+    A function that writes file from an S3 input folder to a Snowflake table
+        - files are loaded one at a time unless Common ingest.workers is greater than 1
+        - with Common dedup.enabled, files with the same ETag and size as a file already loaded to the same
+          table are skipped, it is off by default so a file dropped again on purpose is loaded again
+        - chunk, file and run metrics are appended to Common metrics.json_path as JSON lines and the run
+          aggregates replace the Prometheus textfile Common metrics.textfile_path, when they are set
+        - notifications are sent from a background queue unless Email email.queue is false, with Email
+          email.digest each team gets one email per run with the results of all its files, or one per
+          Email email.digest_max_mails (default 100) results, the error logs are listed by name
+        - in validate-only mode the input files are scanned with validate_s3_file and reported on, nothing is
+          moved and Snowflake is not connected to
+
+    Args
+    ----
+    config_yaml_path : string
+        path to yaml file specifying configurations to be used
+    validate_only : bool
+        whether to validate the input files instead of loading them, Common validate.only when None
+
+    Returns
+    -------
+    files_failed : int
+        number of files that failed validation in validate-only mode, None when the files were loaded
+    """
+    # get configurations
+    with open(config_yaml_path) as file:
+        Config = yaml.load(file, Loader=yaml.FullLoader)
+    run_config = get_run_config(Config)
+
+    if validate_only is None:
+        validate_only = Config['Common'].get('validate.only', False)
+
+    start_run_reporting(Config=Config)
+
+    if validate_only:
+        client = S3Connection.createS3Client(s3Key=run_config['s3Key'], s3Secret=run_config['s3Secret'])
+        items = S3Connection.s3Gets3Items(s3Client=client, s3Bucket=run_config['s3Bucket'],
+                                          s3Folder=run_config['s3Folder'])
+        inputFolders = S3Connection.s3GetInputFolder(FolderItems=items)
+        # nothing is moved, files of the international team are validated once a load run has moved them
+        inputFiles = S3Connection.s3DiscoverInputFiles(s3Client=client, inputFolderlist=inputFolders,
+                                                       s3Bucket=run_config['s3Bucket'])
+        files_found, files_failed = validate_input_files(input_files=inputFiles, Config=Config, client=client)
+        PandasProcessing.closeParseProcessPool()
+        if files_found == 0:
+            print("No files to validate")
+        else:
+            print(f"{files_found - files_failed} of {files_found} files passed validation")
+        finish_run_reporting()
+        return files_failed
+
+    # Snowflake
+    sfPrivateKey = SnowflakeConnection.getPrivateKey(keyFile=run_config['SfKeyfile'],
+                                                     snowflakePassword=run_config['SfPassphrase'])
+
+    # Create S3 Instances
+    client = S3Connection.createS3Client(s3Key=run_config['s3Key'], s3Secret=run_config['s3Secret'])
+
+    move_international_files(client=client, s3Bucket=run_config['s3Bucket'],
+                             s3InternationalInput=run_config['s3InternationalInput'])
 
     ## get input files
-    items = S3Connection.s3Gets3Items(s3Client=client, s3Bucket=s3Bucket, s3Folder=s3Folder)
+    items = S3Connection.s3Gets3Items(s3Client=client, s3Bucket=run_config['s3Bucket'],
+                                      s3Folder=run_config['s3Folder'])
     inputFolders = S3Connection.s3GetInputFolder(FolderItems=items)
-    inputFiles = S3Connection.s3GetInputFiles(s3Client=client, inputFolderlist=inputFolders, s3Bucket=s3Bucket)
-    if not inputFiles:
+    # files stream in while the input folders are still being listed
+    inputFiles = S3Connection.s3DiscoverInputFiles(s3Client=client, inputFolderlist=inputFolders,
+                                                   s3Bucket=run_config['s3Bucket'])
+    files_found = load_input_files(input_files=inputFiles, Config=Config, client=client, sfPrivateKey=sfPrivateKey)
+
+    SnowflakeConnection.closeSnowflakeConnectionPool()
+    PandasProcessing.closeParseProcessPool()
+    if files_found == 0:
         print("No files to import")
-        return
-    for file in inputFiles:
-        start = time.time()
-        print(f"{file} ingestion started")
+    finish_run_reporting()
 
-        try:
-            sfDatabase, sfTable, sfFile = splitFileName(fileKey=file)
-            sfTable_name = fix_table_col_names(sfTable)
-
-            # assign emails
-            if sfDatabase.lower() == "team_A":
-                receiver_email = [email_config['email. A'], email_config['email.B']]
-            elif sfDatabase.lower() == "team_B":
-                receiver_email = [email_config['email.B']]
-            elif sfDatabase.lower() == "team_C":
-                receiver_email = [email_config['email. C'], email_config['email.C']]
-            else:
-                receiver_email = [email_config['email.B']]
 
-            ## assign delimeter
-            if file.endswith('.txt'):
-                delimiter = "|"
-            elif file.endswith('.csv'):
-                delimiter = "|"
-            else:
+def get_input_folder(file_key):
+    """
+    Description
+    -----------
+    A function that gets the folder of an S3 key, with its trailing slash like the input folder list
+
+    Args
+    ----
+    file_key : string
+        S3 key of the file
+
+    Returns
+    -------
+    input_folder : string
+        folder the file is in
+    """
+    return file_key[:file_key.rfind('/') + 1]
+
+
+def get_watermark_time(last_modified):
+    """
+    Description
+    -----------
+    A function that gets the last modified time of a watermark, kept as a string in the checkpoint store
+
+    Args
+    ----
+    last_modified : object
+        datetime from the S3 listing or its string from Checkpoint.getWatermark
+
+    Returns
+    -------
+    watermark_time : object
+        datetime, None when the watermark has no last modified time
+    """
+    if last_modified is None or isinstance(last_modified, datetime.datetime):
+        return last_modified
+    try:
+        return datetime.datetime.fromisoformat(str(last_modified))
+    except ValueError:
+        print(f"Watermark time not read: {last_modified}")
+        return None
+
+
+def list_new_input_files(client, s3Bucket, input_folders, watermarks, full_scan=False, overlap_seconds=300):
+    """
+    Description
+    -----------
+    A function that lists the files that arrived in the input folders after their watermarks
+        - loaded files are moved out of the input folders, so each folder is listed in full and new files are
+          the ones last modified after the watermark less overlap_seconds, whatever their keys sort as
+        - files discovered within the overlap are kept with their ETag and not listed again while they stay
+          in the input folder, e.g. when they could not be moved
+        - a full scan lists every file, also files last modified before the overlap
+        - the watermarks are moved up to the newest file listed in each folder
+
+    Args
+    ----
+    client : object
+        A S3 client instance
+    s3Bucket : string
+        S3 bucket used
+    input_folders : list
+        input folders to list
+    watermarks : dict
+        input folder -> last_key and last_modified of the newest file discovered and recent, key -> ETag and
+        last modified time of the files discovered within the overlap, a folder is given a new dict when
+        its watermark moves
+    full_scan : bool
+        whether to list every file of the input folders
+    overlap_seconds : float
+        seconds before the watermark files are still looked at, S3 dates multipart uploads by when they started
+
+    Returns
+    -------
+    input_files : list
+        Key, Size, ETag and LastModified of each file
+    """
+    overlap = datetime.timedelta(seconds=overlap_seconds)
+    input_files = []
+    moved_watermarks = {}
+    for input_file in S3Connection.s3DiscoverInputFiles(s3Client=client, inputFolderlist=input_folders,
+                                                        s3Bucket=s3Bucket):
+        input_folder = get_input_folder(file_key=input_file['Key'])
+        watermark = watermarks.get(input_folder)
+        last_modified = input_file.get('LastModified')
+        if watermark is not None:
+            recent = watermark.get('recent', {})
+            watermark_time = get_watermark_time(watermark['last_modified'])
+            is_old = last_modified is not None and watermark_time is not None and \
+                last_modified <= watermark_time - overlap
+            if input_file['Key'] in recent and recent[input_file['Key']][0] == input_file['ETag']:
+                if not full_scan:
+                    continue
+            elif is_old:
+                if not full_scan:
+                    continue
+                print(f"{input_file['Key']} found by a full scan, it was last modified before the watermark "
+                      f"{watermark['last_modified']}")
+        input_files.append(input_file)
+
+        moved_watermark = moved_watermarks.get(input_folder)
+        if moved_watermark is None:
+            moved_watermark = {'last_key': None, 'last_modified': None, 'recent': {}}
+            if watermark is not None:
+                moved_watermark = {'last_key': watermark['last_key'], 'last_modified': watermark['last_modified'],
+                                   'recent': dict(watermark.get('recent', {}))}
+            moved_watermarks[input_folder] = moved_watermark
+        moved_watermark['recent'][input_file['Key']] = (input_file['ETag'], last_modified)
+        watermark_time = get_watermark_time(moved_watermark['last_modified'])
+        if moved_watermark['last_key'] is None or \
+                (last_modified is not None and (watermark_time is None or last_modified > watermark_time)):
+            moved_watermark['last_key'] = input_file['Key']
+            moved_watermark['last_modified'] = last_modified
+
+    for input_folder, moved_watermark in moved_watermarks.items():
+        # files last modified before the overlap are left out by their time
+        watermark_time = get_watermark_time(moved_watermark['last_modified'])
+        if watermark_time is not None:
+            moved_watermark['recent'] = {key: (etag, last_modified) for key, (etag, last_modified)
+                                         in moved_watermark['recent'].items()
+                                         if last_modified is None or last_modified > watermark_time - overlap}
+        watermarks[input_folder] = moved_watermark
+    return input_files
+
+
+def receive_input_files(client, s3Bucket, s3Folder, event_queue, wait_seconds, max_messages=100):
+    """
+    Description
+    -----------
+    A function that gets the input files of the S3 events waiting in the event queue
+        - each file is looked up in S3, events of files already loaded and moved are dropped
+        - events of objects outside the input folders are dropped
+
+    Args
+    ----
+    client : object
+        A S3 client instance
+    s3Bucket : string
+        S3 bucket used
+    s3Folder : string
+        S3 folder the input folders are in
+    event_queue : object
+        EventQueue.SqsEventQueue or EventQueue.InMemoryEventQueue
+    wait_seconds : float
+        seconds to wait for the first event
+    max_messages : int
+        most messages handled per call
+
+    Returns
+    -------
+    input_files : list
+        Key, Size, ETag and LastModified of each file
+    message_files : list
+        ReceiptHandle of each message with the Key -> ETag of its input files, for get_handled_receipt_handles
+    """
+    messages = event_queue.receive(maxMessages=max_messages, waitSeconds=wait_seconds)
+    input_files = {}
+    message_files = []
+    for message in messages:
+        files = {}
+        for s3_object in EventQueue.parseS3EventMessage(messageBody=message['Body']):
+            input_folder = get_input_folder(file_key=s3_object['Key'])
+            if s3_object['Bucket'] not in (None, s3Bucket) or not input_folder.startswith(str(s3Folder)) or \
+                    not input_folder.endswith('input/') or s3_object['Key'] == input_folder:
                 continue
+            if s3_object['Key'] not in input_files:
+                # the event can be older than the object, S3 has the ETag and size of what is loaded
+                input_files[s3_object['Key']] = S3Connection.s3GetObjectInfo(s3Client=client, s3Bucket=s3Bucket,
+                                                                             s3Key=s3_object['Key'])
+            if input_files[s3_object['Key']] is not None:
+                files[s3_object['Key']] = input_files[s3_object['Key']]['ETag']
+        message_files.append((message['ReceiptHandle'], files))
+    return [input_file for input_file in input_files.values() if input_file is not None], message_files
 
-            ## try to open the S3 file
-            s3_object = S3Connection.s3GetObject(s3Client=client, s3Bucket=s3Bucket, s3Key=file)
-            file_size = client.head_object(Bucket=s3Bucket, Key=file)['ContentLength']
-            s3_object_body = s3_object['Body']
-
-            # number of bytes to read per chunk
-            mebibytes = 128
-            chunk_size = (1024 ** 2) * mebibytes
-
-            # the character that we'll split the data with (bytes, not string)
-            header_chunk = True
-            start_line_number = 2
-            newline = '\n'.encode()
-            partial_chunk = b''
-            number_o_chunks = 0
-            total_rows_loaded = 0
-
-            text_file_errors = open(f"{temp_folder}/{sfTable}_errors.txt", "w")
-            error_attatchment = []
-            while (True):
-                # If nothing was read there is nothing to process
-                if chunk == b'':
-                    break
-                last_newline = chunk.rfind(newline)
-                number_o_chunks += 1
-                chunk = partial_chunk + s3_object_body.read(chunk_size)
-                # write to a smaller file, or work against some piece of data
-                s3_body_chunk = chunk[0:last_newline + 1].decode('utf-8').splitlines()
-                if header_chunk == True:
-                    table_header_row = s3_body_chunk[0].strip()
-                    original_column_names = table_header_row.split(delimiter)
-                    s3_body_chunk = s3_body_chunk[1:]
-                    clean_table_header_row = fix_table_col_names(table_header_row)
-                    clean_column_names = clean_table_header_row.split(delimiter)
-                    clean_column_names = [f"N{column_name}" if column_name[0].isdigit() else f"{column_name}" for
-                                          column_name in
-                                          clean_column_names]
-                    df = pandas.DataFrame(columns=clean_column_names)
-                    column_count = len(clean_column_names)
-                    column_name_changes = [f"{original_column_name} renamed to {column_name}\n" for
-                                           (original_column_name, column_name) in
-                                           list(zip(original_column_names, clean_column_names)) if
-                                           (original_column_name != column_name)]
-                    column_name_changes_string = "".join(column_name_changes)
-
-                s3_body_chunk_split_rows = [row.strip().split(delimiter) for row in
-                                            s3_body_chunk]  # get split rows to get list of lists
-                endstart_line_number = start_line_number + len(s3_body_chunk_split_rows)
-                line_number_list = list(range(start_line_number, endstart_line_number))
-                row_col_count = [len(split_row) for split_row in s3_body_chunk_split_rows]  # count columns
-                chunk_data = list(zip(line_number_list, row_col_count, s3_body_chunk_split_rows,
-                                      s3_body_chunk))  # line number, number of columns in a row, split rows, original row
-
-                ## get bad data
-                errored_data = [[line_no, unsplit_row] for line_no, col_count, split_row, unsplit_row in chunk_data if
-                                col_count != column_count]
-                errored_data_string_list = [
-                    f"line {line_number}: expected {column_count} columns but read {line.count(delimiter) + 1} [{line}]"
-                    for
-                    line_number, line in errored_data]
-                errored_data_message = "\n".join(errored_data_string_list)
-                text_file_errors.write(f"{errored_data_message}\n")
-                if len(errored_data) > 0:
-                    error_attatchment = [f"{temp_folder}/{sfTable}_errors.txt"]
-
-                ## get data  and insert into pandas inserting
-                loading_data = [split_row for line_no, col_count, split_row, unsplit_row in chunk_data if
-                                col_count == column_count]
-                append_row = pandas.DataFrame(loading_data, columns=clean_column_names)
-                df = pandas.concat([df, append_row], axis=0)
-
-                # create the snowflake table
-                if header_chunk == True:
-                    header_chunk = False
-                    s3FileDF, _ = PandasProcessing.pandasInferSchema(df)
-                    snowflakeSchemaDefinition = PandasProcessing.getSchemaPandas2Snowflake(s3FileDF)
-                    snowflakeConnection = SnowflakeConnection.createSnowflakeConnection(sfAccount=sfAccount,
-                                                                                        sfUser=sfUser,
-                                                                                        sfPrivateKey=sfPrivateKey,
-                                                                                        sfWarehouse=sfWarehouse,
-                                                                                        sfDatabase=sfDatabase,
-                                                                                        sfSchema=SfSchema)
-                    create_sql = SnowflakeConnection.createSnowflakeTable(sfConn=snowflakeConnection, sfRole=sfRole,
-                                                                          sfDatabase=sfDatabase, sfSchema=SfSchema,
-                                                                          sfTable=sfTable_name,
-                                                                          tableSchemaDef=snowflakeSchemaDefinition,
-                                                                          insert=True)
-
-                success, nchunks, nrows = SnowflakeConnection.writePandas2Snowflake(sfConn=snowflakeConnection,
-                                                                                    pdDF=df, sfTable=sfTable_name)
-                total_rows_loaded += nrows
-
-                ## truncate
-                df.drop(df.index, inplace=True)
-
-                # keep the partial line you've read here
-                partial_chunk = chunk[last_newline + 1:]
-                start_line_number = endstart_line_number
-
-            destinationKey = f"file2table/{sfDatabase}/success_files/{sfFile}"
-            S3Connection.s3Move(s3Resource=resource, s3DestinationBucket=s3Bucket, s3DestinationKey=destinationKey,
-                                s3SourceBucket=s3Bucket, s3SourceKey=file)
-
-            text_file_errors.close()
-            end = time.time()
-            duration = end - start
-
-            subject = f"File uploaded to Snowflake from {sfDatabase}"
-            if column_name_changes_string:
-                if len(error_attatchment) == 0:
-                    message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}.\n\n' \
-                              f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
-                              f'The following column names were converted:\n{column_name_changes_string}\n\n' \
-                              f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
-                else:
-                    message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}.\n\n' \
-                              f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
-                              f'The following column names were converted:\n{column_name_changes_string}\n\n' \
-                              f'error log attached\n\n' \
-                              f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
-                del errored_data_message
-            else:
-                if len(error_attatchment) == 0:
-                    message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}.\n\n' \
-                              f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
-                              f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
+
+def get_handled_receipt_handles(client, s3Bucket, message_files):
+    """
+    Description
+    -----------
+    A function that picks the event messages whose files all left their input folder
+        - a loaded file is moved to success_files and a file that failed to the error folder, a file still in
+          its input folder with the ETag it was received with was not handled and its message is received
+          again once its visibility timeout passes
+
+    Args
+    ----
+    client : object
+        A S3 client instance
+    s3Bucket : string
+        S3 bucket used
+    message_files : list
+        ReceiptHandle of each message with the Key -> ETag of its input files, from receive_input_files
+
+    Returns
+    -------
+    receipt_handles : list
+        ReceiptHandle of each message that can be acknowledged
+    """
+    in_input_folder = {}
+    receipt_handles = []
+    for receipt_handle, files in message_files:
+        for key, etag in files.items():
+            if key not in in_input_folder:
+                input_file = S3Connection.s3GetObjectInfo(s3Client=client, s3Bucket=s3Bucket, s3Key=key)
+                in_input_folder[key] = input_file is not None and input_file['ETag'] == etag
+        if not any(in_input_folder[key] for key in files):
+            receipt_handles.append(receipt_handle)
+    return receipt_handles
+
+
+def run_daemon(config_yaml_path, event_queue=None, max_cycles=None):
+    """
+    Description
+    -----------
+    A function that keeps loading files from the S3 input folders as they arrive, until SIGTERM or SIGINT
+        - the S3 client, the Snowflake private key, the pooled Snowflake sessions and the parse processes are
+          kept between cycles
+        - Common daemon.discovery: watermark lists the input folders every Common daemon.poll_seconds and loads
+          the files last modified after the newest file already discovered, less
+          Common daemon.watermark_overlap_seconds (default 300), the watermarks are kept in the checkpoint store
+          so a restart does not load the files again; every Common daemon.full_scan_seconds every file in
+          the input folders is loaded, also files left there by a move that failed
+        - Common daemon.discovery: events loads the files of S3 event notifications from the SQS queue at
+          Common daemon.event_queue_url, or from event_queue; a message is acknowledged once its files
+          have left the input folder, otherwise it is received again
+        - a cycle that fails is logged and the next one waits Common daemon.poll_seconds, doubled for each
+          failed cycle in a row up to Common daemon.max_backoff_seconds (default 900)
+        - the input folders are found again every Common daemon.folder_refresh_seconds
+        - each cycle that finds files is a run for metrics and notifications, idle cycles report nothing
+
+    Args
+    ----
+    config_yaml_path : string
+        path to yaml file specifying configurations to be used
+    event_queue : object
+        queue of S3 events for the events discovery, an EventQueue.InMemoryEventQueue in tests and benchmarks
+    max_cycles : int
+        cycles to run before returning, no limit when None
+
+    Returns
+    -------
+    None
+    """
+    # get configurations
+    with open(config_yaml_path) as file:
+        Config = yaml.load(file, Loader=yaml.FullLoader)
+
+    common_config = Config['Common']
+    run_config = get_run_config(Config)
+
+    discovery = common_config.get("daemon.discovery", "watermark")
+    poll_seconds = float(common_config.get("daemon.poll_seconds", 60))
+    full_scan_seconds = float(common_config.get("daemon.full_scan_seconds", 3600))
+    folder_refresh_seconds = float(common_config.get("daemon.folder_refresh_seconds", 3600))
+    overlap_seconds = float(common_config.get("daemon.watermark_overlap_seconds", 300))
+    max_backoff_seconds = float(common_config.get("daemon.max_backoff_seconds", 900))
+    checkpoint_path = get_checkpoint_path(Config)
+
+    # Snowflake
+    sfPrivateKey = SnowflakeConnection.getPrivateKey(keyFile=run_config['SfKeyfile'],
+                                                     snowflakePassword=run_config['SfPassphrase'])
+
+    # Create S3 Instances
+    client = S3Connection.createS3Client(s3Key=run_config['s3Key'], s3Secret=run_config['s3Secret'])
+    if discovery == "events" and event_queue is None:
+        if not common_config.get("daemon.event_queue_url"):
+            raise ValueError("Common daemon.event_queue_url is needed for daemon.discovery: events")
+        event_queue = EventQueue.SqsEventQueue(
+            sqsClient=EventQueue.createSqsClient(awsKey=run_config['s3Key'], awsSecret=run_config['s3Secret'],
+                                                 regionName=common_config.get("daemon.event_queue_region")),
+            queueUrl=common_config["daemon.event_queue_url"])
+
+    stop_event = threading.Event()
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        # the cycle that is loading finishes before the daemon stops
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            previous_handlers[signal_number] = signal.signal(signal_number, lambda signum, frame: stop_event.set())
+
+    input_folders = None
+    watermarks = {}
+    folders_listed_at = 0
+    # every file of folders without a watermark is listed anyway, the first full scan is one period away
+    full_scanned_at = time.time()
+    cycles = 0
+    failed_cycles = 0
+    try:
+        while not stop_event.is_set():
+            cycle_start = time.time()
+            previous_watermarks = dict(watermarks)
+            message_files = []
+            try:
+                move_international_files(client=client, s3Bucket=run_config['s3Bucket'],
+                                         s3InternationalInput=run_config['s3InternationalInput'])
+
+                if discovery == "events":
+                    inputFiles, message_files = receive_input_files(client=client, s3Bucket=run_config['s3Bucket'],
+                                                                    s3Folder=run_config['s3Folder'],
+                                                                    event_queue=event_queue,
+                                                                    wait_seconds=poll_seconds)
                 else:
-                    message = f'Please be advised that {sfFile} has been imported into snowflake as the table {sfDatabase}.{str(SfSchema).lower()}.{sfTable_name}. \n \n' \
-                              f'Success is {success} with {total_rows_loaded} rows loaded in {number_o_chunks} chunks\n\n' \
-                              f'error log attached\n\n' \
-                              f'file size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds'
-            Communication.send_mail(sender_email=sender_email, receiver_email=receiver_email, subject=subject,
-                                    body=message, attachments=error_attatchment)
-        except Exception as err_message:
-            destinationKey = f"file2table/{sfDatabase}/failed_files/{sfFile}"
-            S3Connection.s3Move(s3Resource=resource, s3DestinationBucket=s3Bucket, s3DestinationKey=destinationKey,
-                                s3SourceBucket=s3Bucket, s3SourceKey=file)
-            err_subject = f"{sfTable_name} Load Table Error"
-            end = time.time()
-            duration = end - start
-            err_body = f"file: {sfFile} \ntable: \n{sfTable_name} \n\nsnowflake schema: \n{snowflakeSchemaDefinition}\n\n" \
-                       f"Create Table SQL:\n{create_sql} \n\nerror: \n{err_message}  \n\n" \
-                       f"Please make sure the file format is UTF-8\n\t- UTF-8-BOM is not supported \n\n" \
-                       f"Delimiter Used: {delimiter}\n\nfile size: {file_size / (1024 ** 2)} mebibytes \n\ntime: {duration} seconds"
-            Communication.send_mail(sender_email=err_sender_email, receiver_email=receiver_email, subject=err_subject,
-                                    body=err_body, attachments=[])
-        if os.path.isfile(f"{temp_folder}/{sfTable}_errors.txt"):
-            os.remove(f"{temp_folder}/{sfTable}_errors.txt")
+                    if input_folders is None or cycle_start - folders_listed_at >= folder_refresh_seconds:
+                        items = S3Connection.s3Gets3Items(s3Client=client, s3Bucket=run_config['s3Bucket'],
+                                                          s3Folder=run_config['s3Folder'])
+                        input_folders = S3Connection.s3GetInputFolder(FolderItems=items)
+                        folders_listed_at = cycle_start
+                        if checkpoint_path:
+                            for input_folder in input_folders:
+                                watermark = Checkpoint.getWatermark(checkpointPath=checkpoint_path,
+                                                                    s3Prefix=input_folder)
+                                if watermark is not None and input_folder not in watermarks:
+                                    watermarks[input_folder] = watermark
+                        previous_watermarks = dict(watermarks)
+                    full_scan = cycle_start - full_scanned_at >= full_scan_seconds
+                    inputFiles = list_new_input_files(client=client, s3Bucket=run_config['s3Bucket'],
+                                                      input_folders=input_folders, watermarks=watermarks,
+                                                      full_scan=full_scan, overlap_seconds=overlap_seconds)
+                    if full_scan:
+                        full_scanned_at = cycle_start
+
+                if inputFiles:
+                    start_run_reporting(Config=Config)
+                    try:
+                        load_input_files(input_files=inputFiles, Config=Config, client=client,
+                                         sfPrivateKey=sfPrivateKey)
+                    finally:
+                        finish_run_reporting()
+
+                if discovery != "events" and checkpoint_path:
+                    for input_folder, watermark in watermarks.items():
+                        if watermark is not previous_watermarks.get(input_folder):
+                            Checkpoint.saveWatermark(checkpointPath=checkpoint_path, s3Prefix=input_folder,
+                                                     lastKey=watermark['last_key'],
+                                                     lastModified=watermark['last_modified'])
+                failed_cycles = 0
+            except Exception as err_message:
+                failed_cycles += 1
+                # the files of the cycle that are still in their input folders are discovered again
+                watermarks.clear()
+                watermarks.update(previous_watermarks)
+                print(f"Daemon cycle failed ({failed_cycles} in a row): {err_message}")
+
+            if message_files:
+                try:
+                    event_queue.acknowledge(receiptHandles=get_handled_receipt_handles(
+                        client=client, s3Bucket=run_config['s3Bucket'], message_files=message_files))
+                except Exception as err_message:
+                    print(f"Events not acknowledged, they are received again: {err_message}")
+
+            cycles += 1
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+            if failed_cycles:
+                stop_event.wait(min(poll_seconds * 2 ** (failed_cycles - 1), max_backoff_seconds))
+            elif discovery != "events":
+                stop_event.wait(max(0.0, poll_seconds - (time.time() - cycle_start)))
+    finally:
+        SnowflakeConnection.closeSnowflakeConnectionPool()
+        PandasProcessing.closeParseProcessPool()
+        for signal_number, previous_handler in previous_handlers.items():
+            signal.signal(signal_number, previous_handler)
+    print(f"Daemon stopped after {cycles} cycles")
 
 
 if __name__ == '__main__':
@@ -338,5 +3382,13 @@ if __name__ == '__main__':
     # dev_config_path = "C:/Users/Darwin_Uyuy/PycharmProjects/Git projects/file2table/config/config_dev.yaml"
     # prod_config_path = "C:/Users/Darwin_Uyuy/PycharmProjects/Git projects/file2table/config/config_prod.yaml"
 
-    s3_to_sf(config_yaml_path=prod_config_path)
+    if "--daemon" in sys.argv[1:]:
+        run_daemon(config_yaml_path=prod_config_path)
+    elif "--validate" in sys.argv[1:]:
+        # a non-zero exit status lets a scheduler hold back the load
+        if s3_to_sf(config_yaml_path=prod_config_path, validate_only=True):
+            print("validation failed")
+            sys.exit(1)
+    else:
+        s3_to_sf(config_yaml_path=prod_config_path)
     print("done")
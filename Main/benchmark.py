@@ -0,0 +1,776 @@
+# title					  : benchmark.py
+# description			  : Offline benchmark of the S3_to_SF program with local S3 and Snowflake stand-ins
+# author				  : Darwin Uy
+# date					  : 2026/10/17
+# version				  : 1.3
+# usage					  : python benchmark.py --size-mb 256 --columns 12 --malformed-ratio 0.001 --mode pandas
+# notes					  : nothing leaves the process, synthetic files are served from memory and every
+#                           Snowflake statement is recorded instead of run
+# python_version		  : 3.9
+# _______________________________________________________________________________________________________________________
+import argparse
+import bz2
+import email
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Modules'))
+
+import Communication
+import Main
+import PandasProcessing
+import S3Connection
+import SnowflakeConnection
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BENCH_BUCKET = 'file2table-benchmark'
+BENCH_DATABASE = 'bench'
+# rows of the block that is repeated to build a file
+BLOCK_ROWS = 10000
+
+
+class StageTimer:
+    """
+    Description
+    -----------
+    Busy time per stage, summed over every thread that ran the stage
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.calls = {}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def time_function(self, module, name, stage):
+        # the modules look their functions up at call time, replacing the attribute times every call
+        function = getattr(module, name)
+
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        setattr(module, name, timed_function)
+
+    def time_generator(self, module, name, stage):
+        generator_function = getattr(module, name)
+
+        def timed_generator(*args, **kwargs):
+            generator = generator_function(*args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        self.add(stage, time.perf_counter() - start)
+                    yield item
+            finally:
+                generator.close()
+
+        setattr(module, name, timed_generator)
+
+
+class FakeS3Body:
+    """
+    Description
+    -----------
+    StreamingBody stand-in over bytes held in memory, optionally throttled to a transfer rate
+    """
+
+    def __init__(self, data, mb_per_sec=0):
+        self.stream = io.BytesIO(data)
+        self.mb_per_sec = mb_per_sec
+
+    def read(self, amt=None):
+        data = self.stream.read(-1 if amt is None else amt)
+        if self.mb_per_sec:
+            time.sleep(len(data) / (self.mb_per_sec * 1024 ** 2))
+        return data
+
+    def close(self):
+        self.stream.close()
+
+
+class FakeS3Paginator:
+    """
+    Description
+    -----------
+    list_objects_v2 paginator stand-in, 1000 keys per page in key order
+    """
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def paginate(self, Bucket, Prefix='', StartAfter=None, **kwargs):
+        with self.s3_client.lock:
+            keys = sorted(key for key in self.s3_client.objects if key.startswith(Prefix)
+                          and (StartAfter is None or key > StartAfter))
+            contents = [{'Key': key, 'Size': len(self.s3_client.objects[key]['data']),
+                         'ETag': self.s3_client.objects[key]['etag']} for key in keys]
+        for page_start in range(0, len(contents), 1000):
+            yield {'Contents': contents[page_start:page_start + 1000], 'KeyCount': len(contents)}
+
+
+class FakeS3Client:
+    """
+    Description
+    -----------
+    S3 client stand-in with the calls S3Connection makes, objects are kept in memory
+    """
+
+    def __init__(self, mb_per_sec=0):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.mb_per_sec = mb_per_sec
+
+    def put_object(self, Bucket, Key, Body=b'', **metadata):
+        # copies of a file share the bytes, the ETag is the MD5 of the contents as for single part uploads
+        etag = metadata.pop('ETag', None) or f'"{hashlib.md5(Body).hexdigest()}"'
+        with self.lock:
+            self.objects[Key] = {'data': Body, 'etag': etag, **metadata}
+
+    def get_paginator(self, operation_name):
+        return FakeS3Paginator(self)
+
+    def get_object(self, Bucket, Key, Range=None):
+        with self.lock:
+            s3_object = self.objects[Key]
+        data = s3_object['data']
+        if Range:
+            start_byte, end_byte = Range[len('bytes='):].split('-')
+            data = data[int(start_byte):int(end_byte) + 1 if end_byte else None]
+        return {'Body': FakeS3Body(data, self.mb_per_sec), 'ContentLength': len(data), 'ETag': s3_object['etag']}
+
+    def head_object(self, Bucket, Key):
+        with self.lock:
+            s3_object = self.objects[Key]
+        return {'ContentLength': len(s3_object['data']), 'ETag': s3_object['etag']}
+
+    def copy(self, CopySource, Bucket, Key, **kwargs):
+        with self.lock:
+            self.objects[Key] = self.objects[CopySource['Key']]
+
+    def delete_objects(self, Bucket, Delete):
+        with self.lock:
+            for s3_object in Delete['Objects']:
+                self.objects.pop(s3_object['Key'], None)
+        return {'Deleted': [{'Key': s3_object['Key']} for s3_object in Delete['Objects']]}
+
+
+class SnowflakeRecorder:
+    """
+    Description
+    -----------
+    Shared record of what the fake Snowflake connections were asked to do
+    """
+
+    def __init__(self, s3_client, rows_per_sec=0):
+        self.lock = threading.Lock()
+        self.s3_client = s3_client
+        self.rows_per_sec = rows_per_sec
+        self.statements = {}
+        self.rows_loaded = 0
+        self.rows_quarantined = 0
+        self.connections = 0
+        # rows of the parquet files PUT to each stage path
+        self.staged_rows = {}
+        # (schema, table) -> {column name: column type} of the tables created, for schema evolution
+        self.tables = {}
+
+    def record_table(self, sql):
+        # CREATE TABLE and ALTER TABLE statements as SnowflakeConnection writes them
+        with self.lock:
+            create_table = re.match(r"CREATE (?:OR REPLACE )?TABLE (?:IF NOT EXISTS )?\S+?\.(\S+?)\.(\S+) \((.*)\)$",
+                                    sql, re.DOTALL)
+            if create_table:
+                table_key = (create_table.group(1).upper(), create_table.group(2).upper())
+                if 'IF NOT EXISTS' not in sql or table_key not in self.tables:
+                    self.tables[table_key] = dict(
+                        column_definition.strip().split(None, 1) for column_definition in
+                        re.split(SnowflakeConnection.SCHEMA_DEFINITION_SEPARATOR, create_table.group(3))
+                        if column_definition.strip())
+                return
+            alter_table = re.match(r"ALTER TABLE \S+?\.(\S+?)\.(\S+) (?:ADD|ALTER) COLUMN (\S+) (?:SET DATA TYPE )?(.+)$",
+                                   sql)
+            if alter_table:
+                table_key = (alter_table.group(1).upper(), alter_table.group(2).upper())
+                self.tables.setdefault(table_key, {})[alter_table.group(3)] = alter_table.group(4)
+
+    def get_table_columns(self, sf_schema, sf_table):
+        # INFORMATION_SCHEMA.COLUMNS rows of a table created in this run
+        with self.lock:
+            columns = dict(self.tables.get((sf_schema.upper(), sf_table.upper()), {}))
+        rows = []
+        for column_name, column_type in columns.items():
+            varchar_length = re.match(r"VARCHAR\((\d+)\)", column_type, re.IGNORECASE)
+            number_precision = re.match(r"NUMBER\((\d+),\s*(\d+)\)", column_type, re.IGNORECASE)
+            if varchar_length:
+                rows.append((column_name.upper(), 'TEXT', int(varchar_length.group(1)), None, None))
+            elif number_precision:
+                rows.append((column_name.upper(), 'NUMBER', None, int(number_precision.group(1)),
+                             int(number_precision.group(2))))
+            elif column_type.upper() in ('FLOAT', 'FLOAT8', 'DOUBLE'):
+                rows.append((column_name.upper(), 'FLOAT', None, None, None))
+            else:
+                rows.append((column_name.upper(), column_type.upper(), None, None, None))
+        return rows
+
+    def record(self, statement, rows=0, quarantine=False):
+        with self.lock:
+            self.statements[statement] = self.statements.get(statement, 0) + 1
+            if quarantine:
+                self.rows_quarantined += rows
+            else:
+                self.rows_loaded += rows
+        if rows and self.rows_per_sec:
+            # warehouse time, the client only waits
+            time.sleep(rows / self.rows_per_sec)
+
+
+class FakeSnowflakeCursor:
+    """
+    Description
+    -----------
+    Cursor stand-in that records each statement and answers with the rows the module functions read
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.results = []
+        self.sfqid = None
+
+    def execute(self, sql, params=None):
+        recorder = self.connection.recorder
+        statement = sql.split()[0].upper()
+        self.results = []
+        self.sfqid = uuid.uuid4().hex
+        if statement in ('CREATE', 'ALTER'):
+            recorder.record_table(sql)
+        elif statement == 'SELECT' and 'INFORMATION_SCHEMA.COLUMNS' in sql:
+            self.results = recorder.get_table_columns(sf_schema=params[0], sf_table=params[1])
+        elif statement == 'PUT':
+            local_file = re.match(r"PUT 'file://(.+?)' @(\S+)", sql)
+            rows = len(PandasProcessing.pd.read_parquet(local_file.group(1), columns=[]))
+            file_name = os.path.basename(local_file.group(1))
+            with recorder.lock:
+                recorder.staged_rows.setdefault(local_file.group(2), []).append((file_name, rows))
+        elif statement == 'SELECT' and 'VALIDATE(' in sql:
+            # rejected rows are not simulated
+            statement = 'VALIDATE'
+        elif statement == 'COPY' and ' FILES = (' in sql:
+            # copy mode, the rows were counted when the file was made
+            file_key = re.search(r"FILES = \('(.+?)'\)", sql).group(1)
+            with recorder.s3_client.lock:
+                s3_object = recorder.s3_client.objects[file_key]
+            status = 'PARTIALLY_LOADED' if s3_object['malformed_rows'] else 'LOADED'
+            self.results = [(file_key, status, s3_object['rows'] + s3_object['malformed_rows'],
+                             s3_object['rows'])]
+            recorder.record(statement, rows=s3_object['rows'])
+            return self
+        elif statement == 'COPY':
+            # staged mode, one result row per staged parquet file
+            stage_path = re.search(r"FROM @(\S+?)/?\) ", sql).group(1)
+            with recorder.lock:
+                staged_rows = recorder.staged_rows.pop(stage_path, [])
+            self.results = [(f"{stage_path}/{file_name}", 'LOADED', rows, rows) for file_name, rows in staged_rows]
+            recorder.record(statement, rows=sum(rows for _, rows in staged_rows), quarantine='RAW_LINE' in sql)
+            return self
+        recorder.record(statement)
+        return self
+
+    def fetchall(self):
+        return self.results
+
+    def fetchone(self):
+        return self.results[0] if self.results else None
+
+    def close(self):
+        pass
+
+
+class FakeSnowflakeConnection:
+    """
+    Description
+    -----------
+    Connection stand-in handed out by the patched SnowflakeConnection.createSnowflakeConnection
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.closed = False
+        with recorder.lock:
+            recorder.connections += 1
+
+    def cursor(self):
+        return FakeSnowflakeCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSMTP:
+    """
+    Description
+    -----------
+    smtplib.SMTP stand-in that keeps the subject of every email, optionally waiting like a slow relay
+    """
+    # seconds each email takes to send
+    seconds_per_mail = 0
+    mails = []
+    connections = 0
+
+    def __init__(self, host='', *args, **kwargs):
+        FakeSMTP.connections += 1
+
+    def sendmail(self, sender_email, receiver_email, text):
+        time.sleep(FakeSMTP.seconds_per_mail)
+        FakeSMTP.mails.append(email.message_from_string(text)['Subject'])
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.quit()
+
+
+def generate_file(size_bytes, columns, malformed_ratio, seed=0):
+    """
+    Description
+    -----------
+    A function that makes a synthetic pipe delimited file
+        - integer, decimal, date and text columns in turn, so typed inference has something to find
+        - malformed rows are missing their last column, the ratio is approximate below one in BLOCK_ROWS
+        - a block of distinct rows is repeated up to the size, the file ends on a complete row
+        - the repeated block compresses better than real files, compare compressed runs with each other only
+
+    Args
+    ----
+    size_bytes : int
+        approximate size of the file
+    columns : int
+        number of columns
+    malformed_ratio : float
+        share of rows with the wrong number of columns
+    seed : int
+        seed of the random values
+
+    Returns
+    -------
+    data : bytes
+        the file with a header row
+    rows : int
+        number of good rows
+    malformed_rows : int
+        number of malformed rows
+    """
+    rng = random.Random(seed)
+    header = '|'.join(f"col_{column}" for column in range(columns)).encode() + b'\n'
+    block_rows = []
+    block_malformed = []
+    for row in range(BLOCK_ROWS):
+        values = []
+        for column in range(columns):
+            if column % 4 == 0:
+                values.append(str(rng.randrange(10 ** 9)))
+            elif column % 4 == 1:
+                values.append(f"{rng.randrange(10 ** 6)}.{rng.randrange(100):02d}")
+            elif column % 4 == 2:
+                values.append(f"20{rng.randrange(10, 30)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}")
+            else:
+                values.append(f"name_{rng.randrange(10 ** 6)}")
+        malformed = rng.random() < malformed_ratio
+        if malformed:
+            values = values[:-1]
+        block_rows.append('|'.join(values).encode() + b'\n')
+        block_malformed.append(malformed)
+    block = b''.join(block_rows)
+
+    repeats, remainder = divmod(max(size_bytes - len(header), 0), len(block))
+    partial_rows = 0
+    partial_bytes = 0
+    while partial_rows < BLOCK_ROWS and partial_bytes + len(block_rows[partial_rows]) <= remainder:
+        partial_bytes += len(block_rows[partial_rows])
+        partial_rows += 1
+    data = header + block * repeats + block[:partial_bytes]
+    malformed_rows = sum(block_malformed) * repeats + sum(block_malformed[:partial_rows])
+    rows = BLOCK_ROWS * repeats + partial_rows - malformed_rows
+    return data, rows, malformed_rows
+
+
+def compress_file(data, compression):
+    """
+    Description
+    -----------
+    A function that compresses a synthetic file the way teams upload them
+
+    Args
+    ----
+    data : bytes
+        the file
+    compression : string
+        "none", "gzip", "bz2" or "zstd"
+
+    Returns
+    -------
+    data : bytes
+        the compressed file
+    extension : string
+        extension added to the file name
+    """
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=6), '.gz'
+    if compression == 'bz2':
+        return bz2.compress(data), '.bz2'
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("the zstandard package is needed for --compression zstd")
+        return zstandard.ZstdCompressor().compress(data), '.zst'
+    return data, ''
+
+
+def convert_to_parquet(data, row_group_rows=100000):
+    """
+    Description
+    -----------
+    A function that rewrites a synthetic file as Parquet, the malformed rows are dropped
+
+    Args
+    ----
+    data : bytes
+        the file from generate_file
+    row_group_rows : int
+        rows per row group
+
+    Returns
+    -------
+    data : bytes
+        the Parquet file
+    rows : int
+        number of rows in it
+    """
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+
+    table = pa_csv.read_csv(io.BytesIO(data), parse_options=pa_csv.ParseOptions(
+        delimiter='|', invalid_row_handler=lambda row: 'skip'))
+    sink = io.BytesIO()
+    pa_parquet.write_table(table, sink, row_group_size=row_group_rows, compression='snappy')
+    return sink.getvalue(), table.num_rows
+
+
+def install_stand_ins(s3_client, recorder, timer, temp_folder, smtp_sec_per_mail=0):
+    """
+    Description
+    -----------
+    A function that points the program at the stand-ins and times its stages
+        - S3 clients, Snowflake connections, write_pandas, the private key and email are replaced
+        - each stage is timed where the program calls into it
+
+    Args
+    ----
+    s3_client : object
+        FakeS3Client serving the synthetic files
+    recorder : object
+        SnowflakeRecorder shared by the fake connections
+    timer : object
+        StageTimer collecting the stage times
+    temp_folder : string
+        folder the fake write_pandas writes its parquet files to
+    smtp_sec_per_mail : float
+        seconds the fake mail relay takes per email
+
+    Returns
+    -------
+    mails : list
+        subject of every notification sent
+    """
+    FakeSMTP.seconds_per_mail = smtp_sec_per_mail
+    FakeSMTP.mails = []
+    FakeSMTP.connections = 0
+
+    def fake_write_pandas(conn, df, table_name, **kwargs):
+        # the connector writes each dataframe to parquet before the PUT, that client side cost is kept
+        local_file = os.path.join(temp_folder, f"write_pandas_{threading.get_ident()}.parquet")
+        df.to_parquet(local_file, compression='snappy', index=False)
+        os.remove(local_file)
+        recorder.record('WRITE_PANDAS', rows=len(df), quarantine='RAW_LINE' in df.columns)
+        return True, 1, len(df), None
+
+    S3Connection.createS3Client = lambda s3Key, s3Secret: s3_client
+    SnowflakeConnection.getPrivateKey = lambda keyFile, snowflakePassword: b''
+    SnowflakeConnection.createSnowflakeConnection = lambda **kwargs: FakeSnowflakeConnection(recorder)
+    SnowflakeConnection.write_pandas = fake_write_pandas
+    # the queued and the direct email paths both end at smtplib.SMTP
+    Communication.smtplib.SMTP = FakeSMTP
+
+    timer.time_function(S3Connection, 's3DiscoverInputFiles', 'discover')
+    timer.time_generator(PandasProcessing, 'readLineChunks', 'read')
+    timer.time_generator(S3Connection, 's3GetObjectLineChunks', 'read')
+    timer.time_function(Main, 'read_file_head', 'read')
+    timer.time_function(Main, 'sample_file_rows', 'schema')
+    timer.time_function(PandasProcessing, 'parseChunk', 'parse')
+    for name in ['pandasInferSchema', 'getSchemaPandas2Snowflake', 'inferSnowflakeSchema']:
+        timer.time_function(PandasProcessing, name, 'schema')
+    timer.time_function(PandasProcessing, 'convertPandas2Schema', 'convert')
+    for name in ['createSnowflakeTable', 'reconcileSnowflakeTable', 'createSnowflakeStage',
+                 'createSnowflakeLoadStage']:
+        timer.time_function(SnowflakeConnection, name, 'ddl')
+    for name in ['writePandas2Snowflake', 'putPandas2Stage', 'copyStage2Snowflake', 'getCopyErrors',
+                 'copyIntoSnowflake']:
+        timer.time_function(SnowflakeConnection, name, 'upload')
+    timer.time_function(S3Connection, 's3MoveObjects', 'move')
+    # notify is the time the load waits on email, smtp the time the relay takes in the background queue
+    timer.time_function(Communication, 'queue_mail', 'notify')
+    timer.time_function(Communication, 'send_mail_batch', 'smtp')
+    return FakeSMTP.mails
+
+
+def watch_peak_rss(stop_event, peak, interval=0.01):
+    """
+    Description
+    -----------
+    A function that samples the resident set size until stop_event is set
+
+    Args
+    ----
+    stop_event : object
+        threading.Event that ends the sampling
+    peak : dict
+        rss_bytes is raised to the highest sample
+    interval : float
+        seconds between samples
+    """
+    while not stop_event.is_set():
+        peak['rss_bytes'] = max(peak['rss_bytes'], Main.get_rss_bytes())
+        stop_event.wait(interval)
+
+
+def get_version():
+    """
+    Description
+    -----------
+    A function that names the version of the program being benchmarked
+
+    Returns
+    -------
+    version : string
+        short git commit, "unknown" outside a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmark(args):
+    """
+    Description
+    -----------
+    A function that runs s3_to_sf over synthetic files with the stand-ins and measures it
+
+    Args
+    ----
+    args : object
+        parsed command line arguments
+
+    Returns
+    -------
+    result : dict
+        throughput, peak RSS and stage times of the run
+    """
+    temp_folder = tempfile.mkdtemp(prefix='file2table_bench_')
+    try:
+        data, rows, malformed_rows = generate_file(size_bytes=int(args.size_mb * 1024 ** 2), columns=args.columns,
+                                                   malformed_ratio=args.malformed_ratio, seed=args.seed)
+        data_bytes = len(data)
+        if args.format == 'parquet':
+            if args.compression != 'none':
+                raise ValueError("Parquet files are compressed inside, use --compression none with --format parquet")
+            stored_data, rows = convert_to_parquet(data, row_group_rows=args.row_group_rows)
+            malformed_rows = 0
+            extension = '.parquet'
+        else:
+            stored_data, extension = compress_file(data, args.compression)
+            extension = f".csv{extension}"
+        data = None
+
+        # bench.0.csv, bench.1.csv, ... all load to the table bench
+        file_separator = '.' if args.one_table else '_'
+        s3_client = FakeS3Client(mb_per_sec=args.s3_mb_per_sec)
+        etag = f'"{hashlib.md5(stored_data).hexdigest()}"'
+        s3_client.put_object(Bucket=BENCH_BUCKET, Key=f"file2table/{BENCH_DATABASE}/", Body=b'')
+        s3_client.put_object(Bucket=BENCH_BUCKET, Key=f"file2table/{BENCH_DATABASE}/input/", Body=b'')
+        for file_number in range(args.files):
+            s3_client.put_object(Bucket=BENCH_BUCKET,
+                                 Key=f"file2table/{BENCH_DATABASE}/input/bench{file_separator}{file_number}{extension}",
+                                 Body=stored_data, ETag=etag, rows=rows, malformed_rows=malformed_rows)
+        recorder = SnowflakeRecorder(s3_client=s3_client, rows_per_sec=args.sf_rows_per_sec)
+        timer = StageTimer()
+        mails = install_stand_ins(s3_client=s3_client, recorder=recorder, timer=timer, temp_folder=temp_folder,
+                                  smtp_sec_per_mail=args.smtp_sec_per_mail)
+
+        common_config = {'linux.temp_path': temp_folder, 'load.mode': args.mode, 'ingest.workers': args.workers,
+                         'checkpoint.path': os.path.join(temp_folder, 'checkpoints.db'), 'dedup.enabled': False}
+        email_config = {'email.sender': 'bench@localhost', 'email.error_sender': 'bench@localhost',
+                        'email.B': 'bench@localhost'}
+        for setting in args.set:
+            key, value = setting.split('=', 1)
+            if key.startswith('email.'):
+                email_config[key] = yaml.safe_load(value)
+            else:
+                common_config[key] = yaml.safe_load(value)
+        Config = {'Common': common_config,
+                  'AWS': {'s3.bucket': BENCH_BUCKET, 's3.key': '', 's3.secret': '', 's3.folder': 'file2table/',
+                          's3.internationalInputFolder': 'file2table/international/input/'},
+                  'Snowflake': {'sf.schema': 'RAW', 'sf.passphrase': '', 'p8.key.file': '', 'sf.user': 'bench',
+                                'sf.account': 'bench', 'sf.warehouse': 'bench', 'sf.Role': 'bench',
+                                'sf.storage_integration': 'bench'},
+                  'Email': email_config}
+        config_yaml_path = os.path.join(temp_folder, 'config.yaml')
+        with open(config_yaml_path, 'w') as config_file:
+            yaml.safe_dump(Config, config_file)
+
+        baseline_rss_bytes = Main.get_rss_bytes()
+        peak = {'rss_bytes': baseline_rss_bytes}
+        stop_watching = threading.Event()
+        watcher = threading.Thread(target=watch_peak_rss, args=(stop_watching, peak), daemon=True)
+        watcher.start()
+        start = time.perf_counter()
+        try:
+            Main.s3_to_sf(config_yaml_path=config_yaml_path)
+        finally:
+            seconds = time.perf_counter() - start
+            stop_watching.set()
+            watcher.join()
+
+        total_mib = data_bytes * args.files / (1024 ** 2)
+        return {'version': get_version(),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'settings': {'size_mb': args.size_mb, 'columns': args.columns, 'one_table': args.one_table,
+                             'malformed_ratio': args.malformed_ratio, 'files': args.files, 'format': args.format,
+                             'compression': args.compression, 'mode': args.mode, 'workers': args.workers,
+                             'set': args.set, 's3_mb_per_sec': args.s3_mb_per_sec,
+                             'sf_rows_per_sec': args.sf_rows_per_sec,
+                             'smtp_sec_per_mail': args.smtp_sec_per_mail},
+                'seconds': seconds,
+                'rows_expected': rows * args.files,
+                'rows_loaded': recorder.rows_loaded,
+                'rows_quarantined': recorder.rows_quarantined,
+                'malformed_rows': malformed_rows * args.files,
+                'rows_per_sec': recorder.rows_loaded / seconds,
+                'mib': total_mib,
+                'mib_per_sec': total_mib / seconds,
+                'transferred_mib': len(stored_data) * args.files / (1024 ** 2),
+                'baseline_rss_mib': baseline_rss_bytes / (1024 ** 2),
+                'peak_rss_mib': peak['rss_bytes'] / (1024 ** 2),
+                'stage_seconds': dict(sorted(timer.seconds.items())),
+                'stage_calls': dict(sorted(timer.calls.items())),
+                'statements': dict(sorted(recorder.statements.items())),
+                'snowflake_connections': recorder.connections,
+                'mails': mails,
+                'smtp_connections': FakeSMTP.connections}
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+
+
+def print_report(result):
+    """
+    Description
+    -----------
+    A function that prints the result of a benchmark run
+
+    Args
+    ----
+    result : dict
+        output from run_benchmark(args)
+    """
+    settings = result['settings']
+    print(f"\nfile2table benchmark {result['version']}, {settings['mode']} mode, {settings['workers']} worker(s), "
+          f"{settings['files']} file(s) of {settings['size_mb']} MiB, {settings['columns']} columns, "
+          f"{settings['malformed_ratio']:.4%} malformed, {settings.get('format', 'csv')} format, "
+          f"compression {settings['compression']}")
+    if settings['set']:
+        print(f"settings: {' '.join(settings['set'])}")
+    print(f"rows loaded      {result['rows_loaded']:,} of {result['rows_expected']:,} "
+          f"({result['malformed_rows']:,} malformed, {result['rows_quarantined']:,} quarantined)")
+    print(f"wall time        {result['seconds']:.2f} s")
+    print(f"rows/sec         {result['rows_per_sec']:,.0f}")
+    print(f"MiB/sec          {result['mib_per_sec']:.1f} ({result['transferred_mib']:.1f} MiB transferred)")
+    print(f"peak RSS         {result['peak_rss_mib']:.0f} MiB (baseline {result['baseline_rss_mib']:.0f} MiB)")
+    print("stage busy time, summed over threads")
+    for stage, seconds in result['stage_seconds'].items():
+        print(f"  {stage:<14} {seconds:8.2f} s  {result['stage_calls'][stage]:>6} calls")
+    print(f"statements       {result['statements']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark s3_to_sf offline on synthetic files")
+    parser.add_argument('--size-mb', type=float, default=64, help="uncompressed size of each file in MiB")
+    parser.add_argument('--columns', type=int, default=12, help="columns per row")
+    parser.add_argument('--malformed-ratio', type=float, default=0.001, help="share of rows missing a column")
+    parser.add_argument('--files', type=int, default=1, help="number of input files")
+    parser.add_argument('--one-table', action='store_true', help="name the files so they all load to one table")
+    parser.add_argument('--compression', choices=['none', 'gzip', 'bz2', 'zstd'], default='none')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="format of the input files")
+    parser.add_argument('--row-group-rows', type=int, default=100000, help="rows per row group of Parquet files")
+    parser.add_argument('--mode', choices=['pandas', 'staged', 'copy'], default='pandas', help="Common load.mode")
+    parser.add_argument('--workers', type=int, default=1, help="Common ingest.workers")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="any other Common or email.* Email setting, e.g. --set parse.engine=pyarrow")
+    parser.add_argument('--s3-mb-per-sec', type=float, default=0, help="throttle S3 reads, 0 for memory speed")
+    parser.add_argument('--smtp-sec-per-mail', type=float, default=0, help="simulated mail relay latency")
+    parser.add_argument('--sf-rows-per-sec', type=float, default=0,
+                        help="simulated warehouse load rate, 0 for no wait")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="number of runs")
+    parser.add_argument('--output', help="append each result as a JSON line to this file")
+    args = parser.parse_args()
+
+    for _ in range(args.repeat):
+        result = run_benchmark(args)
+        print_report(result)
+        if args.output:
+            with open(args.output, 'a') as output_file:
+                output_file.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+# title           :Checkpoint.py
+# description     :Load state of files, checkpoints of partial loads, an index of loaded files and discovery watermarks
+# author          :Darwin Uy
+# date            :2026-10-17
+# version         :0.6
+# usage           :
+# notes           :kept in a local SQLite file, keyed by S3 ETag and target table
+# python_version  :3.9
+# ==============================================================================
+import os
+import sqlite3
+import threading
+import time
+
+# checkpoint stores whose tables were created by this process
+_initializedStores = set()
+_initializedStoresLock = threading.Lock()
+
+
+def connectCheckpointStore(checkpointPath):
+    """
+    Description
+    -----------
+    A function that opens the checkpoint store and creates its tables if they do not exist
+        - the tables are created once per process and store, not on every connection
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+
+    Returns
+    -------
+    checkpointConn: object
+        SQLite connection
+    """
+    # workers of the ingestion pool write to the same file, wait for each other's locks
+    checkpointConn = sqlite3.connect(checkpointPath, timeout=60)
+    storeKey = os.path.abspath(checkpointPath)
+    if storeKey in _initializedStores:
+        return checkpointConn
+    with _initializedStoresLock:
+        if storeKey not in _initializedStores:
+            try:
+                createCheckpointTables(checkpointConn)
+            except Exception:
+                checkpointConn.close()
+                raise
+            _initializedStores.add(storeKey)
+    return checkpointConn
+
+
+def createCheckpointTables(checkpointConn):
+    """
+    Description
+    -----------
+    A function that creates the tables of the checkpoint store and adds the columns of newer versions
+
+    Args
+    ----
+    checkpointConn: object
+        SQLite connection
+
+    Returns
+    -------
+    None
+    """
+    checkpointConn.execute("CREATE TABLE IF NOT EXISTS file_checkpoints ("
+                           "etag TEXT NOT NULL, "
+                           "sf_table TEXT NOT NULL, "
+                           "s3_key TEXT, "
+                           "byte_offset INTEGER NOT NULL, "
+                           "start_line_number INTEGER NOT NULL, "
+                           "rows_loaded INTEGER NOT NULL, "
+                           "chunks_loaded INTEGER NOT NULL, "
+                           "updated_at REAL NOT NULL, "
+                           "bad_rows INTEGER NOT NULL DEFAULT 0, "
+                           "row_group INTEGER NOT NULL DEFAULT 0, "
+                           "quarantined_line_number INTEGER NOT NULL DEFAULT 0, "
+                           "PRIMARY KEY (etag, sf_table))")
+    checkpointColumns = [row[1] for row in checkpointConn.execute("PRAGMA table_info(file_checkpoints)")]
+    # stores written before malformed rows were counted, before Parquet files were loaded by row group and before
+    # quarantine writes were checkpointed
+    for columnName in ['bad_rows', 'row_group', 'quarantined_line_number']:
+        if columnName in checkpointColumns:
+            continue
+        try:
+            checkpointConn.execute(f"ALTER TABLE file_checkpoints ADD COLUMN {columnName} INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError as err_message:
+            # another process added it first
+            if 'duplicate column' not in str(err_message):
+                raise
+    checkpointConn.execute("CREATE TABLE IF NOT EXISTS loaded_files ("
+                           "etag TEXT NOT NULL, "
+                           "file_size INTEGER NOT NULL, "
+                           "sf_table TEXT NOT NULL, "
+                           "s3_key TEXT, "
+                           "rows_loaded INTEGER, "
+                           "loaded_at REAL NOT NULL, "
+                           "PRIMARY KEY (etag, file_size, sf_table))")
+    checkpointConn.execute("CREATE TABLE IF NOT EXISTS discovery_watermarks ("
+                           "s3_prefix TEXT PRIMARY KEY, "
+                           "last_key TEXT NOT NULL, "
+                           "last_modified TEXT, "
+                           "updated_at REAL NOT NULL)")
+    checkpointConn.commit()
+
+
+def getCheckpoint(checkpointPath, etag, sfTable):
+    """
+    Description
+    -----------
+    A function that gets the last committed checkpoint of a file
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+    etag: string
+        S3 ETag of the file
+    sfTable: string
+        table the file is loaded to
+
+    Returns
+    -------
+    checkpoint: dictionary
+        byte_offset, start_line_number, rows_loaded, chunks_loaded, bad_rows, row_group and quarantined_line_number,
+        None when there is no checkpoint
+    """
+    checkpointConn = connectCheckpointStore(checkpointPath)
+    try:
+        row = checkpointConn.execute("SELECT byte_offset, start_line_number, rows_loaded, chunks_loaded, bad_rows, "
+                                     "row_group, quarantined_line_number FROM file_checkpoints "
+                                     "WHERE etag = ? AND sf_table = ?",
+                                     (etag, sfTable)).fetchone()
+    finally:
+        checkpointConn.close()
+    if row is None:
+        return None
+    return {'byte_offset': row[0], 'start_line_number': row[1], 'rows_loaded': row[2], 'chunks_loaded': row[3],
+            'bad_rows': row[4], 'row_group': row[5], 'quarantined_line_number': row[6]}
+
+
+def saveCheckpoint(checkpointPath, etag, sfTable, s3Key, byteOffset, startLineNumber, rowsLoaded, chunksLoaded,
+                   badRows=0, rowGroup=0, quarantinedLineNumber=0):
+    """
+    Description
+    -----------
+    A function that records how far a file is committed, called after each chunk is written to Snowflake
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+    etag: string
+        S3 ETag of the file
+    sfTable: string
+        table the file is loaded to
+    s3Key: string
+        S3 key of the file
+    byteOffset: int
+        offset of the first byte not committed yet, always the start of a line, 0 for a Parquet file
+    startLineNumber: int
+        line number of the line at byteOffset
+    rowsLoaded: int
+        rows of the file committed so far
+    chunksLoaded: int
+        chunks of the file committed so far
+    badRows: int
+        malformed rows of the committed chunks, their error log is not kept for a resumed load
+    rowGroup: int
+        first row group of a Parquet file not committed yet, 0 for delimited files
+    quarantinedLineNumber: int
+        line number up to which the malformed rows are in the quarantine table, can be past startLineNumber when
+        the malformed rows of a chunk were written before its good rows
+
+    Returns
+    -------
+    None
+    """
+    checkpointConn = connectCheckpointStore(checkpointPath)
+    try:
+        with checkpointConn:
+            checkpointConn.execute("INSERT OR REPLACE INTO file_checkpoints (etag, sf_table, s3_key, byte_offset, "
+                                   "start_line_number, rows_loaded, chunks_loaded, updated_at, bad_rows, row_group, "
+                                   "quarantined_line_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (etag, sfTable, s3Key, byteOffset, startLineNumber, rowsLoaded, chunksLoaded,
+                                    time.time(), badRows, rowGroup, quarantinedLineNumber))
+    finally:
+        checkpointConn.close()
+
+
+def deleteCheckpoint(checkpointPath, etag, sfTable):
+    """
+    Description
+    -----------
+    A function that removes the checkpoint of a file once it is fully loaded
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+    etag: string
+        S3 ETag of the file
+    sfTable: string
+        table the file is loaded to
+
+    Returns
+    -------
+    None
+    """
+    checkpointConn = connectCheckpointStore(checkpointPath)
+    try:
+        with checkpointConn:
+            checkpointConn.execute("DELETE FROM file_checkpoints WHERE etag = ? AND sf_table = ?", (etag, sfTable))
+    finally:
+        checkpointConn.close()
+
+
+def getLoadedFile(checkpointPath, etag, fileSize, sfTable):
+    """
+    Description
+    -----------
+    A function that looks up a file with the same contents already loaded to a table
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+    etag: string
+        S3 ETag of the file
+    fileSize: int
+        size of the file in bytes
+    sfTable: string
+        table the file is loaded to
+
+    Returns
+    -------
+    loadedFile: dictionary
+        s3_key, rows_loaded and loaded_at of the earlier load, None when the contents were not loaded before
+    """
+    checkpointConn = connectCheckpointStore(checkpointPath)
+    try:
+        row = checkpointConn.execute("SELECT s3_key, rows_loaded, loaded_at FROM loaded_files "
+                                     "WHERE etag = ? AND file_size = ? AND sf_table = ?",
+                                     (etag, fileSize, sfTable)).fetchone()
+    finally:
+        checkpointConn.close()
+    if row is None:
+        return None
+    return {'s3_key': row[0], 'rows_loaded': row[1], 'loaded_at': row[2]}
+
+
+def recordLoadedFile(checkpointPath, etag, fileSize, sfTable, s3Key, rowsLoaded):
+    """
+    Description
+    -----------
+    A function that adds a loaded file to the index so later copies of it are skipped
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+    etag: string
+        S3 ETag of the file
+    fileSize: int
+        size of the file in bytes
+    sfTable: string
+        table the file was loaded to
+    s3Key: string
+        S3 key of the file
+    rowsLoaded: int
+        rows of the file loaded
+
+    Returns
+    -------
+    None
+    """
+    checkpointConn = connectCheckpointStore(checkpointPath)
+    try:
+        with checkpointConn:
+            checkpointConn.execute("INSERT OR REPLACE INTO loaded_files (etag, file_size, sf_table, s3_key, "
+                                   "rows_loaded, loaded_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (etag, fileSize, sfTable, s3Key, rowsLoaded, time.time()))
+    finally:
+        checkpointConn.close()
+
+
+def getWatermark(checkpointPath, s3Prefix):
+    """
+    Description
+    -----------
+    A function that gets the newest object discovered in an input folder by earlier daemon cycles
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+    s3Prefix: string
+        input folder
+
+    Returns
+    -------
+    watermark: dictionary
+        last_key, last_modified and updated_at, None when the folder has no watermark
+    """
+    checkpointConn = connectCheckpointStore(checkpointPath)
+    try:
+        row = checkpointConn.execute("SELECT last_key, last_modified, updated_at FROM discovery_watermarks "
+                                     "WHERE s3_prefix = ?", (s3Prefix,)).fetchone()
+    finally:
+        checkpointConn.close()
+    if row is None:
+        return None
+    return {'last_key': row[0], 'last_modified': row[1], 'updated_at': row[2]}
+
+
+def saveWatermark(checkpointPath, s3Prefix, lastKey, lastModified=None):
+    """
+    Description
+    -----------
+    A function that moves the watermark of an input folder up to the newest object discovered in it
+
+    Args
+    ----
+    checkpointPath: string
+        path of the SQLite file
+    s3Prefix: string
+        input folder
+    lastKey: string
+        key of the newest object discovered in the folder
+    lastModified: string
+        last modified time of the object at lastKey, files last modified before it are not listed again
+
+    Returns
+    -------
+    None
+    """
+    checkpointConn = connectCheckpointStore(checkpointPath)
+    try:
+        with checkpointConn:
+            checkpointConn.execute("INSERT OR REPLACE INTO discovery_watermarks (s3_prefix, last_key, last_modified, "
+                                   "updated_at) VALUES (?, ?, ?, ?)",
+                                   (s3Prefix, lastKey, None if lastModified is None else str(lastModified),
+                                    time.time()))
+    finally:
+        checkpointConn.close()
@@ -2,9 +2,9 @@
 # description     :This is where we store the email function
 # author          :Darwin Uy
 # date            :2022-6-2
-# version         :1.0
+# version         :1.3
 # usage           :
-# notes           :
+# notes           :queue_mail sends in the background over one SMTP connection once start_mail_queue is called
 # python_version  :3.9
 # ==============================================================================
 
@@ -12,15 +12,57 @@ from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-import smtplib, ssl
+import atexit
+import os
+import queue
+import smtplib, socket
+import threading
 
+SMTP_HOST = "smtp._____.com"
 
-# Email
-def send_mail(sender_email, receiver_email, subject, body, attachments=[]):
+# background notification queue, None until start_mail_queue is called
+_mail_queue = None
+_mail_thread = None
+_mail_digest = False
+_mail_digest_max_mails = 100
+# (digest key, sender, receivers) -> [(subject, body, attachment names)] held until stop_mail_queue, or until
+# _mail_digest_max_mails are held for the key
+_mail_digests = {}
+_mail_lock = threading.Lock()
+_mail_atexit = []
+
+
+def read_attachments(attachments):
     """
     Description
     -----------
-    A program that sends an email with attachments
+    A function that reads the files to attach so they can be deleted before the email is sent
+
+    Args
+    ----
+    attachments: list
+        paths of the files, or (file name, contents) pairs already read
+
+    Returns
+    -------
+    attachments: list
+        (file name, contents) pairs
+    """
+    read_files = []
+    for file in attachments:
+        if isinstance(file, tuple):
+            read_files.append(file)
+            continue
+        with open(file, "rb") as attachment:
+            read_files.append((file, attachment.read()))
+    return read_files
+
+
+def build_message(sender_email, receiver_email, subject, body, attachments=[]):
+    """
+    Description
+    -----------
+    A function that writes an email with attachments as the text sent to the SMTP server
 
     Args
     ----
@@ -33,15 +75,12 @@ def send_mail(sender_email, receiver_email, subject, body, attachments=[]):
     body: string
         body of the email
     attachments: list
-        list of attachments that are to be sent with the email
+        paths of the files to attach, or (file name, contents) pairs
 
     Returns
     -------
-    None
-
-    TODO
-    Fix sender for when there is a single email
-        - program splits the display name
+    text: string
+        the email
     """
     message = MIMEMultipart()
     message["From"] = sender_email
@@ -51,15 +90,11 @@ def send_mail(sender_email, receiver_email, subject, body, attachments=[]):
     #    message["Bcc"] = receiver_email  # Recommended for mass emails
     # Add body to email
     message.attach(MIMEText(body, "plain"))
-    filename = attachments
-    # In same directory as script
-    # Open files in binary mode
-    for file in filename:
-        with open(file, "rb") as attachment:
-            # Add file as application/octet-stream
-            # Email client can usually download this automatically as attachment
-            mbase = MIMEBase("application", "octet-stream")
-            mbase.set_payload(attachment.read())
+    for file, payload in read_attachments(attachments):
+        # Add file as application/octet-stream
+        # Email client can usually download this automatically as attachment
+        mbase = MIMEBase("application", "octet-stream")
+        mbase.set_payload(payload)
         # Encode file in ASCII characters to send by email
         encoders.encode_base64(mbase)
         # Add header as key/value pair to attachment part
@@ -70,10 +105,329 @@ def send_mail(sender_email, receiver_email, subject, body, attachments=[]):
 
         # Add attachment to message and convert message to string
         message.attach(mbase)
-    text = message.as_string()
-    # Log in to server using secure context and send email
-    context = ssl.create_default_context()
+    return message.as_string()
+
+
+# Email
+def send_mail(sender_email, receiver_email, subject, body, attachments=[]):
+    """
+    Description
+    -----------
+    A program that sends an email with attachments
+
+    Args
+    ----
+    sender_email: string, list of strings
+        email of sender
+    receiver_email: string, list of strings
+        email of reciever
+    subject: string
+        subject of the email sent
+    body: string
+        body of the email
+    attachments: list
+        list of attachments that are to be sent with the email
+
+    Returns
+    -------
+    None
+
+    TODO
+    Fix sender for when there is a single email
+        - program splits the display name
+    """
+    text = build_message(sender_email=sender_email, receiver_email=receiver_email, subject=subject, body=body,
+                         attachments=attachments)
 
-    with smtplib.SMTP("smtp._____.com") as server:
+    with smtplib.SMTP(SMTP_HOST) as server:
         server.sendmail(sender_email, receiver_email, text)
     print("Mail sent to user")
+
+
+def close_smtp_connection(server):
+    """
+    Description
+    -----------
+    A function that closes an SMTP connection, a connection the server already dropped is only closed locally
+
+    Args
+    ----
+    server: object
+        smtplib.SMTP connection
+    """
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
+
+
+def send_mail_batch(server, smtp_host, mail_batch):
+    """
+    Description
+    -----------
+    A function that sends emails over one SMTP connection, opened when needed
+        - a dropped connection is opened again and the email retried once
+        - an email that can not be sent is reported and skipped, loads are never stopped by the mail relay
+
+    Args
+    ----
+    server: object
+        open smtplib.SMTP connection, None to open one
+    smtp_host: string
+        SMTP relay
+    mail_batch: list
+        (sender, receivers, email text) of each email
+
+    Returns
+    -------
+    server: object
+        the connection to reuse for the next batch, None when it was lost
+    """
+    for sender_email, receiver_email, text in mail_batch:
+        for attempt in range(2):
+            try:
+                if server is None:
+                    server = smtplib.SMTP(smtp_host)
+                server.sendmail(sender_email, receiver_email, text)
+                print("Mail sent to user")
+                break
+            except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout) as err_message:
+                # relays drop idle connections, open a new one
+                if server is not None:
+                    server.close()
+                server = None
+                if attempt == 1:
+                    print(f"Mail to {receiver_email} not sent: {err_message}")
+            except smtplib.SMTPException as err_message:
+                # refused recipients or a rejected message, the connection is still usable
+                print(f"Mail to {receiver_email} not sent: {err_message}")
+                break
+            except OSError as err_message:
+                # the relay could not be reached, try a new connection
+                if server is not None:
+                    server.close()
+                server = None
+                if attempt == 1:
+                    print(f"Mail to {receiver_email} not sent: {err_message}")
+    return server
+
+
+def run_mail_queue(mail_queue, smtp_host, batch_size):
+    """
+    Description
+    -----------
+    A function that sends the queued emails until it takes None off the queue
+        - emails waiting in the queue are sent together, up to batch_size per batch
+
+    Args
+    ----
+    mail_queue: object
+        queue.Queue of (sender, receivers, email text)
+    smtp_host: string
+        SMTP relay
+    batch_size: int
+        emails sent per batch
+    """
+    server = None
+    stopping = False
+    try:
+        while not stopping:
+            mail = mail_queue.get()
+            if mail is None:
+                break
+            mail_batch = [mail]
+            while len(mail_batch) < batch_size:
+                try:
+                    mail = mail_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if mail is None:
+                    stopping = True
+                    break
+                mail_batch.append(mail)
+            server = send_mail_batch(server=server, smtp_host=smtp_host, mail_batch=mail_batch)
+    finally:
+        if server is not None:
+            close_smtp_connection(server=server)
+
+
+def start_mail_queue(smtp_host=SMTP_HOST, digest=False, batch_size=50, max_queued=1000, digest_max_mails=100):
+    """
+    Description
+    -----------
+    A function that starts sending the emails of queue_mail from a background thread
+        - the emails are sent over one SMTP connection kept open for the run
+        - in digest mode the emails of each digest key are held and sent as one email by stop_mail_queue, or
+          as soon as digest_max_mails are held for the key, their attachments are listed by name, not attached
+        - stop_mail_queue is also called when the program exits
+
+    Args
+    ----
+    smtp_host: string
+        SMTP relay
+    digest: bool
+        whether to roll up the emails of each digest key into one email
+    batch_size: int
+        emails sent per batch
+    max_queued: int
+        emails waiting to be sent before queue_mail waits
+    digest_max_mails: int
+        emails held per digest key before the digest is sent
+
+    Returns
+    -------
+    None
+    """
+    global _mail_queue, _mail_thread, _mail_digest, _mail_digest_max_mails
+    with _mail_lock:
+        if _mail_queue is not None:
+            return
+        _mail_queue = queue.Queue(maxsize=max_queued)
+        _mail_digest = digest
+        _mail_digest_max_mails = max(int(digest_max_mails), 1)
+        _mail_digests.clear()
+        _mail_thread = threading.Thread(target=run_mail_queue, args=(_mail_queue, smtp_host, batch_size),
+                                        daemon=True)
+        _mail_thread.start()
+        if not _mail_atexit:
+            # queued emails are still sent when the run stops early
+            atexit.register(stop_mail_queue)
+            _mail_atexit.append(stop_mail_queue)
+
+
+def queue_mail(sender_email, receiver_email, subject, body, attachments=[], digest_key=None):
+    """
+    Description
+    -----------
+    A function that hands an email to the background queue and returns without waiting for the relay
+        - the attachments are read before returning so they can be deleted
+        - in digest mode only the names of the attachments are kept, the digest lists them
+        - sent straight away with send_mail when the queue is not started or already stopped
+
+    Args
+    ----
+    sender_email: string, list of strings
+        email of sender
+    receiver_email: string, list of strings
+        email of reciever
+    subject: string
+        subject of the email sent
+    body: string
+        body of the email
+    attachments: list
+        list of attachments that are to be sent with the email
+    digest_key: string
+        emails with the same key, sender and receivers are rolled up in digest mode, e.g. the team database
+
+    Returns
+    -------
+    None
+    """
+    with _mail_lock:
+        if _mail_queue is not None and _mail_digest and digest_key is not None:
+            digest = (digest_key, sender_email, tuple(receiver_email))
+            digest_mails = _mail_digests.setdefault(digest, [])
+            digest_mails.append((subject, body, [os.path.basename(file[0] if isinstance(file, tuple) else file)
+                                                 for file in attachments]))
+            if len(digest_mails) < _mail_digest_max_mails:
+                return
+            # the held emails are bounded, a full digest is sent now and the key starts a new one
+            _mail_digests.pop(digest)
+            _mail_queue.put(get_digest_mail(digest=digest, digest_mails=digest_mails))
+            return
+    attachments = read_attachments(attachments)
+    text = build_message(sender_email=sender_email, receiver_email=receiver_email, subject=subject, body=body,
+                         attachments=attachments)
+    with _mail_lock:
+        # put under the lock so stop_mail_queue can not add the None sentinel in between and drop the email
+        if _mail_queue is not None:
+            _mail_queue.put((sender_email, receiver_email, text))
+            return
+    send_mail(sender_email=sender_email, receiver_email=receiver_email, subject=subject, body=body,
+              attachments=attachments)
+
+
+def get_digest_message(digest_key, digest_mails):
+    """
+    Description
+    -----------
+    A function that rolls up the emails held for a digest key into one subject and body
+        - a single email keeps its own subject and body
+
+    Args
+    ----
+    digest_key: string
+        key the emails were queued with
+    digest_mails: list
+        (subject, body, attachment names) of each email
+
+    Returns
+    -------
+    subject: string
+        subject of the digest
+    body: string
+        subjects and bodies of the emails in the order they were queued, with the names of their attachments
+    """
+    mail_bodies = []
+    for _, mail_body, attachment_names in digest_mails:
+        if attachment_names:
+            mail_body += "\n\nnot attached to the digest: " + ", ".join(attachment_names)
+        mail_bodies.append(mail_body)
+    if len(digest_mails) == 1:
+        return digest_mails[0][0], mail_bodies[0]
+    subject = f"{len(digest_mails)} notifications for {digest_key}"
+    summary = "\n".join(f"{number}. {mail_subject}" for number, (mail_subject, _, _) in enumerate(digest_mails, 1))
+    separator = f"\n\n{'-' * 70}\n\n"
+    details = separator.join(f"{mail_subject}\n\n{mail_body}"
+                             for (mail_subject, _, _), mail_body in zip(digest_mails, mail_bodies))
+    body = f"{summary}{separator}{details}"
+    return subject, body
+
+
+def get_digest_mail(digest, digest_mails):
+    """
+    Description
+    -----------
+    A function that writes the email text of a digest for the background queue
+
+    Args
+    ----
+    digest: tuple
+        (digest key, sender, receivers) the emails were queued with
+    digest_mails: list
+        (subject, body, attachment names) of each email
+
+    Returns
+    -------
+    mail: tuple
+        (sender, receivers, email text)
+    """
+    digest_key, sender_email, receiver_email = digest
+    subject, body = get_digest_message(digest_key=digest_key, digest_mails=digest_mails)
+    return (sender_email, list(receiver_email), build_message(sender_email=sender_email,
+                                                              receiver_email=receiver_email, subject=subject,
+                                                              body=body))
+
+
+def stop_mail_queue():
+    """
+    Description
+    -----------
+    A function that sends the digests, waits for every queued email to be sent and closes the SMTP connection
+
+    Returns
+    -------
+    None
+    """
+    global _mail_queue, _mail_thread
+    with _mail_lock:
+        mail_queue, mail_thread = _mail_queue, _mail_thread
+        digests = list(_mail_digests.items())
+        _mail_digests.clear()
+        _mail_queue, _mail_thread = None, None
+    if mail_queue is None:
+        return
+    for digest, digest_mails in digests:
+        mail_queue.put(get_digest_mail(digest=digest, digest_mails=digest_mails))
+    mail_queue.put(None)
+    mail_thread.join()
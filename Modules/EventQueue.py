@@ -0,0 +1,264 @@
+# title           :EventQueue.py
+# description     :S3 object created events for the daemon mode, from SQS or an in-memory queue
+# author          :Darwin Uy
+# date            :2026-10-17
+# version         :0.1
+# usage           :receive messages, parseS3EventMessage each body, acknowledge the messages once handled
+# notes           :both queues return messages shaped like SQS receive_message, a message not acknowledged is
+#                  received again once its visibility timeout passes
+# python_version  :3.9
+# ==============================================================================
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import unquote_plus
+
+import boto3
+
+# delete_message_batch and receive_message accept at most 10 messages per request
+SQS_BATCH_SIZE = 10
+
+
+def createSqsClient(awsKey, awsSecret, regionName=None):
+    """
+    Description
+    -----------
+    a function that creates a SQS client for the queue S3 sends object created events to
+
+    Args
+    ----
+    awsKey: string
+        AWS access key
+    awsSecret: string
+        AWS secret access key
+    regionName: string
+        region of the queue, the default region of the environment when None
+
+    Returns
+    -------
+    sqsClient: object
+        A SQS client
+    """
+    return boto3.client('sqs', aws_access_key_id=awsKey, aws_secret_access_key=awsSecret, region_name=regionName)
+
+
+def parseS3EventMessage(messageBody):
+    """
+    Description
+    -----------
+    A function that gets the objects of an S3 event notification
+        - notifications forwarded through SNS are unwrapped
+        - test events and events other than ObjectCreated give no objects
+
+    Args
+    ----
+    messageBody: string
+        body of the message
+
+    Returns
+    -------
+    s3Objects: list
+        Bucket, Key, Size and ETag of each created object
+    """
+    try:
+        event = json.loads(messageBody)
+    except ValueError:
+        print(f"Event not read: {messageBody[:200]}")
+        return []
+    if 'Records' not in event and isinstance(event.get('Message'), str):
+        return parseS3EventMessage(event['Message'])
+    s3Objects = []
+    for record in event.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated') or 's3' not in record:
+            continue
+        s3Object = record['s3'].get('object', {})
+        s3Objects.append({'Bucket': record['s3'].get('bucket', {}).get('name'),
+                          # keys are URL encoded in the notification
+                          'Key': unquote_plus(s3Object.get('key', '')),
+                          'Size': s3Object.get('size', 0),
+                          'ETag': s3Object.get('eTag', '').strip('"')})
+    return s3Objects
+
+
+def getS3EventMessage(s3Bucket, s3Key, size=0, etag=''):
+    """
+    Description
+    -----------
+    A function that writes the body of an ObjectCreated notification, for publishing to an InMemoryEventQueue
+
+    Args
+    ----
+    s3Bucket: string
+        bucket of the object
+    s3Key: string
+        key of the object
+    size: int
+        size of the object in bytes
+    etag: string
+        ETag of the object
+
+    Returns
+    -------
+    messageBody: string
+        S3 event notification
+    """
+    return json.dumps({'Records': [{'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+                                    's3': {'bucket': {'name': s3Bucket},
+                                           'object': {'key': s3Key, 'size': size, 'eTag': etag}}}]})
+
+
+class InMemoryEventQueue:
+    """
+    Description
+    -----------
+    A queue of S3 events kept in memory, for running the daemon without SQS and in the benchmark
+    """
+
+    def __init__(self, visibilityTimeout=300):
+        """
+        Args
+        ----
+        visibilityTimeout: float
+            seconds before a message received and not acknowledged is received again
+        """
+        self.visibilityTimeout = visibilityTimeout
+        self.messages = deque()
+        self.inFlight = {}
+        self.condition = threading.Condition()
+
+    def publish(self, messageBody):
+        """
+        Description
+        -----------
+        A function that adds a message to the queue
+
+        Args
+        ----
+        messageBody: string
+            body of the message, e.g. from getS3EventMessage
+        """
+        with self.condition:
+            self.messages.append({'MessageId': uuid.uuid4().hex, 'Body': messageBody})
+            self.condition.notify_all()
+
+    def receive(self, maxMessages=SQS_BATCH_SIZE, waitSeconds=0):
+        """
+        Description
+        -----------
+        A function that takes up to maxMessages messages off the queue, waiting up to waitSeconds for the first
+
+        Args
+        ----
+        maxMessages: int
+            most messages returned
+        waitSeconds: float
+            seconds to wait when the queue is empty
+
+        Returns
+        -------
+        messages: list
+            MessageId, ReceiptHandle and Body of each message
+        """
+        deadline = time.time() + waitSeconds
+        with self.condition:
+            while True:
+                now = time.time()
+                # messages not acknowledged in time go back on the queue
+                for receiptHandle, (receivedAt, message) in list(self.inFlight.items()):
+                    if now - receivedAt >= self.visibilityTimeout:
+                        del self.inFlight[receiptHandle]
+                        self.messages.append(message)
+                if self.messages or now >= deadline:
+                    break
+                self.condition.wait(min(deadline - now, 1.0))
+            received = []
+            while self.messages and len(received) < maxMessages:
+                message = self.messages.popleft()
+                receiptHandle = uuid.uuid4().hex
+                self.inFlight[receiptHandle] = (now, message)
+                received.append({'ReceiptHandle': receiptHandle, **message})
+            return received
+
+    def acknowledge(self, receiptHandles):
+        """
+        Description
+        -----------
+        A function that removes handled messages so they are not received again
+
+        Args
+        ----
+        receiptHandles: list
+            ReceiptHandle of each message from receive
+        """
+        with self.condition:
+            for receiptHandle in receiptHandles:
+                self.inFlight.pop(receiptHandle, None)
+
+
+class SqsEventQueue:
+    """
+    Description
+    -----------
+    An SQS queue S3 sends object created events to
+    """
+
+    def __init__(self, sqsClient, queueUrl):
+        """
+        Args
+        ----
+        sqsClient: object
+            SQS client from createSqsClient
+        queueUrl: string
+            URL of the queue
+        """
+        self.sqsClient = sqsClient
+        self.queueUrl = queueUrl
+
+    def receive(self, maxMessages=SQS_BATCH_SIZE, waitSeconds=0):
+        """
+        Description
+        -----------
+        A function that receives up to maxMessages messages, long polling up to waitSeconds for the first
+
+        Args
+        ----
+        maxMessages: int
+            most messages returned
+        waitSeconds: float
+            seconds to wait when the queue is empty, at most 20
+
+        Returns
+        -------
+        messages: list
+            MessageId, ReceiptHandle and Body of each message
+        """
+        received = []
+        while len(received) < maxMessages:
+            response = self.sqsClient.receive_message(
+                QueueUrl=self.queueUrl, MaxNumberOfMessages=min(SQS_BATCH_SIZE, maxMessages - len(received)),
+                WaitTimeSeconds=int(min(waitSeconds, 20)) if not received else 0)
+            messages = response.get('Messages', [])
+            received.extend(messages)
+            if not messages:
+                break
+        return received
+
+    def acknowledge(self, receiptHandles):
+        """
+        Description
+        -----------
+        A function that deletes handled messages so they are not received again
+
+        Args
+        ----
+        receiptHandles: list
+            ReceiptHandle of each message from receive
+        """
+        for batchStart in range(0, len(receiptHandles), SQS_BATCH_SIZE):
+            entries = [{'Id': str(number), 'ReceiptHandle': receiptHandle} for number, receiptHandle in
+                       enumerate(receiptHandles[batchStart:batchStart + SQS_BATCH_SIZE])]
+            response = self.sqsClient.delete_message_batch(QueueUrl=self.queueUrl, Entries=entries)
+            for failed in response.get('Failed', []):
+                print(f"Event not acknowledged: {failed.get('Message', failed)}")
@@ -0,0 +1,297 @@
+# title           :Metrics.py
+# description     :Per chunk, per file and per run load metrics as JSON lines and a Prometheus textfile
+# author          :Darwin Uy
+# date            :2026-10-17
+# version         :0.2
+# usage           :startMetricsRun at the start of a run, record* while loading, finishMetricsRun at the end
+# notes           :nothing is recorded until a run is started, the record functions are safe to call from threads
+# python_version  :3.9
+# ==============================================================================
+import json
+import os
+import threading
+import time
+import uuid
+
+# stages timed for every chunk of a file loaded through pandas
+CHUNK_STAGES = ['download', 'split', 'build', 'convert', 'upload']
+
+# run being recorded, None when metrics are off
+_metricsRun = None
+_metricsLock = threading.Lock()
+
+
+def startMetricsRun(jsonPath=None, textfilePath=None, runId=None):
+    """
+    Description
+    -----------
+    A function that starts recording the metrics of a run
+        - nothing is recorded when neither jsonPath nor textfilePath is given
+
+    Args
+    ----
+    jsonPath: string
+        file the chunk, file and run events are appended to as JSON lines
+    textfilePath: string
+        Prometheus textfile the run aggregates are written to when the run finishes
+        - for the node_exporter textfile collector, the name has to end in .prom
+    runId: string
+        id of the run in every event, a random id by default
+
+    Returns
+    -------
+    runId: string
+        id of the run, None when metrics are off
+    """
+    global _metricsRun
+    if not jsonPath and not textfilePath:
+        return None
+    with _metricsLock:
+        _metricsRun = {'run_id': runId or uuid.uuid4().hex, 'start': time.time(),
+                       'json_file': open(jsonPath, 'a') if jsonPath else None, 'textfile_path': textfilePath,
+                       'files': {'success': 0, 'failed': 0, 'skipped': 0}, 'rows': 0, 'bad_rows': 0, 'bytes': 0,
+                       'chunks': 0, 'stages': {}}
+        return _metricsRun['run_id']
+
+
+def writeMetricEvent(event, fields):
+    """
+    Description
+    -----------
+    A function that appends an event to the JSON lines file of the run, called with _metricsLock held
+
+    Args
+    ----
+    event: string
+        "chunk", "file" or "run"
+    fields: dict
+        values of the event
+    """
+    if _metricsRun['json_file'] is None:
+        return
+    _metricsRun['json_file'].write(json.dumps({'event': event, 'run_id': _metricsRun['run_id'],
+                                               'time': round(time.time(), 3), **fields}, default=str) + "\n")
+    _metricsRun['json_file'].flush()
+
+
+def addStageMetric(stage, seconds, nbytes, rows):
+    """
+    Description
+    -----------
+    A function that adds a call to the totals of a stage, called with _metricsLock held
+
+    Args
+    ----
+    stage: string
+        name of the stage
+    seconds: float
+        time the call took
+    nbytes: int
+        bytes the call moved
+    rows: int
+        rows the call moved
+    """
+    stageMetrics = _metricsRun['stages'].setdefault(stage, {'seconds': 0.0, 'calls': 0, 'bytes': 0, 'rows': 0,
+                                                            'max_seconds': 0.0})
+    stageMetrics['seconds'] += seconds
+    stageMetrics['calls'] += 1
+    stageMetrics['bytes'] += nbytes
+    stageMetrics['rows'] += rows
+    stageMetrics['max_seconds'] = max(stageMetrics['max_seconds'], seconds)
+
+
+def recordStage(stage, seconds, nbytes=0, rows=0):
+    """
+    Description
+    -----------
+    A function that adds a timed call to the run totals of a stage, no event is written
+
+    Args
+    ----
+    stage: string
+        name of the stage, e.g. s3_get_range or sf_write_pandas
+    seconds: float
+        time the call took
+    nbytes: int
+        bytes the call moved
+    rows: int
+        rows the call moved
+
+    Returns
+    -------
+    None
+    """
+    if _metricsRun is None:
+        return
+    with _metricsLock:
+        if _metricsRun is not None:
+            addStageMetric(stage=stage, seconds=seconds, nbytes=nbytes, rows=rows)
+
+
+def recordChunk(s3Key, sfTable, chunkNumber, chunkMetrics):
+    """
+    Description
+    -----------
+    A function that records a loaded chunk as a chunk event and adds it to the run totals
+
+    Args
+    ----
+    s3Key: string
+        S3 key of the file
+    sfTable: string
+        table the chunk was loaded to
+    chunkNumber: int
+        number of the chunk in the file, from 1
+    chunkMetrics: dict
+        download_seconds, split_seconds, build_seconds, convert_seconds, upload_seconds, bytes, rows and bad_rows
+        - missing keys count as 0
+
+    Returns
+    -------
+    None
+    """
+    if _metricsRun is None:
+        return
+    with _metricsLock:
+        if _metricsRun is None:
+            return
+        for stage in CHUNK_STAGES:
+            addStageMetric(stage=stage, seconds=chunkMetrics.get(f"{stage}_seconds", 0.0),
+                           nbytes=chunkMetrics.get('bytes', 0), rows=chunkMetrics.get('rows', 0))
+        _metricsRun['chunks'] += 1
+        writeMetricEvent(event='chunk', fields={'s3_key': s3Key, 'sf_table': sfTable, 'chunk': chunkNumber,
+                                                **chunkMetrics})
+
+
+def recordFile(s3Key, sfTable, status, seconds, fileBytes=0, rowsLoaded=0, badRows=0, chunks=0, loadMode=None):
+    """
+    Description
+    -----------
+    A function that records the outcome of a file as a file event and adds it to the run totals
+
+    Args
+    ----
+    s3Key: string
+        S3 key of the file
+    sfTable: string
+        table the file was loaded to
+    status: string
+        "success", "failed" or "skipped", "valid" or "invalid" for files validated without loading
+    seconds: float
+        time from the start of the file to its notification
+    fileBytes: int
+        size of the file in S3
+    rowsLoaded: int
+        rows loaded to the table
+    badRows: int
+        malformed rows left out
+    chunks: int
+        chunks or staged files loaded
+    loadMode: string
+        Common load.mode of the load
+
+    Returns
+    -------
+    None
+    """
+    if _metricsRun is None:
+        return
+    with _metricsLock:
+        if _metricsRun is None:
+            return
+        _metricsRun['files'][status] = _metricsRun['files'].get(status, 0) + 1
+        if status == 'success':
+            _metricsRun['rows'] += rowsLoaded
+            _metricsRun['bad_rows'] += badRows
+            _metricsRun['bytes'] += fileBytes
+        writeMetricEvent(event='file', fields={'s3_key': s3Key, 'sf_table': sfTable, 'status': status,
+                                               'load_mode': loadMode, 'seconds': seconds, 'bytes': fileBytes,
+                                               'rows': rowsLoaded, 'bad_rows': badRows, 'chunks': chunks,
+                                               'rows_per_second': rowsLoaded / seconds if seconds > 0 else 0.0,
+                                               'bytes_per_second': fileBytes / seconds if seconds > 0 else 0.0})
+
+
+def getPrometheusText(runMetrics):
+    """
+    Description
+    -----------
+    A function that writes the aggregates of a run in the Prometheus text exposition format
+
+    Args
+    ----
+    runMetrics: dict
+        output from finishMetricsRun()
+
+    Returns
+    -------
+    prometheusText: string
+        gauges of the last run, one sample per line
+    """
+    metricLines = []
+
+    def addMetric(name, description, samples):
+        metricLines.append(f"# HELP file2table_{name} {description}")
+        metricLines.append(f"# TYPE file2table_{name} gauge")
+        for labels, value in samples:
+            labelText = ",".join(f'{label}="{labelValue}"' for label, labelValue in labels.items())
+            metricLines.append(f"file2table_{name}{{{labelText}}} {value}" if labelText else
+                               f"file2table_{name} {value}")
+
+    addMetric('last_run_timestamp_seconds', "Unix time the last run finished", [({}, runMetrics['end'])])
+    addMetric('run_duration_seconds', "Duration of the last run", [({}, runMetrics['seconds'])])
+    addMetric('run_files', "Files of the last run by outcome",
+              [({'status': status}, count) for status, count in sorted(runMetrics['files'].items())])
+    addMetric('run_rows_loaded', "Rows loaded by the last run", [({}, runMetrics['rows'])])
+    addMetric('run_bad_rows', "Malformed rows left out by the last run", [({}, runMetrics['bad_rows'])])
+    addMetric('run_bytes', "Bytes of the files loaded by the last run", [({}, runMetrics['bytes'])])
+    addMetric('run_chunks', "Chunks loaded through pandas by the last run", [({}, runMetrics['chunks'])])
+    addMetric('run_rows_per_second', "Rows loaded per second of the last run", [({}, runMetrics['rows_per_second'])])
+    addMetric('run_bytes_per_second', "File bytes loaded per second of the last run",
+              [({}, runMetrics['bytes_per_second'])])
+    stages = sorted(runMetrics['stages'].items())
+    addMetric('run_stage_seconds', "Time spent in each stage by the last run, summed over threads",
+              [({'stage': stage}, stageMetrics['seconds']) for stage, stageMetrics in stages])
+    addMetric('run_stage_calls', "Calls or chunks of each stage in the last run",
+              [({'stage': stage}, stageMetrics['calls']) for stage, stageMetrics in stages])
+    addMetric('run_stage_max_seconds', "Longest call or chunk of each stage in the last run",
+              [({'stage': stage}, stageMetrics['max_seconds']) for stage, stageMetrics in stages])
+    addMetric('run_stage_bytes', "Bytes moved by each stage in the last run",
+              [({'stage': stage}, stageMetrics['bytes']) for stage, stageMetrics in stages])
+    return "\n".join(metricLines) + "\n"
+
+
+def finishMetricsRun():
+    """
+    Description
+    -----------
+    A function that ends the run, writes the run event and replaces the Prometheus textfile
+        - the textfile is written next to its final path and renamed so the collector never reads half a file
+
+    Returns
+    -------
+    runMetrics: dict
+        run aggregates, None when metrics are off
+    """
+    global _metricsRun
+    with _metricsLock:
+        if _metricsRun is None:
+            return None
+        metricsRun = _metricsRun
+        _metricsRun = None
+    end = time.time()
+    seconds = end - metricsRun['start']
+    runMetrics = {'run_id': metricsRun['run_id'], 'start': metricsRun['start'], 'end': end, 'seconds': seconds,
+                  'files': metricsRun['files'], 'rows': metricsRun['rows'], 'bad_rows': metricsRun['bad_rows'],
+                  'bytes': metricsRun['bytes'], 'chunks': metricsRun['chunks'],
+                  'rows_per_second': metricsRun['rows'] / seconds if seconds > 0 else 0.0,
+                  'bytes_per_second': metricsRun['bytes'] / seconds if seconds > 0 else 0.0,
+                  'stages': metricsRun['stages']}
+    if metricsRun['json_file'] is not None:
+        metricsRun['json_file'].write(json.dumps({'event': 'run', 'time': round(end, 3), **runMetrics}) + "\n")
+        metricsRun['json_file'].close()
+    if metricsRun['textfile_path']:
+        temporaryPath = f"{metricsRun['textfile_path']}.{os.getpid()}.tmp"
+        with open(temporaryPath, 'w') as textfile:
+            textfile.write(getPrometheusText(runMetrics=runMetrics))
+        os.replace(temporaryPath, metricsRun['textfile_path'])
+    return runMetrics
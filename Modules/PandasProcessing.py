@@ -2,19 +2,384 @@
 # description     :This will create a header for a python script.
 # author          :Darwin Uy
 # date            :2022-6-2
-# version         :0.1
+# version         :0.12
 # usage           :python pyscript.py
 # notes           :
 # python_version  :3.9
 # ==============================================================================
+import codecs
+import csv
+import io
+import multiprocessing
+import re
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+    pa_csv = None
+    pa_parquet = None
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+# characters str.splitlines() breaks on besides \n and \r\n, chunks holding them use the python engine
+SPLITLINES_ONLY_BREAKS = [b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e', b'\xc2\x85', b'\xe2\x80\xa8', b'\xe2\x80\xa9']
+# the multi-byte ones can only be in chunks that are not ASCII
+SPLITLINES_ONLY_ASCII_BREAKS = [lineBreak for lineBreak in SPLITLINES_ONLY_BREAKS if len(lineBreak) == 1]
+# bytes decoded at a time when checking that a chunk is UTF-8
+DECODE_SLICE_BYTES = 8 * 1024 ** 2
+# bytes str.strip() could remove from the edge of a line, ascii whitespace (including \x0b, \x0c and \x1c-\x1f)
+# and the lead byte of utf-8 characters
+STRIP_EDGE_BYTES = np.array([byte for byte in range(0x80) if chr(byte).isspace()] + list(range(0x80, 0x100)),
+                            dtype=np.uint8)
+
+# typed schema inference, a column gets the first type every non-empty sampled value matches
+BOOLEAN_VALUES = ['true', 'false']
+INTEGER_PATTERN = r'[+-]?(?:0|[1-9]\d*)'
+DECIMAL_PATTERN = r'[+-]?(?:0|[1-9]\d*)?\.\d+|[+-]?(?:0|[1-9]\d*)\.'
+FLOAT_PATTERN = r'[+-]?(?:\d+\.?\d*|\.\d+)[eE][+-]?\d+'
+DATE_PATTERN = r'\d{4}-\d{2}-\d{2}'
+TIMESTAMP_PATTERN = r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,9})?)?'
+TIMESTAMP_TZ_PATTERN = TIMESTAMP_PATTERN + r'(?:Z|[+-]\d{2}:?\d{2})'
+MAX_NUMBER_DIGITS = 38
+# integers that still fit an int64 are converted, longer ones are left for Snowflake to cast
+MAX_INT64_DIGITS = 18
+NUMBER_TYPE_PATTERN = r'NUMBER\((\d+),\s*(\d+)\)'
+CONVERTED_TYPES = ['BOOLEAN', 'FLOAT8', 'DATE', 'TIMESTAMP_NTZ', 'TIMESTAMP_TZ']
+
+# parse processes of Common parse.pool: process, None until a file needs them
+_parseProcessPool = None
+_parseProcessPoolLock = threading.Lock()
+
+
+class S3BodyReader(io.RawIOBase):
+    """
+    Description
+    -----------
+    A raw stream over an S3 StreamingBody, or any object with read(size), so it can be buffered with
+    io.BufferedReader and read line by line
+    """
+
+    def __init__(self, s3ObjectBody):
+        """
+        Args
+        ----
+        s3ObjectBody : object
+            S3 object body
+        """
+        self.s3ObjectBody = s3ObjectBody
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.s3ObjectBody.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def getArrowType(dtype):
+    """
+    Description
+    -----------
+    This is a function that gets the pyarrow type of a pandas dtype hint
+
+    Args
+    ----
+    dtype : object
+        str, object, "string" or a numpy dtype
+
+    Returns
+    -------
+    arrowType : object
+        pyarrow data type
+    """
+    if dtype in (str, object, 'str', 'string', 'object'):
+        return pa.string()
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+def readLineChunks(s3ObjectBody, chunkSize):
+    """
+    Description
+    -----------
+    A generator that reads an S3 object body in chunks that end on a line break
+        - the partial line at the end of a read is carried over to the next chunk
+        - the last line of the object does not need a trailing newline
+
+    Args
+    ----
+    s3ObjectBody : object
+        StreamingBody of the S3 object, or a decompressed stream from S3Connection.s3DecompressBody
+    chunkSize : int or callable
+        number of bytes to read per chunk, a callable is asked before every read
+
+    Yields
+    ------
+    chunk : bytes
+        complete lines of the object
+    """
+    newline = '\n'.encode()
+    partialChunk = b''
+    while True:
+        readBytes = s3ObjectBody.read(chunkSize() if callable(chunkSize) else chunkSize)
+        if readBytes == b'':
+            # end of the object, the last line has no trailing newline
+            if partialChunk != b'':
+                yield partialChunk
+            return
+        lastNewline = readBytes.rfind(newline)
+        if lastNewline == -1:
+            # line longer than the chunk, keep reading
+            partialChunk += readBytes
+            continue
+        # the partial line carried over and the complete lines of this read, copied once
+        chunk = b''.join((partialChunk, memoryview(readBytes)[:lastNewline + 1]))
+        partialChunk = readBytes[lastNewline + 1:]
+        readBytes = None
+        yield chunk
+
+
+def splitCsvBatches(s3ObjectBody, delimiter, header, chunksize, dtype, usecols, splitEngine, erroredRows,
+                    blockSize):
+    """
+    Description
+    -----------
+    A generator that reads a delimited S3 object body in blocks of lines split by parseChunk, for readCsvBatches
+
+    Args
+    ----
+    s3ObjectBody : object
+        S3 object body
+    delimiter : string
+        character used to separate the fields
+    header : bool
+        whether the first line holds the column names
+    chunksize : int
+        most rows per batch, the whole body in one batch when None
+    dtype : object
+        type of every column, or a dictionary of column -> type, strings when None
+    usecols : list
+        names or positions of the columns to read, all columns when None
+    splitEngine : string
+        parseChunk engine
+    erroredRows : list
+        [line number, original row] of each line with the wrong number of fields is appended, the read fails on
+        the first one when None
+    blockSize : int
+        bytes read and split at a time
+
+    Yields
+    ------
+    batch : object
+        dataframe
+    """
+    columnNames = None
+    lineNumber = 1
+    heldBatches = []
+    for chunkBytes in readLineChunks(s3ObjectBody=s3ObjectBody, chunkSize=blockSize):
+        if columnNames is None:
+            firstLineEnd = chunkBytes.find('\n'.encode())
+            firstLineEnd = len(chunkBytes) if firstLineEnd == -1 else firstLineEnd
+            fieldNames = chunkBytes[:firstLineEnd].decode('utf-8').strip().split(delimiter)
+            if header:
+                columnNames = fieldNames
+                chunkBytes = chunkBytes[firstLineEnd + 1:]
+                lineNumber = 2
+            else:
+                columnNames = list(range(len(fieldNames)))
+        batch, erroredData, lineNumber = parseChunk(chunkBytes=chunkBytes, delimiter=delimiter,
+                                                    columnNames=columnNames, startLineNumber=lineNumber,
+                                                    engine=splitEngine)
+        if erroredData and erroredRows is None:
+            raise ValueError(f"line {erroredData[0][0]}: expected {len(columnNames)} fields, "
+                             f"saw {erroredData[0][1].count(delimiter) + 1}")
+        if erroredRows is not None:
+            erroredRows += erroredData
+        if usecols is not None:
+            batch = batch[[columnNames[column] if isinstance(column, int) and header else column
+                           for column in usecols]]
+        if dtype is not None:
+            batch = batch.astype(dtype)
+        if chunksize is None:
+            heldBatches.append(batch)
+            continue
+        for batchStart in range(0, len(batch), chunksize):
+            yield batch.iloc[batchStart:batchStart + chunksize].reset_index(drop=True)
+    if columnNames is None:
+        return
+    if chunksize is None:
+        yield pd.concat(heldBatches, axis=0, ignore_index=True) if len(heldBatches) > 1 else heldBatches[0]
+    elif lineNumber == 2 and header:
+        # only a header, as the pandas reader an empty batch carries the column names
+        yield batch
+
 
-def importToPandas(object, delimiter, header=True):
+def getArrowBatches(recordBatches, chunksize):
+    """
+    Description
+    -----------
+    A generator that regroups pyarrow record batches into batches of chunksize rows, the last one can be shorter
+        - the blocks of pyarrow.csv are cut at line ends, a batch within a block shares its buffers and only a
+          batch across two blocks is copied
+
+    Args
+    ----
+    recordBatches : iterable
+        pyarrow record batches
+    chunksize : int
+        rows per batch
+
+    Yields
+    ------
+    recordBatch : object
+        pyarrow record batch
+    """
+    heldBatches = []
+    heldRows = 0
+    for recordBatch in recordBatches:
+        heldBatches.append(recordBatch)
+        heldRows += recordBatch.num_rows
+        while heldRows >= chunksize:
+            heldTable = pa.Table.from_batches(heldBatches)
+            yield heldTable.slice(0, chunksize).combine_chunks().to_batches()[0]
+            heldBatches = heldTable.slice(chunksize).to_batches()
+            heldRows -= chunksize
+    if heldRows:
+        yield pa.Table.from_batches(heldBatches).combine_chunks().to_batches()[0]
+
+
+def readCsvBatches(s3ObjectBody, delimiter, header=True, chunksize=100000, dtype=None, usecols=None, engine='c',
+                   arrow=False, blockSize=16 * 1024 ** 2, splitEngine=None, erroredRows=None):
+    """
+    Description
+    -----------
+    A generator that reads a delimited S3 object body as batches of at most chunksize rows
+        - only a block of the body is held in memory at a time
+        - "c" parses with the pandas C parser, "pyarrow" with pyarrow.csv.open_csv in blocks of blockSize bytes
+        - with splitEngine the lines are split the way the loader splits them, by parseChunk in blocks of
+          blockSize bytes, without quoting and with every value a string unless dtype is given, and lines with
+          the wrong number of fields go to erroredRows
+        - without a header the columns are numbered from 0
+
+    Args
+    ----
+    s3ObjectBody : object
+        S3 object body, or a decompressed stream from S3Connection.s3DecompressBody
+    delimiter : string
+        character used to separate the fields
+    header : bool
+        whether the first line holds the column names
+    chunksize : int
+        most rows per batch, the whole body in one batch when None
+    dtype : object
+        type of every column, or a dictionary of column -> type, inferred per batch when None
+    usecols : list
+        names or positions of the columns to read, all columns when None
+    engine : string
+        "c" or "pyarrow"
+    arrow : bool
+        whether to yield pyarrow record batches, or one table when chunksize is None, instead of dataframes,
+        only with the pyarrow engine
+    blockSize : int
+        bytes read and parsed at a time by the pyarrow engine and splitEngine
+    splitEngine : string
+        parseChunk engine, "numpy", "pyarrow" or "python", used instead of engine when given
+    erroredRows : list
+        with splitEngine, [line number, original row] of each line with the wrong number of fields is appended,
+        the read fails on the first one when None
+
+    Yields
+    ------
+    batch : object
+        dataframe, or pyarrow record batch
+    """
+    if splitEngine is not None:
+        yield from splitCsvBatches(s3ObjectBody=s3ObjectBody, delimiter=delimiter, header=header,
+                                   chunksize=chunksize, dtype=dtype, usecols=usecols, splitEngine=splitEngine,
+                                   erroredRows=erroredRows, blockSize=blockSize)
+        return
+    stream = io.BufferedReader(S3BodyReader(s3ObjectBody), buffer_size=1024 ** 2)
+    if engine == 'pyarrow' and pa_csv is not None:
+        columnNames = None
+        if header:
+            # column names are needed to give every column one type
+            columnNames = stream.readline().decode('utf-8').rstrip('\r\n').split(delimiter)
+            if columnNames == ['']:
+                return
+        if dtype is not None and not isinstance(dtype, dict):
+            # a single type needs every column, without a header they are counted on the first line
+            if columnNames is None:
+                firstLine = stream.peek(blockSize)
+                if b'\n' not in firstLine and len(firstLine) >= blockSize:
+                    raise ValueError("the first line is longer than blockSize, pass dtype per column")
+                firstLine = firstLine.split(b'\n', 1)[0].decode('utf-8')
+                dtype = {column: dtype for column in range(firstLine.count(delimiter) + 1)} if firstLine else {}
+            else:
+                dtype = {column: dtype for column in columnNames}
+
+        def getArrowColumn(column):
+            # positions are column names of pyarrow, f0, f1, ... without a header
+            if not isinstance(column, int):
+                return column
+            return f"f{column}" if columnNames is None else columnNames[column]
+
+        if usecols is not None:
+            usecols = [getArrowColumn(column) for column in usecols]
+        batchReader = pa_csv.open_csv(
+            stream,
+            read_options=pa_csv.ReadOptions(column_names=columnNames, autogenerate_column_names=columnNames is None,
+                                            block_size=blockSize),
+            parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={getArrowColumn(column): getArrowType(columnType)
+                              for column, columnType in (dtype or {}).items()},
+                include_columns=usecols))
+        if chunksize is None:
+            recordBatches = [batchReader.read_all()]
+        else:
+            recordBatches = getArrowBatches(recordBatches=batchReader, chunksize=chunksize)
+        for batch in recordBatches:
+            if arrow:
+                yield batch
+                continue
+            batch = batch.to_pandas()
+            if columnNames is None:
+                batch.columns = [int(column[1:]) for column in batch.columns]
+            yield batch
+        return
+
+    if not stream.peek(1):
+        return
+    batches = pd.read_csv(stream, sep=delimiter, header=0 if header else None, dtype=dtype, usecols=usecols,
+                          engine='c', chunksize=chunksize)
+    if chunksize is None:
+        yield batches
+        return
+    with batches:
+        for batch in batches:
+            yield batch
+
+
+def importToPandas(object, delimiter, header=True, chunksize=100000, dtype=None, usecols=None, engine='c',
+                   arrow=False):
     """
     Description
     -----------
     This is a function that reads a file from S3 and imports it into pandas
+        - the file is streamed as batches of at most chunksize rows by readCsvBatches
+        - chunksize None reads the whole object into one dataframe, it is deprecated as the file has to fit in
+          memory
 
     Args
     ----
@@ -22,19 +387,31 @@ def importToPandas(object, delimiter, header=True):
         S3 object
     delimeter : string
         character used to beginning and end of the field
-    header : int
-        indicates the header row of the file
+    header : bool
+        whether the first line holds the column names
+    chunksize : int
+        most rows per batch, None (deprecated) reads the whole object into one dataframe
+    dtype : object
+        type of every column, or a dictionary of column -> type
+    usecols : list
+        names or positions of the columns to read
+    engine : string
+        "c" or "pyarrow"
+    arrow : bool
+        whether the batches are pyarrow record batches, only with the pyarrow engine
 
     Returns
     -------
-    df : object
-        Pandas Dataframe of S3 object
+    batches : object
+        generator of batches, or the Pandas Dataframe of the S3 object when chunksize is None
     """
-    if header == True:
-        df = pd.read_csv(object['Body'], sep=delimiter, header=0)
-    if header == False:
-        df = pd.read_csv(object['Body'], sep=delimiter, header=None)
-    return df
+    batches = readCsvBatches(s3ObjectBody=object['Body'], delimiter=delimiter, header=header, chunksize=chunksize,
+                             dtype=dtype, usecols=usecols, engine=engine, arrow=arrow)
+    if chunksize is not None:
+        return batches
+    warnings.warn("importToPandas with chunksize=None is deprecated, iterate over the batches instead",
+                  DeprecationWarning, stacklevel=2)
+    return next(batches, pd.DataFrame())
 
 
 def pandasInferSchema(pandasDataframe):
@@ -90,3 +467,831 @@ def getSchemaPandas2Snowflake(pandasDataFrame):
     schema = ' '.join(schema)
     schema = schema[:len(schema) - 1]
     return schema
+
+
+def getChunkErrorMessage(erroredData, columnCount, delimiter):
+    """
+    Description
+    -----------
+    This is a function that writes the error log text for the rows of a chunk with the wrong number of columns
+
+    Args
+    ----
+    erroredData : list
+        [line number, original row] for each malformed row
+    columnCount : int
+        number of columns in the header
+    delimiter : string
+        character used to separate the fields
+
+    Returns
+    -------
+    erroredDataMessage : string
+        one error line per malformed row
+    """
+    erroredDataStringList = [
+        f"line {lineNumber}: expected {columnCount} columns but read {line.count(delimiter) + 1} [{line}]"
+        for lineNumber, line in erroredData]
+    erroredDataMessage = "\n".join(erroredDataStringList)
+    return erroredDataMessage
+
+
+def parseChunkPython(chunkBytes, delimiter, columnNames, startLineNumber, timings=None):
+    """
+    Description
+    -----------
+    This is a function that parses a chunk of delimited lines row by row in python
+        - reference implementation the vectorized engines have to match
+
+    Args
+    ----
+    chunkBytes : bytes
+        complete lines of a file, no header
+    delimiter : string
+        character used to separate the fields
+    columnNames : list
+        column names of the table
+    startLineNumber : int
+        line number of the first line in the chunk
+    timings : dict
+        split_seconds and build_seconds are set when given
+
+    Returns
+    -------
+    pandasDataframe : object
+        dataframe of the rows with the right number of columns
+    erroredData : list
+        [line number, original row] for each malformed row
+    endLineNumber : int
+        line number of the line after the chunk
+    """
+    start = time.perf_counter()
+    columnCount = len(columnNames)
+    chunkLines = chunkBytes.decode('utf-8').splitlines()
+    splitRows = [row.strip().split(delimiter) for row in chunkLines]  # get split rows to get list of lists
+    endLineNumber = startLineNumber + len(splitRows)
+    erroredData = [[lineNumber, line] for lineNumber, splitRow, line in
+                   zip(range(startLineNumber, endLineNumber), splitRows, chunkLines) if len(splitRow) != columnCount]
+    loadingData = [splitRow for splitRow in splitRows if len(splitRow) == columnCount]
+    split = time.perf_counter()
+    pandasDataframe = pd.DataFrame(loadingData, columns=columnNames)
+    if timings is not None:
+        timings['split_seconds'] = split - start
+        timings['build_seconds'] = time.perf_counter() - split
+    return pandasDataframe, erroredData, endLineNumber
+
+
+def scanChunkLines(chunkBytes, delimiter):
+    """
+    Description
+    -----------
+    This is a function that finds the line boundaries and column counts of a chunk with numpy
+
+    Args
+    ----
+    chunkBytes : bytes
+        complete lines of a file
+    delimiter : string
+        single byte character used to separate the fields
+
+    Returns
+    -------
+    chunkArray : object
+        numpy uint8 view of the chunk
+    lineStarts : object
+        numpy array of the first byte of each line
+    lineEnds : object
+        numpy array of the byte after each line, line terminators excluded
+    columnCounts : object
+        numpy array of the number of columns in each line
+    """
+    chunkArray = np.frombuffer(chunkBytes, dtype=np.uint8)
+    newlines = np.flatnonzero(chunkArray == NEWLINE)
+    lineStarts = np.concatenate(([0], newlines + 1))
+    lineEnds = np.concatenate((newlines, [len(chunkArray)]))
+    if len(lineStarts) and lineStarts[-1] >= len(chunkArray):
+        # the chunk ends with a newline so there is no trailing partial line
+        lineStarts = lineStarts[:-1]
+        lineEnds = lineEnds[:-1]
+    # \r\n counts as one line break
+    lineEnds = lineEnds - ((lineEnds > lineStarts) & (chunkArray[np.maximum(lineEnds - 1, 0)] == CARRIAGE_RETURN))
+    if len(lineStarts) == 0:
+        return chunkArray, lineStarts, lineEnds, np.zeros(0, dtype=np.int64)
+    columnCounts = np.add.reduceat(chunkArray == ord(delimiter), lineStarts, dtype=np.int64) + 1
+    return chunkArray, lineStarts, lineEnds, columnCounts
+
+
+def needsPythonSplit(chunkBytes, delimiter, columnCount):
+    """
+    Description
+    -----------
+    This is a function that checks whether a chunk has to be split in python for its lines to match str.splitlines
+        - single column, whitespace or multi-byte delimiters
+        - line breaks other than \n and \r\n
+
+    Args
+    ----
+    chunkBytes : bytes
+        complete lines of a file
+    delimiter : string
+        character used to separate the fields
+    columnCount : int
+        number of columns of the table
+
+    Returns
+    -------
+    pythonSplit : bool
+        True when the vectorized engines can not split the chunk exactly
+    """
+    if columnCount == 1 or len(delimiter.encode('utf-8')) != 1 or delimiter.isspace():
+        return True
+    lineBreaks = SPLITLINES_ONLY_ASCII_BREAKS if chunkBytes.isascii() else SPLITLINES_ONLY_BREAKS
+    if any(lineBreak in chunkBytes for lineBreak in lineBreaks):
+        return True
+    carriageReturns = chunkBytes.count(b'\r')
+    return carriageReturns > 0 and carriageReturns != chunkBytes.count(b'\r\n')
+
+
+def parseChunk(chunkBytes, delimiter, columnNames, startLineNumber, engine='numpy', timings=None):
+    """
+    Description
+    -----------
+    This is a function that parses a chunk of delimited lines into a dataframe of good rows and a list of bad rows
+        - "python" splits every row in python
+        - "numpy" counts delimiters over np.frombuffer and parses the good rows with the pandas C parser
+        - "pyarrow" counts delimiters the same way and parses the good rows with pyarrow.csv
+        - the vectorized engines fall back to python for chunks they can not match exactly
+          (single column, whitespace or multi-byte delimiters, line breaks other than \n and \r\n)
+
+    Args
+    ----
+    chunkBytes : bytes
+        complete lines of a file, no header
+    delimiter : string
+        character used to separate the fields
+    columnNames : list
+        column names of the table
+    startLineNumber : int
+        line number of the first line in the chunk
+    engine : string
+        parser engine, "numpy", "pyarrow" or "python"
+    timings : dict
+        split_seconds (line scan, bad rows, decode of bad rows) and build_seconds (dataframe of the good rows)
+        are set when given
+
+    Returns
+    -------
+    pandasDataframe : object
+        dataframe of the rows with the right number of columns, all values are strings
+    erroredData : list
+        [line number, original row] for each malformed row
+    endLineNumber : int
+        line number of the line after the chunk
+    """
+    if engine == 'pyarrow' and pa_csv is None:
+        engine = 'numpy'
+    if engine == 'python' or needsPythonSplit(chunkBytes=chunkBytes, delimiter=delimiter, columnCount=len(columnNames)):
+        return parseChunkPython(chunkBytes=chunkBytes, delimiter=delimiter, columnNames=columnNames,
+                                startLineNumber=startLineNumber, timings=timings)
+
+    start = time.perf_counter()
+    columnCount = len(columnNames)
+    chunkArray, lineStarts, lineEnds, columnCounts = scanChunkLines(chunkBytes=chunkBytes, delimiter=delimiter)
+    endLineNumber = startLineNumber + len(lineStarts)
+
+    ## get bad data
+    badLines = np.flatnonzero(columnCounts != columnCount)
+    erroredData = [[startLineNumber + int(line), chunkBytes[lineStarts[line]:lineEnds[line]].decode('utf-8')]
+                   for line in badLines]
+
+    ## get good data
+    goodBytes = chunkBytes
+    goodLineCount = len(lineStarts) - len(badLines)
+    if len(badLines):
+        # drop the bad lines, each line owns its bytes up to the start of the next line
+        # the runs of good lines between them are joined in a single copy
+        lineBounds = np.append(lineStarts, len(chunkArray))
+        runStarts = np.append(0, lineBounds[badLines + 1]).tolist()
+        runEnds = np.append(lineStarts[badLines], len(chunkArray)).tolist()
+        chunkView = memoryview(chunkBytes)
+        goodBytes = b''.join([chunkView[runStart:runEnd] for runStart, runEnd in zip(runStarts, runEnds)
+                              if runEnd > runStart])
+        chunkView.release()
+    split = time.perf_counter()
+    if timings is not None:
+        timings['split_seconds'] = split - start
+        timings['build_seconds'] = 0.0
+    if goodLineCount == 0:
+        return pd.DataFrame(columns=columnNames), erroredData, endLineNumber
+
+    if engine == 'pyarrow':
+        pandasDataframe = pa_csv.read_csv(
+            io.BytesIO(goodBytes),
+            read_options=pa_csv.ReadOptions(column_names=[f"c{i}" for i in range(columnCount)]),
+            parse_options=pa_csv.ParseOptions(delimiter=delimiter, quote_char=False, double_quote=False,
+                                              escape_char=False, newlines_in_values=False,
+                                              ignore_empty_lines=False),
+            convert_options=pa_csv.ConvertOptions(column_types={f"c{i}": pa.string() for i in range(columnCount)},
+                                                  strings_can_be_null=False,
+                                                  quoted_strings_can_be_null=False)).to_pandas()
+    else:
+        pandasDataframe = pd.read_csv(io.BytesIO(goodBytes), sep=delimiter, header=None, dtype=object,
+                                      engine='c', quoting=csv.QUOTE_NONE, na_filter=False,
+                                      skip_blank_lines=False, encoding='utf-8')
+    pandasDataframe.columns = columnNames
+
+    # str.strip() on the whole line only changes the first and last field
+    goodStarts = lineStarts[columnCounts == columnCount]
+    goodEnds = lineEnds[columnCounts == columnCount]
+    nonEmpty = goodEnds > goodStarts
+    if np.isin(chunkArray[goodStarts[nonEmpty]], STRIP_EDGE_BYTES).any() \
+            or np.isin(chunkArray[goodEnds[nonEmpty] - 1], STRIP_EDGE_BYTES).any():
+        pandasDataframe.iloc[:, 0] = pandasDataframe.iloc[:, 0].str.lstrip()
+        pandasDataframe.iloc[:, -1] = pandasDataframe.iloc[:, -1].str.rstrip()
+    if timings is not None:
+        timings['build_seconds'] = time.perf_counter() - split
+    return pandasDataframe, erroredData, endLineNumber
+
+
+def validateChunk(chunkBytes, delimiter, columnCount, startLineNumber):
+    """
+    Description
+    -----------
+    This is a function that checks the lines of a chunk without building a dataframe, for a validation scan
+        - lines are split and counted the way parseChunk splits them, so line numbers match a load of the file
+        - ASCII chunks are not decoded, others are decoded a slice at a time and resumed after each bad line
+
+    Args
+    ----
+    chunkBytes : bytes
+        complete lines of a file, no header
+    delimiter : string
+        character used to separate the fields
+    columnCount : int
+        number of columns in the header
+    startLineNumber : int
+        line number of the first line in the chunk
+
+    Returns
+    -------
+    erroredData : list
+        [line number, original row] for each line with the wrong number of columns
+    encodingErrors : list
+        [line number, error] for each line that is not valid UTF-8
+    endLineNumber : int
+        line number of the line after the chunk
+    """
+    if needsPythonSplit(chunkBytes=chunkBytes, delimiter=delimiter, columnCount=columnCount):
+        # the python engine splits these chunks, check them line by line like it does
+        chunkLines = chunkBytes.decode('utf-8', errors='surrogateescape').splitlines()
+        erroredData = []
+        encodingErrors = []
+        for lineNumber, line in enumerate(chunkLines, startLineNumber):
+            try:
+                line.encode('utf-8')
+            except UnicodeEncodeError as err:
+                encodingErrors.append([lineNumber, f"byte {line[err.start].encode('utf-8', 'surrogateescape')!r} "
+                                                   f"at column {err.start + 1} is not UTF-8"])
+                line = line.encode('utf-8', 'surrogateescape').decode('utf-8', errors='replace')
+            if len(line.strip().split(delimiter)) != columnCount:
+                erroredData.append([lineNumber, line])
+        return erroredData, encodingErrors, startLineNumber + len(chunkLines)
+
+    _, lineStarts, lineEnds, columnCounts = scanChunkLines(chunkBytes=chunkBytes, delimiter=delimiter)
+    encodingErrors = []
+    position = len(chunkBytes) if chunkBytes.isascii() else 0
+    chunkView = memoryview(chunkBytes)
+    while position < len(chunkBytes):
+        sliceEnd = min(position + DECODE_SLICE_BYTES, len(chunkBytes))
+        try:
+            # a character cut by the end of the slice is decoded with the next slice
+            _, decodedBytes = codecs.utf_8_decode(chunkView[position:sliceEnd], 'strict', sliceEnd == len(chunkBytes))
+            position += decodedBytes
+        except UnicodeDecodeError as err:
+            errorByte = position + err.start
+            line = int(np.searchsorted(lineStarts, errorByte, side='right')) - 1
+            encodingErrors.append([startLineNumber + line, f"byte {chunkBytes[errorByte:errorByte + 1]!r} at "
+                                                           f"column {errorByte - int(lineStarts[line]) + 1} "
+                                                           f"is not UTF-8"])
+            position = int(lineStarts[line + 1]) if line + 1 < len(lineStarts) else len(chunkBytes)
+    chunkView.release()
+    erroredData = [[startLineNumber + int(line),
+                    chunkBytes[lineStarts[line]:lineEnds[line]].decode('utf-8', errors='replace')]
+                   for line in np.flatnonzero(columnCounts != columnCount)]
+    return erroredData, encodingErrors, startLineNumber + len(lineStarts)
+
+
+def getParseProcessPool(workers):
+    """
+    Description
+    -----------
+    A function that gets the process pool chunks are parsed in, started on first use and shared by every file
+        - the processes are started from a fork server, forking the loader itself would copy the locks held by
+          its S3 and Snowflake threads
+
+    Args
+    ----
+    workers : int
+        number of parse processes, only used when the pool is started
+
+    Returns
+    -------
+    processPool : object
+        concurrent.futures.ProcessPoolExecutor
+    """
+    global _parseProcessPool
+    with _parseProcessPoolLock:
+        if _parseProcessPool is None:
+            startMethods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in startMethods else 'spawn')
+            _parseProcessPool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return _parseProcessPool
+
+
+def closeParseProcessPool():
+    """
+    Description
+    -----------
+    A function that stops the parse processes, run at the end of a run
+
+    Returns
+    -------
+    None
+    """
+    global _parseProcessPool
+    with _parseProcessPoolLock:
+        processPool = _parseProcessPool
+        _parseProcessPool = None
+    if processPool is not None:
+        processPool.shutdown(wait=True, cancel_futures=True)
+
+
+def parseSharedChunk(sharedMemoryName, chunkSize, delimiter, columnNames, engine='numpy'):
+    """
+    Description
+    -----------
+    This is a function that parses a chunk placed in shared memory, run in a parse process
+        - with pyarrow the good rows are returned as arrow string columns, which go back to the loader as a few
+          buffers instead of one pickled object per value
+
+    Args
+    ----
+    sharedMemoryName : string
+        name of the shared memory block holding the chunk
+    chunkSize : int
+        bytes of the chunk in the block
+    delimiter : string
+        character used to separate the fields
+    columnNames : list
+        column names of the table
+    engine : string
+        parseChunk engine
+
+    Returns
+    -------
+    parsedRows : object
+        pyarrow table with columns c0, c1, ... or a dataframe of the good rows when pyarrow is not installed
+    erroredData : list
+        [line number from 0, original row] for each malformed row
+    endLineNumber : int
+        lines in the chunk
+    timings : dict
+        split_seconds and build_seconds
+    """
+    sharedChunk = shared_memory.SharedMemory(name=sharedMemoryName)
+    try:
+        chunkBytes = bytes(sharedChunk.buf[:chunkSize])
+    finally:
+        sharedChunk.close()
+    timings = {}
+    pandasDataframe, erroredData, endLineNumber = parseChunk(chunkBytes=chunkBytes, delimiter=delimiter,
+                                                             columnNames=columnNames, startLineNumber=0,
+                                                             engine=engine, timings=timings)
+    if pa is None:
+        return pandasDataframe, erroredData, endLineNumber, timings
+    start = time.perf_counter()
+    # positional names, the table header can repeat a column name
+    parsedRows = pa.Table.from_arrays([pa.array(pandasDataframe.iloc[:, column], type=pa.string())
+                                       for column in range(len(columnNames))],
+                                      names=[f"c{column}" for column in range(len(columnNames))])
+    timings['build_seconds'] += time.perf_counter() - start
+    return parsedRows, erroredData, endLineNumber, timings
+
+
+def submitParseChunk(processPool, chunkBytes, delimiter, columnNames, engine='numpy'):
+    """
+    Description
+    -----------
+    A function that hands a chunk to a parse process through shared memory instead of pickling it
+        - the shared memory block is freed when the parse finishes or is cancelled
+
+    Args
+    ----
+    processPool : object
+        output from getParseProcessPool(workers)
+    chunkBytes : bytes
+        complete lines of a file, no header
+    delimiter : string
+        character used to separate the fields
+    columnNames : list
+        column names of the table
+    engine : string
+        parseChunk engine
+
+    Returns
+    -------
+    future : object
+        future of parseSharedChunk, read with getParseChunkResult(future, columnNames, timings)
+    """
+    sharedChunk = shared_memory.SharedMemory(create=True, size=max(len(chunkBytes), 1))
+    sharedChunk.buf[:len(chunkBytes)] = chunkBytes
+
+    def releaseSharedChunk(future):
+        sharedChunk.close()
+        sharedChunk.unlink()
+
+    try:
+        future = processPool.submit(parseSharedChunk, sharedChunk.name, len(chunkBytes), delimiter, columnNames,
+                                    engine)
+    except Exception:
+        releaseSharedChunk(None)
+        raise
+    future.add_done_callback(releaseSharedChunk)
+    return future
+
+
+def getParseChunkResult(future, columnNames, timings=None):
+    """
+    Description
+    -----------
+    A function that waits for a chunk parsed by submitParseChunk and returns it the way parseChunk does
+
+    Args
+    ----
+    future : object
+        output from submitParseChunk
+    columnNames : list
+        column names of the table
+    timings : dict
+        split_seconds and build_seconds of the parse process are set when given
+
+    Returns
+    -------
+    pandasDataframe : object
+        dataframe of the rows with the right number of columns, all values are strings
+    erroredData : list
+        [line number from 0, original row] for each malformed row
+    endLineNumber : int
+        lines in the chunk
+    """
+    parsedRows, erroredData, endLineNumber, chunkTimings = future.result()
+    if pa is not None and isinstance(parsedRows, pa.Table):
+        start = time.perf_counter()
+        pandasDataframe = parsedRows.to_pandas()
+        pandasDataframe.columns = columnNames
+        chunkTimings['build_seconds'] += time.perf_counter() - start
+    else:
+        pandasDataframe = parsedRows
+    if timings is not None:
+        timings.update(chunkTimings)
+    return pandasDataframe, erroredData, endLineNumber
+
+
+def getDecimalDigits(values):
+    """
+    Description
+    -----------
+    This is a function that measures the digits before and after the decimal point of numeric strings
+
+    Args
+    ----
+    values : object
+        pandas series of numeric strings
+
+    Returns
+    -------
+    integerDigits : int
+        most digits before the decimal point
+    scale : int
+        most digits after the decimal point
+    """
+    unsigned = values.str.lstrip('+-')
+    parts = unsigned.str.split('.', n=1, expand=True)
+    integerDigits = int(parts[0].str.lstrip('0').str.len().max())
+    scale = int(parts[1].fillna('').str.len().max()) if parts.shape[1] > 1 else 0
+    return integerDigits, scale
+
+
+def parseTimestamps(values, utc=False):
+    """
+    Description
+    -----------
+    This is a function that parses ISO 8601 timestamp strings, invalid values become NaT
+
+    Args
+    ----
+    values : object
+        pandas series of timestamp strings
+    utc : bool
+        whether the strings carry a time zone offset
+
+    Returns
+    -------
+    timestamps : object
+        pandas series of timestamps
+    """
+    try:
+        timestamps = pd.to_datetime(values, errors='coerce', utc=utc, format='ISO8601')
+    except ValueError:
+        # pandas before 2.0 has no ISO8601 format and parses ISO strings by default
+        timestamps = pd.to_datetime(values, errors='coerce', utc=utc)
+    return timestamps
+
+
+def inferColumnType(values):
+    """
+    Description
+    -----------
+    This is a function that infers the Snowflake type of a column of strings
+        - empty strings are treated as NULL and do not decide the type
+        - integers with leading zeros stay VARCHAR so codes like 00123 keep their zeros
+
+    Args
+    ----
+    values : object
+        pandas series of strings
+
+    Returns
+    -------
+    columnType : string
+        Snowflake type, e.g. NUMBER(38,0), NUMBER(38,2), FLOAT8, BOOLEAN, DATE, TIMESTAMP_NTZ, VARCHAR(16777216)
+    """
+    values = values[values != ''].dropna().astype(str)
+    if len(values) == 0:
+        return 'VARCHAR(16777216)'
+    if values.str.lower().isin(BOOLEAN_VALUES).all():
+        return 'BOOLEAN'
+    if values.str.fullmatch(INTEGER_PATTERN).all():
+        integerDigits, _ = getDecimalDigits(values)
+        if integerDigits <= MAX_NUMBER_DIGITS:
+            return 'NUMBER(38,0)'
+    isDecimal = values.str.fullmatch(DECIMAL_PATTERN) | values.str.fullmatch(INTEGER_PATTERN)
+    if isDecimal.all():
+        integerDigits, scale = getDecimalDigits(values)
+        if integerDigits + scale <= MAX_NUMBER_DIGITS:
+            return f'NUMBER(38,{scale})'
+        return 'FLOAT8'
+    if (isDecimal | values.str.fullmatch(FLOAT_PATTERN)).all():
+        return 'FLOAT8'
+    if values.str.fullmatch(DATE_PATTERN).all() \
+            and pd.to_datetime(values, format='%Y-%m-%d', errors='coerce').notna().all():
+        return 'DATE'
+    if values.str.fullmatch(TIMESTAMP_PATTERN).all() and parseTimestamps(values).notna().all():
+        return 'TIMESTAMP_NTZ'
+    if values.str.fullmatch(TIMESTAMP_TZ_PATTERN).all() and parseTimestamps(values, utc=True).notna().all():
+        return 'TIMESTAMP_TZ'
+    return 'VARCHAR(16777216)'
+
+
+def inferSnowflakeSchema(pandasDataframe):
+    """
+    Description
+    -----------
+    This is a function that infers a typed Snowflake schema from a sample of string columns
+        - replaces pandasInferSchema and getSchemaPandas2Snowflake when rows come from split strings,
+          where every column would be object and map to VARCHAR
+
+    Args
+    ----
+    pandasDataframe : object
+        a pandas dataframe of strings sampled from the file
+
+    Returns
+    -------
+    columnTypes : list
+        Snowflake type of each column
+    schema : string
+        string that defines the schema for table creation in Snowflake
+    """
+    columnTypes = [inferColumnType(pandasDataframe.iloc[:, column])
+                   for column in range(len(pandasDataframe.columns))]
+    schema = ', '.join([f"{columnName} {columnType}" for columnName, columnType in
+                        zip(pandasDataframe.columns.tolist(), columnTypes)])
+    return columnTypes, schema
+
+
+def getArrowSnowflakeType(arrowType):
+    """
+    Description
+    -----------
+    This is a function that maps the type of a Parquet column, read as a pyarrow type, to a Snowflake type
+
+    Args
+    ----
+    arrowType : object
+        pyarrow data type
+
+    Returns
+    -------
+    snowflakeType : string
+        Snowflake type, e.g. NUMBER(38,0), NUMBER(12,2), FLOAT8, BOOLEAN, DATE, TIMESTAMP_NTZ, VARIANT
+    """
+    if pa.types.is_dictionary(arrowType):
+        return getArrowSnowflakeType(arrowType.value_type)
+    if pa.types.is_boolean(arrowType):
+        return 'BOOLEAN'
+    if pa.types.is_integer(arrowType):
+        return 'NUMBER(38,0)'
+    if pa.types.is_floating(arrowType):
+        return 'FLOAT8'
+    if pa.types.is_decimal(arrowType):
+        if arrowType.precision <= MAX_NUMBER_DIGITS:
+            return f'NUMBER({arrowType.precision},{arrowType.scale})'
+        # wider than NUMBER, kept exact as text by convertArrow2Schema
+        return 'VARCHAR(16777216)'
+    if pa.types.is_date(arrowType):
+        return 'DATE'
+    if pa.types.is_timestamp(arrowType):
+        return 'TIMESTAMP_NTZ' if arrowType.tz is None else 'TIMESTAMP_TZ'
+    if pa.types.is_time(arrowType):
+        return 'TIME'
+    if pa.types.is_binary(arrowType) or pa.types.is_large_binary(arrowType) \
+            or pa.types.is_fixed_size_binary(arrowType):
+        return 'BINARY'
+    if pa.types.is_nested(arrowType):
+        return 'VARIANT'
+    return 'VARCHAR(16777216)'
+
+
+def getSnowflakeSchemaArrow(arrowSchema, columnNames):
+    """
+    Description
+    -----------
+    This is a function that writes the Snowflake schema of a Parquet file from the types in its metadata
+        - replaces pandasInferSchema, the columns of a Parquet file are already typed
+
+    Args
+    ----
+    arrowSchema : object
+        pyarrow schema of the file, e.g. ParquetFile.schema_arrow
+    columnNames : list
+        table column name of each field of the schema
+
+    Returns
+    -------
+    columnTypes : list
+        Snowflake type of each column
+    schema : string
+        string that defines the schema for table creation in Snowflake
+    """
+    columnTypes = [getArrowSnowflakeType(field.type) for field in arrowSchema]
+    schema = ', '.join([f"{columnName} {columnType}" for columnName, columnType in zip(columnNames, columnTypes)])
+    return columnTypes, schema
+
+
+def convertArrow2Schema(arrowTable, columnTypes):
+    """
+    Description
+    -----------
+    This is a function that converts the columns of a Parquet row group that Snowflake can not load as they are
+        - decimals of more than 38 digits are cast to strings for their VARCHAR columns, without losing digits
+
+    Args
+    ----
+    arrowTable : object
+        pyarrow table read from a row group
+    columnTypes : list
+        Snowflake type of each column, output from getSnowflakeSchemaArrow(arrowSchema, columnNames)
+
+    Returns
+    -------
+    arrowTable : object
+        pyarrow table with the converted columns
+    """
+    for column, (field, columnType) in enumerate(zip(arrowTable.schema, columnTypes)):
+        arrowType = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        if pa.types.is_decimal(arrowType) and columnType.startswith('VARCHAR'):
+            arrowColumn = arrowTable.column(column)
+            if pa.types.is_dictionary(field.type):
+                arrowColumn = arrowColumn.cast(arrowType)
+            arrowTable = arrowTable.set_column(column, field.name, arrowColumn.cast(pa.string()))
+    return arrowTable
+
+
+def openParquetFile(fileObject):
+    """
+    Description
+    -----------
+    This is a function that opens a Parquet file to read its metadata and row groups
+
+    Args
+    ----
+    fileObject : object
+        seekable file, e.g. S3Connection.S3RangedFile so row groups are read with ranged GETs
+
+    Returns
+    -------
+    parquetFile : object
+        pyarrow.parquet.ParquetFile
+        - the column chunks of a row group are fetched together when it is read
+
+    Raises
+    ------
+    ImportError
+        when pyarrow is not installed
+    """
+    if pa_parquet is None:
+        raise ImportError("pyarrow is needed to load Parquet files")
+    return pa_parquet.ParquetFile(fileObject, pre_buffer=True)
+
+
+def convertPandas2Schema(pandasDataframe, columnTypes):
+    """
+    Description
+    -----------
+    This is a function that converts the string columns of a chunk to the inferred Snowflake types before upload
+        - every non-empty value is checked against its type, empty strings become NULL
+        - dates and timestamps are parsed, not only matched, so values like 2024-02-30 do not match
+        - integers that fit int64, floats and booleans are converted, decimals, dates and timestamps
+          are checked and left as strings for Snowflake to cast without losing precision
+        - the types come from a sample, rows of a later chunk that do not match them are taken out and
+          returned so they can be reported with the malformed rows instead of failing a partly written load
+
+    Args
+    ----
+    pandasDataframe : object
+        a pandas dataframe of strings
+    columnTypes : list
+        Snowflake type of each column
+        - output from inferSnowflakeSchema(pandasDataframe) or SnowflakeConnection.reconcileSnowflakeTable
+
+    Returns
+    -------
+    pandasDataframe : object
+        dataframe of the matching rows with the typed columns converted
+    mismatchedRows : list
+        [row position in the given dataframe, error message] for each row taken out
+    """
+    typedColumns = []
+    mismatchMessages = {}
+    for column, (columnName, columnType) in enumerate(zip(pandasDataframe.columns.tolist(), columnTypes)):
+        numberType = re.fullmatch(NUMBER_TYPE_PATTERN, columnType)
+        if not (numberType or columnType in CONVERTED_TYPES):
+            # VARCHAR and types Snowflake casts itself
+            continue
+        isInteger = numberType is not None and int(numberType.group(2)) == 0
+        typedColumns.append((column, columnType, isInteger))
+        values = pandasDataframe.iloc[:, column]
+        isEmpty = (values == '').to_numpy(dtype=bool)
+        present = values[~isEmpty].astype(str)
+        if columnType == 'BOOLEAN':
+            matches = present.str.lower().isin(BOOLEAN_VALUES)
+        elif isInteger:
+            matches = present.str.fullmatch(INTEGER_PATTERN)
+        elif numberType:
+            scale = int(numberType.group(2))
+            matches = present.str.fullmatch(DECIMAL_PATTERN) | present.str.fullmatch(INTEGER_PATTERN)
+            matches &= present.str.split('.', n=1).str[1].fillna('').str.len() <= scale
+        elif columnType == 'FLOAT8':
+            matches = present.str.fullmatch(DECIMAL_PATTERN) | present.str.fullmatch(INTEGER_PATTERN) \
+                      | present.str.fullmatch(FLOAT_PATTERN)
+        elif columnType == 'DATE':
+            matches = present.str.fullmatch(DATE_PATTERN) \
+                      & pd.to_datetime(present, format='%Y-%m-%d', errors='coerce').notna()
+        elif columnType == 'TIMESTAMP_NTZ':
+            matches = present.str.fullmatch(TIMESTAMP_PATTERN) & parseTimestamps(present).notna()
+        else:
+            matches = present.str.fullmatch(TIMESTAMP_TZ_PATTERN) & parseTimestamps(present, utc=True).notna()
+        matches = matches.to_numpy(dtype=bool)
+        if not matches.all():
+            # the first column that does not match is the error of the row
+            for position, badValue in zip(np.flatnonzero(~isEmpty)[~matches].tolist(), present[~matches].tolist()):
+                mismatchMessages.setdefault(
+                    position, f"column {columnName} value '{badValue}' does not match the inferred type {columnType}")
+
+    mismatchedRows = [[position, mismatchMessages[position]] for position in sorted(mismatchMessages)]
+    if mismatchedRows:
+        keep = np.ones(len(pandasDataframe), dtype=bool)
+        keep[list(mismatchMessages)] = False
+        pandasDataframe = pandasDataframe.iloc[keep].reset_index(drop=True)
+
+    convertedColumns = {}
+    for column, columnType, isInteger in typedColumns:
+        values = pandasDataframe.iloc[:, column]
+        isEmpty = values == ''
+        present = values[~isEmpty].astype(str)
+        if columnType == 'BOOLEAN':
+            converted = present.str.lower().eq('true').astype('boolean').reindex(values.index)
+        elif isInteger and (len(present) == 0 or present.str.lstrip('+-').str.len().max() <= MAX_INT64_DIGITS):
+            converted = pd.to_numeric(present).astype('Int64').reindex(values.index)
+        elif columnType == 'FLOAT8':
+            converted = pd.to_numeric(present).astype('float64').reindex(values.index)
+        else:
+            converted = values.where(~isEmpty, None)
+        convertedColumns[column] = converted
+    if convertedColumns:
+        # isetitem replaces whole columns, the unconverted columns can be shared with the original
+        pandasDataframe = pandasDataframe.copy(deep=False)
+        for column, converted in convertedColumns.items():
+            pandasDataframe.isetitem(column, converted)
+    return pandasDataframe, mismatchedRows
@@ -2,12 +2,34 @@
 # description     :This will create a header for a python script.
 # author          :Darwin Uy
 # date            :2022-6-1
-# version         :0.3
+# version         :0.12
 # usage           :python pyscript.py
 # notes           :
 # python_version  :3.9
 # ==============================================================================
+import bz2
+import gzip
+import io
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+
+import Metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# delete_objects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+# compression of input files by extension
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd'}
 
 
 def createS3Client(s3Key, s3Secret):
@@ -97,11 +119,41 @@ def s3Gets3Items(s3Client, s3Bucket, s3Folder):
         A list of all items inside the bucket prefix.
         - includes folders and files
     """
-    objects = s3Client.list_objects(Bucket=s3Bucket, Prefix=s3Folder)
-    items = [x['Key'] for x in objects['Contents']]
+    items = [item['Key'] for item in s3ListObjects(s3Client=s3Client, s3Bucket=s3Bucket, s3Prefix=s3Folder)]
     return items
 
 
+def s3GetObjectInfo(s3Client, s3Bucket, s3Key):
+    """
+    Description
+    -----------
+    A function that gets the size, ETag and last modified time of an object the way listings return them
+
+    Args
+    ----
+    s3Client: object
+        A S3 client instance
+    s3Bucket: string
+        S3 bucket used
+    s3Key: string
+        S3 key of the object
+
+    Returns
+    -------
+    item: dict
+        Key, Size, ETag and LastModified of the object, None when the object does not exist
+    """
+    try:
+        s3Head = s3Client.head_object(Bucket=s3Bucket, Key=s3Key)
+    except Exception as err_message:
+        # head requests have no body, a missing object is only told apart by its status code
+        if getattr(err_message, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return {'Key': s3Key, 'Size': s3Head['ContentLength'], 'ETag': s3Head['ETag'].strip('"'),
+            'LastModified': s3Head.get('LastModified')}
+
+
 def s3GetInputFolder(FolderItems):
     """
     Description
@@ -143,15 +195,122 @@ def s3GetInputFiles(s3Client, inputFolderlist, s3Bucket):
     file_list: list
         List of files to be in folder
     """
-    inputFolderlist_objects = [s3Client.list_objects(Bucket=s3Bucket, Prefix=str(folder)) for folder in inputFolderlist]
-    input_file_contents = [item["Contents"] for item in inputFolderlist_objects if "Contents" in item.keys()]
-    input_folder_file_keys_list_unflattened = [[item["Key"] for item in i] for i in input_file_contents]
-    input_folder_file_keys_list_flattened = [item for sublist in input_folder_file_keys_list_unflattened for item in
-                                             sublist]
-    input_files = [file for file in input_folder_file_keys_list_flattened if not file.endswith("/")]
+    input_files = [item['Key'] for item in
+                   s3DiscoverInputFiles(s3Client=s3Client, inputFolderlist=inputFolderlist, s3Bucket=s3Bucket)]
     return input_files
 
 
+def s3ListObjects(s3Client, s3Bucket, s3Prefix, s3StartAfter=None):
+    """
+    Description
+    -----------
+    A generator that lists every object under a S3 prefix using ListObjectsV2 pagination
+        - list_objects only returns the first 1000 keys, this follows the continuation tokens
+
+    Args
+    ----
+    s3Client: object
+        A S3 client instance
+    s3Bucket: string
+        S3 bucket in use
+    s3Prefix: string
+        S3 prefix to list
+    s3StartAfter: string
+        optional key to start listing after
+
+    Yields
+    ------
+    item: dict
+        Key, Size, ETag and LastModified of an object under the prefix
+    """
+    paginator = s3Client.get_paginator('list_objects_v2')
+    pagination_args = {'Bucket': s3Bucket, 'Prefix': str(s3Prefix)}
+    if s3StartAfter:
+        pagination_args['StartAfter'] = s3StartAfter
+    for page in paginator.paginate(**pagination_args):
+        for item in page.get('Contents', []):
+            yield {'Key': item['Key'], 'Size': item['Size'], 'ETag': item['ETag'].strip('"'),
+                   'LastModified': item.get('LastModified')}
+
+
+def s3DiscoverInputFiles(s3Client, inputFolderlist, s3Bucket, maxWorkers=8, queueSize=10000, s3StartAfter=None):
+    """
+    Description
+    -----------
+    A generator that lists all input folders concurrently and streams the files back as they are found
+        - each folder is paginated in its own thread
+        - files are yielded while listing is still running so ingestion can start right away
+        - folder placeholder keys (ending with "/") are skipped
+
+    Args
+    ----
+    s3Client: object
+        A S3 client instance
+    inputFolderlist: list
+        List of folders to find input files in
+    s3Bucket: string
+        S3 bucket in use
+    maxWorkers: int
+        number of folders listed at the same time
+    queueSize: int
+        number of listed files buffered before the listing threads wait on the consumer
+    s3StartAfter: dict
+        folder -> key to start listing the folder after, folders without a key are listed in full
+
+    Yields
+    ------
+    item: dict
+        Key, Size, ETag and LastModified of an input file
+    """
+    s3StartAfter = s3StartAfter or {}
+    inputFolderlist = list(inputFolderlist)
+    if not inputFolderlist:
+        return
+    found_items = queue.Queue(maxsize=queueSize)
+    stop_listing = threading.Event()
+    folder_done = object()
+
+    def put_item(item):
+        # wait for space in the queue unless the consumer has stopped reading
+        while not stop_listing.is_set():
+            try:
+                found_items.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def list_folder(folder):
+        try:
+            for item in s3ListObjects(s3Client=s3Client, s3Bucket=s3Bucket, s3Prefix=folder,
+                                      s3StartAfter=s3StartAfter.get(folder)):
+                if item['Key'].endswith("/"):
+                    continue
+                if not put_item(item):
+                    return
+        except Exception as err_message:
+            put_item(err_message)
+        finally:
+            put_item(folder_done)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(inputFolderlist))))
+    try:
+        for folder in inputFolderlist:
+            executor.submit(list_folder, folder)
+        folders_remaining = len(inputFolderlist)
+        while folders_remaining:
+            item = found_items.get()
+            if item is folder_done:
+                folders_remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop_listing.set()
+        executor.shutdown(wait=True)
+
+
 def s3GetObject(s3Client, s3Bucket, s3Key):
     """
     Description
@@ -176,6 +335,255 @@ def s3GetObject(s3Client, s3Bucket, s3Key):
     return object
 
 
+def s3ObjectCompression(s3Key):
+    """
+    Description
+    -----------
+    A function that gets the compression of an object from its extension
+
+    Args
+    ----
+    s3Key: string
+        S3 object path
+
+    Returns
+    -------
+    s3DataKey: string
+        S3 object path without the compression extension
+    compression: string
+        "gzip", "bz2" or "zstd", None for uncompressed objects
+    """
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if s3Key.endswith(extension):
+            return s3Key[:-len(extension)], compression
+    return s3Key, None
+
+
+def s3DecompressBody(s3ObjectBody, compression, startByte=0, skipSize=1024 ** 2):
+    """
+    Description
+    -----------
+    A function that wraps an object body so it is decompressed as it is read
+        - only the compressed bytes being read and the decompressor state are held in memory
+        - concatenated gzip members, bz2 streams and zstd frames are read through
+        - a stream resumed at startByte is decompressed from the start and the bytes before it are dropped,
+          the StreamingBody can not seek so neither can the decompressors over it
+
+    Args
+    ----
+    s3ObjectBody: object
+        StreamingBody of the S3 object
+    compression: string
+        "gzip", "bz2" or "zstd", None returns the body as it is
+    startByte: int
+        offset in the decompressed bytes to start reading from, only for compressed objects
+    skipSize: int
+        decompressed bytes dropped per read until startByte
+
+    Returns
+    -------
+    stream: object
+        file like object whose read(size) returns decompressed bytes
+    """
+    if compression is None:
+        return s3ObjectBody
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=s3ObjectBody, mode='rb')
+    elif compression == 'bz2':
+        stream = bz2.BZ2File(s3ObjectBody, mode='rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("the zstandard package is needed to read .zst files")
+        stream = zstandard.ZstdDecompressor().stream_reader(s3ObjectBody, read_across_frames=True)
+    else:
+        raise ValueError(f"unsupported compression {compression}")
+    skipped = 0
+    while skipped < startByte:
+        skippedBytes = stream.read(min(skipSize, startByte - skipped))
+        if not skippedBytes:
+            raise ValueError(f"the decompressed object ends before byte {startByte}")
+        skipped += len(skippedBytes)
+    return stream
+
+
+def s3GetObjectRange(s3Client, s3Bucket, s3Key, startByte, endByte=None):
+    """
+    Description
+    -----------
+    a function that reads a byte range of an object with a ranged GET
+
+    Args
+    ----
+    s3Client: object
+        A S3 client instance
+    s3Bucket: string
+        A S3 bucket
+    s3Key: string
+        S3 object path
+    startByte: int
+        first byte to read
+    endByte: int
+        last byte to read, inclusive
+        - reads to the end of the object when None
+
+    Returns
+    -------
+    objectBytes: bytes
+        the bytes in the range
+    """
+    start = time.perf_counter()
+    byteRange = f"bytes={startByte}-" if endByte is None else f"bytes={startByte}-{endByte}"
+    object = s3Client.get_object(Bucket=s3Bucket, Key=s3Key, Range=byteRange)
+    objectBytes = object['Body'].read()
+    Metrics.recordStage(stage='s3_get_range', seconds=time.perf_counter() - start, nbytes=len(objectBytes))
+    return objectBytes
+
+
+class S3RangedFile(io.RawIOBase):
+    """
+    Description
+    -----------
+    A read only, seekable file over an S3 object where every read is a ranged GET
+        - for formats read by offset like Parquet, only the footer and the column chunks read are downloaded
+    """
+
+    def __init__(self, s3Client, s3Bucket, s3Key, fileSize):
+        """
+        Args
+        ----
+        s3Client: object
+            A S3 client instance
+        s3Bucket: string
+            A S3 bucket
+        s3Key: string
+            S3 object path
+        fileSize: int
+            size of the object in bytes
+        """
+        self.s3Client = s3Client
+        self.s3Bucket = s3Bucket
+        self.s3Key = s3Key
+        self.fileSize = fileSize
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.fileSize
+        self.position = max(offset, 0)
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.fileSize - self.position
+        size = min(size, self.fileSize - self.position)
+        if size <= 0:
+            return b''
+        objectBytes = s3GetObjectRange(s3Client=self.s3Client, s3Bucket=self.s3Bucket, s3Key=self.s3Key,
+                                       startByte=self.position, endByte=self.position + size - 1)
+        self.position += len(objectBytes)
+        return objectBytes
+
+    def readinto(self, buffer):
+        objectBytes = self.read(len(buffer))
+        buffer[:len(objectBytes)] = objectBytes
+        return len(objectBytes)
+
+
+def s3GetObjectLineChunks(s3Client, s3Bucket, s3Key, fileSize, chunkSize, rangeSize=16 * 1024 ** 2, maxWorkers=8,
+                          startByte=0):
+    """
+    Description
+    -----------
+    A generator that downloads an object with concurrent ranged GETs and yields it in chunks of complete lines
+        - up to maxWorkers ranges are downloaded at the same time, ahead of the consumer
+        - ranges are joined in order and cut at the last line break, the partial line is carried to the next chunk
+        - yields the same lines in the same order as reading the StreamingBody sequentially
+
+    Args
+    ----
+    s3Client: object
+        A S3 client instance
+    s3Bucket: string
+        A S3 bucket
+    s3Key: string
+        S3 object path
+    fileSize: int
+        size of the object in bytes
+    chunkSize: int or callable
+        approximate number of bytes per chunk yielded, a callable is asked before every chunk
+    rangeSize: int
+        number of bytes per ranged GET
+    maxWorkers: int
+        number of ranged GETs in flight
+    startByte: int
+        offset to start reading from, must be the start of a line
+
+    Yields
+    ------
+    chunk: bytes
+        complete lines of the object
+    """
+    newline = '\n'.encode()
+    byteRanges = deque((rangeStart, min(rangeStart + rangeSize, fileSize) - 1) for rangeStart in
+                       range(startByte, fileSize, rangeSize))
+    executor = ThreadPoolExecutor(max_workers=maxWorkers)
+    pendingRanges = deque()
+    try:
+        chunkParts = []
+        chunkPartsSize = 0
+        # parts before this one are known to have no line break
+        searchedParts = 0
+        while byteRanges or pendingRanges:
+            while byteRanges and len(pendingRanges) < maxWorkers:
+                rangeStart, rangeEnd = byteRanges.popleft()
+                pendingRanges.append(executor.submit(s3GetObjectRange, s3Client, s3Bucket, s3Key, rangeStart,
+                                                     rangeEnd))
+            chunkParts.append(pendingRanges.popleft().result())
+            chunkPartsSize += len(chunkParts[-1])
+            endOfObject = not (byteRanges or pendingRanges)
+            if chunkPartsSize < (chunkSize() if callable(chunkSize) else chunkSize) and not endOfObject:
+                continue
+            if endOfObject:
+                # end of the object, the last line has no trailing newline
+                lastPart, lastNewline = len(chunkParts) - 1, len(chunkParts[-1]) - 1
+            else:
+                lastPart, lastNewline = -1, -1
+                for part in range(len(chunkParts) - 1, searchedParts - 1, -1):
+                    lastNewline = chunkParts[part].rfind(newline)
+                    if lastNewline != -1:
+                        lastPart = part
+                        break
+                if lastPart == -1:
+                    # line longer than the chunk, keep reading
+                    searchedParts = len(chunkParts)
+                    continue
+            # the parts are copied once into the chunk, the partial line after it is carried over
+            partView = memoryview(chunkParts[lastPart])
+            chunk = b''.join(chunkParts[:lastPart] + [partView[:lastNewline + 1]])
+            remainder = b''.join([partView[lastNewline + 1:]] + chunkParts[lastPart + 1:])
+            partView.release()
+            chunkParts = [remainder] if remainder else []
+            chunkPartsSize = len(remainder)
+            searchedParts = 0
+            yield chunk
+            chunk = None
+    finally:
+        for pendingRange in pendingRanges:
+            pendingRange.cancel()
+        executor.shutdown(wait=True)
+
+
 def s3Copy(s3Resource, s3DestinationBucket, s3DestinationKey, s3SourceBucket, s3SourceKey):
     """
     Description
@@ -253,3 +661,130 @@ def s3Move(s3Resource, s3DestinationBucket, s3DestinationKey, s3SourceBucket, s3
     s3Copy(s3Resource, s3DestinationBucket, s3DestinationKey, s3SourceBucket, s3SourceKey)
     s3Delete(s3Resource, s3SourceBucket, s3SourceKey)
     print('S3 Object moved')
+
+
+def s3CopyObject(s3Client, s3Bucket, s3SourceKey, s3DestinationKey, transferConfig=None):
+    """
+    Description
+    -----------
+    A function that copies an object inside a bucket with the managed transfer, objects over the multipart
+    threshold are copied in parts, so objects larger than 5 GB can be copied
+
+    Args
+    ----
+    s3Client: object
+        A S3 client
+    s3Bucket: string
+        A S3 bucket
+    s3SourceKey: string
+        S3 Source Key for object
+    s3DestinationKey: string
+        S3 Destination Key for object
+    transferConfig: object
+        boto3 TransferConfig for the multipart threshold, part size and concurrency of a single copy
+
+    Returns
+    -------
+    exists: bool
+        True when the copied object was found at the destination
+    """
+    s3Client.copy(CopySource={'Bucket': s3Bucket, 'Key': s3SourceKey}, Bucket=s3Bucket, Key=s3DestinationKey,
+                  Config=transferConfig)
+    # S3 is read after write consistent, the copy can be checked right away
+    s3Client.head_object(Bucket=s3Bucket, Key=s3DestinationKey)
+    return True
+
+
+def s3DeleteObjects(s3Client, s3Bucket, s3Keys):
+    """
+    Description
+    -----------
+    A function that deletes objects in batches of up to 1000 keys per request
+
+    Args
+    ----
+    s3Client: object
+        A S3 client
+    s3Bucket: string
+        A S3 bucket
+    s3Keys: list
+        S3 Keys of the objects to delete
+
+    Returns
+    -------
+    errors: dictionary
+        error message per key that could not be deleted
+    """
+    errors = {}
+    for batchStart in range(0, len(s3Keys), DELETE_BATCH_SIZE):
+        batch = s3Keys[batchStart:batchStart + DELETE_BATCH_SIZE]
+        try:
+            response = s3Client.delete_objects(Bucket=s3Bucket,
+                                               Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        except Exception as err:
+            for key in batch:
+                errors[key] = str(err)
+            continue
+        for error in response.get('Errors', []):
+            errors[error['Key']] = f"{error.get('Code')}: {error.get('Message')}"
+    return errors
+
+
+def s3MoveObjects(s3Client, s3Bucket, s3Moves, maxWorkers=8, multipartThresholdMb=256):
+    """
+    Description
+    -----------
+    A function that moves objects inside a bucket, the objects are copied concurrently and the sources of the
+    copies found at their destination are deleted in batches
+
+    Args
+    ----
+    s3Client: object
+        A S3 client
+    s3Bucket: string
+        A S3 bucket
+    s3Moves: list
+        (source key, destination key) pairs
+    maxWorkers: int
+        number of objects copied at the same time
+    multipartThresholdMb: int
+        objects of this size or larger are copied in parts of this size
+
+    Returns
+    -------
+    results: dictionary
+        per source key, {'destination': destination key, 'moved': bool, 'error': error message or None}
+    """
+    results = {sourceKey: {'destination': destinationKey, 'moved': False, 'error': None}
+               for sourceKey, destinationKey in s3Moves}
+    if not results:
+        return results
+    start = time.perf_counter()
+    partSize = multipartThresholdMb * (1024 ** 2)
+    transferConfig = TransferConfig(multipart_threshold=partSize, multipart_chunksize=partSize, max_concurrency=4)
+
+    def copyObject(sourceKey):
+        try:
+            s3CopyObject(s3Client=s3Client, s3Bucket=s3Bucket, s3SourceKey=sourceKey,
+                         s3DestinationKey=results[sourceKey]['destination'], transferConfig=transferConfig)
+            return sourceKey, None
+        except Exception as err:
+            return sourceKey, str(err)
+
+    copied = []
+    with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(results)))) as executor:
+        for sourceKey, error in executor.map(copyObject, list(results)):
+            if error is None:
+                copied.append(sourceKey)
+            else:
+                results[sourceKey]['error'] = f"copy failed: {error}"
+
+    # only sources with a verified copy are deleted
+    deleteErrors = s3DeleteObjects(s3Client=s3Client, s3Bucket=s3Bucket, s3Keys=copied)
+    for sourceKey in copied:
+        if sourceKey in deleteErrors:
+            results[sourceKey]['error'] = f"copied but source not deleted: {deleteErrors[sourceKey]}"
+        else:
+            results[sourceKey]['moved'] = True
+    Metrics.recordStage(stage='s3_move', seconds=time.perf_counter() - start)
+    return results
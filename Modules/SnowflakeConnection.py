@@ -2,12 +2,17 @@
 # description     :Module to perform functions regarding Snowflake
 # author          :Darwin Uy
 # date            :2022-6-2
-# version         :0.1
+# version         :0.12
 # usage           : Module for Snowflake related functions
 # notes           :
 # python_version  :3.9
 # ==============================================================================
 # Connectors
+import os
+import re
+import threading
+import time
+
 import snowflake.connector
 from snowflake.connector.pandas_tools import write_pandas
 
@@ -15,6 +20,40 @@ from snowflake.connector.pandas_tools import write_pandas
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 
+import Metrics
+
+# VALIDATE and VALIDATION_MODE = RETURN_ERRORS result columns
+COPY_ERROR_COLUMN = 0
+COPY_ERROR_LINE_COLUMN = 2
+COPY_ERROR_REJECTED_RECORD_COLUMN = 11
+
+# COPY INTO load result columns
+COPY_FILE_COLUMN = 0
+COPY_STATUS_COLUMN = 1
+COPY_ROWS_PARSED_COLUMN = 2
+COPY_ROWS_LOADED_COLUMN = 3
+
+# type widening, Snowflake can only widen VARCHAR length and NUMBER precision in place
+# commas that separate columns, not the ones inside NUMBER(38,2)
+SCHEMA_DEFINITION_SEPARATOR = r',\s*(?![^()]*\))'
+VARCHAR_TYPE_PATTERN = r'VARCHAR\((\d+)\)'
+NUMBER_TYPE_PATTERN = r'NUMBER\((\d+),\s*(\d+)\)'
+
+# malformed rows kept per database, one row per rejected line
+QUARANTINE_COLUMNS = ['FILE_NAME', 'SF_TABLE', 'LINE_NUMBER', 'EXPECTED_COLUMNS', 'ACTUAL_COLUMNS', 'RAW_LINE', 'ERROR']
+QUARANTINE_TABLE_DEFINITION = "FILE_NAME VARCHAR, SF_TABLE VARCHAR, LINE_NUMBER NUMBER(38,0), " \
+                              "EXPECTED_COLUMNS NUMBER(38,0), ACTUAL_COLUMNS NUMBER(38,0), RAW_LINE VARCHAR, " \
+                              "ERROR VARCHAR, QUARANTINED_AT TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP()"
+
+# Connection pool
+# (account, user, warehouse, role) -> list of (idle connection, time released)
+_connectionPool = {}
+# connection -> (database, schema) the session is using
+_connectionContext = {}
+# connection -> pool it is given back to
+_connectionPoolKey = {}
+_connectionPoolLock = threading.Lock()
+
 
 # Get Private Key
 def getPrivateKey(keyFile, snowflakePassword):
@@ -48,7 +87,7 @@ def getPrivateKey(keyFile, snowflakePassword):
     return dKey
 
 
-def createSnowflakeConnection(sfAccount, sfUser, sfPrivateKey, sfWarehouse, sfDatabase, sfSchema):
+def createSnowflakeConnection(sfAccount, sfUser, sfPrivateKey, sfWarehouse, sfDatabase, sfSchema, sfRole=None):
     """
     Description
     -----------
@@ -69,22 +108,192 @@ def createSnowflakeConnection(sfAccount, sfUser, sfPrivateKey, sfWarehouse, sfDa
         Snowflake Database to be used
     sfSchema: string
         Snowflake Schema to be used
+    sfRole: string
+        Snowflake Role the session starts with, the user's default role when None
 
     Returns
     -------
     connection: object
         A Snowflake connection instance
     """
+    start = time.perf_counter()
     connection = snowflake.connector.connect(user=sfUser,
                                              account=sfAccount,
                                              private_key=sfPrivateKey,
                                              warehouse=sfWarehouse,
                                              database=sfDatabase,
-                                             schema=sfSchema)
+                                             schema=sfSchema,
+                                             role=sfRole)
+    Metrics.recordStage(stage='sf_connect', seconds=time.perf_counter() - start)
+    return connection
+
+
+def useSnowflakeContext(sfConn, sfDatabase, sfSchema):
+    """
+    Description
+    -----------
+    Switches the database and schema of a session, statements are only run when the session uses something else
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfDatabase: string
+        Snowflake Database to be used
+    sfSchema: string
+        Snowflake Schema to be used
+
+    Returns
+    -------
+    None
+    """
+    currentDatabase, currentSchema = _connectionContext.get(sfConn, (None, None))
+    if currentDatabase == sfDatabase and currentSchema == sfSchema:
+        return
+    cur = sfConn.cursor()
+    if currentDatabase != sfDatabase:
+        cur.execute(f"USE DATABASE {sfDatabase}")
+    cur.execute(f"USE SCHEMA {sfSchema}")
+    _connectionContext[sfConn] = (sfDatabase, sfSchema)
+
+
+def getPooledSnowflakeConnection(sfAccount, sfUser, sfPrivateKey, sfWarehouse, sfRole, sfDatabase, sfSchema,
+                                 healthCheckSeconds=60):
+    """
+    Description
+    -----------
+    Hands out an authenticated Snowflake session from the connection pool
+        - sessions are pooled by account, user, warehouse and role
+        - a new session is created with its role, database and schema only when no idle session is left
+        - sessions idle longer than healthCheckSeconds are checked with SELECT 1 before reuse
+        - the database and schema of a reused session are switched only when needed
+
+    Args
+    ----
+    sfAccount: string
+        Snowflake account
+    sfUser: string
+        Snowflake User Name
+    sfPrivateKey: object
+        This is the decrypted private key
+    sfWarehouse: string
+        Snowflake Warehouse to be used
+    sfRole: string
+        Snowflake Role
+    sfDatabase: string
+        Snowflake Database to be used
+    sfSchema: string
+        Snowflake Schema to be used
+    healthCheckSeconds: int
+        seconds a session can sit idle before it is checked
+
+    Returns
+    -------
+    connection: object
+        A Snowflake connection instance
+        - give it back with releaseSnowflakeConnection(sfConn, ...)
+    """
+    poolKey = (sfAccount, sfUser, sfWarehouse, sfRole)
+    connection = None
+    while connection is None:
+        with _connectionPoolLock:
+            idleConnections = _connectionPool.get(poolKey, [])
+            if not idleConnections:
+                break
+            connection, releasedAt = idleConnections.pop()
+        if connection.is_closed():
+            closeSnowflakeConnection(sfConn=connection)
+            connection = None
+        elif time.time() - releasedAt > healthCheckSeconds:
+            try:
+                connection.cursor().execute("SELECT 1")
+            except Exception:
+                closeSnowflakeConnection(sfConn=connection)
+                connection = None
+
+    if connection is None:
+        # the role is set at login so no statement of the session runs under the user's default role
+        connection = createSnowflakeConnection(sfAccount=sfAccount, sfUser=sfUser, sfPrivateKey=sfPrivateKey,
+                                               sfWarehouse=sfWarehouse, sfDatabase=sfDatabase, sfSchema=sfSchema,
+                                               sfRole=sfRole)
+        _connectionContext[connection] = (sfDatabase, sfSchema)
+    else:
+        useSnowflakeContext(sfConn=connection, sfDatabase=sfDatabase, sfSchema=sfSchema)
+    _connectionPoolKey[connection] = poolKey
     return connection
 
 
-def createSnowflakeTable(sfConn, sfRole, sfDatabase, sfSchema, sfTable, tableSchemaDef, insert=True):
+def releaseSnowflakeConnection(sfConn, healthy=True):
+    """
+    Description
+    -----------
+    Gives a session from getPooledSnowflakeConnection back to the pool
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    healthy: bool
+        False closes the session instead, e.g. after a failed load
+
+    Returns
+    -------
+    None
+    """
+    if not healthy or sfConn.is_closed():
+        closeSnowflakeConnection(sfConn=sfConn)
+        return
+    with _connectionPoolLock:
+        _connectionPool.setdefault(_connectionPoolKey[sfConn], []).append((sfConn, time.time()))
+
+
+def closeSnowflakeConnection(sfConn):
+    """
+    Description
+    -----------
+    Closes a session and forgets its database and schema
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+
+    Returns
+    -------
+    None
+    """
+    _connectionContext.pop(sfConn, None)
+    _connectionPoolKey.pop(sfConn, None)
+    try:
+        sfConn.close()
+    except Exception as err_message:
+        print(f"Snowflake connection close failed: {err_message}")
+
+
+def closeSnowflakeConnectionPool():
+    """
+    Description
+    -----------
+    Closes every idle session in the connection pool, run at the end of a run
+
+    Args
+    ----
+    None
+
+    Returns
+    -------
+    None
+    """
+    with _connectionPoolLock:
+        idleConnections = [connection for pooled in _connectionPool.values() for connection, _ in pooled]
+        _connectionPool.clear()
+    for connection in idleConnections:
+        closeSnowflakeConnection(sfConn=connection)
+    print(f"{len(idleConnections)} Snowflake connections closed")
+
+
+def createSnowflakeTable(sfConn, sfRole, sfDatabase, sfSchema, sfTable, tableSchemaDef, insert=True,
+                         setContext=True):
     """
     Description
     -----------
@@ -106,6 +315,9 @@ def createSnowflakeTable(sfConn, sfRole, sfDatabase, sfSchema, sfTable, tableSch
         Schema definition for a Snowflake table
     insert: Bool
         Whether to insert or not
+    setContext: Bool
+        Whether to run USE ROLE, DATABASE and SCHEMA first
+        - pooled sessions from getPooledSnowflakeConnection already have them set
 
     Returns
     -------
@@ -113,17 +325,18 @@ def createSnowflakeTable(sfConn, sfRole, sfDatabase, sfSchema, sfTable, tableSch
     """
     cur = sfConn.cursor()
 
-    # Select Role
-    sql = f"USE ROLE {sfRole}"  # Specify role
-    cur.execute(sql)
+    if setContext == True:
+        # Select Role
+        sql = f"USE ROLE {sfRole}"  # Specify role
+        cur.execute(sql)
 
-    # Select Database
-    sql = f"USE DATABASE {sfDatabase}"  # from the folder name
-    cur.execute(sql)
+        # Select Database
+        sql = f"USE DATABASE {sfDatabase}"  # from the folder name
+        cur.execute(sql)
 
-    # Select Schema
-    sql = f"USE SCHEMA {sfSchema}"
-    cur.execute(sql)
+        # Select Schema
+        sql = f"USE SCHEMA {sfSchema}"
+        cur.execute(sql)
 
     # Create Table
     if insert == False:
@@ -135,6 +348,165 @@ def createSnowflakeTable(sfConn, sfRole, sfDatabase, sfSchema, sfTable, tableSch
     return sql
 
 
+def createQuarantineTable(sfConn, sfDatabase, sfSchema, sfTable='FILE2TABLE_QUARANTINE'):
+    """
+    Description
+    -----------
+    Creates the table malformed rows of every file loaded to a database are written to, if it does not exist
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfDatabase: string
+        Snowflake Database to be used
+    sfSchema: string
+        Snowflake Schema to be used
+    sfTable: string
+        quarantine table name
+
+    Returns
+    -------
+    sfTable: string
+        quarantine table name
+    """
+    cur = sfConn.cursor()
+    sql = f"CREATE TABLE IF NOT EXISTS {sfDatabase}.{sfSchema}.{sfTable} ({QUARANTINE_TABLE_DEFINITION})"
+    cur.execute(sql)
+    return sfTable
+
+
+def getSnowflakeTableColumns(sfConn, sfDatabase, sfSchema, sfTable):
+    """
+    Description
+    -----------
+    Reads the columns of an existing table from the information schema
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfDatabase: string
+        Snowflake Database of the table
+    sfSchema: string
+        Snowflake Schema of the table
+    sfTable: string
+        Snowflake Table
+
+    Returns
+    -------
+    tableColumns: dict
+        upper case column name -> column type written the way table definitions write it
+        - e.g. VARCHAR(100), NUMBER(38,2), FLOAT8
+    """
+    cur = sfConn.cursor()
+    sql = f"SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, NUMERIC_PRECISION, NUMERIC_SCALE " \
+          f"FROM {sfDatabase}.INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s " \
+          f"ORDER BY ORDINAL_POSITION"
+    cur.execute(sql, (sfSchema.upper(), sfTable.upper()))
+    tableColumns = {}
+    for columnName, dataType, characterLength, numericPrecision, numericScale in cur.fetchall():
+        if dataType == 'TEXT':
+            columnType = f"VARCHAR({characterLength})"
+        elif dataType == 'NUMBER':
+            columnType = f"NUMBER({numericPrecision},{numericScale})"
+        elif dataType == 'FLOAT':
+            columnType = 'FLOAT8'
+        else:
+            columnType = dataType
+        tableColumns[columnName.upper()] = columnType
+    return tableColumns
+
+
+def getWidenedType(tableType, incomingType):
+    """
+    Description
+    -----------
+    Works out the column type that holds both the existing and the incoming type, when it can be changed in place
+
+    Args
+    ----
+    tableType: string
+        type of the column in the table
+    incomingType: string
+        type inferred from the incoming file
+
+    Returns
+    -------
+    widenedType: string
+        type to alter the column to, None when the table type already holds the incoming type
+        or the column can not be widened in place
+    """
+    tableVarchar = re.fullmatch(VARCHAR_TYPE_PATTERN, tableType)
+    incomingVarchar = re.fullmatch(VARCHAR_TYPE_PATTERN, incomingType)
+    if tableVarchar and incomingVarchar:
+        if int(incomingVarchar.group(1)) > int(tableVarchar.group(1)):
+            return incomingType
+        return None
+    tableNumber = re.fullmatch(NUMBER_TYPE_PATTERN, tableType)
+    incomingNumber = re.fullmatch(NUMBER_TYPE_PATTERN, incomingType)
+    if tableNumber and incomingNumber and tableNumber.group(2) == incomingNumber.group(2):
+        if int(incomingNumber.group(1)) > int(tableNumber.group(1)):
+            return f"NUMBER({incomingNumber.group(1)},{incomingNumber.group(2)})"
+    return None
+
+
+def reconcileSnowflakeTable(sfConn, sfDatabase, sfSchema, sfTable, tableSchemaDef):
+    """
+    Description
+    -----------
+    Evolves an existing table so an incoming file can be appended without recreating the table
+        - columns of the file that the table does not have are added
+        - VARCHAR length and NUMBER precision are widened when the file needs more
+        - any other type difference keeps the table type, the file is loaded into the table type
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfDatabase: string
+        Snowflake Database of the table
+    sfSchema: string
+        Snowflake Schema of the table
+    sfTable: string
+        Snowflake Table
+    tableSchemaDef: string
+        Schema definition of the incoming file
+        - output from PandasProcessing.getSchemaPandas2Snowflake or PandasProcessing.inferSnowflakeSchema
+
+    Returns
+    -------
+    alterSql: list
+        ALTER TABLE statements that were run
+    columnTypes: list
+        type of each incoming column in the table after reconciliation
+    """
+    cur = sfConn.cursor()
+    tableColumns = getSnowflakeTableColumns(sfConn=sfConn, sfDatabase=sfDatabase, sfSchema=sfSchema,
+                                            sfTable=sfTable)
+    alterSql = []
+    columnTypes = []
+    schemaColumns = [columnDefinition.strip().split(None, 1) for columnDefinition in
+                     re.split(SCHEMA_DEFINITION_SEPARATOR, tableSchemaDef) if columnDefinition.strip()]
+    for columnName, incomingType in schemaColumns:
+        tableType = tableColumns.get(columnName.upper())
+        if tableType is None:
+            alterSql.append(f"ALTER TABLE {sfDatabase}.{sfSchema}.{sfTable} ADD COLUMN {columnName} {incomingType}")
+            columnTypes.append(incomingType)
+            continue
+        widenedType = getWidenedType(tableType=tableType, incomingType=incomingType)
+        if widenedType:
+            alterSql.append(f"ALTER TABLE {sfDatabase}.{sfSchema}.{sfTable} ALTER COLUMN {columnName} "
+                            f"SET DATA TYPE {widenedType}")
+            columnTypes.append(widenedType)
+        else:
+            columnTypes.append(tableType)
+    for sql in alterSql:
+        cur.execute(sql)
+        print(sql)
+    return alterSql, columnTypes
+
+
 def writePandas2Snowflake(sfConn, pdDF, sfTable):
     """
     Description
@@ -161,6 +533,384 @@ def writePandas2Snowflake(sfConn, pdDF, sfTable):
     """
     # Writes pandas DF to Snowflake
     print("PD to Snowflake")
+    start = time.perf_counter()
     success, nchunks, nrows, _ = write_pandas(sfConn, pdDF, sfTable, quote_identifiers=False)
+    Metrics.recordStage(stage='sf_write_pandas', seconds=time.perf_counter() - start, rows=nrows)
+    print(f"Success is {success} with {nrows} rows loaded")
+    return (success, nchunks, nrows)
+
+
+def getFileFormatSql(delimiter, skipHeader=1):
+    """
+    Description
+    -----------
+    Writes the inline file format used to COPY a delimited file
+
+    Args
+    ----
+    delimiter: string
+        character used to separate the fields
+    skipHeader: int
+        number of header lines to skip
+
+    Returns
+    -------
+    fileFormat: string
+        FILE_FORMAT option for COPY INTO
+    """
+    delimiter = delimiter.replace("'", "\\'")
+    fileFormat = f"FILE_FORMAT = (TYPE = CSV FIELD_DELIMITER = '{delimiter}' SKIP_HEADER = {skipHeader} " \
+                 f"ENCODING = 'UTF8' ERROR_ON_COLUMN_COUNT_MISMATCH = TRUE)"
+    return fileFormat
+
+
+def getCopyIntoSql(sfTable, sfStage, fileKey, delimiter, onError='CONTINUE', validationMode=None, columnNames=None):
+    """
+    Description
+    -----------
+    Writes a COPY INTO statement that loads a single file from a stage
+
+    Args
+    ----
+    sfTable: string
+        Snowflake Table to be loaded
+    sfStage: string
+        fully qualified stage name
+    fileKey: string
+        path of the file relative to the stage
+    delimiter: string
+        character used to separate the fields
+    onError: string
+        ON_ERROR option, ignored when validating
+    validationMode: string
+        VALIDATION_MODE option, e.g. RETURN_ERRORS
+        - when set the file is only validated and nothing is loaded
+    columnNames: list
+        table columns the fields of the file are loaded into, in file order
+        - loads by position when None
+
+    Returns
+    -------
+    sql: string
+        COPY INTO statement
+    """
+    fileKey = fileKey.replace("'", "\\'")
+    targetColumns = f" ({', '.join(columnNames)})" if columnNames else ""
+    sql = f"COPY INTO {sfTable}{targetColumns} FROM @{sfStage} FILES = ('{fileKey}') {getFileFormatSql(delimiter)}"
+    if validationMode:
+        sql = f"{sql} VALIDATION_MODE = {validationMode}"
+    else:
+        sql = f"{sql} ON_ERROR = {onError} FORCE = TRUE"
+    return sql
+
+
+def createSnowflakeStage(sfConn, sfDatabase, sfSchema, sfStage, s3Bucket, s3Key=None, s3Secret=None,
+                         sfStorageIntegration=None, inlineCredentials=False):
+    """
+    Description
+    -----------
+    Creates an external stage over the S3 bucket, an existing stage is reused
+        - a storage integration is required, keys written into the CREATE STAGE end up in the query history
+          and in any SQL that is logged, so they are only used when inlineCredentials is set
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfDatabase: string
+        Snowflake Database the stage belongs to
+    sfSchema: string
+        Snowflake Schema the stage belongs to
+    sfStage: string
+        stage name
+    s3Bucket: string
+        S3 bucket the stage points to
+    s3Key: string
+        AWS S3 access key, used when no storage integration is given
+    s3Secret: string
+        AWS S3 secret access key, used when no storage integration is given
+    sfStorageIntegration: string
+        Snowflake storage integration to use instead of keys
+    inlineCredentials: bool
+        whether to write s3Key and s3Secret into the statement when there is no storage integration
+
+    Returns
+    -------
+    stage: string
+        fully qualified stage name
+
+    Raises
+    ------
+    ValueError
+        when there is no storage integration and inline credentials are not allowed
+    """
+    stage = f"{sfDatabase}.{sfSchema}.{sfStage}"
+    if sfStorageIntegration:
+        credentials = f"STORAGE_INTEGRATION = {sfStorageIntegration}"
+    elif not inlineCredentials:
+        raise ValueError(f"{stage} needs a storage integration (Snowflake sf.storage_integration), "
+                         f"inline AWS keys are only used with Snowflake sf.stage_inline_credentials")
+    else:
+        print(f"WARNING: {stage} is created with inline AWS keys, they are kept in the Snowflake query history")
+        credentials = f"CREDENTIALS = (AWS_KEY_ID = '{s3Key}' AWS_SECRET_KEY = '{s3Secret}')"
+    sql = f"CREATE STAGE IF NOT EXISTS {stage} URL = 's3://{s3Bucket}/' {credentials}"
+    cur = sfConn.cursor()
+    cur.execute(sql)
+    print(f'{stage} stage ready')
+    return stage
+
+
+def getCopyErrors(sfConn, sfTable, queryId):
+    """
+    Description
+    -----------
+    Reads the rows a COPY INTO rejected back from its job with VALIDATE, the file is not scanned again
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfTable: string
+        Snowflake Table the file was loaded into
+    queryId: string
+        query id of the COPY INTO
+
+    Returns
+    -------
+    copyErrors: list
+        (line number, error message, rejected line) for every row that was rejected
+        - ordered by line number
+    """
+    cur = sfConn.cursor()
+    sql = f"SELECT * FROM TABLE(VALIDATE({sfTable}, JOB_ID => '{queryId}'))"
+    start = time.perf_counter()
+    cur.execute(sql)
+    copyErrors = [(row[COPY_ERROR_LINE_COLUMN], row[COPY_ERROR_COLUMN], row[COPY_ERROR_REJECTED_RECORD_COLUMN])
+                  for row in cur.fetchall()]
+    Metrics.recordStage(stage='sf_validate', seconds=time.perf_counter() - start, rows=len(copyErrors))
+    copyErrors.sort(key=lambda copyError: copyError[0])
+    return copyErrors
+
+
+def copyIntoSnowflake(sfConn, sfTable, sfStage, fileKey, delimiter, onError='CONTINUE', columnNames=None,
+                      copyErrors=None):
+    """
+    Description
+    -----------
+    Loads a staged file into a Snowflake table with COPY INTO
+        - the file is scanned once, the rows it rejects are read back from the job with getCopyErrors
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfTable: string
+        Snowflake Table to be loaded
+    sfStage: string
+        fully qualified stage name
+    fileKey: string
+        path of the file relative to the stage
+    delimiter: string
+        character used to separate the fields
+    onError: string
+        ON_ERROR option, CONTINUE skips rejected rows
+    columnNames: list
+        table columns the fields of the file are loaded into, in file order
+    copyErrors: list
+        filled with the (line number, error message, rejected line) of every rejected row, when given
+
+    Returns
+    -------
+    success: bool
+        Indicates whether the load was successful or not
+    nchunks: int
+        number of files loaded
+    nrows: int
+        number of rows loaded
+    """
+    cur = sfConn.cursor()
+    sql = getCopyIntoSql(sfTable=sfTable, sfStage=sfStage, fileKey=fileKey, delimiter=delimiter, onError=onError,
+                         columnNames=columnNames)
+    print("S3 to Snowflake")
+    start = time.perf_counter()
+    cur.execute(sql)
+    queryId = cur.sfqid
+    results = [row for row in cur.fetchall() if len(row) > COPY_ROWS_LOADED_COLUMN]
+    success = len(results) > 0 and all(row[COPY_STATUS_COLUMN] in ('LOADED', 'PARTIALLY_LOADED') for row in results)
+    nchunks = len(results)
+    nrows = sum(int(row[COPY_ROWS_LOADED_COLUMN]) for row in results)
+    Metrics.recordStage(stage='sf_copy_into', seconds=time.perf_counter() - start, rows=nrows)
+    if copyErrors is not None and any(int(row[COPY_ROWS_PARSED_COLUMN]) > int(row[COPY_ROWS_LOADED_COLUMN])
+                                      for row in results):
+        copyErrors.extend(getCopyErrors(sfConn=sfConn, sfTable=sfTable, queryId=queryId))
+    print(f"Success is {success} with {nrows} rows loaded")
+    return (success, nchunks, nrows)
+
+
+def createSnowflakeLoadStage(sfConn, sfStage):
+    """
+    Description
+    -----------
+    Creates a temporary internal stage that chunks of a file are PUT to before a single COPY INTO
+        - the stage is dropped by Snowflake when the session ends
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfStage: string
+        stage name
+
+    Returns
+    -------
+    sfStage: string
+        stage name
+    """
+    cur = sfConn.cursor()
+    sql = f"CREATE TEMPORARY STAGE IF NOT EXISTS {sfStage}"
+    cur.execute(sql)
+    return sfStage
+
+
+def putPandas2Stage(sfConn, pdDF, sfStage, stagePath, fileName, tempFolder):
+    """
+    Description
+    -----------
+    Writes a pandas dataframe to a parquet file and PUTs it to a stage without loading it
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    pdDF: object
+        pandas dataframe to be staged
+    sfStage: string
+        stage name
+        - output from createSnowflakeLoadStage(sfConn, sfStage)
+    stagePath: string
+        folder in the stage that holds the chunks of one file
+    fileName: string
+        name of the parquet file
+    tempFolder: string
+        local folder the parquet file is written to before the PUT
+
+    Returns
+    -------
+    nrows: int
+        number of rows staged
+    """
+    cur = sfConn.cursor()
+    start = time.perf_counter()
+    localFile = os.path.join(tempFolder, fileName)
+    pdDF.to_parquet(localFile, compression='snappy', index=False)
+    try:
+        sql = f"PUT 'file://{localFile}' @{sfStage}/{stagePath} PARALLEL = 4 AUTO_COMPRESS = FALSE " \
+              f"SOURCE_COMPRESSION = NONE OVERWRITE = TRUE"
+        cur.execute(sql)
+        Metrics.recordStage(stage='sf_put', seconds=time.perf_counter() - start, nbytes=os.path.getsize(localFile),
+                            rows=len(pdDF))
+    finally:
+        os.remove(localFile)
+    return len(pdDF)
+
+
+def putArrow2Stage(sfConn, arrowTable, sfStage, stagePath, fileName, tempFolder):
+    """
+    Description
+    -----------
+    Writes a pyarrow table to a parquet file and PUTs it to a stage without loading it
+        - rows read from a Parquet file keep their types, they are never converted through pandas
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    arrowTable: object
+        pyarrow table to be staged
+    sfStage: string
+        stage name
+        - output from createSnowflakeLoadStage(sfConn, sfStage)
+    stagePath: string
+        folder in the stage that holds the chunks of one file
+    fileName: string
+        name of the parquet file
+    tempFolder: string
+        local folder the parquet file is written to before the PUT
+
+    Returns
+    -------
+    nrows: int
+        number of rows staged
+    """
+    # only Parquet input needs pyarrow
+    import pyarrow.parquet as pa_parquet
+
+    cur = sfConn.cursor()
+    start = time.perf_counter()
+    localFile = os.path.join(tempFolder, fileName)
+    pa_parquet.write_table(arrowTable, localFile, compression='snappy')
+    try:
+        sql = f"PUT 'file://{localFile}' @{sfStage}/{stagePath} PARALLEL = 4 AUTO_COMPRESS = FALSE " \
+              f"SOURCE_COMPRESSION = NONE OVERWRITE = TRUE"
+        cur.execute(sql)
+        Metrics.recordStage(stage='sf_put', seconds=time.perf_counter() - start, nbytes=os.path.getsize(localFile),
+                            rows=arrowTable.num_rows)
+    finally:
+        os.remove(localFile)
+    return arrowTable.num_rows
+
+
+def copyStage2Snowflake(sfConn, sfStage, stagePath, sfTable, columnNames, onError='ABORT_STATEMENT', fileResults=None):
+    """
+    Description
+    -----------
+    Loads every parquet chunk staged for a file with a single COPY INTO
+        - with ON_ERROR = ABORT_STATEMENT the file is loaded completely or not at all
+        - loaded chunks are purged from the stage
+
+    Args
+    ----
+    sfConn: object
+        Snowflake connection instance
+    sfStage: string
+        stage name
+    stagePath: string
+        folder in the stage that holds the chunks of the file
+    sfTable: string
+        designated snowflake table
+    columnNames: list
+        column names of the table, in the same order as the parquet columns
+    onError: string
+        ON_ERROR option
+    fileResults: dict
+        filled with the status and rows loaded of each staged file, keyed by file name, when given
+
+    Returns
+    -------
+    success: bool
+        Indicates whether the load was successful or not
+    nchunks: int
+        number of staged chunks loaded
+    nrows: int
+        number of rows loaded
+    """
+    cur = sfConn.cursor()
+    targetColumns = ", ".join(columnNames)
+    parquetColumns = ", ".join([f'$1:"{columnName}"' for columnName in columnNames])
+    sql = f"COPY INTO {sfTable} ({targetColumns}) FROM (SELECT {parquetColumns} FROM @{sfStage}/{stagePath}/) " \
+          f"FILE_FORMAT = (TYPE = PARQUET COMPRESSION = AUTO) PURGE = TRUE ON_ERROR = {onError}"
+    print("Stage to Snowflake")
+    start = time.perf_counter()
+    cur.execute(sql)
+    results = [row for row in cur.fetchall() if len(row) > COPY_ROWS_LOADED_COLUMN]
+    success = len(results) > 0 and all(row[COPY_STATUS_COLUMN] == 'LOADED' for row in results)
+    nchunks = len(results)
+    nrows = sum(int(row[COPY_ROWS_LOADED_COLUMN]) for row in results)
+    if fileResults is not None:
+        for row in results:
+            # reported with the stage path
+            fileResults[str(row[COPY_FILE_COLUMN]).rsplit('/', 1)[-1]] = (row[COPY_STATUS_COLUMN],
+                                                                          int(row[COPY_ROWS_LOADED_COLUMN]))
+    Metrics.recordStage(stage='sf_copy_stage', seconds=time.perf_counter() - start, rows=nrows)
     print(f"Success is {success} with {nrows} rows loaded")
     return (success, nchunks, nrows)
@@ -0,0 +1,145 @@
+import datetime
+import hashlib
+import os
+import sys
+import threading
+
+import pytest
+
+# the modules import each other by name, as Main.py and benchmark.py run them
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'Modules'), os.path.join(ROOT, 'Main')]
+
+
+class FakeS3Error(Exception):
+    """
+    Description
+    -----------
+    botocore ClientError stand-in, with the error code in response
+    """
+
+    def __init__(self, code, message=''):
+        super().__init__(f"{code} {message}".strip())
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+class FakeS3Body:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, amt=None):
+        end = len(self.data) if amt is None or amt < 0 else self.position + amt
+        data = self.data[self.position:end]
+        self.position += len(data)
+        return data
+
+    def seekable(self):
+        # botocore StreamingBody can only be read forward
+        return False
+
+    def close(self):
+        pass
+
+
+class FakeS3Paginator:
+    """
+    Description
+    -----------
+    list_objects_v2 paginator stand-in, pages of page_size keys in key order chained by continuation tokens
+    """
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def paginate(self, Bucket, Prefix='', StartAfter=None, **kwargs):
+        continuation_token = None
+        while True:
+            page = self.s3_client.list_objects_v2(Bucket=Bucket, Prefix=Prefix, StartAfter=StartAfter,
+                                                  ContinuationToken=continuation_token)
+            yield page
+            if not page['IsTruncated']:
+                return
+            continuation_token = page['NextContinuationToken']
+
+
+class FakeS3Client:
+    """
+    Description
+    -----------
+    S3 client stand-in with the calls S3Connection makes, objects are kept in memory
+    """
+
+    def __init__(self, page_size=1000):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.page_size = page_size
+        self.calls = []
+        # keys delete_objects reports as errors
+        self.delete_errors = set()
+        self.clock = datetime.datetime(2026, 10, 17, tzinfo=datetime.timezone.utc)
+
+    def put_object(self, Bucket, Key, Body=b'', LastModified=None):
+        with self.lock:
+            self.clock += datetime.timedelta(seconds=1)
+            self.objects[Key] = {'data': Body, 'etag': f'"{hashlib.md5(Body).hexdigest()}"',
+                                 'last_modified': LastModified or self.clock}
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter=None, ContinuationToken=None):
+        self.calls.append(('list_objects_v2', Prefix, ContinuationToken))
+        with self.lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix)
+                          and (StartAfter is None or key > StartAfter))
+            start = int(ContinuationToken or 0)
+            contents = [{'Key': key, 'Size': len(self.objects[key]['data']), 'ETag': self.objects[key]['etag'],
+                         'LastModified': self.objects[key]['last_modified']}
+                        for key in keys[start:start + self.page_size]]
+        page = {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': start + self.page_size < len(keys)}
+        if page['IsTruncated']:
+            page['NextContinuationToken'] = str(start + self.page_size)
+        return page
+
+    def get_paginator(self, operation_name):
+        assert operation_name == 'list_objects_v2'
+        return FakeS3Paginator(self)
+
+    def head_object(self, Bucket, Key):
+        with self.lock:
+            if Key not in self.objects:
+                raise FakeS3Error('404', 'Not Found')
+            s3_object = self.objects[Key]
+        return {'ContentLength': len(s3_object['data']), 'ETag': s3_object['etag'],
+                'LastModified': s3_object['last_modified']}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.calls.append(('get_object', Key, Range))
+        with self.lock:
+            if Key not in self.objects:
+                raise FakeS3Error('NoSuchKey')
+            data = self.objects[Key]['data']
+        if Range:
+            start_byte, end_byte = Range[len('bytes='):].split('-')
+            data = data[int(start_byte):int(end_byte) + 1 if end_byte else None]
+        return {'Body': FakeS3Body(data), 'ContentLength': len(data)}
+
+    def copy(self, CopySource, Bucket, Key, Config=None, **kwargs):
+        with self.lock:
+            if CopySource['Key'] not in self.objects:
+                raise FakeS3Error('NoSuchKey')
+            self.objects[Key] = dict(self.objects[CopySource['Key']])
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls.append(('delete_objects', len(Delete['Objects'])))
+        errors = []
+        with self.lock:
+            for s3_object in Delete['Objects']:
+                if s3_object['Key'] in self.delete_errors:
+                    errors.append({'Key': s3_object['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+                else:
+                    self.objects.pop(s3_object['Key'], None)
+        return {'Errors': errors} if errors else {}
+
+
+@pytest.fixture
+def s3_client():
+    return FakeS3Client()
@@ -0,0 +1,75 @@
+import sqlite3
+
+import Checkpoint
+
+
+def test_checkpoint_round_trip_keeps_bad_rows(tmp_path):
+    checkpointPath = str(tmp_path / 'checkpoints.db')
+    assert Checkpoint.getCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t') is None
+
+    Checkpoint.saveCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t', s3Key='db/input/t.txt',
+                              byteOffset=1024, startLineNumber=51, rowsLoaded=45, chunksLoaded=2, badRows=5)
+    assert Checkpoint.getCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t') == {
+        'byte_offset': 1024, 'start_line_number': 51, 'rows_loaded': 45, 'chunks_loaded': 2, 'bad_rows': 5,
+        'row_group': 0, 'quarantined_line_number': 0}
+    # keyed by table as well as ETag
+    assert Checkpoint.getCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.other') is None
+
+    Checkpoint.deleteCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t')
+    assert Checkpoint.getCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t') is None
+
+
+def test_tables_are_created_once_per_store(tmp_path, monkeypatch):
+    checkpointPath = str(tmp_path / 'checkpoints.db')
+    created = []
+    createCheckpointTables = Checkpoint.createCheckpointTables
+    monkeypatch.setattr(Checkpoint, 'createCheckpointTables',
+                        lambda checkpointConn: created.append(createCheckpointTables(checkpointConn)))
+    for chunk in range(3):
+        Checkpoint.saveCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t', s3Key='k',
+                                  byteOffset=chunk, startLineNumber=2, rowsLoaded=chunk, chunksLoaded=chunk)
+    assert len(created) == 1
+
+
+def test_checkpoint_of_a_parquet_file_keeps_its_row_group(tmp_path):
+    checkpointPath = str(tmp_path / 'checkpoints.db')
+    Checkpoint.saveCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t', s3Key='db/input/t.parquet',
+                              byteOffset=0, startLineNumber=0, rowsLoaded=20, chunksLoaded=2, rowGroup=3)
+    checkpoint = Checkpoint.getCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t')
+    assert checkpoint['row_group'] == 3 and checkpoint['byte_offset'] == 0
+
+
+def test_checkpoint_keeps_the_line_rows_were_quarantined_up_to(tmp_path):
+    checkpointPath = str(tmp_path / 'checkpoints.db')
+    # the malformed rows of the chunk at line 51 are written, its good rows are not
+    Checkpoint.saveCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t', s3Key='db/input/t.txt',
+                              byteOffset=1024, startLineNumber=51, rowsLoaded=45, chunksLoaded=2, badRows=5,
+                              quarantinedLineNumber=101)
+    checkpoint = Checkpoint.getCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t')
+    assert checkpoint['start_line_number'] == 51 and checkpoint['quarantined_line_number'] == 101
+
+
+def test_older_store_gets_the_columns_of_newer_versions(tmp_path):
+    checkpointPath = str(tmp_path / 'checkpoints.db')
+    checkpointConn = sqlite3.connect(checkpointPath)
+    checkpointConn.execute("CREATE TABLE file_checkpoints (etag TEXT NOT NULL, sf_table TEXT NOT NULL, s3_key TEXT, "
+                           "byte_offset INTEGER NOT NULL, start_line_number INTEGER NOT NULL, "
+                           "rows_loaded INTEGER NOT NULL, chunks_loaded INTEGER NOT NULL, updated_at REAL NOT NULL, "
+                           "PRIMARY KEY (etag, sf_table))")
+    checkpointConn.execute("INSERT INTO file_checkpoints VALUES ('e1', 'db.raw.t', 'k', 10, 3, 1, 1, 0)")
+    checkpointConn.commit()
+    checkpointConn.close()
+    checkpoint = Checkpoint.getCheckpoint(checkpointPath=checkpointPath, etag='e1', sfTable='db.raw.t')
+    assert checkpoint['bad_rows'] == 0 and checkpoint['row_group'] == 0
+    assert checkpoint['quarantined_line_number'] == 0
+
+
+def test_loaded_file_index(tmp_path):
+    checkpointPath = str(tmp_path / 'checkpoints.db')
+    Checkpoint.recordLoadedFile(checkpointPath=checkpointPath, etag='e1', fileSize=10, sfTable='db.raw.t',
+                                s3Key='db/input/t.txt', rowsLoaded=3)
+    loadedFile = Checkpoint.getLoadedFile(checkpointPath=checkpointPath, etag='e1', fileSize=10, sfTable='db.raw.t')
+    assert loadedFile['s3_key'] == 'db/input/t.txt' and loadedFile['rows_loaded'] == 3
+    # same ETag with another size or table is other contents
+    assert Checkpoint.getLoadedFile(checkpointPath=checkpointPath, etag='e1', fileSize=11, sfTable='db.raw.t') is None
+    assert Checkpoint.getLoadedFile(checkpointPath=checkpointPath, etag='e1', fileSize=10, sfTable='db.raw.u') is None
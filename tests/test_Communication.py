@@ -0,0 +1,109 @@
+import queue
+import smtplib
+
+import pytest
+
+import Communication
+
+
+class FakeSMTP:
+    """
+    Description
+    -----------
+    smtplib.SMTP stand-in, every connection and email sent is recorded on the class
+    """
+    connections = []
+    sent = []
+    # errors raised by the next sendmail calls in order, None sends
+    errors = []
+
+    def __init__(self, host):
+        self.host = host
+        self.closed = False
+        FakeSMTP.connections.append(self)
+
+    def sendmail(self, sender_email, receiver_email, text):
+        error = FakeSMTP.errors.pop(0) if FakeSMTP.errors else None
+        if error is not None:
+            raise error
+        FakeSMTP.sent.append((self, receiver_email, text))
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch):
+    FakeSMTP.connections, FakeSMTP.sent, FakeSMTP.errors = [], [], []
+    monkeypatch.setattr(Communication.smtplib, 'SMTP', FakeSMTP)
+    yield FakeSMTP
+    Communication.stop_mail_queue()
+
+
+def test_queued_emails_are_sent_over_one_connection(fake_smtp, tmp_path):
+    error_log = tmp_path / 'orders_errors.txt'
+    error_log.write_text('line 3: expected 2 columns')
+    Communication.start_mail_queue(smtp_host='relay')
+    for number in range(3):
+        Communication.queue_mail(sender_email='loads@example.com', receiver_email=['team@example.com'],
+                                 subject=f"load {number}", body='done', attachments=[str(error_log)])
+    # the attachments are read before queue_mail returns
+    error_log.unlink()
+    Communication.stop_mail_queue()
+    assert len(fake_smtp.connections) == 1 and fake_smtp.connections[0].closed
+    assert [text.count('Subject: load') for _, _, text in fake_smtp.sent] == [1, 1, 1]
+    assert all('orders_errors.txt' in text for _, _, text in fake_smtp.sent)
+
+
+def test_run_mail_queue_sends_waiting_emails_in_batches(monkeypatch):
+    mail_queue = queue.Queue()
+    for number in range(5):
+        mail_queue.put(('loads@example.com', ['team@example.com'], f"mail {number}"))
+    mail_queue.put(None)
+    batches = []
+
+    def send_mail_batch(server, smtp_host, mail_batch):
+        batches.append([text for _, _, text in mail_batch])
+        return server
+
+    monkeypatch.setattr(Communication, 'send_mail_batch', send_mail_batch)
+    Communication.run_mail_queue(mail_queue=mail_queue, smtp_host='relay', batch_size=2)
+    assert batches == [['mail 0', 'mail 1'], ['mail 2', 'mail 3'], ['mail 4']]
+
+
+def test_send_mail_batch_reconnects_once_and_skips_refused_emails(fake_smtp):
+    fake_smtp.errors = [smtplib.SMTPServerDisconnected('idle'), None,
+                        smtplib.SMTPRecipientsRefused({'nobody@example.com': (550, b'unknown')}),
+                        ConnectionError('reset'), ConnectionError('reset')]
+    mail_batch = [('loads@example.com', ['team@example.com'], 'retried'),
+                  ('loads@example.com', ['nobody@example.com'], 'refused'),
+                  ('loads@example.com', ['team@example.com'], 'dropped'),
+                  ('loads@example.com', ['team@example.com'], 'sent')]
+    server = Communication.send_mail_batch(server=None, smtp_host='relay', mail_batch=mail_batch)
+    # a dropped connection is opened again, a refused email keeps the connection, two drops skip the email
+    assert [text for _, _, text in fake_smtp.sent] == ['retried', 'sent']
+    assert len(fake_smtp.connections) == 4 and server is fake_smtp.connections[-1]
+
+
+def test_digest_lists_attachments_by_name_and_is_sent_when_full(fake_smtp, tmp_path):
+    error_log = tmp_path / 'orders_errors.txt'
+    error_log.write_text('x' * 1000)
+    Communication.start_mail_queue(smtp_host='relay', digest=True, digest_max_mails=2)
+    for number in range(3):
+        Communication.queue_mail(sender_email='loads@example.com', receiver_email=['team@example.com'],
+                                 subject=f"load {number}", body=f"body {number}", attachments=[str(error_log)],
+                                 digest_key='team_b')
+    # the attachments are not held for the digest
+    assert all(attachment_names == ['orders_errors.txt'] for digest_mails in Communication._mail_digests.values()
+               for _, _, attachment_names in digest_mails)
+    Communication.stop_mail_queue()
+    texts = [text for _, _, text in fake_smtp.sent]
+    assert len(texts) == 2
+    assert 'Subject: 2 notifications for team_b' in texts[0] and 'body 0' in texts[0] and 'body 1' in texts[0]
+    # the last email is on its own and keeps its subject
+    assert 'Subject: load 2' in texts[1] and 'body 2' in texts[1]
+    assert all('not attached to the digest: orders_errors.txt' in text and 'Content-Disposition' not in text
+               for text in texts)
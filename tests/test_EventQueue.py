@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+pytest.importorskip('boto3')
+
+import EventQueue
+
+
+def test_parse_s3_event_message_reads_created_objects():
+    messageBody = EventQueue.getS3EventMessage(s3Bucket='bucket', s3Key='file2table/team_B/input/my+file%281%29.csv',
+                                               size=12, etag='"abc"')
+    assert EventQueue.parseS3EventMessage(messageBody) == [
+        {'Bucket': 'bucket', 'Key': 'file2table/team_B/input/my file(1).csv', 'Size': 12, 'ETag': 'abc'}]
+
+
+def test_parse_s3_event_message_unwraps_sns_and_skips_other_events():
+    messageBody = EventQueue.getS3EventMessage(s3Bucket='bucket', s3Key='a.csv')
+    assert EventQueue.parseS3EventMessage(json.dumps({'Type': 'Notification', 'Message': messageBody}))[0]['Key'] \
+        == 'a.csv'
+    removed = json.dumps({'Records': [{'eventName': 'ObjectRemoved:Delete',
+                                       's3': {'bucket': {'name': 'bucket'}, 'object': {'key': 'a.csv'}}}]})
+    assert EventQueue.parseS3EventMessage(removed) == []
+    assert EventQueue.parseS3EventMessage(json.dumps({'Event': 's3:TestEvent'})) == []
+    assert EventQueue.parseS3EventMessage('not json') == []
+
+
+def test_in_memory_event_queue_receives_again_until_acknowledged():
+    eventQueue = EventQueue.InMemoryEventQueue(visibilityTimeout=0)
+    for key in ['a.csv', 'b.csv', 'c.csv']:
+        eventQueue.publish(EventQueue.getS3EventMessage(s3Bucket='bucket', s3Key=key))
+
+    received = eventQueue.receive(maxMessages=2)
+    assert [EventQueue.parseS3EventMessage(message['Body'])[0]['Key'] for message in received] == ['a.csv', 'b.csv']
+    eventQueue.acknowledge(receiptHandles=[received[0]['ReceiptHandle']])
+
+    # b.csv was not acknowledged and is back on the queue once its visibility timeout passed
+    received = eventQueue.receive(maxMessages=10)
+    assert sorted(EventQueue.parseS3EventMessage(message['Body'])[0]['Key'] for message in received) \
+        == ['b.csv', 'c.csv']
+    eventQueue.acknowledge(receiptHandles=[message['ReceiptHandle'] for message in received])
+    assert eventQueue.receive(maxMessages=10, waitSeconds=0) == []
@@ -0,0 +1,550 @@
+import pytest
+
+pytest.importorskip('boto3')
+pytest.importorskip('snowflake.connector')
+
+import datetime
+import decimal
+import io
+import re
+import threading
+import types
+from multiprocessing import shared_memory
+
+import pandas as pd
+import yaml
+
+import EventQueue
+import Main
+import PandasProcessing
+
+
+def test_get_mismatched_data_numbers_rows_around_malformed_lines():
+    # chunk starting at line 10: lines 11 and 13 had the wrong number of columns and are not in df
+    df = pd.DataFrame({'ID': ['1', 'x', '3', 'y'], 'NAME': ['a', 'b', 'c', 'd']})
+    errored_data = [[11, '2|b|extra'], [13, 'bad']]
+    _, mismatched_rows = PandasProcessing.convertPandas2Schema(pandasDataframe=df,
+                                                               columnTypes=['NUMBER(38,0)', 'VARCHAR(16777216)'])
+    mismatched_data, error_messages = Main.get_mismatched_data(df=df, mismatched_rows=mismatched_rows,
+                                                               delimiter='|', start_line_number=10,
+                                                               errored_data=errored_data)
+    assert mismatched_data == [[12, 'x|b'], [15, 'y|d']]
+    assert "column ID value 'x'" in error_messages[0]
+
+
+def test_get_quarantine_dataframe_lays_rows_out_like_the_quarantine_table():
+    errored_data = [[7, 'a|b'], ['12', 'a|b|c|d']]
+    quarantine_df = Main.get_quarantine_dataframe(errored_data=errored_data, file='db/input/t.txt',
+                                                  sf_table='DB.RAW.T', column_count=3, delimiter='|')
+    table_columns = [column.split()[0] for column in
+                     Main.SnowflakeConnection.QUARANTINE_TABLE_DEFINITION.split(', ')]
+    # QUARANTINED_AT is filled in by the table
+    assert list(quarantine_df.columns) == table_columns[:-1] == Main.SnowflakeConnection.QUARANTINE_COLUMNS
+    assert quarantine_df.to_dict('records') == [
+        {'FILE_NAME': 'db/input/t.txt', 'SF_TABLE': 'DB.RAW.T', 'LINE_NUMBER': 7, 'EXPECTED_COLUMNS': 3,
+         'ACTUAL_COLUMNS': 2, 'RAW_LINE': 'a|b', 'ERROR': 'expected 3 columns but read 2'},
+        {'FILE_NAME': 'db/input/t.txt', 'SF_TABLE': 'DB.RAW.T', 'LINE_NUMBER': 12, 'EXPECTED_COLUMNS': 3,
+         'ACTUAL_COLUMNS': 4, 'RAW_LINE': 'a|b|c|d', 'ERROR': 'expected 3 columns but read 4'}]
+    assert quarantine_df['LINE_NUMBER'].dtype.kind == 'i'
+
+
+def test_get_quarantine_dataframe_keeps_the_copy_errors_and_an_empty_layout():
+    quarantine_df = Main.get_quarantine_dataframe(errored_data=[[3, 'x|y|z']], file='f', sf_table='T',
+                                                  column_count=3, delimiter='|',
+                                                  error_messages=["Numeric value 'x' is not recognized"])
+    assert quarantine_df['ERROR'].tolist() == ["Numeric value 'x' is not recognized"]
+    assert quarantine_df['ACTUAL_COLUMNS'].tolist() == [3]
+    empty_df = Main.get_quarantine_dataframe(errored_data=[], file='f', sf_table='T', column_count=3,
+                                             delimiter='|')
+    assert empty_df.empty and list(empty_df.columns) == Main.SnowflakeConnection.QUARANTINE_COLUMNS
+
+
+def test_get_run_config_reads_each_section():
+    Config = {'Common': {'linux.temp_path': '/tmp/file2table', 'quarantine.enabled': True, 'read.chunk_mb': 0.5},
+              'AWS': {'s3.bucket': 'bucket', 's3.key': 'key', 's3.secret': 'secret', 's3.folder': 'file2table/',
+                      's3.internationalInputFolder': 'file2table/international/input/'},
+              'Snowflake': {'sf.schema': 'RAW', 'sf.passphrase': 'passphrase', 'p8.key.file': 'rsa_key.p8'},
+              'Email': {'email.sender': 'loads@example.com', 'email.error_sender': 'errors@example.com'}}
+    run_config = Main.get_run_config(Config)
+    assert run_config['s3Bucket'] == 'bucket' and run_config['s3InternationalInput'].endswith('international/input/')
+    assert run_config['SfSchema'] == 'RAW' and run_config['SfKeyfile'] == 'rsa_key.p8'
+    assert run_config['err_sender_email'] == 'errors@example.com'
+    assert run_config['load_mode'] == 'pandas'
+    assert run_config['quarantine_enabled'] and run_config['quarantine_table'] == 'FILE2TABLE_QUARANTINE'
+    assert run_config['chunk_size'] == 512 * 1024 and run_config['large_file_bytes'] == 1024 ** 3
+    assert run_config['checkpoint_path'] == '/tmp/file2table/file2table_checkpoints.db'
+    assert run_config['sfOnError'] == 'CONTINUE' and run_config['sfUser'] is None
+
+
+@pytest.mark.parametrize('max_queued', [0, 1])
+def test_pipeline_stage_raises_the_error_of_the_stage_in_the_consumer(max_queued):
+    def chunks():
+        yield 1
+        yield 2
+        raise ValueError('line 3: expected 2 columns')
+
+    consumed = []
+    with pytest.raises(ValueError, match='line 3'):
+        for item in Main.pipeline_stage(chunks(), max_queued=max_queued):
+            consumed.append(item)
+    assert consumed == [1, 2]
+
+
+def test_pipeline_stage_stops_the_stage_when_the_consumer_stops_early():
+    stage_closed = threading.Event()
+
+    def chunks():
+        try:
+            item = 0
+            while True:
+                item += 1
+                yield item
+        finally:
+            stage_closed.set()
+
+    stage = Main.pipeline_stage(chunks(), max_queued=1)
+    assert [next(stage) for _ in range(3)] == [1, 2, 3]
+    # the stage is blocked on a full queue, closing the consumer must not wait on it forever
+    closer = threading.Thread(target=stage.close, daemon=True)
+    closer.start()
+    closer.join(timeout=10)
+    assert not closer.is_alive() and stage_closed.is_set()
+
+
+def parse_file_chunks(line_chunks, **kwargs):
+    text_file_errors = io.StringIO()
+    file_load = {}
+    parsed_chunks = list(Main.parse_line_chunks(line_chunks=line_chunks, delimiter='|', parse_engine='numpy',
+                                                text_file_errors=text_file_errors, file_load=file_load, **kwargs))
+    df = pd.concat([parsed_chunk[0] for parsed_chunk in parsed_chunks], ignore_index=True)
+    chunk_ends = [parsed_chunk[1:4] for parsed_chunk in parsed_chunks]
+    return df, chunk_ends, text_file_errors.getvalue(), file_load
+
+
+def test_parse_line_chunks_in_parse_processes_matches_the_single_process_parse():
+    lines = [f"{row}|name {row}|{row * 1.5}\n" if row % 7 else f"{row}|bad row\n" for row in range(1, 400)]
+    line_chunks = [b'ID|NAME|AMOUNT\n' + ''.join(lines[:50]).encode()]
+    line_chunks += [''.join(lines[start:start + 50]).encode() for start in range(50, len(lines), 50)]
+    df, chunk_ends, error_log, file_load = parse_file_chunks(line_chunks)
+    try:
+        process_result = parse_file_chunks(line_chunks, parse_workers=3, parse_pool='process')
+    finally:
+        PandasProcessing.closeParseProcessPool()
+    # arrow strings come back as the pandas string dtype where the pandas version has one
+    pd.testing.assert_frame_equal(process_result[0].astype(object), df.astype(object))
+    assert process_result[1:] == (chunk_ends, error_log, file_load)
+    assert len(df) == 342 and file_load['bad_rows'] == 57
+
+
+def test_parse_line_chunks_releases_the_shared_memory_of_a_failed_parse(monkeypatch):
+    shared_chunk_names = []
+
+    def SharedMemory(**kwargs):
+        shared_chunk = shared_memory.SharedMemory(**kwargs)
+        shared_chunk_names.append(shared_chunk.name)
+        return shared_chunk
+
+    monkeypatch.setattr(PandasProcessing, 'shared_memory', types.SimpleNamespace(SharedMemory=SharedMemory))
+    good_chunk = ''.join(f"{row}|name {row}\n" for row in range(100)).encode()
+    # not utf-8, the parse process raises
+    line_chunks = [b'ID|NAME\n' + good_chunk, b'1|\xff\n', good_chunk, good_chunk, good_chunk]
+    try:
+        with pytest.raises(UnicodeDecodeError):
+            parse_file_chunks(line_chunks, parse_workers=2, parse_pool='process')
+    finally:
+        PandasProcessing.closeParseProcessPool()
+    assert len(shared_chunk_names) >= 2
+    for shared_chunk_name in shared_chunk_names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared_chunk_name)
+
+
+MIB = 1024 ** 2
+
+
+@pytest.mark.parametrize('available_bytes, chunk_size', [
+    # a spent budget still reads the smallest chunk
+    (-500 * MIB, MIB),
+    (0, MIB),
+    # 100 MiB shared by 2 raw chunks and 2 dataframes of 4 times the bytes
+    (100 * MIB, 10 * MIB),
+    (10 ** 6 * MIB, 128 * MIB),
+])
+def test_set_budget_chunk_size_stays_within_the_chunk_limits(available_bytes, chunk_size):
+    memory_budget = {'available_bytes': available_bytes, 'raw_chunks': 2, 'dataframe_chunks': 2, 'expansion': 4,
+                     'min_chunk_size': MIB, 'max_chunk_size': 128 * MIB}
+    assert Main.set_budget_chunk_size(memory_budget) == chunk_size
+    assert memory_budget['chunk_size'] == chunk_size
+
+
+def test_new_memory_budget_gives_prefetch_ranges_at_most_a_quarter_of_the_budget(monkeypatch):
+    monkeypatch.setattr(Main, 'get_rss_bytes', lambda: 200 * MIB)
+    memory_budget = Main.new_memory_budget(max_rss_mb=1000, raw_chunks=2, dataframe_chunks=2,
+                                           max_chunk_size=128 * MIB, prefetch_ranges=4)
+    assert memory_budget['range_size'] == 16 * MIB
+    assert memory_budget['available_bytes'] == 800 * MIB - 4 * 16 * MIB
+    memory_budget = Main.new_memory_budget(max_rss_mb=210, raw_chunks=2, dataframe_chunks=2,
+                                           max_chunk_size=128 * MIB, prefetch_ranges=4)
+    assert memory_budget['range_size'] == MIB
+    assert memory_budget['chunk_size'] == MIB
+
+
+def test_observe_chunk_memory_halves_the_chunks_while_over_the_budget(monkeypatch):
+    monkeypatch.setattr(Main, 'get_rss_bytes', lambda: 0)
+    memory_budget = Main.new_memory_budget(max_rss_mb=10 ** 6, raw_chunks=1, dataframe_chunks=1,
+                                           max_chunk_size=64 * MIB, min_chunk_size=MIB)
+    assert memory_budget['chunk_size'] == 64 * MIB
+    monkeypatch.setattr(Main, 'get_rss_bytes', lambda: 2 * 10 ** 6 * MIB)
+    df = pd.DataFrame({'a': ['x' * 10] * 100})
+    chunk_sizes = [Main.observe_chunk_memory(memory_budget, chunk_bytes=1100, df=df) for _ in range(8)]
+    assert chunk_sizes == [32 * MIB, 16 * MIB, 8 * MIB, 4 * MIB, 2 * MIB, MIB, MIB, MIB]
+
+
+def test_plan_input_batches_groups_small_files_by_table():
+    Config = {'Common': {'coalesce.enabled': True, 'coalesce.max_files': 2, 'coalesce.max_file_mb': 1}}
+    inputFiles = [{'Key': 'file2table/team_B/input/orders.1.csv', 'Size': 10, 'ETag': 'a'},
+                  {'Key': 'file2table/team_B/input/big.csv', 'Size': 2 * 1024 ** 2, 'ETag': 'b'},
+                  {'Key': 'file2table/team_B/input/ORDERS.2.csv.gz', 'Size': 10, 'ETag': 'c'},
+                  {'Key': 'file2table/team_B/input/orders.3.csv', 'Size': 10, 'ETag': 'd'},
+                  {'Key': 'file2table/team_B/input/data.parquet', 'Size': 10, 'ETag': 'e'},
+                  {'Key': 'file2table/team_A/input/orders.4.csv', 'Size': 10, 'ETag': 'f'}]
+    batches = [[inputFile['ETag'] for inputFile in batch]
+               for batch in Main.plan_input_batches(input_files=inputFiles, Config=Config)]
+    assert batches == [['b'], ['a', 'c'], ['e'], ['d'], ['f']]
+
+
+def test_plan_input_batches_loads_files_on_their_own_by_default():
+    inputFiles = [{'Key': 'file2table/team_B/input/orders.1.csv', 'Size': 10, 'ETag': 'a'},
+                  {'Key': 'file2table/team_B/input/orders.2.csv', 'Size': 10, 'ETag': 'b'}]
+    batches = list(Main.plan_input_batches(input_files=inputFiles, Config={'Common': {}}))
+    assert batches == [[inputFiles[0]], [inputFiles[1]]]
+
+
+def load_run_config(tmp_path, **common):
+    return Main.get_run_config({
+        'Common': dict({'linux.temp_path': str(tmp_path)}, **common),
+        'AWS': {'s3.bucket': 'bucket', 's3.key': '', 's3.secret': '', 's3.folder': 'file2table/',
+                's3.internationalInputFolder': 'file2table/international/input/'},
+        'Snowflake': {'sf.schema': 'RAW', 'sf.passphrase': '', 'p8.key.file': '', 'sf.user': 'user',
+                      'sf.account': 'account', 'sf.warehouse': 'wh', 'sf.Role': 'role'},
+        'Email': {'email.sender': 'loads@example.com', 'email.error_sender': 'errors@example.com'}})
+
+
+def read_coalesced_files(s3_client, run_config, tmp_path, bodies):
+    file_loads = []
+    for name, body in bodies.items():
+        s3_client.put_object(Bucket='bucket', Key=f"file2table/team_B/input/{name}", Body=body)
+        input_file = {'Key': f"file2table/team_B/input/{name}", 'Size': len(body), 'ETag': name}
+        file_loads.append((input_file, Main.read_coalesced_file(input_file=input_file, run_config=run_config,
+                                                                client=s3_client, temp_folder=str(tmp_path))))
+    return file_loads
+
+
+def patch_coalesced_load(monkeypatch, copy_status, table_column_types=None):
+    snowflake_calls = {'put': [], 'copy': [], 'healthy': []}
+
+    def copyStage2Snowflake(sfConn, sfStage, stagePath, sfTable, columnNames, fileResults=None, **kwargs):
+        staged_files = [fileName for path, fileName in snowflake_calls['put'] if path == stagePath]
+        snowflake_calls['copy'].append((sfTable, staged_files))
+        for fileName in staged_files:
+            fileResults[fileName] = (copy_status.get(fileName, 'LOADED'), 0)
+
+    def reconcileSnowflakeTable(sfConn, sfDatabase, sfSchema, sfTable, tableSchemaDef):
+        # the table types of the incoming columns, in their order
+        column_names = [columnDefinition.split()[0].upper() for columnDefinition in
+                        re.split(Main.SnowflakeConnection.SCHEMA_DEFINITION_SEPARATOR, tableSchemaDef)]
+        return [], [table_column_types[column_name] for column_name in column_names] if table_column_types else []
+
+    monkeypatch.setattr(Main.SnowflakeConnection, 'getPooledSnowflakeConnection', lambda **kwargs: object())
+    monkeypatch.setattr(Main.SnowflakeConnection, 'releaseSnowflakeConnection',
+                        lambda sfConn, healthy=True: snowflake_calls['healthy'].append(healthy))
+    monkeypatch.setattr(Main.SnowflakeConnection, 'createSnowflakeLoadStage', lambda sfConn, sfStage: sfStage)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'createQuarantineTable', lambda sfConn, sfDatabase, sfSchema,
+                        sfTable: sfTable)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'createSnowflakeTable', lambda **kwargs: 'CREATE TABLE')
+    monkeypatch.setattr(Main.SnowflakeConnection, 'reconcileSnowflakeTable', reconcileSnowflakeTable)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'putPandas2Stage',
+                        lambda sfConn, pdDF, sfStage, stagePath, fileName, tempFolder:
+                        snowflake_calls['put'].append((stagePath, fileName)))
+    monkeypatch.setattr(Main.SnowflakeConnection, 'copyStage2Snowflake', copyStage2Snowflake)
+    return snowflake_calls
+
+
+def test_load_coalesced_files_reports_the_rows_and_status_of_each_file(tmp_path, monkeypatch, s3_client):
+    run_config = load_run_config(tmp_path, **{'quarantine.enabled': True})
+    file_loads = read_coalesced_files(s3_client, run_config, tmp_path, {
+        'orders.1.csv': b'ID|NAME\n1|a\n2|b|extra\n3|c\n',
+        'orders.2.txt': b'NAME|ID\nd|4\n',
+        'orders.3.csv': b'ID|NAME\nbad\n'})
+    assert [file_load['delimiter'] for _, file_load in file_loads] == ['|', '|', '|']
+    # the quarantine COPY of orders.3.csv, the only file with no good rows, fails
+    snowflake_calls = patch_coalesced_load(monkeypatch, copy_status={'orders_2.parquet': 'LOAD_FAILED'})
+    Main.load_coalesced_files(file_loads=file_loads, run_config=run_config, sfPrivateKey=None,
+                              temp_folder=str(tmp_path))
+
+    # one parquet file per header, one quarantine file per file with malformed rows
+    assert snowflake_calls['copy'] == [('orders', ['orders_0.parquet', 'orders_1.parquet']),
+                                       ('FILE2TABLE_QUARANTINE', ['orders_1.parquet', 'orders_2.parquet'])]
+    assert [(file_load['success'], file_load['total_rows_loaded'], file_load['bad_rows'])
+            for _, file_load in file_loads] == [(True, 2, 1), (True, 1, 0), (False, 0, 1)]
+    assert snowflake_calls['healthy'] == [True]
+
+
+def test_load_coalesced_files_stages_nothing_when_rows_do_not_match_the_table(tmp_path, monkeypatch, s3_client):
+    run_config = load_run_config(tmp_path, **{'schema.inference': 'typed'})
+    file_loads = read_coalesced_files(s3_client, run_config, tmp_path, {
+        'orders.1.csv': b'ID|NAME\n1|a\n',
+        'orders.2.csv': b'NAME|ID\nb|x\n'})
+    snowflake_calls = patch_coalesced_load(monkeypatch, copy_status={},
+                                           table_column_types={'ID': 'NUMBER(38,0)', 'NAME': 'VARCHAR(16777216)'})
+    with pytest.raises(ValueError, match='do not match the column types'):
+        Main.load_coalesced_files(file_loads=file_loads, run_config=run_config, sfPrivateKey=None,
+                                  temp_folder=str(tmp_path))
+    # a data error, the files are loaded one at a time on a connection that is still good
+    assert snowflake_calls['put'] == [] and snowflake_calls['copy'] == []
+    assert snowflake_calls['healthy'] == [True]
+
+
+def test_pandas_file_to_sf_does_not_quarantine_rows_twice_on_a_resume(tmp_path, monkeypatch, s3_client):
+    # every 7th row is missing a column, about 10 lines per chunk
+    lines = [f"{row}\n" if row % 7 == 0 else f"{row}|n{row}\n" for row in range(1, 41)]
+    file = 'file2table/team_B/input/orders.txt'
+    s3_client.put_object(Bucket='bucket', Key=file, Body=('ID|NAME\n' + ''.join(lines)).encode())
+    run_config = load_run_config(tmp_path, **{'quarantine.enabled': True, 'read.chunk_mb': 0.0001,
+                                              'pipeline.queue_size': 0})
+    writes = {'orders': [], 'FILE2TABLE_QUARANTINE': []}
+    # the first run fails on the good rows of the second chunk, after its malformed rows were quarantined
+    failed_writes = [1]
+
+    def writePandas2Snowflake(sfConn, pdDF, sfTable):
+        if sfTable == 'orders' and failed_writes and len(writes['orders']) == failed_writes[0]:
+            failed_writes.pop()
+            raise ConnectionError('Snowflake is not reachable')
+        writes[sfTable] += pdDF['LINE_NUMBER'].tolist() if sfTable == 'FILE2TABLE_QUARANTINE' else [pdDF['ID'].tolist()]
+        return True, 1, len(pdDF)
+
+    monkeypatch.setattr(Main.SnowflakeConnection, 'getPooledSnowflakeConnection', lambda **kwargs: object())
+    monkeypatch.setattr(Main.SnowflakeConnection, 'releaseSnowflakeConnection', lambda sfConn, healthy=True: None)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'createSnowflakeTable', lambda **kwargs: 'CREATE TABLE')
+    monkeypatch.setattr(Main.SnowflakeConnection, 'reconcileSnowflakeTable', lambda **kwargs: ([], []))
+    monkeypatch.setattr(Main.SnowflakeConnection, 'createQuarantineTable', lambda **kwargs: None)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'writePandas2Snowflake', writePandas2Snowflake)
+
+    def load_file():
+        file_load = {'delimiter': '|', 'compression': None, 'bad_rows': 0}
+        return Main.pandas_file_to_sf(file=file, run_config=run_config, client=s3_client, sfPrivateKey=None,
+                                      temp_folder=str(tmp_path), file_load=file_load)
+
+    with pytest.raises(ConnectionError):
+        load_file()
+    checkpoint = Main.Checkpoint.getCheckpoint(checkpointPath=run_config['checkpoint_path'],
+                                               etag=s3_client.objects[file]['etag'].strip('"'),
+                                               sfTable='team_B.raw.orders')
+    # the first chunk is committed, the malformed rows of the second one are quarantined
+    assert checkpoint['chunks_loaded'] == 1 and checkpoint['rows_loaded'] == len(writes['orders'][0])
+    assert checkpoint['quarantined_line_number'] > checkpoint['start_line_number']
+    assert writes['FILE2TABLE_QUARANTINE'][-1] < checkpoint['quarantined_line_number']
+
+    file_load = load_file()
+    # line numbers count the header, row 7 is on line 8
+    assert writes['FILE2TABLE_QUARANTINE'] == [8, 15, 22, 29, 36]
+    assert sorted(int(row) for rows in writes['orders'] for row in rows) == [
+        row for row in range(1, 41) if row % 7]
+    assert file_load['success'] and file_load['total_rows_loaded'] == 35 and file_load['bad_rows'] == 5
+
+
+def test_parquet_file_to_sf_resumes_at_the_row_group_after_the_checkpoint(tmp_path, monkeypatch, s3_client):
+    pa = pytest.importorskip('pyarrow')
+    pa_parquet = pytest.importorskip('pyarrow.parquet')
+    amount = decimal.Decimal('1234567890123456789012345678901234567890.12')
+    parquet_buffer = io.BytesIO()
+    pa_parquet.write_table(pa.table({'ID': list(range(6)), 'AMOUNT': pa.array([amount] * 6, pa.decimal256(45, 2))}),
+                           parquet_buffer, row_group_size=2)
+    file = 'file2table/team_B/input/orders.parquet'
+    s3_client.put_object(Bucket='bucket', Key=file, Body=parquet_buffer.getvalue())
+    run_config = load_run_config(tmp_path)
+    staged_tables = []
+    # the first run commits row group 0 and fails on row group 1
+    failed_copies = [2]
+
+    def copyStage2Snowflake(sfConn, sfStage, stagePath, sfTable, columnNames, **kwargs):
+        if failed_copies and len(staged_tables) == failed_copies[0]:
+            failed_copies.pop()
+            raise ConnectionError('Snowflake is not reachable')
+        return True, 1, staged_tables[-1].num_rows
+
+    monkeypatch.setattr(Main.SnowflakeConnection, 'getPooledSnowflakeConnection', lambda **kwargs: object())
+    monkeypatch.setattr(Main.SnowflakeConnection, 'releaseSnowflakeConnection', lambda sfConn, healthy=True: None)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'createSnowflakeTable', lambda **kwargs: 'CREATE TABLE')
+    monkeypatch.setattr(Main.SnowflakeConnection, 'reconcileSnowflakeTable', lambda **kwargs: ([], []))
+    monkeypatch.setattr(Main.SnowflakeConnection, 'createSnowflakeLoadStage', lambda sfConn, sfStage: sfStage)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'putArrow2Stage',
+                        lambda sfConn, arrowTable, **kwargs: staged_tables.append(arrowTable))
+    monkeypatch.setattr(Main.SnowflakeConnection, 'copyStage2Snowflake', copyStage2Snowflake)
+
+    with pytest.raises(ConnectionError):
+        Main.parquet_file_to_sf(file=file, run_config=run_config, client=s3_client, sfPrivateKey=None,
+                                temp_folder=str(tmp_path), file_load={})
+    checkpoint = Main.Checkpoint.getCheckpoint(checkpointPath=run_config['checkpoint_path'],
+                                               etag=s3_client.objects[file]['etag'].strip('"'),
+                                               sfTable='team_B.raw.orders')
+    assert checkpoint['row_group'] == 1 and checkpoint['byte_offset'] == 0 and checkpoint['rows_loaded'] == 2
+
+    staged_tables.clear()
+    file_load = Main.parquet_file_to_sf(file=file, run_config=run_config, client=s3_client, sfPrivateKey=None,
+                                        temp_folder=str(tmp_path), file_load={})
+    assert [arrow_table.column('ID').to_pylist() for arrow_table in staged_tables] == [[2, 3], [4, 5]]
+    assert file_load['success'] and file_load['total_rows_loaded'] == 6 and file_load['number_o_chunks'] == 3
+    # wider than NUMBER, the decimals are loaded as text without losing digits
+    assert 'AMOUNT VARCHAR(16777216)' in file_load['snowflakeSchemaDefinition']
+    assert staged_tables[0].column('AMOUNT').to_pylist() == [str(amount)] * 2
+
+
+def validate_text_file(tmp_path, s3_client, body, **common):
+    file = 'DB1/input/T1.txt'
+    s3_client.put_object(Bucket='bucket', Key=file, Body=body)
+    file_load = {'delimiter': '|', 'compression': None, 'bad_rows': 0}
+    return Main.validate_file(file=file, run_config=load_run_config(tmp_path, **common), client=s3_client,
+                              temp_folder=str(tmp_path), file_load=file_load)
+
+
+def test_get_header_problems_finds_empty_and_duplicated_names():
+    assert Main.get_header_problems(table_header_row='ID|NAME|AMOUNT\r\n', delimiter='|') == []
+    assert Main.get_header_problems(table_header_row='ID||AMOUNT', delimiter='|') == ["column 2 has no name"]
+    assert Main.get_header_problems(table_header_row='ID|First Name|first_name', delimiter='|') == [
+        "columns First Name, first_name are all named FIRST_NAME once cleaned"]
+
+
+def test_validate_file_reports_a_utf8_byte_order_mark_and_reads_the_header_without_it(tmp_path, s3_client):
+    file_load = validate_text_file(tmp_path, s3_client, body='\ufeffID|NAME\r\n1|a\r\n2|b\r\n'.encode('utf-8'))
+    assert file_load['problems'] == ["the file starts with a UTF-8 byte order mark (UTF-8-BOM), "
+                                     "save it as UTF-8 without one"]
+    assert file_load['column_names'] == ['ID', 'NAME']
+    assert (file_load['rows'], file_load['bad_rows'], file_load['success']) == (2, 0, False)
+
+
+def test_validate_file_stops_at_a_utf16_file(tmp_path, s3_client):
+    file_load = validate_text_file(tmp_path, s3_client, body='ID|NAME\r\n1|a\r\n'.encode('utf-16'))
+    assert file_load['problems'] == ["the file is UTF-16, save it as UTF-8"]
+    assert (file_load['rows'], file_load['success']) == (0, False)
+
+
+@pytest.mark.parametrize('max_bad_ratio, success', [(0, False), (0.05, False), (0.1, True), (0.5, True)])
+def test_validate_file_allows_malformed_rows_up_to_max_bad_ratio(tmp_path, s3_client, max_bad_ratio, success):
+    # 1 of 10 rows has the wrong number of columns
+    body = 'ID|NAME\n' + ''.join(f"{row}|name {row}\n" for row in range(9)) + '9|name|extra\n'
+    file_load = validate_text_file(tmp_path, s3_client, body=body.encode(),
+                                   **{'validate.max_bad_ratio': max_bad_ratio})
+    assert (file_load['rows'], file_load['bad_rows']) == (10, 1)
+    assert file_load['success'] is success
+    assert bool(file_load['problems']) is not success
+    assert file_load['error_sample'] == ["line 11: expected 2 columns but read 3 [9|name|extra]"]
+
+
+def test_get_receiver_email_matches_the_database_in_any_case():
+    email_config = {'email. A': 'a@example.com', 'email.B': 'b@example.com', 'email. C': 'c@example.com',
+                    'email.C': 'c2@example.com'}
+    assert Main.get_receiver_email(sfDatabase='TEAM_A', email_config=email_config) == ['a@example.com',
+                                                                                        'b@example.com']
+    assert Main.get_receiver_email(sfDatabase='team_C', email_config=email_config) == ['c@example.com',
+                                                                                        'c2@example.com']
+    assert Main.get_receiver_email(sfDatabase='other', email_config=email_config) == ['b@example.com']
+
+
+def test_list_new_input_files_finds_a_file_that_sorts_before_the_watermark(s3_client):
+    folder = 'file2table/team_B/input/'
+    watermarks = {}
+    s3_client.put_object(Bucket='bucket', Key=f"{folder}z.csv", Body=b'z')
+    assert [inputFile['Key'] for inputFile in Main.list_new_input_files(
+        client=s3_client, s3Bucket='bucket', input_folders=[folder], watermarks=watermarks)] == [f"{folder}z.csv"]
+    assert watermarks[folder]['last_key'] == f"{folder}z.csv"
+
+    # z.csv is loaded and moved out, b.csv arrives after it
+    del s3_client.objects[f"{folder}z.csv"]
+    s3_client.put_object(Bucket='bucket', Key=f"{folder}b.csv", Body=b'b')
+    assert [inputFile['Key'] for inputFile in Main.list_new_input_files(
+        client=s3_client, s3Bucket='bucket', input_folders=[folder], watermarks=watermarks)] == [f"{folder}b.csv"]
+    assert watermarks[folder]['last_key'] == f"{folder}b.csv"
+
+    # b.csv could not be moved, it is not loaded again until a full scan
+    assert Main.list_new_input_files(client=s3_client, s3Bucket='bucket', input_folders=[folder],
+                                     watermarks=watermarks) == []
+    assert [inputFile['Key'] for inputFile in Main.list_new_input_files(
+        client=s3_client, s3Bucket='bucket', input_folders=[folder], watermarks=watermarks,
+        full_scan=True)] == [f"{folder}b.csv"]
+
+
+def test_list_new_input_files_uses_the_watermark_time_of_the_checkpoint_store(s3_client):
+    folder = 'file2table/team_B/input/'
+    watermark_time = datetime.datetime(2026, 10, 17, 12, tzinfo=datetime.timezone.utc)
+    # as Checkpoint.getWatermark returns it
+    watermarks = {folder: {'last_key': f"{folder}m.csv", 'last_modified': str(watermark_time)}}
+    s3_client.put_object(Bucket='bucket', Key=f"{folder}old.csv", Body=b'1',
+                         LastModified=watermark_time - datetime.timedelta(hours=1))
+    s3_client.put_object(Bucket='bucket', Key=f"{folder}overlap.csv", Body=b'2',
+                         LastModified=watermark_time - datetime.timedelta(seconds=30))
+    s3_client.put_object(Bucket='bucket', Key=f"{folder}a_new.csv", Body=b'3',
+                         LastModified=watermark_time + datetime.timedelta(seconds=30))
+    inputFiles = Main.list_new_input_files(client=s3_client, s3Bucket='bucket', input_folders=[folder],
+                                           watermarks=watermarks, overlap_seconds=60)
+    assert [inputFile['Key'] for inputFile in inputFiles] == [f"{folder}a_new.csv", f"{folder}overlap.csv"]
+    assert watermarks[folder]['last_modified'] == watermark_time + datetime.timedelta(seconds=30)
+
+
+def write_daemon_config(tmp_path, discovery):
+    Config = {'Common': {'linux.temp_path': str(tmp_path), 'checkpoint.path': str(tmp_path / 'checkpoints.db'),
+                         'daemon.discovery': discovery, 'daemon.poll_seconds': 0},
+              'AWS': {'s3.bucket': 'bucket', 's3.key': '', 's3.secret': '', 's3.folder': 'file2table/',
+                      's3.internationalInputFolder': 'file2table/international/input/'},
+              'Snowflake': {'sf.schema': 'RAW', 'sf.passphrase': '', 'p8.key.file': ''},
+              'Email': {'email.sender': 'loads@example.com', 'email.error_sender': 'errors@example.com'}}
+    config_yaml_path = tmp_path / 'config.yaml'
+    config_yaml_path.write_text(yaml.safe_dump(Config))
+    return str(config_yaml_path)
+
+
+def patch_daemon(monkeypatch, s3_client, load_input_files):
+    monkeypatch.setattr(Main.S3Connection, 'createS3Client', lambda **kwargs: s3_client)
+    monkeypatch.setattr(Main.SnowflakeConnection, 'getPrivateKey', lambda **kwargs: None)
+    monkeypatch.setattr(Main, 'start_run_reporting', lambda Config: None)
+    monkeypatch.setattr(Main, 'finish_run_reporting', lambda: None)
+    monkeypatch.setattr(Main, 'load_input_files', load_input_files)
+
+
+def test_run_daemon_keeps_running_after_a_failed_cycle(tmp_path, monkeypatch, s3_client):
+    s3_client.put_object(Bucket='bucket', Key='file2table/team_B/input/', Body=b'')
+    s3_client.put_object(Bucket='bucket', Key='file2table/team_B/input/a.csv', Body=b'a')
+    loads = []
+
+    def load_input_files(input_files, Config, client, sfPrivateKey):
+        loads.append([inputFile['Key'] for inputFile in input_files])
+        if len(loads) == 1:
+            raise ConnectionError('Snowflake is not reachable')
+        for inputFile in input_files:
+            del client.objects[inputFile['Key']]
+        return len(input_files)
+
+    patch_daemon(monkeypatch, s3_client, load_input_files)
+    Main.run_daemon(config_yaml_path=write_daemon_config(tmp_path, 'watermark'), max_cycles=3)
+    # the file of the failed cycle is discovered again
+    assert loads == [['file2table/team_B/input/a.csv'], ['file2table/team_B/input/a.csv']]
+
+
+def test_run_daemon_acknowledges_only_events_of_files_that_left_the_input_folder(tmp_path, monkeypatch, s3_client):
+    event_queue = EventQueue.InMemoryEventQueue(visibilityTimeout=0)
+    for key in ['file2table/team_B/input/loaded.csv', 'file2table/team_B/input/stuck.csv']:
+        s3_client.put_object(Bucket='bucket', Key=key, Body=key.encode())
+        event_queue.publish(EventQueue.getS3EventMessage(s3Bucket='bucket', s3Key=key))
+    # an event of a file that is gone already is acknowledged
+    event_queue.publish(EventQueue.getS3EventMessage(s3Bucket='bucket', s3Key='file2table/team_B/input/gone.csv'))
+
+    def load_input_files(input_files, Config, client, sfPrivateKey):
+        del client.objects['file2table/team_B/input/loaded.csv']
+        raise ConnectionError('Snowflake is not reachable')
+
+    patch_daemon(monkeypatch, s3_client, load_input_files)
+    Main.run_daemon(config_yaml_path=write_daemon_config(tmp_path, 'events'), event_queue=event_queue,
+                    max_cycles=1)
+    received = event_queue.receive(maxMessages=10)
+    assert [EventQueue.parseS3EventMessage(message['Body'])[0]['Key'] for message in received] == \
+        ['file2table/team_B/input/stuck.csv']
@@ -0,0 +1,64 @@
+import json
+
+import Metrics
+
+
+def run_short_load(jsonPath, textfilePath):
+    runId = Metrics.startMetricsRun(jsonPath=jsonPath, textfilePath=textfilePath, runId='run-1')
+    Metrics.recordStage(stage='s3_get_range', seconds=0.5, nbytes=2048)
+    for chunkNumber in (1, 2):
+        Metrics.recordChunk(s3Key='db/input/t.txt', sfTable='DB.RAW.T', chunkNumber=chunkNumber,
+                            chunkMetrics={'bytes': 1024, 'rows': 10, 'bad_rows': 1, 'download_seconds': 0.25,
+                                          'upload_seconds': chunkNumber})
+    Metrics.recordFile(s3Key='db/input/t.txt', sfTable='DB.RAW.T', status='success', seconds=4.0, fileBytes=2048,
+                       rowsLoaded=20, badRows=2, chunks=2, loadMode='pandas')
+    Metrics.recordFile(s3Key='db/input/u.txt', sfTable='DB.RAW.U', status='failed', seconds=1.0, fileBytes=512)
+    return runId, Metrics.finishMetricsRun()
+
+
+def test_metrics_run_writes_chunk_file_and_run_events(tmp_path):
+    jsonPath = tmp_path / 'metrics.jsonl'
+    runId, runMetrics = run_short_load(jsonPath=str(jsonPath), textfilePath=None)
+    assert runId == 'run-1'
+    events = [json.loads(line) for line in jsonPath.read_text().splitlines()]
+    assert [event['event'] for event in events] == ['chunk', 'chunk', 'file', 'file', 'run']
+    assert all(event['run_id'] == 'run-1' for event in events)
+    assert (events[1]['chunk'], events[1]['upload_seconds'], events[1]['bad_rows']) == (2, 2, 1)
+    assert (events[2]['status'], events[2]['load_mode'], events[2]['rows_per_second']) == ('success', 'pandas', 5.0)
+    # a failed file is counted but adds no rows or bytes
+    assert (events[3]['status'], events[3]['rows']) == ('failed', 0)
+    assert events[4]['files'] == {'success': 1, 'failed': 1, 'skipped': 0}
+    assert (events[4]['rows'], events[4]['bad_rows'], events[4]['bytes'], events[4]['chunks']) == (20, 2, 2048, 2)
+    assert events[4]['stages']['upload'] == {'seconds': 3.0, 'calls': 2, 'bytes': 2048, 'rows': 20,
+                                             'max_seconds': 2.0}
+    assert events[4]['stages']['s3_get_range']['bytes'] == 2048
+    assert runMetrics['files'] == events[4]['files']
+
+
+def test_metrics_run_replaces_the_prometheus_textfile(tmp_path):
+    textfilePath = tmp_path / 'file2table.prom'
+    textfilePath.write_text("stale\n")
+    run_short_load(jsonPath=None, textfilePath=str(textfilePath))
+    samples = {}
+    for line in textfilePath.read_text().splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    assert 'stale' not in samples
+    assert samples['file2table_run_files{status="success"}'] == 1
+    assert samples['file2table_run_files{status="failed"}'] == 1
+    assert samples['file2table_run_rows_loaded'] == 20
+    assert samples['file2table_run_chunks'] == 2
+    assert samples['file2table_run_stage_seconds{stage="upload"}'] == 3.0
+    assert samples['file2table_run_stage_max_seconds{stage="upload"}'] == 2.0
+    assert samples['file2table_run_stage_bytes{stage="s3_get_range"}'] == 2048
+    assert '# TYPE file2table_run_rows_loaded gauge' in textfilePath.read_text().splitlines()
+    # written next to the textfile and renamed over it
+    assert [path.name for path in tmp_path.iterdir()] == ['file2table.prom']
+
+
+def test_metrics_are_off_without_an_output():
+    assert Metrics.startMetricsRun() is None
+    Metrics.recordChunk(s3Key='k', sfTable='T', chunkNumber=1, chunkMetrics={'rows': 1})
+    Metrics.recordFile(s3Key='k', sfTable='T', status='success', seconds=1.0)
+    assert Metrics.finishMetricsRun() is None
@@ -0,0 +1,190 @@
+import decimal
+import io
+import random
+
+import pandas as pd
+import pytest
+
+import PandasProcessing
+
+# characters that are easy to get wrong at the edge of a line: whitespace str.strip() removes, utf-8 and quotes
+FIELD_CHARACTERS = ['a', '1', '', ' ', '\t', '\x0b', '\x0c', '\x1c', '\x1d', '\x1e', '\x1f', '\xa0', '\u3000',
+                    '\u2028', '\x85', 'é', '"', "'", '#']
+
+
+def random_chunk(rng, columnCount):
+    lines = []
+    for _ in range(rng.randint(0, 8)):
+        fieldCount = rng.choice([columnCount, columnCount, columnCount, columnCount - 1, columnCount + 1])
+        fields = [''.join(rng.choice(FIELD_CHARACTERS) for _ in range(rng.randint(0, 3)))
+                  for _ in range(max(fieldCount, 1))]
+        lines.append('|'.join(fields) + rng.choice(['\n', '\n', '\r\n']))
+    chunk = ''.join(lines)
+    if chunk and rng.random() < 0.3:
+        # last line without a line break
+        chunk = chunk.rstrip('\n').rstrip('\r')
+    return chunk.encode('utf-8')
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'pyarrow'])
+def test_parse_chunk_matches_the_python_parser(engine):
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    rng = random.Random(4)
+    for _ in range(2000):
+        columnNames = [f"C{column}" for column in range(rng.randint(1, 4))]
+        chunkBytes = random_chunk(rng, len(columnNames))
+        expected = PandasProcessing.parseChunkPython(chunkBytes=chunkBytes, delimiter='|', columnNames=columnNames,
+                                                     startLineNumber=2)
+        parsed = PandasProcessing.parseChunk(chunkBytes=chunkBytes, delimiter='|', columnNames=columnNames,
+                                             startLineNumber=2, engine=engine)
+        assert parsed[1] == expected[1], chunkBytes
+        assert parsed[2] == expected[2], chunkBytes
+        assert list(parsed[0].columns) == columnNames
+        assert parsed[0].values.tolist() == expected[0].values.tolist(), chunkBytes
+
+
+def test_parse_chunk_strips_unit_separators_at_the_line_edges():
+    chunkBytes = b'\x1fa|b\x1f\nc|d\n'
+    parsed, erroredData, endLineNumber = PandasProcessing.parseChunk(chunkBytes=chunkBytes, delimiter='|',
+                                                                     columnNames=['A', 'B'], startLineNumber=2)
+    assert parsed.values.tolist() == [['a', 'b'], ['c', 'd']]
+    assert erroredData == [] and endLineNumber == 4
+
+
+def test_convert_pandas2schema_takes_out_late_chunk_mismatches():
+    # types inferred from the first chunk
+    sample = pd.DataFrame({'ID': ['1', '2'], 'DAY': ['2024-01-01', '2024-01-02'], 'NAME': ['a', 'b']})
+    columnTypes, _ = PandasProcessing.inferSnowflakeSchema(sample)
+    assert columnTypes == ['NUMBER(38,0)', 'DATE', 'VARCHAR(16777216)']
+
+    # a later chunk with a value of another type and a date that does not exist
+    chunk = pd.DataFrame({'ID': ['3', 'x4', '5', '6'], 'DAY': ['2024-01-03', '2024-01-04', '2024-02-30', ''],
+                          'NAME': ['c', 'd', 'e', 'f']})
+    converted, mismatchedRows = PandasProcessing.convertPandas2Schema(pandasDataframe=chunk, columnTypes=columnTypes)
+
+    assert [position for position, _ in mismatchedRows] == [1, 2]
+    assert "column ID value 'x4'" in mismatchedRows[0][1]
+    assert "column DAY value '2024-02-30'" in mismatchedRows[1][1]
+    assert converted['ID'].tolist() == [3, 6]
+    assert converted['NAME'].tolist() == ['c', 'f']
+    assert converted['DAY'].iloc[0] == '2024-01-03' and pd.isna(converted['DAY'].iloc[1])
+
+
+def test_convert_pandas2schema_parses_timestamps():
+    chunk = pd.DataFrame({'AT': ['2024-01-01 10:00:00', '2024-01-01 25:00:00', '2024-01-01T10:00']})
+    converted, mismatchedRows = PandasProcessing.convertPandas2Schema(pandasDataframe=chunk,
+                                                                      columnTypes=['TIMESTAMP_NTZ'])
+    assert [position for position, _ in mismatchedRows] == [1]
+    assert converted['AT'].tolist() == ['2024-01-01 10:00:00', '2024-01-01T10:00']
+
+
+def test_parse_chunk_keeps_line_numbers_of_bad_rows():
+    chunkBytes = b'a|b\nc\nd|e|f\r\ng|h'
+    parsed, erroredData, endLineNumber = PandasProcessing.parseChunk(chunkBytes=chunkBytes, delimiter='|',
+                                                                     columnNames=['X', 'Y'], startLineNumber=2)
+    assert parsed.values.tolist() == [['a', 'b'], ['g', 'h']]
+    assert erroredData == [[3, 'c'], [4, 'd|e|f']]
+    assert endLineNumber == 6
+
+
+# a whitespace delimiter is split by the python engine, "|" by the vectorized one
+@pytest.mark.parametrize('delimiter', ['|', '\t'])
+def test_validate_chunk_reports_column_counts_and_bytes_that_are_not_utf8(delimiter):
+    lines = [b'a|b|c', b'a|b', b'a|\xff|c', 'é|b|c'.encode('utf-8'), b'a|b|c|d', b'a|b|c']
+    chunkBytes = b'\r\n'.join(lines).replace(b'|', delimiter.encode())
+    erroredData, encodingErrors, endLineNumber = PandasProcessing.validateChunk(
+        chunkBytes=chunkBytes, delimiter=delimiter, columnCount=3, startLineNumber=2)
+    assert erroredData == [[3, f"a{delimiter}b"], [6, f"a{delimiter}b{delimiter}c{delimiter}d"]]
+    assert encodingErrors == [[4, "byte b'\\xff' at column 3 is not UTF-8"]]
+    assert endLineNumber == 8
+
+
+def test_infer_snowflake_schema_types_each_column():
+    sample = pd.DataFrame({'ID': ['1', '2'], 'CODE': ['007', '1'], 'PRICE': ['1.50', '2'], 'FLAG': ['true', 'False'],
+                           'RATE': ['1e5', '2.5'], 'EMPTY': ['', ''],
+                           'SEEN': ['2024-01-01T10:00:00+02:00', '2024-01-02 00:00:00Z'],
+                           'AT': ['2024-01-01 10:00:00', '']})
+    columnTypes, schema = PandasProcessing.inferSnowflakeSchema(sample)
+    assert columnTypes == ['NUMBER(38,0)', 'VARCHAR(16777216)', 'NUMBER(38,2)', 'BOOLEAN', 'FLOAT8',
+                           'VARCHAR(16777216)', 'TIMESTAMP_TZ', 'TIMESTAMP_NTZ']
+    assert schema.startswith('ID NUMBER(38,0), CODE VARCHAR(16777216), PRICE NUMBER(38,2)')
+
+
+def test_get_arrow_snowflake_type_maps_parquet_types():
+    pa = pytest.importorskip('pyarrow')
+    assert [PandasProcessing.getArrowSnowflakeType(arrowType) for arrowType in [
+        pa.int32(), pa.float32(), pa.decimal128(12, 2), pa.decimal256(38, 0), pa.bool_(), pa.date32(),
+        pa.timestamp('us'), pa.timestamp('us', tz='UTC'), pa.binary(), pa.list_(pa.int64()),
+        pa.dictionary(pa.int32(), pa.string()), pa.string()]] == [
+        'NUMBER(38,0)', 'FLOAT8', 'NUMBER(12,2)', 'NUMBER(38,0)', 'BOOLEAN', 'DATE', 'TIMESTAMP_NTZ',
+        'TIMESTAMP_TZ', 'BINARY', 'VARIANT', 'VARCHAR(16777216)', 'VARCHAR(16777216)']
+
+
+def test_convert_arrow2schema_keeps_every_digit_of_wide_decimals():
+    pa = pytest.importorskip('pyarrow')
+    wide = decimal.Decimal('1234567890123456789012345678901234567890.12')
+    arrowTable = pa.table({'ID': pa.array([1, 2]),
+                           'AMOUNT': pa.array([wide, None], pa.decimal256(45, 2)),
+                           'CODE': pa.array([wide, wide], pa.decimal256(45, 2)).dictionary_encode()})
+    columnTypes, _ = PandasProcessing.getSnowflakeSchemaArrow(arrowSchema=arrowTable.schema,
+                                                              columnNames=arrowTable.column_names)
+    assert columnTypes == ['NUMBER(38,0)', 'VARCHAR(16777216)', 'VARCHAR(16777216)']
+    arrowTable = PandasProcessing.convertArrow2Schema(arrowTable=arrowTable, columnTypes=columnTypes)
+    assert arrowTable.column('ID').type == pa.int64()
+    assert arrowTable.column('AMOUNT').to_pylist() == [str(wide), None]
+    assert arrowTable.column('CODE').to_pylist() == [str(wide), str(wide)]
+
+
+CSV_BODY = ''.join(f"{row}|name {row}|{row * 0.5}\n" for row in range(1, 26)).encode()
+
+
+def read_batches(body, engine, **kwargs):
+    return list(PandasProcessing.readCsvBatches(s3ObjectBody=io.BytesIO(body), delimiter='|', engine=engine,
+                                                **kwargs))
+
+
+@pytest.mark.parametrize('header', [True, False])
+@pytest.mark.parametrize('chunksize', [None, 7, 25, 100])
+def test_read_csv_batches_matches_between_the_c_and_pyarrow_engines(header, chunksize):
+    pytest.importorskip('pyarrow')
+    body = (b'ID|NAME|RATE\n' if header else b'') + CSV_BODY
+    usecols = ['ID', 'RATE'] if header else [0, 2]
+    expected = read_batches(body, 'c', header=header, chunksize=chunksize, usecols=usecols,
+                            dtype={usecols[0]: 'int64', usecols[1]: 'float64'})
+    # small blocks so pyarrow batches are cut across block boundaries
+    batches = read_batches(body, 'pyarrow', header=header, chunksize=chunksize, usecols=usecols,
+                           dtype={usecols[0]: 'int64', usecols[1]: 'float64'}, blockSize=64)
+    assert [len(batch) for batch in batches if len(batch)] == [len(batch) for batch in expected if len(batch)]
+    assert all(chunksize is None or len(batch) <= chunksize for batch in batches)
+    combined = pd.concat(batches, ignore_index=True)
+    pd.testing.assert_frame_equal(combined, pd.concat(expected, ignore_index=True))
+    assert list(combined.columns) == usecols
+
+
+def test_read_csv_batches_gives_every_column_a_single_dtype_without_a_header():
+    pytest.importorskip('pyarrow')
+    expected = read_batches(CSV_BODY, 'c', header=False, chunksize=None, dtype=str)[0]
+    batch = read_batches(CSV_BODY, 'pyarrow', header=False, chunksize=None, dtype=str)[0]
+    assert batch.values.tolist() == expected.values.tolist()
+    assert batch.iloc[0].tolist() == ['1', 'name 1', '0.5']
+
+
+def test_read_csv_batches_splits_lines_like_the_loader():
+    body = b'ID|NAME\n1|a\n2|b|extra\n3|c\r\n4\n5|e'
+    erroredRows = []
+    batches = read_batches(body, 'c', chunksize=2, splitEngine='numpy', erroredRows=erroredRows, blockSize=8)
+    assert [batch.values.tolist() for batch in batches] == [[['1', 'a']], [['3', 'c']], [['5', 'e']]]
+    assert erroredRows == [[3, '2|b|extra'], [5, '4']]
+    with pytest.raises(ValueError, match='line 3'):
+        read_batches(body, 'c', splitEngine='numpy')
+    # a file with only a header still gives its columns
+    assert [list(batch.columns) for batch in read_batches(b'ID|NAME\n', 'c', splitEngine='numpy')] == [['ID', 'NAME']]
+
+
+def test_import_to_pandas_streams_by_default():
+    batches = PandasProcessing.importToPandas(object={'Body': io.BytesIO(b'ID\n' + b'1\n' * 250000)}, delimiter='|')
+    assert [len(batch) for batch in batches] == [100000, 100000, 50000]
+    with pytest.warns(DeprecationWarning):
+        df = PandasProcessing.importToPandas(object={'Body': io.BytesIO(b'ID\n1\n')}, delimiter='|', chunksize=None)
+    assert df['ID'].tolist() == [1]
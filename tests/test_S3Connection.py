@@ -0,0 +1,188 @@
+import bz2
+import gzip
+import io
+
+import pytest
+
+pytest.importorskip('boto3')
+
+import PandasProcessing
+import S3Connection
+
+DATA = ''.join(f"{row}|name {row}|{row * 0.25}\r\n" for row in range(2000)).encode()
+
+
+def compress(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data)
+    if compression == 'bz2':
+        return bz2.compress(data)
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdCompressor().compress(data)
+
+
+@pytest.mark.parametrize('s3Key, expected', [('t/orders.csv.gz', ('t/orders.csv', 'gzip')),
+                                             ('t/orders.txt.bz2', ('t/orders.txt', 'bz2')),
+                                             ('t/orders.csv.zst', ('t/orders.csv', 'zstd')),
+                                             ('t/orders.csv', ('t/orders.csv', None)),
+                                             ('t/orders.gz.csv', ('t/orders.gz.csv', None))])
+def test_s3_object_compression_reads_the_extension(s3Key, expected):
+    assert S3Connection.s3ObjectCompression(s3Key=s3Key) == expected
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'bz2', 'zstd'])
+def test_s3_decompress_body_round_trips_concatenated_streams(s3_client, compression):
+    # two gzip members, bz2 streams or zstd frames, as files appended to each other
+    half = len(DATA) // 2
+    s3_client.put_object(Bucket='bucket', Key='t/orders.csv', Body=compress(DATA[:half], compression) +
+                         compress(DATA[half:], compression))
+    stream = S3Connection.s3DecompressBody(
+        s3ObjectBody=S3Connection.s3GetObject(s3Client=s3_client, s3Bucket='bucket', s3Key='t/orders.csv')['Body'],
+        compression=compression)
+    chunks = list(PandasProcessing.readLineChunks(s3ObjectBody=stream, chunkSize=4096))
+    assert b''.join(chunks) == DATA
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'bz2', 'zstd'])
+def test_s3_decompress_body_resumes_from_a_decompressed_offset(s3_client, compression):
+    s3_client.put_object(Bucket='bucket', Key='t/orders.csv', Body=compress(DATA, compression))
+    # the checkpoint offset of a compressed file is the start of a line in the decompressed data
+    offset = DATA.index(b'1000|')
+    stream = S3Connection.s3DecompressBody(
+        s3ObjectBody=S3Connection.s3GetObject(s3Client=s3_client, s3Bucket='bucket', s3Key='t/orders.csv')['Body'],
+        compression=compression, startByte=offset, skipSize=1000)
+    assert b''.join(PandasProcessing.readLineChunks(s3ObjectBody=stream, chunkSize=4096)) == DATA[offset:]
+
+
+def test_s3_decompress_body_leaves_uncompressed_bodies_alone():
+    body = io.BytesIO(DATA)
+    assert S3Connection.s3DecompressBody(s3ObjectBody=body, compression=None) is body
+    with pytest.raises(ValueError):
+        S3Connection.s3DecompressBody(s3ObjectBody=body, compression='lz4')
+
+
+def get_line_chunks(s3_client, data, **kwargs):
+    s3_client.put_object(Bucket='bucket', Key='t/orders.csv', Body=data)
+    return list(S3Connection.s3GetObjectLineChunks(s3Client=s3_client, s3Bucket='bucket', s3Key='t/orders.csv',
+                                                   fileSize=len(data), **kwargs))
+
+
+@pytest.mark.parametrize('final_newline', [True, False])
+@pytest.mark.parametrize('chunkSize', [1, 100, 10 ** 6])
+def test_s3_get_object_line_chunks_splits_on_line_boundaries(s3_client, final_newline, chunkSize):
+    data = b''.join(DATA.splitlines(keepends=True)[:300])
+    if not final_newline:
+        data = data.rstrip(b'\r\n')
+    # the first range ends between the \r and \n of a line
+    rangeSize = data.index(b'\r\n') + 1
+    chunks = get_line_chunks(s3_client, data, chunkSize=chunkSize, rangeSize=rangeSize, maxWorkers=4)
+    assert b''.join(chunks) == data
+    assert all(chunk.endswith(b'\r\n') for chunk in chunks[:-1])
+    assert chunks[-1].endswith(b'\r\n') == final_newline
+    if chunkSize == 1:
+        # every line is its own chunk
+        assert chunks == data.splitlines(keepends=True)
+
+
+def test_s3_get_object_line_chunks_starts_at_a_checkpoint(s3_client):
+    data = DATA[:5000]
+    startByte = data.index(b'100|')
+    chunks = get_line_chunks(s3_client, data, chunkSize=64, rangeSize=7, startByte=startByte)
+    assert b''.join(chunks) == data[startByte:]
+    assert all(call[2].startswith('bytes=') and int(call[2][len('bytes='):].split('-')[0]) >= startByte
+               for call in s3_client.calls)
+
+
+def test_s3_get_object_line_chunks_keeps_a_line_longer_than_the_chunk(s3_client):
+    data = b'short\n' + b'x' * 1000 + b'\nend'
+    assert get_line_chunks(s3_client, data, chunkSize=10, rangeSize=16) == [b'short\n', b'x' * 1000 + b'\n',
+                                                                              b'end']
+
+
+def test_s3_ranged_file_seeks_and_reads_with_ranged_gets(s3_client):
+    s3_client.put_object(Bucket='bucket', Key='k', Body=b'0123456789')
+    s3File = S3Connection.S3RangedFile(s3Client=s3_client, s3Bucket='bucket', s3Key='k', fileSize=10)
+    assert s3File.seek(-4, io.SEEK_END) == 6 and s3File.read() == b'6789' and s3File.read(1) == b''
+    s3File.seek(2)
+    assert s3File.read(3) == b'234' and s3File.tell() == 5
+    assert s3File.seek(1, io.SEEK_CUR) == 6 and s3File.read(100) == b'6789'
+    buffer = bytearray(4)
+    s3File.seek(0)
+    assert s3File.readinto(buffer) == 4 and bytes(buffer) == b'0123'
+    assert [call[2] for call in s3_client.calls] == ['bytes=6-9', 'bytes=2-4', 'bytes=6-9', 'bytes=0-3']
+
+
+def test_s3_ranged_file_reads_only_the_parquet_columns_asked_for(s3_client):
+    pa = pytest.importorskip('pyarrow')
+    pa_parquet = pytest.importorskip('pyarrow.parquet')
+    arrowTable = pa.table({'ID': list(range(1000)), 'TEXT': [f"row {row}" * 20 for row in range(1000)]})
+    parquetBuffer = io.BytesIO()
+    pa_parquet.write_table(arrowTable, parquetBuffer, row_group_size=500, compression='none')
+    s3_client.put_object(Bucket='bucket', Key='t.parquet', Body=parquetBuffer.getvalue())
+    parquetFile = pa_parquet.ParquetFile(S3Connection.S3RangedFile(s3Client=s3_client, s3Bucket='bucket',
+                                                                   s3Key='t.parquet',
+                                                                   fileSize=len(parquetBuffer.getvalue())))
+    assert parquetFile.num_row_groups == 2
+    assert parquetFile.read_row_group(1, columns=['ID']).column('ID').to_pylist() == list(range(500, 1000))
+    # every read is ranged, the TEXT column chunks are never downloaded
+    rangeBytes = [int(call[2].split('-')[1]) - int(call[2][len('bytes='):].split('-')[0]) + 1
+                  for call in s3_client.calls]
+    assert all(call[2] for call in s3_client.calls)
+    assert sum(rangeBytes) < len(parquetBuffer.getvalue()) / 2
+
+
+def test_s3_delete_objects_sends_1000_keys_per_request_and_reports_per_key_errors(s3_client):
+    s3Keys = [f"t/input/{number:04}.csv" for number in range(2500)]
+    for s3Key in s3Keys:
+        s3_client.put_object(Bucket='bucket', Key=s3Key, Body=b'1')
+    s3_client.delete_errors = {s3Keys[5], s3Keys[2400]}
+    errors = S3Connection.s3DeleteObjects(s3Client=s3_client, s3Bucket='bucket', s3Keys=s3Keys)
+    assert [call[1] for call in s3_client.calls if call[0] == 'delete_objects'] == [1000, 1000, 500]
+    assert errors == {s3Keys[5]: 'AccessDenied: Access Denied', s3Keys[2400]: 'AccessDenied: Access Denied'}
+    assert sorted(s3_client.objects) == [s3Keys[5], s3Keys[2400]]
+
+
+def test_s3_move_objects_keeps_sources_that_were_not_copied_or_deleted(s3_client):
+    s3Moves = [(f"t/input/{number}.csv", f"t/success_files/{number}.csv") for number in range(1200)]
+    for sourceKey, _ in s3Moves[:-1]:
+        s3_client.put_object(Bucket='bucket', Key=sourceKey, Body=sourceKey.encode())
+    # the last source is missing, the first one can not be deleted
+    s3_client.delete_errors = {s3Moves[0][0]}
+    results = S3Connection.s3MoveObjects(s3Client=s3_client, s3Bucket='bucket', s3Moves=s3Moves, maxWorkers=4)
+    assert [call[1] for call in s3_client.calls if call[0] == 'delete_objects'] == [1000, 199]
+    assert results[s3Moves[0][0]]['error'].startswith('copied but source not deleted: AccessDenied')
+    assert results[s3Moves[-1][0]]['error'].startswith('copy failed')
+    assert not results[s3Moves[0][0]]['moved'] and not results[s3Moves[-1][0]]['moved']
+    assert all(results[sourceKey]['moved'] and results[sourceKey]['error'] is None
+               for sourceKey, _ in s3Moves[1:-1])
+    assert s3Moves[0][0] in s3_client.objects and s3Moves[1][0] not in s3_client.objects
+    assert all(destinationKey in s3_client.objects for _, destinationKey in s3Moves[:-1])
+
+
+def test_s3_discover_input_files_follows_continuation_tokens(s3_client):
+    s3_client.page_size = 3
+    folders = {'file2table/team_A/input/': 8, 'file2table/team_B/input/': 5}
+    for folder, fileCount in folders.items():
+        # the folder placeholder is listed but is not an input file
+        s3_client.put_object(Bucket='bucket', Key=folder, Body=b'')
+        for number in range(fileCount):
+            s3_client.put_object(Bucket='bucket', Key=f"{folder}{number}.csv", Body=b'1')
+    inputFiles = list(S3Connection.s3DiscoverInputFiles(s3Client=s3_client, inputFolderlist=list(folders),
+                                                        s3Bucket='bucket', maxWorkers=2, queueSize=2))
+    assert sorted(inputFile['Key'] for inputFile in inputFiles) == sorted(
+        f"{folder}{number}.csv" for folder, fileCount in folders.items() for number in range(fileCount))
+    assert all(inputFile['ETag'] and inputFile['Size'] == 1 for inputFile in inputFiles)
+    # 9 keys in pages of 3, then 6 keys
+    assert sorted((call[1], call[2] or '') for call in s3_client.calls if call[0] == 'list_objects_v2') == [
+        ('file2table/team_A/input/', ''), ('file2table/team_A/input/', '3'), ('file2table/team_A/input/', '6'),
+        ('file2table/team_B/input/', ''), ('file2table/team_B/input/', '3')]
+
+
+def test_s3_discover_input_files_starts_each_folder_after_its_key(s3_client):
+    s3_client.page_size = 2
+    for number in range(6):
+        s3_client.put_object(Bucket='bucket', Key=f"t/input/{number}.csv", Body=b'1')
+    inputFiles = S3Connection.s3DiscoverInputFiles(s3Client=s3_client, inputFolderlist=['t/input/'],
+                                                   s3Bucket='bucket', s3StartAfter={'t/input/': 't/input/1.csv'})
+    assert [inputFile['Key'] for inputFile in inputFiles] == [f"t/input/{number}.csv" for number in range(2, 6)]
@@ -0,0 +1,194 @@
+import pytest
+
+pytest.importorskip('snowflake.connector')
+
+import SnowflakeConnection
+
+
+class RecordingCursor:
+    """
+    Description
+    -----------
+    Cursor stand-in that records the SQL it receives and returns the rows it was given
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.sfqid = None
+
+    def execute(self, sql, *args, **kwargs):
+        self.connection.statements.append(sql)
+        self.sfqid = f"query-{len(self.connection.statements)}"
+        return self
+
+    def fetchall(self):
+        return self.connection.results.pop(0) if self.connection.results else []
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, results=None, **connectArgs):
+        self.statements = []
+        self.results = list(results or [])
+        self.connectArgs = connectArgs
+        self.closed = False
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def test_get_file_format_sql_escapes_the_delimiter():
+    fileFormat = SnowflakeConnection.getFileFormatSql(delimiter="'", skipHeader=0)
+    assert fileFormat == "FILE_FORMAT = (TYPE = CSV FIELD_DELIMITER = '\\'' SKIP_HEADER = 0 ENCODING = 'UTF8' " \
+                         "ERROR_ON_COLUMN_COUNT_MISMATCH = TRUE)"
+
+
+def test_get_copy_into_sql_loads_with_on_error_and_never_purges_the_input():
+    sql = SnowflakeConnection.getCopyIntoSql(sfTable='T', sfStage='DB.RAW.S3_STAGE', fileKey="team/input/o'k.txt",
+                                             delimiter='|', onError='SKIP_FILE', columnNames=['A', 'B'])
+    assert sql.startswith("COPY INTO T (A, B) FROM @DB.RAW.S3_STAGE FILES = ('team/input/o\\'k.txt') ")
+    assert "FIELD_DELIMITER = '|' SKIP_HEADER = 1" in sql
+    assert sql.endswith("ON_ERROR = SKIP_FILE FORCE = TRUE")
+    # the file is moved to success_files or failed_files afterwards
+    assert 'PURGE' not in sql
+
+
+def test_get_copy_into_sql_validation_mode_replaces_on_error():
+    sql = SnowflakeConnection.getCopyIntoSql(sfTable='T', sfStage='S', fileKey='f.txt', delimiter='|',
+                                             onError='CONTINUE', validationMode='RETURN_ERRORS')
+    assert sql.startswith("COPY INTO T FROM @S FILES = ('f.txt') ")
+    assert sql.endswith("VALIDATION_MODE = RETURN_ERRORS")
+    assert 'ON_ERROR' not in sql and 'FORCE' not in sql
+
+
+def test_copy_stage_to_snowflake_purges_the_staged_chunks():
+    rows = [('db/t/run/t_1.parquet', 'LOADED', 10, 10), ('db/t/run/t_2.parquet', 'LOADED', 5, 5)]
+    connection = RecordingConnection(results=[rows])
+    fileResults = {}
+    success, nchunks, nrows = SnowflakeConnection.copyStage2Snowflake(
+        sfConn=connection, sfStage='LOAD_STAGE', stagePath='db/t/run', sfTable='T', columnNames=['A', 'B'],
+        fileResults=fileResults)
+    assert connection.statements == [
+        'COPY INTO T (A, B) FROM (SELECT $1:"A", $1:"B" FROM @LOAD_STAGE/db/t/run/) '
+        'FILE_FORMAT = (TYPE = PARQUET COMPRESSION = AUTO) PURGE = TRUE ON_ERROR = ABORT_STATEMENT']
+    assert (success, nchunks, nrows) == (True, 2, 15)
+    assert fileResults == {'t_1.parquet': ('LOADED', 10), 't_2.parquet': ('LOADED', 5)}
+
+
+def test_copy_into_snowflake_records_the_copy_sql():
+    connection = RecordingConnection(results=[[('f.txt', 'PARTIALLY_LOADED', 9, 8)]])
+    result = SnowflakeConnection.copyIntoSnowflake(sfConn=connection, sfTable='T', sfStage='S', fileKey='f.txt',
+                                                   delimiter='|', onError='CONTINUE')
+    assert result == (True, 1, 8)
+    assert connection.statements == [SnowflakeConnection.getCopyIntoSql(sfTable='T', sfStage='S', fileKey='f.txt',
+                                                                         delimiter='|', onError='CONTINUE')]
+
+
+def copy_error_row(line_number, error, rejected_record):
+    # VALIDATE result row, ERROR, FILE, LINE, ... REJECTED_RECORD
+    row = [None] * 12
+    row[0], row[2], row[11] = error, line_number, rejected_record
+    return tuple(row)
+
+
+def test_copy_into_snowflake_reads_the_rejected_rows_back_from_its_job():
+    connection = RecordingConnection(results=[[('f.txt', 'PARTIALLY_LOADED', 10, 8)],
+                                              [copy_error_row(7, 'Numeric value is not recognized', '7|x'),
+                                               copy_error_row(3, 'Number of columns in file', '3|a|b')]])
+    copyErrors = []
+    result = SnowflakeConnection.copyIntoSnowflake(sfConn=connection, sfTable='T', sfStage='S', fileKey='f.txt',
+                                                   delimiter='|', copyErrors=copyErrors)
+    assert result == (True, 1, 8)
+    # the file is scanned once, the rejects come from the COPY job
+    assert len(connection.statements) == 2 and 'VALIDATION_MODE' not in connection.statements[0]
+    assert connection.statements[1] == "SELECT * FROM TABLE(VALIDATE(T, JOB_ID => 'query-1'))"
+    assert copyErrors == [(3, 'Number of columns in file', '3|a|b'), (7, 'Numeric value is not recognized', '7|x')]
+
+
+def test_copy_into_snowflake_does_not_validate_a_clean_load():
+    connection = RecordingConnection(results=[[('f.txt', 'LOADED', 10, 10)]])
+    copyErrors = []
+    SnowflakeConnection.copyIntoSnowflake(sfConn=connection, sfTable='T', sfStage='S', fileKey='f.txt',
+                                          delimiter='|', copyErrors=copyErrors)
+    assert len(connection.statements) == 1 and copyErrors == []
+
+
+def test_create_stage_requires_a_storage_integration():
+    connection = RecordingConnection()
+    with pytest.raises(ValueError):
+        SnowflakeConnection.createSnowflakeStage(sfConn=connection, sfDatabase='DB', sfSchema='RAW',
+                                                 sfStage='S3_STAGE', s3Bucket='bucket', s3Key='AKIA',
+                                                 s3Secret='secret')
+    assert connection.statements == []
+
+    stage = SnowflakeConnection.createSnowflakeStage(sfConn=connection, sfDatabase='DB', sfSchema='RAW',
+                                                     sfStage='S3_STAGE', s3Bucket='bucket', s3Key='AKIA',
+                                                     s3Secret='secret', sfStorageIntegration='S3_INT')
+    assert stage == 'DB.RAW.S3_STAGE'
+    assert connection.statements == [
+        "CREATE STAGE IF NOT EXISTS DB.RAW.S3_STAGE URL = 's3://bucket/' STORAGE_INTEGRATION = S3_INT"]
+
+
+def test_create_stage_inline_credentials_are_opt_in():
+    connection = RecordingConnection()
+    SnowflakeConnection.createSnowflakeStage(sfConn=connection, sfDatabase='DB', sfSchema='RAW', sfStage='S3_STAGE',
+                                             s3Bucket='bucket', s3Key='AKIA', s3Secret='secret',
+                                             inlineCredentials=True)
+    assert "CREDENTIALS = (AWS_KEY_ID = 'AKIA' AWS_SECRET_KEY = 'secret')" in connection.statements[0]
+
+
+def test_pooled_session_logs_in_with_its_role(monkeypatch):
+    monkeypatch.setattr(SnowflakeConnection.snowflake.connector, 'connect',
+                        lambda **connectArgs: RecordingConnection(**connectArgs), raising=False)
+    connection = SnowflakeConnection.getPooledSnowflakeConnection(
+        sfAccount='acct', sfUser='loader', sfPrivateKey=b'key', sfWarehouse='WH', sfRole='LOADER_ROLE',
+        sfDatabase='DB1', sfSchema='RAW')
+    try:
+        assert connection.connectArgs['role'] == 'LOADER_ROLE'
+        assert (connection.connectArgs['database'], connection.connectArgs['schema']) == ('DB1', 'RAW')
+        # nothing runs before the load, under the default role or otherwise
+        assert connection.statements == []
+
+        SnowflakeConnection.releaseSnowflakeConnection(sfConn=connection)
+        reused = SnowflakeConnection.getPooledSnowflakeConnection(
+            sfAccount='acct', sfUser='loader', sfPrivateKey=b'key', sfWarehouse='WH', sfRole='LOADER_ROLE',
+            sfDatabase='DB2', sfSchema='RAW')
+        assert reused is connection
+        assert connection.statements == ['USE DATABASE DB2', 'USE SCHEMA RAW']
+    finally:
+        SnowflakeConnection.closeSnowflakeConnection(sfConn=connection)
+
+
+@pytest.mark.parametrize('tableType, incomingType, widenedType', [
+    ('NUMBER(10,0)', 'NUMBER(18,0)', 'NUMBER(18,0)'),
+    ('NUMBER(10,2)', 'NUMBER(38, 2)', 'NUMBER(38,2)'),
+    ('NUMBER(18,0)', 'NUMBER(10,0)', None),
+    ('NUMBER(10,2)', 'NUMBER(10,2)', None),
+    # the scale of a column can not be changed in place
+    ('NUMBER(10,0)', 'NUMBER(18,2)', None),
+    ('NUMBER(18,4)', 'NUMBER(18,2)', None),
+])
+def test_get_widened_type_widens_number_precision_at_the_same_scale(tableType, incomingType, widenedType):
+    assert SnowflakeConnection.getWidenedType(tableType=tableType, incomingType=incomingType) == widenedType
+
+
+@pytest.mark.parametrize('tableType, incomingType, widenedType', [
+    ('VARCHAR(16)', 'VARCHAR(256)', 'VARCHAR(256)'),
+    ('VARCHAR(256)', 'VARCHAR(16777216)', 'VARCHAR(16777216)'),
+    ('VARCHAR(256)', 'VARCHAR(16)', None),
+    ('VARCHAR(16)', 'VARCHAR(16)', None),
+    # any other type difference keeps the table type
+    ('VARCHAR(16)', 'NUMBER(18,0)', None),
+    ('NUMBER(18,0)', 'VARCHAR(16)', None),
+    ('TIMESTAMP_NTZ', 'VARCHAR(16)', None),
+])
+def test_get_widened_type_widens_varchar_length(tableType, incomingType, widenedType):
+    assert SnowflakeConnection.getWidenedType(tableType=tableType, incomingType=incomingType) == widenedType
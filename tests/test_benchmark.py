@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip('boto3')
+pytest.importorskip('snowflake.connector')
+pytest.importorskip('pyarrow')
+
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Main', 'benchmark.py')
+
+
+def run_benchmark(tmp_path, *arguments):
+    # a process of its own, the benchmark replaces the S3, Snowflake and SMTP functions of the modules it loads
+    output_path = tmp_path / 'benchmark.jsonl'
+    subprocess.run([sys.executable, BENCHMARK_PATH, '--size-mb', '0.05', '--output', str(output_path), *arguments],
+                   cwd=str(tmp_path), check=True, capture_output=True, timeout=300)
+    return json.loads(output_path.read_text().splitlines()[-1])
+
+
+@pytest.mark.parametrize('mode, statement', [('pandas', 'WRITE_PANDAS'), ('staged', 'PUT'), ('copy', 'VALIDATE')])
+def test_benchmark_loads_every_row_of_a_tiny_run(tmp_path, mode, statement):
+    result = run_benchmark(tmp_path, '--mode', mode, '--files', '2', '--malformed-ratio', '0.01',
+                           '--set', 'quarantine.enabled=true')
+    assert result['settings']['mode'] == mode
+    assert result['rows_expected'] > 0 and result['malformed_rows'] > 0
+    assert result['rows_loaded'] == result['rows_expected']
+    # rows rejected by a COPY are not simulated
+    assert result['rows_quarantined'] == (0 if mode == 'copy' else result['malformed_rows'])
+    assert result['statements'][statement] >= 2
+    assert result['mails'] and result['stage_seconds']['parse' if mode != 'copy' else 'upload'] >= 0
+
+
+def test_benchmark_loads_a_parquet_file_by_row_group(tmp_path):
+    result = run_benchmark(tmp_path, '--format', 'parquet', '--row-group-rows', '100')
+    assert result['rows_loaded'] == result['rows_expected'] > 0
+    assert result['statements']['PUT'] == result['statements']['COPY'] == -(-result['rows_expected'] // 100)